@@ -10,6 +10,8 @@ from telegram.ext import ContextTypes
 import logging
 
 from async_wavespeed import AsyncWavespeedAPI
+from async_polling import wait_for_prediction, PredictionFailedError, PredictionTimeoutError
+from file_id_cache import file_id_cache, send_video_cached, url_key
 from config import Config
 
 logger = logging.getLogger(__name__)
@@ -57,67 +59,29 @@ async def save_video_to_volume(video_data: bytes, filename: str) -> str:
     logger.info(f"💾 Video guardado asíncronamente: {filepath}")
     return filepath
 
-async def optimize_user_prompt_async(image_url: str, text: str, mode: str = "video", style: str = "default") -> str:
+async def optimize_user_prompt_async(image_url: str, text: str, mode: str = "video", style: str = "default",
+                                     image_bytes: Optional[bytes] = None, image_key: Optional[str] = None) -> str:
     """
     Optimiza un prompt usando la nueva API v3 de WaveSpeedAI (async)
+    Las repeticiones (misma foto y caption) se sirven desde la caché de prompts
     """
     try:
         wavespeed = AsyncWavespeedAPI()
-
-        # Iniciar optimización con la nueva API
-        result = await wavespeed.optimize_prompt_v3(
+        optimized_text = await wavespeed.optimize_prompt(
             image_url=image_url,
             text=text,
             mode=mode,
-            style=style
+            style=style,
+            image_bytes=image_bytes,
+            image_key=image_key
         )
-
-        if result.get('data') and result['data'].get('id'):
-            request_id = result['data']['id']
-            logger.info(f"🤖 Prompt optimization started. Request ID: {request_id}")
-
-            # Esperar resultado (máximo 30 segundos)
-            max_attempts = 300  # 30 segundos con polling de 0.1s
-            attempt = 0
-
-            while attempt < max_attempts:
-                try:
-                    status_result = await wavespeed.get_prompt_optimizer_result(request_id)
-
-                    if status_result.get('data'):
-                        task_data = status_result['data']
-                        status = task_data.get('status')
-
-                        if status == 'completed':
-                            if task_data.get('outputs') and len(task_data['outputs']) > 0:
-                                optimized_text = task_data['outputs'][0]
-                                logger.info(f"🤖 Optimized result: {optimized_text[:100]}...")
-                                logger.info(f"Original text: '{text}'")
-                                logger.info(f"Optimization completed in {attempt * 0.1:.1f} seconds")
-                                return optimized_text
-                            else:
-                                logger.warning("🤖 Prompt optimization completed but no outputs")
-                                break
-
-                        elif status == 'failed':
-                            error_msg = task_data.get('error', 'Unknown error')
-                            logger.error(f"🤖 Prompt optimization failed: {error_msg}")
-                            break
-
-                    attempt += 1
-                    await asyncio.sleep(0.1)
-
-                except Exception as poll_error:
-                    logger.error(f"Error polling optimizer status: {poll_error}")
-                    attempt += 1
-                    await asyncio.sleep(0.1)
-
-            logger.warning("🤖 Prompt optimization timed out or failed, using original text")
+        if not optimized_text:
+            logger.warning("🤖 Prompt optimization failed or timed out, using original text")
             return text
 
-        else:
-            logger.error(f"Failed to start prompt optimization. API Response: {result}")
-            return text
+        logger.info(f"🤖 Optimized result: {optimized_text[:100]}...")
+        logger.info(f"Original text: '{text}'")
+        return optimized_text
 
     except Exception as e:
         logger.error(f"Critical error in prompt optimization: {e}")
@@ -134,103 +98,70 @@ async def process_video_generation_async(
     """
     Función común para procesar la generación de video (async version)
     """
-    attempt = 0
-    video_sent = False
     wavespeed = AsyncWavespeedAPI()
 
-    while attempt < Config.MAX_POLLING_ATTEMPTS and not video_sent:
-        try:
-            status_result = await wavespeed.get_video_status(request_id)
-
-            if status_result.get('data'):
-                task_data = status_result['data']
-                status = task_data.get('status')
-
-                if status == 'completed':
-                    logger.info(f"🎬 Task marked as completed. Checking for outputs...")
-
-                    # Verificar múltiples veces si los outputs están disponibles
-                    for output_check in range(5):  # Intentar hasta 5 veces obtener outputs
-                        if task_data.get('outputs') and len(task_data['outputs']) > 0:
-                            video_url = task_data['outputs'][0]
-                            logger.info(f"🎬 Video URL obtained: {video_url}")
-
-                            try:
-                                # Descargar el video con validación
-                                video_bytes = await wavespeed.download_video(video_url)
-
-                                if len(video_bytes) > 1000:  # Verificar que tenga contenido significativo
-                                    # Generar nombre único para el video y guardarlo en el volumen
-                                    video_filename = generate_serial_filename("output", "mp4")
-                                    video_filepath = await save_video_to_volume(video_bytes, video_filename)
-                                    logger.info(f"Video saved to: {video_filepath}")
-
-                                    # Preparar el caption del video con el prompt utilizado
-                                    video_caption = f"🎬 **Prompt utilizado:**\n{prompt}"
-                                    if prompt_optimized:
-                                        video_caption += "\n\n🎨 *Prompt optimizado automáticamente*"
-
-                                    # Enviar el video desde el archivo guardado
-                                    with open(video_filepath, 'rb') as video_file:
-                                        sent_message = await context.bot.send_video(
-                                            chat_id=update.effective_chat.id,
-                                            video=video_file,
-                                            caption=video_caption,
-                                            supports_streaming=True,
-                                            parse_mode='Markdown'
-                                        )
-
-                                    # Confirmar envío exitoso
-                                    success_msg = "✅ ¡Video enviado exitosamente!"
-                                    if prompt_optimized:
-                                        success_msg += "\n\n🎨 Video con prompt optimizado"
-                                    await processing_msg.edit_text(success_msg)
-                                    logger.info(f"Video sent successfully to user {update.effective_chat.id}")
-                                    video_sent = True
-                                    return
-                                else:
-                                    logger.warning(f"Downloaded video too small: {len(video_bytes)} bytes")
-
-                            except Exception as download_error:
-                                logger.error(f"❌ Error downloading/sending video (attempt {output_check + 1}): {download_error}")
-                                if output_check < 4:  # No es el último intento
-                                    wait_time = 2 * (output_check + 1)  # Espera progresiva: 2s, 4s, 6s, 8s
-                                    logger.info(f"⏳ Reintentando en {wait_time} segundos...")
-                                    await asyncio.sleep(wait_time)  # ASYNC SLEEP
-                                else:  # Último intento fallido
-                                    error_details = wavespeed._format_download_error(download_error, video_url)
-                                    await processing_msg.edit_text(error_details)
-                                    return
-
-                        else:
-                            logger.warning(f"No outputs available yet (attempt {output_check + 1}/5)")
-                            await asyncio.sleep(1)  # ASYNC SLEEP
-
-                elif status == 'failed':
-                    error_msg = task_data.get('error', 'Unknown error')
-                    logger.error(f"🎬 Task failed: {error_msg}")
-                    await processing_msg.edit_text(
-                        f"❌ La generación del video falló.\n\nError: {error_msg}"
-                    )
-                    return
-
-                else:
-                    logger.info(f"🎬 Task still processing. Status: {status}")
-
-            else:
-                logger.warning(f"No data in status response: {status_result}")
-
-        except Exception as polling_error:
-            logger.error(f"Error during polling (attempt {attempt + 1}): {polling_error}")
-
-        # Esperar antes del siguiente check
-        await asyncio.sleep(Config.POLLING_INTERVAL)  # ASYNC SLEEP
-        attempt += 1
-
-    # Si llegamos aquí, agotamos los intentos
-    if not video_sent:
+    try:
+        task_data = await wait_for_prediction(wavespeed, request_id)
+    except PredictionFailedError as e:
+        await processing_msg.edit_text(
+            f"❌ La generación del video falló.\n\nError: {e.error}"
+        )
+        return
+    except PredictionTimeoutError:
         await processing_msg.edit_text(
             f"⏰ Timeout agotado. La generación del video está tardando demasiado.\n\n"
             f"Request ID: `{request_id}`\n\n"
             f"💡 Inténtalo de nuevo más tarde."
         )
+        return
+
+    video_url = task_data['outputs'][0]
+    logger.info(f"🎬 Video URL obtained: {video_url}")
+
+    # Mismo nombre en todos los intentos para reanudar la descarga parcial (HTTP Range)
+    video_filename = generate_serial_filename("output", "mp4")
+    video_filepath = None
+    for download_attempt in range(5):
+        try:
+            # Descargar el video en streaming directo al volumen (valida tamaño mínimo y firma)
+            # Si ya se subió a Telegram en un intento anterior se reenvía por file_id sin descargar
+            already_uploaded = Config.USE_FILE_ID_CACHE and await file_id_cache.lookup([url_key(video_url)]) is not None
+            if not video_filepath and not already_uploaded:
+                video_filepath = await wavespeed.download_video_to_file(
+                    video_url, video_filename, keep_partial=download_attempt < 4
+                )
+                logger.info(f"Video saved to: {video_filepath}")
+
+            # Preparar el caption del video con el prompt utilizado
+            video_caption = f"🎬 **Prompt utilizado:**\n{prompt}"
+            if prompt_optimized:
+                video_caption += "\n\n🎨 *Prompt optimizado automáticamente*"
+
+            # Enviar el video (el file_id queda indexado: los reintentos no vuelven a subirlo)
+            await send_video_cached(
+                context.bot, update.effective_chat.id,
+                filepath=video_filepath,
+                keys=[url_key(video_url)],
+                caption=video_caption,
+                supports_streaming=True,
+                parse_mode='Markdown'
+            )
+
+            # Confirmar envío exitoso
+            success_msg = "✅ ¡Video enviado exitosamente!"
+            if prompt_optimized:
+                success_msg += "\n\n🎨 Video con prompt optimizado"
+            await processing_msg.edit_text(success_msg)
+            logger.info(f"Video sent successfully to user {update.effective_chat.id}")
+            return
+
+        except Exception as download_error:
+            logger.error(f"❌ Error downloading/sending video (attempt {download_attempt + 1}): {download_error}")
+            if download_attempt < 4:  # No es el último intento
+                wait_time = 2 * (download_attempt + 1)  # Espera progresiva: 2s, 4s, 6s, 8s
+                logger.info(f"⏳ Reintentando en {wait_time} segundos...")
+                await asyncio.sleep(wait_time)
+            else:  # Último intento fallido
+                error_details = wavespeed._format_download_error(download_error, video_url)
+                await processing_msg.edit_text(error_details)
+                return
@@ -0,0 +1,196 @@
+"""
+Async Polling Engine
+Motor de polling no bloqueante para predicciones de WaveSpeed AI
+Reemplaza los bucles con time.sleep() que congelaban el event loop
+"""
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class PredictionFailedError(Exception):
+    """La predicción terminó con status 'failed' en WaveSpeed"""
+
+    def __init__(self, request_id: str, error: str):
+        self.request_id = request_id
+        self.error = error
+        super().__init__(f"Prediction {request_id} failed: {error}")
+
+
+class PredictionTimeoutError(Exception):
+    """Se agotaron los intentos de polling sin obtener un resultado"""
+
+    def __init__(self, request_id: str, attempts: int, last_status: Optional[str] = None):
+        self.request_id = request_id
+        self.attempts = attempts
+        self.last_status = last_status
+        super().__init__(f"Prediction {request_id} timed out after {attempts} attempts (last status: {last_status})")
+
+
+def calculate_smart_polling_interval(attempt: int, total_attempts: int, base_interval: float = 0.5) -> float:
+    """
+    Calcula intervalos de polling inteligentes con exponential backoff adaptativo
+
+    Args:
+        attempt: Número de intento actual (0-based)
+        total_attempts: Número total de intentos permitidos
+        base_interval: Intervalo base en segundos
+
+    Returns:
+        Intervalo de polling en segundos
+    """
+    # Estrategia adaptativa:
+    # - Primeros 10 intentos: polling rápido (0.5s) para detectar cambios tempranos
+    # - Intentos 10-30: polling medio (1-2s) con ligero backoff
+    # - Intentos 30+: polling lento (3-5s) con exponential backoff
+
+    if attempt < 10:
+        # Polling rápido inicial para detectar cambios inmediatos
+        return base_interval
+    elif attempt < 30:
+        # Polling medio con backoff lineal
+        return min(base_interval * 2, base_interval + (attempt - 10) * 0.1)
+    else:
+        # Polling lento con exponential backoff
+        # Fórmula: base_interval * 2^(attempt/20) con límite superior
+        backoff_factor = 2 ** ((attempt - 30) / 20)
+        return min(base_interval * 4 * backoff_factor, 10.0)  # Máximo 10 segundos
+
+
+def fixed_polling_interval(seconds: float) -> Callable[[int, int, float], float]:
+    """Retorna una función de intervalo constante (compatible con calculate_smart_polling_interval)"""
+    def _interval(attempt: int, total_attempts: int, base_interval: float = seconds) -> float:
+        return seconds
+    return _interval
+
+
+def normalize_prediction(status_result: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Normaliza la respuesta de /predictions/{id}/result
+
+    WavespeedAPI (sync) retorna el JSON completo {"data": {...}} mientras que
+    AsyncWavespeedAPI ya retorna el objeto 'data' directamente.
+    """
+    if not status_result:
+        return {}
+    if isinstance(status_result.get('data'), dict):
+        return status_result['data']
+    return status_result
+
+
+async def wait_for_prediction(
+    api,
+    request_id: str,
+    max_attempts: Optional[int] = None,
+    base_interval: Optional[float] = None,
+    timeout: Optional[float] = None,
+    interval_fn: Callable[[int, int, float], float] = calculate_smart_polling_interval,
+    on_progress: Optional[Callable[[int, Optional[str]], Awaitable[None]]] = None,
+    label: str = "video",
+    use_tracker: Optional[bool] = None,
+    push: bool = False,
+) -> Dict[str, Any]:
+    """
+    Espera de forma asíncrona a que una predicción de WaveSpeed termine
+
+    Args:
+        api: Cliente con un método async get_video_status(request_id) (AsyncWavespeedAPI)
+        request_id: ID de la predicción
+        max_attempts: Máximo de consultas de estado (default: Config.MAX_POLLING_ATTEMPTS)
+        base_interval: Intervalo base en segundos (default: Config.POLLING_INTERVAL)
+        timeout: Límite total en segundos (opcional, además de max_attempts)
+        interval_fn: Función que calcula la espera entre consultas
+        on_progress: Callback async opcional llamado tras cada consulta (attempt, status)
+        label: Etiqueta para los logs ('video', 'audio', 'upscale', 'optimizer')
+        use_tracker: Delegar en el PredictionTracker central (default: Config.USE_PREDICTION_TRACKER)
+        push: La predicción se creó con webhook; el tracker solo hace un barrido lento de respaldo
+
+    Returns:
+        dict: Datos de la predicción completada (incluye 'outputs' no vacío)
+
+    Raises:
+        PredictionFailedError: Si WaveSpeed reporta status 'failed'
+        PredictionTimeoutError: Si se agotan los intentos o el timeout
+    """
+    if use_tracker is None:
+        use_tracker = Config.USE_PREDICTION_TRACKER
+    if use_tracker:
+        # Un solo loop central para todas las predicciones en vuelo
+        from prediction_tracker import prediction_tracker
+        return await prediction_tracker.wait(
+            api, request_id,
+            max_attempts=max_attempts,
+            base_interval=base_interval,
+            timeout=timeout,
+            interval_fn=interval_fn,
+            on_progress=on_progress,
+            label=label,
+            push=push,
+        )
+
+    if max_attempts is None:
+        max_attempts = Config.MAX_POLLING_ATTEMPTS
+    if base_interval is None:
+        base_interval = Config.POLLING_INTERVAL
+
+    deadline = time.monotonic() + timeout if timeout else None
+    last_status = None
+    consecutive_errors = 0
+    started_at = time.monotonic()
+
+    for attempt in range(max_attempts):
+        try:
+            task_data = normalize_prediction(await api.get_video_status(request_id))
+            consecutive_errors = 0
+            last_status = task_data.get('status')
+
+            if last_status == 'completed':
+                if task_data.get('outputs'):
+                    logger.info(f"🎬 {label} {request_id} completado en {time.monotonic() - started_at:.1f}s ({attempt + 1} consultas)")
+                    return task_data
+                # A veces WaveSpeed marca 'completed' antes de publicar los outputs
+                logger.warning(f"⚠️ {label} {request_id} completado pero sin outputs todavía (intento {attempt + 1})")
+
+            elif last_status == 'failed':
+                error_msg = task_data.get('error') or 'Unknown error'
+                logger.error(f"❌ {label} {request_id} falló: {error_msg}")
+                raise PredictionFailedError(request_id, error_msg)
+
+            elif last_status is None:
+                logger.warning(f"⚠️ Respuesta sin status para {label} {request_id}: {task_data}")
+
+            else:
+                logger.debug(f"⏳ {label} {request_id} status={last_status} (intento {attempt + 1}/{max_attempts})")
+
+        except PredictionFailedError:
+            raise
+        except Exception as polling_error:
+            consecutive_errors += 1
+            logger.error(f"❌ Error consultando {label} {request_id} (intento {attempt + 1}): {polling_error}")
+
+        if on_progress:
+            try:
+                await on_progress(attempt, last_status)
+            except Exception as progress_error:
+                logger.warning(f"⚠️ Error en callback de progreso: {progress_error}")
+
+        interval = interval_fn(attempt, max_attempts, base_interval)
+        if consecutive_errors >= 3:
+            # Errores de red repetidos: espaciar las consultas
+            interval = max(interval, base_interval * 4)
+
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            interval = min(interval, remaining)
+
+        await asyncio.sleep(interval)
+
+    logger.error(f"⏰ Timeout esperando {label} {request_id} (último status: {last_status})")
+    raise PredictionTimeoutError(request_id, max_attempts, last_status)
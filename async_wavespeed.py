@@ -3,14 +3,204 @@ Async WaveSpeed API Client
 Reemplaza la implementación síncrona con aiohttp para arquitectura event-driven
 """
 import aiohttp
+import aiofiles
 import asyncio
 import json
+import os
+import secrets
 from typing import Dict, Optional, Any
 from config import Config
+from async_polling import wait_for_prediction, fixed_polling_interval, PredictionFailedError, PredictionTimeoutError
+from prompt_cache import prompt_cache, make_cache_key, image_digest
+from mp4_boxes import inspect_buffer, probe_video, ensure_complete
+from media_processing import media_processor
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Sesión HTTP compartida (keep-alive + caché DNS) para todas las llamadas a WaveSpeed
+_shared_session: Optional[aiohttp.ClientSession] = None
+_shared_session_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+async def get_shared_session() -> aiohttp.ClientSession:
+    """
+    Retorna la sesión aiohttp compartida, creándola bajo demanda
+    Una sola sesión reutiliza conexiones TCP/TLS entre peticiones en lugar de un handshake por llamada
+    """
+    global _shared_session, _shared_session_loop
+
+    loop = asyncio.get_running_loop()
+    if _shared_session is None or _shared_session.closed or _shared_session_loop is not loop:
+        connector = aiohttp.TCPConnector(
+            limit=Config.WAVESPEED_POOL_LIMIT,
+            limit_per_host=Config.WAVESPEED_POOL_LIMIT_PER_HOST,
+            ttl_dns_cache=Config.WAVESPEED_DNS_CACHE_TTL,
+            keepalive_timeout=Config.WAVESPEED_KEEPALIVE_TIMEOUT,
+        )
+        _shared_session = aiohttp.ClientSession(connector=connector)
+        _shared_session_loop = loop
+        logger.info(f"🔌 Sesión HTTP compartida creada (limit={Config.WAVESPEED_POOL_LIMIT}, per_host={Config.WAVESPEED_POOL_LIMIT_PER_HOST})")
+
+    return _shared_session
+
+
+async def close_shared_session():
+    """Cierra la sesión compartida (llamar en el shutdown de la aplicación)"""
+    global _shared_session, _shared_session_loop
+
+    if _shared_session is not None and not _shared_session.closed:
+        await _shared_session.close()
+        logger.info("✅ Sesión HTTP compartida cerrada")
+    _shared_session = None
+    _shared_session_loop = None
+
+
+def wavespeed_webhook_url() -> Optional[str]:
+    """
+    URL pública a la que WaveSpeed notifica cuando termina una predicción
+    None si el webhook está desactivado o no hay URL pública (se usa solo polling)
+    """
+    if not Config.USE_WAVESPEED_WEBHOOK:
+        return None
+
+    url = Config.WAVESPEED_WEBHOOK_URL
+    if not url:
+        if not Config.WEBHOOK_URL:
+            return None
+        url = f"{Config.WEBHOOK_URL.rstrip('/')}{Config.WAVESPEED_WEBHOOK_PATH}"
+    if not url.startswith('http'):
+        url = f"https://{url}"
+
+    if Config.WAVESPEED_WEBHOOK_SECRET:
+        separator = '&' if '?' in url else '?'
+        url = f"{url}{separator}token={Config.WAVESPEED_WEBHOOK_SECRET}"
+    return url
+
+
+def verify_wavespeed_webhook_token(token: Optional[str]) -> bool:
+    """Valida el token recibido en el webhook (siempre válido si no hay secreto configurado)"""
+    if not Config.WAVESPEED_WEBHOOK_SECRET:
+        return True
+    return bool(token) and secrets.compare_digest(token, Config.WAVESPEED_WEBHOOK_SECRET)
+
+
+# Timeouts mínimos de descarga por modelo (videos 720p tardan más)
+MODEL_DOWNLOAD_TIMEOUTS = {
+    'quality': 180,
+    'fast': 90,
+}
+DEFAULT_DOWNLOAD_TIMEOUT = 60
+
+
+# Tamaño mínimo esperado por modelo (videos 720p deben ser más grandes)
+MODEL_MIN_VIDEO_SIZES = {
+    'quality': 500 * 1024,  # 500KB
+    'fast': 200 * 1024,     # 200KB
+}
+DEFAULT_MIN_VIDEO_SIZE = 50 * 1024  # 50KB (ultra_fast y otros)
+
+# Firmas de cajas MP4 esperadas en los primeros bytes
+MP4_SIGNATURES = (b'ftyp', b'moov', b'mdat', b'free')
+
+# Headers para descargar videos generados
+DOWNLOAD_HEADERS = {
+    'User-Agent': 'TELEWAN-Bot/1.0',
+    'Accept': 'video/mp4,video/*,*/*'
+}
+
+
+class VideoIntegrityValidator:
+    """
+    Validación incremental de un video mientras se descarga
+    Comprueba la firma MP4 con los primeros bytes y los límites de tamaño sin mantener el archivo en memoria
+    """
+
+    def __init__(self, model: Optional[str] = None, max_size: Optional[int] = None):
+        self.model = model
+        self.max_size = max_size if max_size is not None else Config.MAX_VIDEO_DOWNLOAD_SIZE
+        self.size = 0
+        self._header = b''
+        self.signature_checked = False
+
+    def check_content_length(self, content_length: Optional[int]) -> None:
+        """Rechaza la descarga antes de empezar si el servidor anuncia un tamaño excesivo"""
+        if content_length and self.max_size and content_length > self.max_size:
+            raise ValueError(f"Video demasiado grande: {content_length:,} bytes (máximo: {self.max_size:,} bytes)")
+
+    def feed(self, chunk: bytes, offset: Optional[int] = None) -> None:
+        """
+        Procesa un bloque recibido
+        offset indica la posición del bloque en el archivo (descargas por segmentos); por defecto es secuencial
+        """
+        if offset is None:
+            offset = self.size
+        self.size += len(chunk)
+        if self.max_size and self.size > self.max_size:
+            raise ValueError(f"Video demasiado grande: más de {self.max_size:,} bytes")
+
+        if not self.signature_checked and offset <= len(self._header) < 12:
+            self._header = self._header[:offset] + chunk[:12 - offset]
+            if len(self._header) >= 12:
+                self._check_signature()
+
+    def resume(self, existing_size: int, header: bytes = b'') -> None:
+        """Contabiliza bytes ya presentes en disco de un intento anterior (descarga reanudada)"""
+        self.size += existing_size
+        if self.max_size and self.size > self.max_size:
+            raise ValueError(f"Video demasiado grande: más de {self.max_size:,} bytes")
+        if header and not self.signature_checked:
+            self._header = header[:12]
+            if len(self._header) >= 12:
+                self._check_signature()
+
+    def _check_signature(self) -> None:
+        self.signature_checked = True
+        if not any(sig in self._header for sig in MP4_SIGNATURES):
+            logger.warning(f"⚠️  Firma de video no reconocida en header: {self._header[:8].hex()}")
+
+    def finish(self) -> None:
+        """Validaciones finales una vez recibido el archivo completo"""
+        file_size = self.size
+
+        # Validación básica de tamaño mínimo
+        if file_size < 1000:
+            raise ValueError(f"Archivo descargado demasiado pequeño: {file_size} bytes")
+
+        # Validaciones específicas por modelo
+        if self.model:
+            min_size = MODEL_MIN_VIDEO_SIZES.get(self.model, DEFAULT_MIN_VIDEO_SIZE)
+            if file_size < min_size:
+                raise ValueError(f"Video {self.model} demasiado pequeño: {file_size:,} bytes (mínimo: {min_size:,} bytes)")
+
+        logger.info(f"✅ Video validado: {file_size:,} bytes, modelo: {self.model}")
+
+
+def discard_partial_download(final_path: str) -> None:
+    """Elimina los archivos parciales (.part y segmentos .partN) de una descarga"""
+    part_path = f"{final_path}.part"
+    directory = os.path.dirname(part_path) or '.'
+    prefix = os.path.basename(part_path)
+    try:
+        for name in os.listdir(directory):
+            if name == prefix or (name.startswith(prefix) and name[len(prefix):].isdigit()):
+                os.remove(os.path.join(directory, name))
+    except FileNotFoundError:
+        pass
+
+
+def validate_video_integrity(video_bytes: bytes, model: str) -> None:
+    """
+    Valida que el video descargado esté completo y sea válido
+    Realiza validaciones más estrictas para videos de calidad
+    Además del tamaño, recorre las cajas MP4: un archivo cortado o sin 'moov' se rechaza
+    """
+    validator = VideoIntegrityValidator(model, max_size=0)
+    validator.feed(video_bytes)
+    validator.finish()
+    ensure_complete(inspect_buffer(memoryview(video_bytes)))
+
+
 class AsyncWavespeedAPI:
     """
     Async client for WaveSpeed AI APIs
@@ -25,7 +215,8 @@ class AsyncWavespeedAPI:
             'Content-Type': 'application/json'
         }
 
-    async def generate_video(self, prompt: str, image_url: str = None, model: str = None) -> Dict[str, Any]:
+    async def generate_video(self, prompt: str, image_url: str = None, model: str = None,
+                             webhook_url: Optional[str] = None) -> Dict[str, Any]:
         """
         Genera un video usando diferentes modelos de Wavespeed AI (async)
 
@@ -33,6 +224,7 @@ class AsyncWavespeedAPI:
             prompt: Descripción del video a generar
             image_url: URL de la imagen de referencia (opcional para text-to-video)
             model: Modelo a usar ('ultra_fast', 'fast', 'quality', 'text_to_video')
+            webhook_url: URL notificada al terminar (default: wavespeed_webhook_url())
         """
         if model is None or model not in Config.AVAILABLE_MODELS:
             model = Config.DEFAULT_MODEL
@@ -66,18 +258,24 @@ class AsyncWavespeedAPI:
             payload["image"] = image_url
             payload["last_image"] = ""
 
-        async with aiohttp.ClientSession(headers=self.headers) as session:
-            try:
-                logger.info(f"🚀 Iniciando generación de video con modelo: {model}")
-                async with session.post(endpoint, json=payload) as response:
-                    response.raise_for_status()
-                    result = await response.json()
-                    logger.info("✅ Video generation request submitted successfully")
-                    # Return the data object directly as shown in the official API example
-                    return result.get("data", result)
-            except aiohttp.ClientError as e:
-                logger.error(f"❌ Error en la API de Wavespeed: {e}")
-                raise
+        # WaveSpeed recibe el webhook como query param del submit
+        params = None
+        webhook_url = webhook_url or wavespeed_webhook_url()
+        if webhook_url:
+            params = {"webhook": webhook_url}
+
+        session = await get_shared_session()
+        try:
+            logger.info(f"🚀 Iniciando generación de video con modelo: {model}")
+            async with session.post(endpoint, json=payload, headers=self.headers, params=params) as response:
+                response.raise_for_status()
+                result = await response.json()
+                logger.info("✅ Video generation request submitted successfully")
+                # Return the data object directly as shown in the official API example
+                return result.get("data", result)
+        except aiohttp.ClientError as e:
+            logger.error(f"❌ Error en la API de Wavespeed: {e}")
+            raise
 
     async def get_video_status(self, request_id: str) -> Dict[str, Any]:
         """
@@ -85,51 +283,52 @@ class AsyncWavespeedAPI:
         """
         endpoint = f"{self.base_url}/api/v3/predictions/{request_id}/result"
 
-        async with aiohttp.ClientSession(headers=self.headers) as session:
-            try:
-                async with session.get(endpoint) as response:
-                    response.raise_for_status()
-                    result = await response.json()
-                    # Return the data object directly as shown in the official API example
-                    return result.get("data", result)
-            except aiohttp.ClientError as e:
-                logger.error(f"❌ Error obteniendo estado del video: {e}")
-                raise
+        session = await get_shared_session()
+        try:
+            async with session.get(endpoint, headers=self.headers) as response:
+                response.raise_for_status()
+                result = await response.json()
+                # Return the data object directly as shown in the official API example
+                return result.get("data", result)
+        except aiohttp.ClientError as e:
+            logger.error(f"❌ Error obteniendo estado del video: {e}")
+            raise
 
-    async def download_video(self, video_url: str, timeout: int = 30) -> bytes:
+    async def download_video(self, video_url: str, timeout: int = 30, model: str = None) -> bytes:
         """
-        Descarga el video generado con mejor manejo de errores (async)
+        Descarga el video generado en memoria (async)
+        Para videos grandes usar download_video_to_file, que no mantiene el archivo en RAM
         """
+        if model:
+            timeout = max(timeout, MODEL_DOWNLOAD_TIMEOUTS.get(model, DEFAULT_DOWNLOAD_TIMEOUT))
+
         try:
             logger.info(f"📥 Iniciando descarga de video desde: {video_url[:50]}...")
-            logger.info(f"   Timeout configurado: {timeout} segundos")
-
-            # Headers para la descarga
-            headers = {
-                'User-Agent': 'TELEWAN-Bot/1.0',
-                'Accept': 'video/mp4,video/*,*/*'
-            }
+            logger.info(f"   Modelo: {model} | Timeout configurado: {timeout} segundos")
 
             timeout_config = aiohttp.ClientTimeout(total=timeout)
 
-            async with aiohttp.ClientSession(headers=headers, timeout=timeout_config) as session:
-                async with session.get(video_url) as response:
-                    response.raise_for_status()
+            session = await get_shared_session()
+            async with session.get(video_url, headers=DOWNLOAD_HEADERS, timeout=timeout_config) as response:
+                response.raise_for_status()
+
+                # Verificar el tipo de contenido
+                content_type = response.headers.get('content-type', '')
+                logger.info(f"   Content-Type: {content_type}")
+                logger.info(f"   Content-Length: {response.headers.get('content-length', 'unknown')}")
 
-                    # Verificar el tipo de contenido
-                    content_type = response.headers.get('content-type', '')
-                    logger.info(f"   Content-Type: {content_type}")
-                    logger.info(f"   Content-Length: {response.headers.get('content-length', 'unknown')}")
+                # Verificar que sea un video
+                if not content_type.startswith('video/'):
+                    logger.warning(f"⚠️  Content-Type inesperado: {content_type}")
 
-                    # Verificar que sea un video
-                    if not content_type.startswith('video/'):
-                        logger.warning(f"⚠️  Content-Type inesperado: {content_type}")
+                # Descargar el contenido
+                content = await response.read()
+                logger.info(f"✅ Video descargado exitosamente: {len(content)} bytes")
 
-                    # Descargar el contenido
-                    content = await response.read()
-                    logger.info(f"✅ Video descargado exitosamente: {len(content)} bytes")
+            if model:
+                validate_video_integrity(content, model)
 
-                    return content
+            return content
 
         except asyncio.TimeoutError as e:
             logger.error(f"⏰ Timeout descargando video ({timeout}s): {e}")
@@ -141,6 +340,218 @@ class AsyncWavespeedAPI:
             logger.error(f"💥 Error inesperado descargando video: {e}")
             raise
 
+    async def download_video_to_file(self, video_url: str, filename: str, timeout: int = 30,
+                                     model: str = None, directory: str = None,
+                                     max_retries: int = None, keep_partial: bool = False) -> str:
+        """
+        Descarga el video en streaming directamente a disco (async)
+
+        Escribe por bloques en un archivo temporal '.part' dentro de Config.VOLUME_PATH,
+        valida firma y tamaño mientras llegan los datos y lo renombra de forma atómica al terminar.
+        La memoria usada por descarga se limita al tamaño de bloque (Config.DOWNLOAD_CHUNK_SIZE).
+
+        Si el servidor soporta HTTP Range:
+        - Tras un error de red se reanuda desde el último byte escrito en lugar de empezar de cero
+        - Los videos grandes (>= Config.PARALLEL_DOWNLOAD_MIN_SIZE) se descargan en varios segmentos en paralelo
+
+        Args:
+            max_retries: Reintentos internos con reanudación (default: Config.DOWNLOAD_MAX_RETRIES)
+            keep_partial: Conservar los archivos parciales si se agotan los reintentos,
+                          para que una llamada posterior con el mismo filename los reanude
+
+        Returns:
+            str: Ruta final del video guardado
+        """
+        if model:
+            timeout = max(timeout, MODEL_DOWNLOAD_TIMEOUTS.get(model, DEFAULT_DOWNLOAD_TIMEOUT))
+        if max_retries is None:
+            max_retries = Config.DOWNLOAD_MAX_RETRIES
+
+        directory = directory or Config.VOLUME_PATH
+        os.makedirs(directory, exist_ok=True)
+        final_path = os.path.join(directory, filename)
+        part_path = f"{final_path}.part"
+        timeout_config = aiohttp.ClientTimeout(total=timeout)
+
+        logger.info(f"📥 Descargando video en streaming desde: {video_url[:50]}...")
+        logger.info(f"   Modelo: {model} | Timeout configurado: {timeout} segundos | Destino: {final_path}")
+
+        session = await get_shared_session()
+        started_at = asyncio.get_running_loop().time()
+
+        for attempt in range(max_retries + 1):
+            validator = VideoIntegrityValidator(model)
+            try:
+                total_size, accepts_ranges = await self._probe_download(session, video_url, timeout_config)
+                validator.check_content_length(total_size)
+
+                segments = self._plan_segments(total_size, accepts_ranges)
+                if len(segments) > 1:
+                    logger.info(f"   ⚡ Descarga en {len(segments)} segmentos paralelos ({total_size:,} bytes)")
+                    tasks = [
+                        asyncio.create_task(self._download_range(
+                            session, video_url, self._segment_path(part_path, index),
+                            start, end, timeout_config, validator
+                        ))
+                        for index, (start, end) in enumerate(segments)
+                    ]
+                    try:
+                        await asyncio.gather(*tasks)
+                    except BaseException:
+                        # Detener los demás segmentos antes de reintentar sobre los mismos archivos
+                        for task in tasks:
+                            task.cancel()
+                        await asyncio.gather(*tasks, return_exceptions=True)
+                        raise
+                    await self._merge_segments(part_path, len(segments))
+                else:
+                    await self._download_range(session, video_url, part_path, 0, None, timeout_config,
+                                               validator, resumable=accepts_ranges)
+
+                validator.finish()
+                ensure_complete(await probe_video(part_path))
+                # 'moov' delante antes de publicar el archivo (nadie más lo tiene abierto todavía)
+                await media_processor.make_faststart(part_path)
+
+                # Renombrado atómico: nunca queda un .mp4 a medio escribir
+                os.replace(part_path, final_path)
+                elapsed = max(asyncio.get_running_loop().time() - started_at, 1e-6)
+                logger.info(f"✅ Video descargado en streaming: {validator.size:,} bytes -> {final_path} "
+                            f"({validator.size / elapsed / (1024 * 1024):.1f} MB/s)")
+                return final_path
+
+            except (asyncio.TimeoutError, aiohttp.ClientError) as e:
+                logger.error(f"🌐 Error de conexión descargando video (intento {attempt + 1}/{max_retries + 1}): {e}")
+                if attempt < max_retries:
+                    # Los bytes ya escritos se conservan: el siguiente intento reanuda con Range
+                    await asyncio.sleep(Config.DOWNLOAD_RETRY_BACKOFF * (attempt + 1))
+                    continue
+                if not keep_partial:
+                    discard_partial_download(final_path)
+                raise
+            except Exception as e:
+                # Contenido inválido (tamaño, firma...): reanudar no tiene sentido
+                logger.error(f"💥 Error inesperado descargando video: {e}")
+                discard_partial_download(final_path)
+                raise
+
+    async def get_remote_size(self, video_url: str, timeout: float = 10) -> Optional[int]:
+        """Tamaño anunciado por el servidor para una URL (HEAD), o None si no se conoce"""
+        session = await get_shared_session()
+        total_size, _ = await self._probe_download(session, video_url, aiohttp.ClientTimeout(total=timeout))
+        return total_size
+
+    async def _probe_download(self, session: aiohttp.ClientSession, video_url: str,
+                              timeout_config: aiohttp.ClientTimeout):
+        """
+        Consulta tamaño y soporte de Range con una petición HEAD
+        Returns: (tamaño total o None, acepta rangos)
+        """
+        try:
+            async with session.head(video_url, headers=DOWNLOAD_HEADERS, timeout=timeout_config,
+                                    allow_redirects=True) as response:
+                if response.status >= 400:
+                    return None, False
+                accepts_ranges = response.headers.get('Accept-Ranges', '').lower() == 'bytes'
+                return response.content_length, accepts_ranges
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.debug(f"HEAD no soportado para {video_url[:50]}: {e}")
+            return None, False
+
+    def _plan_segments(self, total_size: Optional[int], accepts_ranges: bool):
+        """Divide el archivo en rangos [start, end] inclusivos para descarga paralela"""
+        segment_count = Config.DOWNLOAD_SEGMENTS
+        if (not accepts_ranges or not total_size or segment_count <= 1
+                or total_size < Config.PARALLEL_DOWNLOAD_MIN_SIZE):
+            return [(0, None)]
+
+        segment_size = -(-total_size // segment_count)
+        return [
+            (start, min(start + segment_size, total_size) - 1)
+            for start in range(0, total_size, segment_size)
+        ]
+
+    @staticmethod
+    def _segment_path(part_path: str, index: int) -> str:
+        # El segmento 0 se escribe directamente en el .part; el resto se anexa al final
+        return part_path if index == 0 else f"{part_path}{index}"
+
+    async def _download_range(self, session: aiohttp.ClientSession, video_url: str, path: str,
+                              start: int, end: Optional[int], timeout_config: aiohttp.ClientTimeout,
+                              validator: VideoIntegrityValidator, resumable: bool = True):
+        """
+        Descarga el rango [start, end] (end=None: hasta el final) en path
+        Si path ya contiene bytes de un intento anterior, pide solo lo que falta
+        """
+        existing = os.path.getsize(path) if os.path.exists(path) else 0
+        expected = None if end is None else end - start + 1
+
+        if existing and (not resumable or (expected is not None and existing > expected)):
+            # Parcial inutilizable (servidor sin Range o segmentación distinta): empezar de cero
+            os.remove(path)
+            existing = 0
+
+        if existing:
+            header = b''
+            if start == 0:
+                async with aiofiles.open(path, 'rb') as f:
+                    header = await f.read(12)
+            validator.resume(existing, header)
+            logger.info(f"   ↪️  Reanudando rango desde byte {start + existing:,} ({existing:,} bytes ya descargados)")
+            if expected is not None and existing == expected:
+                return
+
+        request_headers = dict(DOWNLOAD_HEADERS)
+        range_start = start + existing
+        if range_start > 0 or end is not None:
+            request_headers['Range'] = f"bytes={range_start}-{'' if end is None else end}"
+
+        async with session.get(video_url, headers=request_headers, timeout=timeout_config) as response:
+            if response.status == 416:
+                # El parcial ya no corresponde al archivo remoto
+                os.remove(path)
+            response.raise_for_status()
+
+            content_type = response.headers.get('content-type', '')
+            if not content_type.startswith('video/'):
+                logger.warning(f"⚠️  Content-Type inesperado: {content_type}")
+
+            mode = 'ab'
+            if 'Range' in request_headers and response.status != 206:
+                if start > 0:
+                    raise aiohttp.ClientPayloadError(f"El servidor ignoró Range para el segmento desde {start}")
+                # Respuesta completa (200): descartar lo reanudado y reescribir
+                validator.size -= existing
+                mode, range_start = 'wb', 0
+            elif not existing:
+                mode = 'wb'
+
+            if end is None and range_start == 0:
+                validator.check_content_length(response.content_length)
+
+            offset = range_start
+            async with aiofiles.open(path, mode) as f:
+                async for chunk in response.content.iter_chunked(Config.DOWNLOAD_CHUNK_SIZE):
+                    validator.feed(chunk, offset)
+                    offset += len(chunk)
+                    await f.write(chunk)
+
+        if end is not None and offset != end + 1:
+            raise aiohttp.ClientPayloadError(f"Segmento incompleto: {offset - start:,}/{expected:,} bytes")
+
+    async def _merge_segments(self, part_path: str, segment_count: int):
+        """Anexa los segmentos 1..N al .part (el segmento 0) por bloques"""
+        async with aiofiles.open(part_path, 'ab') as output:
+            for index in range(1, segment_count):
+                segment_path = self._segment_path(part_path, index)
+                async with aiofiles.open(segment_path, 'rb') as segment:
+                    while True:
+                        block = await segment.read(Config.DOWNLOAD_CHUNK_SIZE)
+                        if not block:
+                            break
+                        await output.write(block)
+                os.remove(segment_path)
+
     async def optimize_prompt_v3(self, image_url: str, text: str, mode: str = "video", style: str = "default") -> Dict[str, Any]:
         """
         Optimiza un prompt usando la nueva API v3 de WaveSpeedAI (async)
@@ -163,26 +574,26 @@ class AsyncWavespeedAPI:
 
         logger.info(f"🤖 Calling prompt optimizer v3: image={image_url[:50]}..., text='{text}', mode={mode}, style={style}")
 
-        async with aiohttp.ClientSession(headers=self.headers) as session:
-            try:
-                async with session.post(endpoint, json=payload) as response:
-                    response.raise_for_status()
-                    result = await response.json()
-                    logger.info(f"✅ Prompt optimization request submitted successfully: {result}")
-
-                    # Extract the task ID from the response (can be nested in data)
-                    task_id = (result.get("data", {}).get("id") or
-                              result.get("id") or
-                              result.get("request_id") or
-                              result.get("task_id"))
-                    if not task_id:
-                        logger.error(f"❌ No task ID found in response: {result}")
-                        raise ValueError("No task ID in prompt optimization response")
-
-                    return {"id": task_id, "result": result}
-            except aiohttp.ClientError as e:
-                logger.error(f"❌ Error en nuevo prompt optimizer v3: {e}")
-                raise
+        session = await get_shared_session()
+        try:
+            async with session.post(endpoint, json=payload, headers=self.headers) as response:
+                response.raise_for_status()
+                result = await response.json()
+                logger.info(f"✅ Prompt optimization request submitted successfully: {result}")
+
+                # Extract the task ID from the response (can be nested in data)
+                task_id = (result.get("data", {}).get("id") or
+                          result.get("id") or
+                          result.get("request_id") or
+                          result.get("task_id"))
+                if not task_id:
+                    logger.error(f"❌ No task ID found in response: {result}")
+                    raise ValueError("No task ID in prompt optimization response")
+
+                return {"id": task_id, "result": result}
+        except aiohttp.ClientError as e:
+            logger.error(f"❌ Error en nuevo prompt optimizer v3: {e}")
+            raise
 
     async def get_prompt_optimizer_result(self, request_id: str) -> Dict[str, Any]:
         """
@@ -191,38 +602,84 @@ class AsyncWavespeedAPI:
         """
         endpoint = f"{self.base_url}/api/v3/predictions/{request_id}/result"
 
-        async with aiohttp.ClientSession(headers=self.headers) as session:
-            try:
-                async with session.get(endpoint) as response:
-                    response.raise_for_status()
-                    raw_result = await response.json()
+        session = await get_shared_session()
+        try:
+            async with session.get(endpoint, headers=self.headers) as response:
+                response.raise_for_status()
+                raw_result = await response.json()
                     
-                    # Log raw response for debugging
-                    print(f"📋 Raw optimizer result: {raw_result}")
+                # Log raw response for debugging
+                print(f"📋 Raw optimizer result: {raw_result}")
                     
-                    # Extract data from response (API wraps in 'data' object)
-                    data = raw_result.get("data", raw_result)
+                # Extract data from response (API wraps in 'data' object)
+                data = raw_result.get("data", raw_result)
                     
-                    # Normalize the response
-                    normalized = {
-                        "status": data.get("status"),
-                        "raw_response": raw_result
-                    }
+                # Normalize the response
+                normalized = {
+                    "status": data.get("status"),
+                    "raw_response": raw_result
+                }
                     
-                    # Extract optimized prompt from outputs array (like other APIs)
-                    if data.get("outputs") and len(data["outputs"]) > 0:
-                        normalized["optimized_prompt"] = data["outputs"][0]
-                        print(f"✅ Found optimized prompt in outputs: '{normalized['optimized_prompt'][:50]}...'")
-                    elif data.get("result"):
-                        # Alternative field name
-                        normalized["optimized_prompt"] = data["result"]
-                        print(f"✅ Found optimized prompt in result: '{normalized['optimized_prompt'][:50]}...'")
+                # Extract optimized prompt from outputs array (like other APIs)
+                if data.get("outputs") and len(data["outputs"]) > 0:
+                    normalized["optimized_prompt"] = data["outputs"][0]
+                    print(f"✅ Found optimized prompt in outputs: '{normalized['optimized_prompt'][:50]}...'")
+                elif data.get("result"):
+                    # Alternative field name
+                    normalized["optimized_prompt"] = data["result"]
+                    print(f"✅ Found optimized prompt in result: '{normalized['optimized_prompt'][:50]}...'")
                     
-                    return normalized
+                return normalized
                     
-            except aiohttp.ClientError as e:
-                logger.error(f"❌ Error obteniendo resultado del prompt optimizer: {e}")
-                raise
+        except aiohttp.ClientError as e:
+            logger.error(f"❌ Error obteniendo resultado del prompt optimizer: {e}")
+            raise
+
+    @staticmethod
+    def _image_cache_hash(image_url: str, image_bytes: Optional[bytes] = None, image_key: Optional[str] = None) -> str:
+        """
+        Identidad exacta de la imagen para la caché de prompts, sin descargar nada:
+        clave ya calculada (file_unique_id) > SHA-256 de los bytes que tiene el llamador > URL
+        """
+        if image_key:
+            return image_key
+        if image_bytes is not None:
+            return image_digest(image_bytes)
+        return f"url:{image_url}"
+
+    async def optimize_prompt(self, image_url: str, text: str, mode: str = "video", style: str = "default",
+                              image_bytes: Optional[bytes] = None, image_key: Optional[str] = None) -> Optional[str]:
+        """
+        Optimiza un prompt con imagen y espera el resultado, usando la caché de prompts
+        Retorna el prompt optimizado o None si la optimización falla
+
+        Args:
+            image_bytes: Contenido de la imagen si ya está en memoria (clave por SHA-256)
+            image_key: Clave de imagen ya conocida, p.ej. telegram_image_key(file_unique_id)
+        """
+        key = make_cache_key(self._image_cache_hash(image_url, image_bytes, image_key), text, mode, style)
+        cached = await prompt_cache.get(key)
+        if cached is not None:
+            logger.info(f"⚡ Prompt optimizado desde caché: '{cached[:50]}...'")
+            return cached
+
+        result = await self.optimize_prompt_v3(image_url=image_url, text=text, mode=mode, style=style)
+        try:
+            task_data = await wait_for_prediction(
+                self, result["id"],
+                max_attempts=120, timeout=30,
+                interval_fn=fixed_polling_interval(0.25),
+                label="optimizer"
+            )
+        except (PredictionFailedError, PredictionTimeoutError) as e:
+            logger.warning(f"🤖 Prompt optimization failed or timed out ({e})")
+            return None
+
+        optimized = (task_data.get("outputs") or [None])[0] or task_data.get("result")
+        if optimized and optimized.strip():
+            await prompt_cache.set(key, optimized)
+            return optimized
+        return None
 
     def _format_download_error(self, error: Exception, video_url: str) -> str:
         """
@@ -251,7 +708,14 @@ class AsyncWavespeedAPI:
         """
         Optimiza un prompt de texto solo (sin imagen) usando WaveSpeedAI
         Ahora usa modo asíncrono para consistencia y mejor manejo de timeouts
+        Los resultados se guardan en la caché de prompts
         """
+        key = make_cache_key(None, text, mode, style)
+        cached = await prompt_cache.get(key)
+        if cached is not None:
+            print(f"⚡ Text-only prompt from cache: {cached[:50]}...")
+            return {"status": "completed", "optimized_prompt": cached, "cached": True}
+
         try:
             endpoint = f"{self.base_url}/api/v3/wavespeed-ai/prompt-optimizer"
 
@@ -264,43 +728,46 @@ class AsyncWavespeedAPI:
             }
 
             print(f"🤖 Optimizing text-only prompt: {text[:50]}...")
-            async with aiohttp.ClientSession(headers=self.headers) as session:
-                async with session.post(endpoint, json=payload) as response:
-                    response.raise_for_status()
-                    result = await response.json()
-                    print("✅ Text-only prompt optimization request submitted")
-
-                    # Extract the task ID from the response (can be nested in data)
-                    task_id = (result.get("data", {}).get("id") or
-                              result.get("id") or
-                              result.get("request_id") or
-                              result.get("task_id"))
-                    if not task_id:
-                        logger.error(f"❌ No task ID found in text-only optimization response: {result}")
-                        raise ValueError("No task ID in text-only prompt optimization response")
-
-                    # Poll for result immediately (text-only should be fast)
-                    max_attempts = 10
-                    for attempt in range(max_attempts):
-                        try:
-                            status_result = await self.get_prompt_optimizer_result(task_id)
-
-                            if status_result.get("status") == "completed":
-                                print("✅ Text-only prompt optimization completed")
-                                return status_result
-                            elif status_result.get("status") == "failed":
-                                print("⚠️  Text-only prompt optimization failed on server side")
-                                return {"optimized_prompt": text}  # Return original text
-
-                            await asyncio.sleep(0.3)  # Shorter wait for text-only
-
-                        except Exception as poll_error:
-                            print(f"⚠️  Error polling text-only optimization: {poll_error}")
-                            break
-
-                    # If polling fails, return original text
-                    print("⚠️  Text-only optimization polling failed, using original text")
-                    return {"optimized_prompt": text}
+            session = await get_shared_session()
+            async with session.post(endpoint, json=payload, headers=self.headers) as response:
+                response.raise_for_status()
+                result = await response.json()
+                print("✅ Text-only prompt optimization request submitted")
+
+                # Extract the task ID from the response (can be nested in data)
+                task_id = (result.get("data", {}).get("id") or
+                          result.get("id") or
+                          result.get("request_id") or
+                          result.get("task_id"))
+                if not task_id:
+                    logger.error(f"❌ No task ID found in text-only optimization response: {result}")
+                    raise ValueError("No task ID in text-only prompt optimization response")
+
+                # Poll for result immediately (text-only should be fast)
+                max_attempts = 10
+                for attempt in range(max_attempts):
+                    try:
+                        status_result = await self.get_prompt_optimizer_result(task_id)
+
+                        if status_result.get("status") == "completed":
+                            print("✅ Text-only prompt optimization completed")
+                            optimized = status_result.get("optimized_prompt")
+                            if optimized and optimized.strip():
+                                await prompt_cache.set(key, optimized)
+                            return status_result
+                        elif status_result.get("status") == "failed":
+                            print("⚠️  Text-only prompt optimization failed on server side")
+                            return {"optimized_prompt": text}  # Return original text
+
+                        await asyncio.sleep(0.3)  # Shorter wait for text-only
+
+                    except Exception as poll_error:
+                        print(f"⚠️  Error polling text-only optimization: {poll_error}")
+                        break
+
+                # If polling fails, return original text
+                print("⚠️  Text-only optimization polling failed, using original text")
+                return {"optimized_prompt": text}
 
         except Exception as e:
             print(f"❌ Text-only prompt optimization failed: {e}")
@@ -321,53 +788,36 @@ class AsyncWavespeedAPI:
             }
 
             print(f"🎵 Sending audio request for video: {video_url}")
-            async with aiohttp.ClientSession(headers=self.headers) as session:
-                async with session.post(audio_url, json=audio_payload) as response:
-                    response.raise_for_status()
-                    audio_result = await response.json()
-
-                    if audio_result.get("data") and audio_result["data"].get("id"):
-                        audio_request_id = audio_result["data"]["id"]
-                        print(f"🎵 Audio generation started, request ID: {audio_request_id}")
-                    else:
-                        print(f"❌ Invalid audio API response: {audio_result}")
-                        return None
-
-            # Poll for audio completion
-            audio_status_url = f"{self.base_url}/api/v3/predictions/{audio_request_id}/result"
-            max_audio_attempts = 120  # ~2 minutes for audio
-
-            for attempt in range(max_audio_attempts):
-                try:
-                    async with aiohttp.ClientSession(headers=self.headers) as session:
-                        async with session.get(audio_status_url) as response:
-                            if response.status == 200:
-                                status_result = await response.json()
-
-                                if status_result.get("data"):
-                                    audio_data = status_result["data"]
-                                    status = audio_data.get("status")
-
-                                    if status == "completed":
-                                        if audio_data.get("outputs") and len(audio_data["outputs"]) > 0:
-                                            audio_video_url = audio_data["outputs"][0]
-                                            print(f"🎵 Audio generation completed: {audio_video_url}")
-                                            return audio_video_url
-
-                                    elif status == "failed":
-                                        error_msg = audio_data.get("error", "Audio generation failed")
-                                        print(f"❌ Audio generation failed: {error_msg}")
-                                        return None
-
-                    print(f"⏳ Audio processing... ({attempt + 1}/{max_audio_attempts})")
-                    await asyncio.sleep(1)
-
-                except Exception as e:
-                    print(f"⚠️  Audio polling error: {e}")
-                    await asyncio.sleep(1)
-
-            print("⏰ Audio generation timeout")
-            return None
+            session = await get_shared_session()
+            async with session.post(audio_url, json=audio_payload, headers=self.headers) as response:
+                response.raise_for_status()
+                audio_result = await response.json()
+
+                if audio_result.get("data") and audio_result["data"].get("id"):
+                    audio_request_id = audio_result["data"]["id"]
+                    print(f"🎵 Audio generation started, request ID: {audio_request_id}")
+                else:
+                    print(f"❌ Invalid audio API response: {audio_result}")
+                    return None
+
+            # Poll for audio completion (~2 minutes)
+            try:
+                audio_data = await wait_for_prediction(
+                    self, audio_request_id,
+                    max_attempts=120, timeout=180,
+                    interval_fn=fixed_polling_interval(1.0),
+                    label="audio"
+                )
+            except PredictionFailedError as e:
+                print(f"❌ Audio generation failed: {e.error}")
+                return None
+            except PredictionTimeoutError:
+                print("⏰ Audio generation timeout")
+                return None
+
+            audio_video_url = audio_data["outputs"][0]
+            print(f"🎵 Audio generation completed: {audio_video_url}")
+            return audio_video_url
 
         except Exception as e:
             print(f"❌ Audio generation error: {e}")
@@ -386,53 +836,36 @@ class AsyncWavespeedAPI:
             }
 
             print(f"⬆️ Sending upscale request for video: {video_url}")
-            async with aiohttp.ClientSession(headers=self.headers) as session:
-                async with session.post(upscale_url, json=upscale_payload) as response:
-                    response.raise_for_status()
-                    upscale_result = await response.json()
-
-                    if upscale_result.get("data") and upscale_result["data"].get("id"):
-                        upscale_request_id = upscale_result["data"]["id"]
-                        print(f"⬆️ Upscale generation started, request ID: {upscale_request_id}")
-                    else:
-                        print(f"❌ Invalid upscale API response: {upscale_result}")
-                        return None
-
-            # Poll for upscale completion
-            upscale_status_url = f"{self.base_url}/api/v3/predictions/{upscale_request_id}/result"
-            max_upscale_attempts = 120  # ~2 minutes for upscale
-
-            for attempt in range(max_upscale_attempts):
-                try:
-                    async with aiohttp.ClientSession(headers=self.headers) as session:
-                        async with session.get(upscale_status_url) as response:
-                            if response.status == 200:
-                                status_result = await response.json()
-
-                                if status_result.get("data"):
-                                    upscale_data = status_result["data"]
-                                    status = upscale_data.get("status")
-
-                                    if status == "completed":
-                                        if upscale_data.get("outputs") and len(upscale_data["outputs"]) > 0:
-                                            upscaled_video_url = upscale_data["outputs"][0]
-                                            print(f"⬆️ Upscale completed: {upscaled_video_url}")
-                                            return upscaled_video_url
-
-                                    elif status == "failed":
-                                        error_msg = upscale_data.get("error", "Upscale failed")
-                                        print(f"❌ Upscale failed: {error_msg}")
-                                        return None
-
-                    print(f"⏫ Upscaling... ({attempt + 1}/{max_upscale_attempts})")
-                    await asyncio.sleep(1)
-
-                except Exception as e:
-                    print(f"⚠️  Upscale polling error: {e}")
-                    await asyncio.sleep(1)
-
-            print("⏰ Upscale timeout")
-            return None
+            session = await get_shared_session()
+            async with session.post(upscale_url, json=upscale_payload, headers=self.headers) as response:
+                response.raise_for_status()
+                upscale_result = await response.json()
+
+                if upscale_result.get("data") and upscale_result["data"].get("id"):
+                    upscale_request_id = upscale_result["data"]["id"]
+                    print(f"⬆️ Upscale generation started, request ID: {upscale_request_id}")
+                else:
+                    print(f"❌ Invalid upscale API response: {upscale_result}")
+                    return None
+
+            # Poll for upscale completion (~2 minutes)
+            try:
+                upscale_data = await wait_for_prediction(
+                    self, upscale_request_id,
+                    max_attempts=120, timeout=180,
+                    interval_fn=fixed_polling_interval(1.0),
+                    label="upscale"
+                )
+            except PredictionFailedError as e:
+                print(f"❌ Upscale failed: {e.error}")
+                return None
+            except PredictionTimeoutError:
+                print("⏰ Upscale timeout")
+                return None
+
+            upscaled_video_url = upscale_data["outputs"][0]
+            print(f"⬆️ Upscale completed: {upscaled_video_url}")
+            return upscaled_video_url
 
         except Exception as e:
             print(f"❌ Upscale error: {e}")
@@ -163,6 +163,65 @@ class Config:
     MAX_ASYNC_WORKERS = int(os.getenv('MAX_ASYNC_WORKERS', '3'))  # Número máximo de workers asíncronos
     ASYNC_TASK_TIMEOUT = int(os.getenv('ASYNC_TASK_TIMEOUT', '300'))  # Timeout para tareas asíncronas (segundos)
 
+    # Poller central de predicciones (un solo loop para todos los request_id pendientes)
+    USE_PREDICTION_TRACKER = os.getenv('USE_PREDICTION_TRACKER', 'true').lower() == 'true'
+    PREDICTION_TRACKER_MAX_RPS = float(os.getenv('PREDICTION_TRACKER_MAX_RPS', '10'))  # Máximo de consultas de estado por segundo
+    PREDICTION_TRACKER_JITTER = float(os.getenv('PREDICTION_TRACKER_JITTER', '0.15'))  # Jitter relativo (±15%) para repartir consultas
+
+    # Pool de conexiones HTTP compartido para WaveSpeed (aiohttp)
+    WAVESPEED_POOL_LIMIT = int(os.getenv('WAVESPEED_POOL_LIMIT', '100'))  # Conexiones simultáneas totales
+    WAVESPEED_POOL_LIMIT_PER_HOST = int(os.getenv('WAVESPEED_POOL_LIMIT_PER_HOST', '20'))  # Conexiones simultáneas por host
+    WAVESPEED_DNS_CACHE_TTL = int(os.getenv('WAVESPEED_DNS_CACHE_TTL', '300'))  # Caché DNS (segundos)
+    WAVESPEED_KEEPALIVE_TIMEOUT = float(os.getenv('WAVESPEED_KEEPALIVE_TIMEOUT', '30'))  # Keep-alive de conexiones inactivas (segundos)
+
+    # Descarga de videos en streaming a disco
+    DOWNLOAD_CHUNK_SIZE = int(os.getenv('DOWNLOAD_CHUNK_SIZE', str(64 * 1024)))  # Tamaño de bloque de lectura/escritura (bytes)
+    MAX_VIDEO_DOWNLOAD_SIZE = int(os.getenv('MAX_VIDEO_DOWNLOAD_SIZE', str(200 * 1024 * 1024)))  # Tamaño máximo aceptado por video (bytes)
+    DOWNLOAD_MAX_RETRIES = int(os.getenv('DOWNLOAD_MAX_RETRIES', '2'))  # Reintentos internos reanudando con HTTP Range
+    DOWNLOAD_RETRY_BACKOFF = float(os.getenv('DOWNLOAD_RETRY_BACKOFF', '1.0'))  # Espera base entre reintentos (segundos)
+    DOWNLOAD_SEGMENTS = int(os.getenv('DOWNLOAD_SEGMENTS', '4'))  # Segmentos paralelos para videos grandes (1 = desactivado)
+    PARALLEL_DOWNLOAD_MIN_SIZE = int(os.getenv('PARALLEL_DOWNLOAD_MIN_SIZE', str(8 * 1024 * 1024)))  # Tamaño mínimo para descargar por segmentos (bytes)
+
+    # Entrega por URL: Telegram descarga el video directamente del CDN de WaveSpeed
+    DELIVER_VIDEO_BY_URL = os.getenv('DELIVER_VIDEO_BY_URL', 'true').lower() == 'true'
+    TELEGRAM_URL_FETCH_LIMIT = int(os.getenv('TELEGRAM_URL_FETCH_LIMIT', str(20 * 1024 * 1024)))  # Límite de Telegram para enviar archivos por URL (bytes)
+    TELEGRAM_UPLOAD_LIMIT = int(os.getenv('TELEGRAM_UPLOAD_LIMIT', str(50 * 1024 * 1024)))  # Límite de Telegram para subir archivos (bytes; mayor con un servidor Bot API local)
+    ARCHIVE_URL_DELIVERED_VIDEOS = os.getenv('ARCHIVE_URL_DELIVERED_VIDEOS', 'true').lower() == 'true'  # Guardar en segundo plano una copia en el volumen
+
+    # Imagen de entrada: se pasa a WaveSpeed la URL de Telegram del tamaño más pequeño que cubre la resolución del modelo
+    ARCHIVE_INPUT_IMAGES = os.getenv('ARCHIVE_INPUT_IMAGES', 'true').lower() == 'true'  # Guardar en segundo plano la imagen en el volumen
+    DEFAULT_INPUT_MIN_SIDE = int(os.getenv('DEFAULT_INPUT_MIN_SIDE', '720'))  # Lado corto mínimo si el modelo no indica resolución (px)
+
+    # Normalización de documentos y stickers (HEIC, TIFF, PNG enormes...) en un pool de procesos
+    NORMALIZE_INPUT_IMAGES = os.getenv('NORMALIZE_INPUT_IMAGES', 'true').lower() == 'true'  # Decodificar, orientar, recortar y re-codificar antes de WaveSpeed
+    IMAGE_NORMALIZER_WORKERS = int(os.getenv('IMAGE_NORMALIZER_WORKERS', str(min(2, os.cpu_count() or 1))))  # Procesos del pool de normalización
+    INPUT_IMAGE_FORMAT = os.getenv('INPUT_IMAGE_FORMAT', 'JPEG').upper()  # Formato de salida: JPEG o WEBP
+    INPUT_IMAGE_QUALITY = int(os.getenv('INPUT_IMAGE_QUALITY', '90'))  # Calidad de re-codificación
+    INPUT_IMAGE_CROP_TO_ASPECT = os.getenv('INPUT_IMAGE_CROP_TO_ASPECT', 'true').lower() == 'true'  # Recortar al centro a ASPECT_RATIO
+    PUBLIC_BASE_URL = os.getenv('PUBLIC_BASE_URL')  # URL pública que sirve /images (por defecto WEBHOOK_URL)
+
+    # Pipeline de generación web (pipeline.py): timeout por intento y reintentos de las etapas
+    STAGE_TRANSLATION_TIMEOUT = float(os.getenv('STAGE_TRANSLATION_TIMEOUT', '20'))  # Detección de idioma y traducción (segundos)
+    STAGE_OPTIMIZER_TIMEOUT = float(os.getenv('STAGE_OPTIMIZER_TIMEOUT', '60'))  # Prompt optimizer (segundos)
+    STAGE_SUBMIT_TIMEOUT = float(os.getenv('STAGE_SUBMIT_TIMEOUT', '60'))  # Envío de la generación a WaveSpeed (segundos)
+    STAGE_DOWNLOAD_TIMEOUT = float(os.getenv('STAGE_DOWNLOAD_TIMEOUT', '300'))  # Descarga del video (segundos)
+    STAGE_POSTPROCESS_TIMEOUT = float(os.getenv('STAGE_POSTPROCESS_TIMEOUT', '420'))  # Audio y upscale, incluida la espera (segundos)
+    STAGE_RETRIES = int(os.getenv('STAGE_RETRIES', '1'))  # Reintentos de las etapas idempotentes
+
+    # Caché de resultados del prompt optimizer (memoria + SQLite opcional)
+    PROMPT_CACHE_SIZE = int(os.getenv('PROMPT_CACHE_SIZE', '1000'))  # Entradas en el LRU en memoria
+    PROMPT_CACHE_TTL = float(os.getenv('PROMPT_CACHE_TTL', str(7 * 24 * 3600)))  # Vigencia de cada entrada (segundos)
+    PROMPT_CACHE_USE_DISK = os.getenv('PROMPT_CACHE_USE_DISK', 'true').lower() == 'true'  # Segundo nivel persistente en disco
+    PROMPT_CACHE_DB_PATH = os.getenv('PROMPT_CACHE_DB_PATH', os.path.join(os.getenv('VOLUME_PATH', './storage'), 'prompt_cache.db'))
+
+    # Detección de idioma y traducción de prompts (translation_service.py)
+    TRANSLATION_BACKEND = os.getenv('TRANSLATION_BACKEND', 'google')  # google (deep-translator + langdetect) o none
+    TRANSLATION_WORKERS = int(os.getenv('TRANSLATION_WORKERS', '4'))  # Threads para langdetect y llamadas a Google
+    TRANSLATION_CACHE_SIZE = int(os.getenv('TRANSLATION_CACHE_SIZE', '2000'))  # Entradas en el LRU en memoria
+    TRANSLATION_CACHE_TTL = float(os.getenv('TRANSLATION_CACHE_TTL', str(30 * 24 * 3600)))  # Vigencia de cada entrada (segundos)
+    TRANSLATION_CACHE_USE_DISK = os.getenv('TRANSLATION_CACHE_USE_DISK', 'true').lower() == 'true'  # Segundo nivel persistente en disco
+    TRANSLATION_CACHE_DB_PATH = os.getenv('TRANSLATION_CACHE_DB_PATH', os.path.join(os.getenv('VOLUME_PATH', './storage'), 'translations.db'))
+
     # Negative prompt automática para todas las solicitudes (configurable via env)
     NEGATIVE_PROMPT = os.getenv('NEGATIVE_PROMPT', '')
 
@@ -229,6 +288,62 @@ class Config:
     # Almacenamiento (para Railway u otros servicios)
     VOLUME_PATH = os.getenv('VOLUME_PATH', './storage')  # Default: ./storage
 
+    # Cola de trabajos persistente (generación de videos)
+    JOB_QUEUE_BACKEND = os.getenv('JOB_QUEUE_BACKEND', 'sqlite')  # 'sqlite' o 'redis'
+    JOB_QUEUE_DB_PATH = os.getenv('JOB_QUEUE_DB_PATH', os.path.join(VOLUME_PATH, 'jobs.db'))  # Base de datos SQLite de la cola
+    REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379')  # Redis para la cola (si JOB_QUEUE_BACKEND=redis)
+    JOB_VISIBILITY_TIMEOUT = float(os.getenv('JOB_VISIBILITY_TIMEOUT', '60'))  # Lease de un trabajo sin heartbeat antes de retomarlo (segundos)
+    JOB_PROGRESS_SYNC_INTERVAL = float(os.getenv('JOB_PROGRESS_SYNC_INTERVAL', '2'))  # Frecuencia de heartbeat/persistencia del progreso (segundos)
+    JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', '3'))  # Intentos máximos por trabajo
+    JOB_RETRY_BACKOFF = float(os.getenv('JOB_RETRY_BACKOFF', '5'))  # Espera base entre reintentos (segundos, exponencial)
+    JOB_RETENTION_HOURS = float(os.getenv('JOB_RETENTION_HOURS', '24'))  # Tiempo que se conservan los trabajos terminados
+
+    # Contadores de uso diario / rate limiting (reemplaza usage_data.json)
+    USAGE_STORE_BACKEND = os.getenv('USAGE_STORE_BACKEND', 'sqlite')  # 'sqlite' o 'redis' (usa REDIS_URL)
+    USAGE_DB_PATH = os.getenv('USAGE_DB_PATH', os.path.join(VOLUME_PATH, 'usage.db'))  # Base de datos SQLite de uso
+    USAGE_LEGACY_JSON_PATH = os.getenv('USAGE_LEGACY_JSON_PATH', 'usage_data.json')  # Archivo JSON antiguo a migrar al arrancar
+    USAGE_RETENTION_DAYS = int(os.getenv('USAGE_RETENTION_DAYS', '7'))  # Días de contadores e IPs que se conservan
+
+    # Rate limiting en memoria con volcado periódico al almacén de uso
+    # Límites diarios (ventana deslizante de 24h) por plan; None = ilimitado (ver /premium)
+    RATE_LIMIT_TIERS = {
+        'free': {'daily': int(os.getenv('FREE_DAILY_VIDEO_LIMIT', '5')), 'ip_daily': int(os.getenv('FREE_IP_DAILY_VIDEO_LIMIT', '20'))},
+        'pro': {'daily': None, 'ip_daily': None},
+        'creator': {'daily': None, 'ip_daily': None},
+        'enterprise': {'daily': None, 'ip_daily': None},
+    }
+    RATE_LIMIT_DEFAULT_TIER = os.getenv('RATE_LIMIT_DEFAULT_TIER', 'free')
+    RATE_LIMIT_USER_TIERS = os.getenv('RATE_LIMIT_USER_TIERS', '')  # Asignaciones "fingerprint:plan,fingerprint:plan"
+    RATE_LIMIT_FLUSH_INTERVAL = float(os.getenv('RATE_LIMIT_FLUSH_INTERVAL', '5'))  # Volcado de contadores cambiados (segundos)
+
+    # Índice de file_id de Telegram (un video subido una vez se reenvía sin volver a subirlo)
+    USE_FILE_ID_CACHE = os.getenv('USE_FILE_ID_CACHE', 'true').lower() == 'true'
+    FILE_ID_CACHE_DB_PATH = os.getenv('FILE_ID_CACHE_DB_PATH', os.path.join(VOLUME_PATH, 'file_ids.db'))  # Base de datos SQLite del índice
+    FILE_ID_CACHE_MEMORY_SIZE = int(os.getenv('FILE_ID_CACHE_MEMORY_SIZE', '2000'))  # Entradas recientes en memoria
+
+    # Descargas de redes sociales (/download y detección automática de URLs)
+    SOCIAL_DOWNLOAD_CONCURRENCY = int(os.getenv('SOCIAL_DOWNLOAD_CONCURRENCY', '4'))  # Descargas simultáneas en total
+    SOCIAL_DOWNLOAD_PER_PLATFORM = int(os.getenv('SOCIAL_DOWNLOAD_PER_PLATFORM', '2'))  # Descargas simultáneas por plataforma
+    SOCIAL_DOWNLOAD_MAX_QUEUE = int(os.getenv('SOCIAL_DOWNLOAD_MAX_QUEUE', '50'))  # Descargas en espera antes de rechazar (0 = sin límite)
+    SOCIAL_DOWNLOAD_TIMEOUT = float(os.getenv('SOCIAL_DOWNLOAD_TIMEOUT', '120'))  # Tiempo máximo de yt-dlp por intento (segundos)
+    SOCIAL_DOWNLOAD_PROGRESS_INTERVAL = float(os.getenv('SOCIAL_DOWNLOAD_PROGRESS_INTERVAL', '3'))  # Mínimo entre ediciones del mensaje de progreso (segundos)
+    YTDLP_IN_PROCESS = os.getenv('YTDLP_IN_PROCESS', 'true').lower() == 'true'  # yt_dlp en un pool de procesos precargado (false = CLI por enlace)
+    YTDLP_WORKERS = int(os.getenv('YTDLP_WORKERS', '2'))  # Procesos del pool de yt-dlp
+    CURL_SESSION_IDLE_TTL = float(os.getenv('CURL_SESSION_IDLE_TTL', '300'))  # Sesión curl_cffi sin uso antes de cerrarla (segundos)
+    CURL_SESSION_MAX_CONCURRENT = int(os.getenv('CURL_SESSION_MAX_CONCURRENT', '4'))  # Peticiones simultáneas por sesión curl_cffi
+    FFMPEG_CONCURRENCY = int(os.getenv('FFMPEG_CONCURRENCY', '1'))  # Procesos ffmpeg simultáneos (ajuste de tamaño, faststart y miniaturas)
+    FFMPEG_TIMEOUT = float(os.getenv('FFMPEG_TIMEOUT', '300'))  # Tiempo máximo de un trabajo de ffmpeg (segundos)
+    VIDEO_FASTSTART = os.getenv('VIDEO_FASTSTART', 'true').lower() == 'true'  # Remux sin re-codificar con 'moov' delante antes de subir
+    VIDEO_THUMBNAILS = os.getenv('VIDEO_THUMBNAILS', 'true').lower() == 'true'  # Miniatura JPEG del primer keyframe al subir un video
+
+    # Caché de videos sociales por ID canónico (archivo descargado + file_id de Telegram)
+    USE_SOCIAL_CACHE = os.getenv('USE_SOCIAL_CACHE', 'true').lower() == 'true'
+    SOCIAL_CACHE_DB_PATH = os.getenv('SOCIAL_CACHE_DB_PATH', os.path.join(VOLUME_PATH, 'social_cache.db'))  # Índice SQLite
+    SOCIAL_CACHE_DIR = os.getenv('SOCIAL_CACHE_DIR', os.path.join(VOLUME_PATH, 'social_cache'))  # Carpeta de los videos guardados
+    SOCIAL_CACHE_TTL = float(os.getenv('SOCIAL_CACHE_TTL', str(7 * 24 * 3600)))  # Vigencia de cada video (segundos)
+    SOCIAL_CACHE_MAX_MB = int(os.getenv('SOCIAL_CACHE_MAX_MB', '2048'))  # Espacio máximo de los videos guardados (MB)
+    SOCIAL_SHORT_LINK_TIMEOUT = float(os.getenv('SOCIAL_SHORT_LINK_TIMEOUT', '10'))  # Resolución de enlaces cortos (segundos)
+
     # Webhook configuration
     # En Railway, forzar webhooks ya que polling no funciona
     is_railway = os.getenv('RAILWAY_ENVIRONMENT') or os.getenv('RAILWAY_PROJECT_ID')
@@ -238,6 +353,14 @@ class Config:
     WEBHOOK_PORT = int(os.getenv('PORT', os.getenv('WEBHOOK_PORT', '8443')))
     WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
 
+    # Webhook de WaveSpeed: las predicciones se completan por push en vez de polling
+    USE_WAVESPEED_WEBHOOK = os.getenv('USE_WAVESPEED_WEBHOOK', 'true' if USE_WEBHOOK else 'false').lower() == 'true'
+    WAVESPEED_WEBHOOK_URL = os.getenv('WAVESPEED_WEBHOOK_URL')  # URL completa (por defecto WEBHOOK_URL + WAVESPEED_WEBHOOK_PATH)
+    WAVESPEED_WEBHOOK_PATH = os.getenv('WAVESPEED_WEBHOOK_PATH', '/wavespeed-webhook')
+    WAVESPEED_WEBHOOK_SECRET = os.getenv('WAVESPEED_WEBHOOK_SECRET')  # Token opcional que se añade como ?token= a la URL
+    WAVESPEED_WEBHOOK_FALLBACK_INTERVAL = float(os.getenv('WAVESPEED_WEBHOOK_FALLBACK_INTERVAL', '20'))  # Barrido de polling de respaldo (segundos)
+    WAVESPEED_WEBHOOK_TIMEOUT = float(os.getenv('WAVESPEED_WEBHOOK_TIMEOUT', '900'))  # Tiempo máximo esperando una predicción con webhook (segundos)
+
     @classmethod
     def validate(cls):
         """Valida que todas las configuraciones requeridas estén presentes"""
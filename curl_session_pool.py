@@ -0,0 +1,128 @@
+"""
+Curl Session Pool
+Sesiones curl_cffi (AsyncSession) de larga duración por plataforma y objetivo de impersonación
+
+- Una sesión por (plataforma, impersonate): conexiones TLS/HTTP2 reutilizadas entre enlaces
+  y un cookie jar que se conserva (las cookies de la página sirven para el video y el siguiente enlace)
+- Límite de peticiones simultáneas por sesión (semáforo + max_clients de curl)
+- Sesiones sin uso durante CURL_SESSION_IDLE_TTL se cierran (conexiones y cookies caducadas)
+"""
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+def _default_session_factory(impersonate: str, headers: Dict[str, str], max_clients: int):
+    from curl_cffi.requests import AsyncSession
+    return AsyncSession(impersonate=impersonate, headers=headers, max_clients=max_clients)
+
+
+@dataclass
+class _PooledSession:
+    session: Any
+    semaphore: asyncio.Semaphore
+    created_at: float = field(default_factory=time.time)
+    last_used: float = field(default_factory=time.time)
+    in_use: int = 0
+    requests: int = 0
+
+
+class CurlSessionPool:
+    """
+    Pool de AsyncSession de curl_cffi
+
+    Uso:
+        async with curl_session_pool.session('TikTok', 'safari18_ios', headers) as session:
+            page = await session.get(url)
+            video = await session.get(video_url)  # Misma conexión y cookies
+    """
+
+    def __init__(self, idle_ttl: float = None, max_concurrent: int = None,
+                 session_factory: Callable = _default_session_factory):
+        self.idle_ttl = idle_ttl if idle_ttl is not None else Config.CURL_SESSION_IDLE_TTL
+        self.max_concurrent = max_concurrent or Config.CURL_SESSION_MAX_CONCURRENT
+        self.session_factory = session_factory
+        self._sessions: Dict[Tuple[str, str], _PooledSession] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+        self.stats = {"created": 0, "reused": 0, "evicted": 0, "waits": 0}
+
+    @asynccontextmanager
+    async def session(self, platform: str, impersonate: str, headers: Optional[Dict[str, str]] = None):
+        """
+        Sesión de la plataforma (creada bajo demanda) reservada durante el bloque
+
+        Las cabeceras solo se aplican al crear la sesión: las de cada plataforma no cambian entre enlaces
+        """
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Las sesiones quedan ligadas al event loop en que se crearon
+            self._sessions.clear()
+            self._loop = loop
+        await self.evict_idle()
+
+        key = (platform, impersonate)
+        pooled = self._sessions.get(key)
+        if pooled is None:
+            pooled = _PooledSession(self.session_factory(impersonate, dict(headers or {}), self.max_concurrent),
+                                    asyncio.Semaphore(self.max_concurrent))
+            self._sessions[key] = pooled
+            self.stats["created"] += 1
+            logger.info(f"🔌 Sesión curl_cffi creada para {platform} ({impersonate})")
+        else:
+            self.stats["reused"] += 1
+
+        if pooled.semaphore.locked():
+            self.stats["waits"] += 1
+        pooled.in_use += 1  # Antes de esperar: una sesión con peticiones en cola no se expulsa
+        try:
+            async with pooled.semaphore:
+                pooled.requests += 1
+                yield pooled.session
+        finally:
+            pooled.in_use -= 1
+            pooled.last_used = time.time()
+
+    async def evict_idle(self) -> int:
+        """Cierra las sesiones sin uso durante más de idle_ttl; retorna cuántas se cerraron"""
+        cutoff = time.time() - self.idle_ttl
+        idle = [key for key, pooled in self._sessions.items() if not pooled.in_use and pooled.last_used < cutoff]
+        for key in idle:
+            await self._close(self._sessions.pop(key))
+            self.stats["evicted"] += 1
+            logger.info(f"🧹 Sesión curl_cffi inactiva cerrada: {key[0]} ({key[1]})")
+        return len(idle)
+
+    @staticmethod
+    async def _close(pooled: _PooledSession):
+        try:
+            await pooled.session.close()
+        except Exception as e:
+            logger.warning(f"⚠️ Error cerrando sesión curl_cffi: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "sessions": {f"{platform} ({impersonate})": {"requests": pooled.requests, "in_use": pooled.in_use}
+                         for (platform, impersonate), pooled in self._sessions.items()},
+        }
+
+    async def close(self):
+        """Cierra todas las sesiones (shutdown de la aplicación)"""
+        sessions = list(self._sessions.values())
+        self._sessions.clear()
+        for pooled in sessions:
+            await self._close(pooled)
+        if sessions:
+            logger.info(f"✅ {len(sessions)} sesiones curl_cffi cerradas")
+
+
+# Instancia global del pool
+curl_session_pool = CurlSessionPool()
@@ -0,0 +1,281 @@
+"""
+Download Service
+Cola de descargas de redes sociales con concurrencia limitada y deduplicación (single-flight)
+
+- Límite global y por plataforma de descargas simultáneas; el resto espera en cola (FIFO)
+- Peticiones simultáneas de la misma URL canónica comparten una sola descarga
+- Progreso (posición en la cola, porcentaje) enviado a todos los que esperan la misma descarga
+- La descarga en sí la hace una corrutina externa (VideoDownloader.download_video en bot.py)
+- El archivo descargado se borra cuando todos los que compartieron la descarga llaman a release()
+- Con una caché (social_cache.SocialCache) la clave es el ID canónico del video, un enlace ya descargado
+  se responde desde disco sin tráfico a la plataforma y los archivos nuevos pasan a la caché
+"""
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from urllib.parse import parse_qsl, urlencode, urlparse, urlunparse
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+DOWNLOADING = "downloading"
+COMPLETED = "completed"
+FAILED = "failed"
+
+
+@dataclass
+class DownloadProgress:
+    """Estado de una descarga, enviado a los callbacks de progreso"""
+    url: str
+    platform: Optional[str]
+    stage: str
+    position: int = 0  # Posición en la cola (solo en QUEUED)
+    percent: Optional[float] = None
+    detail: Optional[str] = None  # Método en uso, velocidad...
+    shared: bool = False  # La descarga la inició otra petición
+
+
+ProgressCallback = Callable[[DownloadProgress], Awaitable[None]]
+# download_fn(url, platform, report) -> dict con 'success'; report(percent, detail) es async
+DownloadFn = Callable[[str, Optional[str], Callable[..., Awaitable[None]]], Awaitable[Dict[str, Any]]]
+
+
+# Parámetros de seguimiento que no cambian el contenido del enlace
+TRACKING_PARAMS = {
+    "igsh", "igshid", "fbclid", "gclid", "si", "ref", "ref_src", "ref_url", "s", "t", "share_id",
+    "is_from_webapp", "sender_device", "sender_web_id", "web_id", "_r", "_t", "mibextid", "rdid",
+    "share_app_id", "share_link_id", "social_sharing", "utm_name", "context",
+}
+
+
+def canonical_url(url: str) -> str:
+    """
+    Clave de deduplicación: esquema y host en minúsculas, sin www./m., sin fragmento, barra final
+    ni parámetros de seguimiento (utm_*, igsh, fbclid...); el resto de la query se ordena
+    """
+    parsed = urlparse(url.strip())
+    host = parsed.netloc.lower()
+    for prefix in ("www.", "m.", "mobile."):
+        if host.startswith(prefix):
+            host = host[len(prefix):]
+            break
+    path = parsed.path.rstrip("/") or "/"
+    query = urlencode(sorted(
+        (name, value) for name, value in parse_qsl(parsed.query, keep_blank_values=True)
+        if name.lower() not in TRACKING_PARAMS and not name.lower().startswith("utm_")
+    ))
+    return urlunparse(("https", host, path, "", query, ""))
+
+
+@dataclass
+class _Flight:
+    key: str
+    url: str
+    platform: Optional[str]
+    future: asyncio.Future
+    subscribers: List[ProgressCallback] = field(default_factory=list)
+    last_progress: Optional[DownloadProgress] = None
+    consumers: int = 1  # Peticiones que recibirán el resultado (y deben llamar a release)
+    created_at: float = field(default_factory=time.monotonic)
+
+
+class DownloadService:
+    """
+    Descargas async con límite de concurrencia global y por plataforma
+
+    Uso:
+        result = await social_downloads.download(url, on_progress=callback)
+    """
+
+    def __init__(self, download_fn: DownloadFn, platform_of: Callable[[str], Optional[str]],
+                 cleanup_fn: Optional[Callable[[str], Any]] = None, cache=None,
+                 max_concurrent: int = None, per_platform: int = None, max_queue: int = None):
+        self.download_fn = download_fn
+        self.platform_of = platform_of
+        self.cleanup_fn = cleanup_fn
+        self.cache = cache
+        self.max_concurrent = max_concurrent or Config.SOCIAL_DOWNLOAD_CONCURRENCY
+        self.per_platform = per_platform or Config.SOCIAL_DOWNLOAD_PER_PLATFORM
+        self.max_queue = Config.SOCIAL_DOWNLOAD_MAX_QUEUE if max_queue is None else max_queue
+
+        self._global = asyncio.Semaphore(self.max_concurrent)
+        self._platforms: Dict[str, asyncio.Semaphore] = {}
+        self._flights: Dict[str, _Flight] = {}
+        self._waiting: List[_Flight] = []
+        self._holders: Dict[str, int] = {}  # filepath -> consumidores que aún no han llamado a release
+        self._active = 0
+
+        self.stats = {"downloads": 0, "coalesced": 0, "cache_hits": 0, "failed": 0, "rejected": 0, "max_waiting": 0}
+
+    def _platform_limit(self, platform: Optional[str]) -> asyncio.Semaphore:
+        key = platform or "other"
+        if key not in self._platforms:
+            self._platforms[key] = asyncio.Semaphore(self.per_platform)
+        return self._platforms[key]
+
+    async def download(self, url: str, on_progress: Optional[ProgressCallback] = None) -> Dict[str, Any]:
+        """
+        Descarga el video (o se une a la descarga en curso de la misma URL)
+
+        Returns:
+            El dict de download_fn ({'success': bool, 'filepath': ..., 'error': ...});
+            las peticiones coalescidas reciben el mismo dict con 'shared': True y los aciertos de la
+            caché 'cache_hit': True. 'canonical_id' es la clave del video.
+            Tras enviar el archivo hay que llamar a release(result)
+        """
+        key = await self.cache.canonicalize(url) if self.cache else canonical_url(url)
+        if self.cache:
+            artifact = await self.cache.lookup(key)
+            if artifact is not None and artifact.filepath:
+                self.stats["cache_hits"] += 1
+                logger.info(f"💾 {key} servido desde la caché sin descargar")
+                return {**artifact.meta, 'success': True, 'filepath': artifact.filepath, 'file_size': artifact.size,
+                        'cached': True, 'cache_hit': True, 'canonical_id': key}
+
+        flight = self._flights.get(key)
+        if flight is not None:
+            self.stats["coalesced"] += 1
+            flight.consumers += 1
+            logger.info(f"🔗 Descarga ya en curso para {key}: compartiendo resultado")
+            if on_progress:
+                flight.subscribers.append(on_progress)
+                if flight.last_progress:
+                    await self._notify_one(on_progress, flight.last_progress, shared=True)
+            try:
+                result = await asyncio.shield(flight.future)
+            except asyncio.CancelledError:
+                # Ya no recibirá el archivo: no debe retener su borrado
+                if flight.future.done() and not flight.future.exception():
+                    self.release(flight.future.result())
+                else:
+                    flight.consumers -= 1
+                raise
+            finally:
+                if on_progress in flight.subscribers:
+                    flight.subscribers.remove(on_progress)
+            return {**result, "shared": True}
+
+        if self.max_queue and len(self._waiting) >= self.max_queue:
+            self.stats["rejected"] += 1
+            return {
+                'success': False,
+                'error': f'Demasiadas descargas en cola ({len(self._waiting)}). Inténtalo en unos minutos.'
+            }
+
+        flight = _Flight(key, url, self.platform_of(url), asyncio.get_running_loop().create_future())
+        if on_progress:
+            flight.subscribers.append(on_progress)
+        self._flights[key] = flight
+        try:
+            result = {**await self._run(flight), 'canonical_id': key}
+            if self.cache and result.get('success'):
+                try:
+                    result = await self.cache.store(key, result)
+                except Exception as e:
+                    logger.warning(f"⚠️ No se pudo guardar la descarga en la caché: {e}")
+            if result.get('success') and result.get('filepath') and not result.get('cached'):
+                self._holders[result['filepath']] = self._holders.get(result['filepath'], 0) + flight.consumers
+            flight.future.set_result(result)
+            return result
+        except BaseException as e:
+            flight.future.set_exception(e)
+            flight.future.exception()  # Evitar el aviso de excepción no recuperada si nadie más espera
+            raise
+        finally:
+            del self._flights[key]
+
+    def release(self, result: Dict[str, Any]):
+        """El consumidor terminó con el archivo; se borra cuando lo han liberado todos (salvo si es de la caché)"""
+        filepath = result.get('filepath')
+        if not result.get('success') or not filepath or result.get('cached'):
+            return
+        remaining = self._holders.get(filepath, 1) - 1
+        if remaining > 0:
+            self._holders[filepath] = remaining
+            return
+        self._holders.pop(filepath, None)
+        if self.cleanup_fn:
+            self.cleanup_fn(filepath)
+
+    async def _run(self, flight: _Flight) -> Dict[str, Any]:
+        self._waiting.append(flight)
+        self.stats["max_waiting"] = max(self.stats["max_waiting"], len(self._waiting))
+        await self._broadcast_positions()
+        acquired = False
+        try:
+            # Primero el límite de la plataforma: una plataforma saturada no ocupa huecos globales
+            async with self._platform_limit(flight.platform):
+                async with self._global:
+                    self._waiting.remove(flight)
+                    acquired = True
+                    await self._broadcast_positions()
+                    return await self._download(flight)
+        finally:
+            if not acquired:
+                self._waiting.remove(flight)
+                await self._broadcast_positions()
+
+    async def _download(self, flight: _Flight) -> Dict[str, Any]:
+        self._active += 1
+        started = time.monotonic()
+        waited = started - flight.created_at
+
+        async def report(percent: Optional[float] = None, detail: Optional[str] = None):
+            await self._notify(flight, DownloadProgress(flight.url, flight.platform, DOWNLOADING,
+                                                        percent=percent, detail=detail))
+
+        try:
+            await report()
+            try:
+                result = await self.download_fn(flight.url, flight.platform, report)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Error descargando {flight.url}: {e}")
+                result = {'success': False, 'error': f'Error interno: {str(e)}', 'platform': flight.platform}
+
+            elapsed = time.monotonic() - started
+            if result.get('success'):
+                self.stats["downloads"] += 1
+                logger.info(f"📥 Descarga de {flight.platform} completada en {elapsed:.1f}s (en cola {waited:.1f}s)")
+                await self._notify(flight, DownloadProgress(flight.url, flight.platform, COMPLETED, percent=100.0))
+            else:
+                self.stats["failed"] += 1
+                await self._notify(flight, DownloadProgress(flight.url, flight.platform, FAILED,
+                                                            detail=result.get('error')))
+            return result
+        finally:
+            self._active -= 1
+
+    async def _broadcast_positions(self):
+        for position, flight in enumerate(list(self._waiting), start=1):
+            await self._notify(flight, DownloadProgress(flight.url, flight.platform, QUEUED, position=position))
+
+    async def _notify(self, flight: _Flight, progress: DownloadProgress):
+        flight.last_progress = progress
+        for index, callback in enumerate(list(flight.subscribers)):
+            await self._notify_one(callback, progress, shared=index > 0)
+
+    @staticmethod
+    async def _notify_one(callback: ProgressCallback, progress: DownloadProgress, shared: bool):
+        try:
+            if shared:
+                progress = DownloadProgress(**{**progress.__dict__, "shared": True})
+            await callback(progress)
+        except Exception as progress_error:
+            logger.warning(f"⚠️ Error en callback de progreso: {progress_error}")
+
+    def get_stats(self):
+        return {
+            **self.stats,
+            "active": self._active,
+            "waiting": len(self._waiting),
+            "in_flight": len(self._flights),
+            "held_files": len(self._holders),
+            "max_concurrent": self.max_concurrent,
+            "per_platform": self.per_platform,
+        }
@@ -7,9 +7,9 @@ import uuid
 import asyncio
 import aiofiles
 import base64
-import json
 import logging
-from datetime import datetime, date
+import mimetypes
+from datetime import datetime
 from contextlib import asynccontextmanager
 from typing import Dict, Any, Optional
 from pathlib import Path
@@ -18,25 +18,25 @@ from fastapi import FastAPI, Request, HTTPException, BackgroundTasks, Form, File
 from fastapi.responses import JSONResponse, HTMLResponse, FileResponse
 import uvicorn
 
-# Translation imports
-try:
-    from deep_translator import GoogleTranslator
-    from langdetect import detect
-    TRANSLATION_AVAILABLE = True
-    # Define exception for langdetect errors (langdetect doesn't export LangDetectError in some versions)
-    LangDetectError = Exception
-except ImportError as e:
-    print(f"⚠️ Translation libraries import failed: {e}. Install with: pip install deep-translator langdetect")
-    TRANSLATION_AVAILABLE = False
-    GoogleTranslator = None
-    detect = None
-    LangDetectError = Exception
-
 # Imports de Telegram al inicio para evitar errores de scope
 from telegram import Update
 from telegram.ext import Application, CommandHandler, MessageHandler, filters
 
 from config import Config
+from async_wavespeed import AsyncWavespeedAPI, close_shared_session, wavespeed_webhook_url, verify_wavespeed_webhook_token
+from async_polling import wait_for_prediction, PredictionFailedError, PredictionTimeoutError
+from pipeline import Pipeline, Stage, StageError
+from prediction_tracker import prediction_tracker
+from job_queue import job_queue
+from usage_store import usage_store
+from rate_limiter import rate_limiter
+from prompt_cache import prompt_cache
+from translation_service import translation_service
+from file_id_cache import file_id_cache
+from social_cache import social_cache
+from ytdlp_engine import ytdlp_engine
+from curl_session_pool import curl_session_pool
+from image_normalizer import image_normalizer, public_image_url
 from bot import (
     start, help_command, list_models_command, handle_text_video,
     handle_quality_video, handle_preview_video, handle_optimize, handle_lastvideo, handle_balance, handle_debug_files, handle_download, handle_social_url,
@@ -76,130 +76,43 @@ def generate_fingerprint(client_ip: str, user_agent: str = "", fingerprint_data:
     fingerprint_string = "|".join(fingerprint_parts)
     return hashlib.sha256(fingerprint_string.encode()).hexdigest()[:16]
 
-def associate_fingerprint_with_ip(usage_data: Dict[str, Any], client_ip: str, fingerprint: str):
-    """Associate a fingerprint with an IP address for tracking"""
-    ip_fingerprints = usage_data.setdefault("ip_fingerprints", {})
-    if client_ip not in ip_fingerprints:
-        ip_fingerprints[client_ip] = []
-
-    if fingerprint not in ip_fingerprints[client_ip]:
-        ip_fingerprints[client_ip].append(fingerprint)
-
-def is_suspicious_user(usage_data: Dict[str, Any], fingerprint: str) -> bool:
-    """Check if user is flagged as suspicious"""
-    suspicious_users = usage_data.get("suspicious_users", {})
-    return fingerprint in suspicious_users
-
-def flag_suspicious_user(usage_data: Dict[str, Any], fingerprint: str, reason: str):
-    """Flag a user as suspicious"""
-    suspicious_users = usage_data.setdefault("suspicious_users", {})
-    suspicious_users[fingerprint] = {
-        "flagged_at": datetime.now().isoformat(),
-        "reason": reason
-    }
-    save_usage_data(usage_data)
-
-def detect_language(text: str) -> str:
-    """Detect the language of the given text"""
-    if not TRANSLATION_AVAILABLE:
-        return "en"  # Default to English if translation not available
-
-    try:
-        detected = detect(text)
-        logger.info(f"🌐 Language detected: {detected}")
-        return detected
-    except (LangDetectError, Exception) as e:
-        logger.warning(f"⚠️ Language detection failed: {e}, defaulting to English")
-        return "en"
-
-def translate_to_english(text: str) -> tuple[str, bool]:
-    """Translate text to English if not already in English"""
-    if not TRANSLATION_AVAILABLE:
-        return text, False
-
-    try:
-        detected_lang = detect_language(text)
-        if detected_lang == "en":
-            logger.info("🌐 Text already in English")
-            return text, False
-
-        logger.info(f"🌐 Translating from {detected_lang} to English")
-        translator = GoogleTranslator(source=detected_lang, target="en")
-        translated = translator.translate(text)
+async def detect_language(text: str) -> str:
+    """Detect the language of the given text (cached, off the event loop)"""
+    return await translation_service.detect_language(text)
 
-        logger.info(f"🌐 Translation: '{text[:50]}...' → '{translated[:50]}...'")
-        return translated, True
-
-    except Exception as e:
-        logger.error(f"❌ Translation failed: {e}")
-        return text, False
+async def translate_to_english(text: str, source: Optional[str] = None) -> tuple[str, bool]:
+    """Translate text to English if not already in English (cached, coalesced, off the event loop)"""
+    return await translation_service.translate_to_english(text, source=source)
 
-def load_usage_data() -> Dict[str, Any]:
-    """Load usage data from file"""
-    try:
-        with open("usage_data.json", "r") as f:
-            return json.load(f)
-    except FileNotFoundError:
-        return {"daily_usage": {}, "ip_fingerprints": {}, "suspicious_users": {}}
-    except Exception as e:
-        logger.error(f"Error loading usage data: {e}")
-        return {"daily_usage": {}, "ip_fingerprints": {}, "suspicious_users": {}}
-
-def save_usage_data(data: Dict[str, Any]):
-    """Save usage data to file"""
-    try:
-        with open("usage_data.json", "w") as f:
-            json.dump(data, f, indent=2)
-    except Exception as e:
-        logger.error(f"Error saving usage data: {e}")
-
-def check_rate_limit_advanced(client_ip: str, fingerprint: str, user_agent: str = "") -> tuple[bool, int, int, bool]:
+async def check_rate_limit_advanced(client_ip: str, fingerprint: str, user_agent: str = "") -> tuple[bool, int, int, bool]:
     """Advanced rate limiting with fingerprinting and VPN detection"""
-    usage_data = load_usage_data()
-    today = date.today().isoformat()
-
-    # Initialize today's data
-    if today not in usage_data["daily_usage"]:
-        usage_data["daily_usage"][today] = {}
-
-    today_usage = usage_data["daily_usage"][today]
-
     # Associate fingerprint with IP
-    associate_fingerprint_with_ip(usage_data, client_ip, fingerprint)
+    ip_fingerprint_count = await usage_store.associate_fingerprint(client_ip, fingerprint)
 
     # Check for suspicious activity
-    ip_fingerprints = usage_data.get("ip_fingerprints", {}).get(client_ip, [])
-    is_vpn_suspicious = len(ip_fingerprints) > 3  # More than 3 fingerprints from same IP
-
-    # Check usage for this fingerprint
-    fingerprint_usage = today_usage.get(fingerprint, 0)
+    is_vpn_suspicious = ip_fingerprint_count > 3  # More than 3 fingerprints from same IP
 
-    # Allow 5 videos per day per fingerprint
-    limit = 5
-    remaining = max(0, limit - fingerprint_usage)
+    # Check usage for this fingerprint and IP against the plan limits (in memory)
+    decision = await rate_limiter.check(fingerprint, client_ip)
+    fingerprint_usage = decision.used
+    remaining = decision.remaining  # None = unlimited plan
 
     # Apply rate limit
-    if fingerprint_usage >= limit:
-        logger.warning(f"🚫 Rate limit exceeded for fingerprint {fingerprint[:8]}...: {fingerprint_usage}/{limit}")
+    if not decision.allowed:
+        logger.warning(f"🚫 Rate limit exceeded for {decision.scope} {fingerprint[:8]}... "
+                       f"({decision.tier}): {fingerprint_usage}/{decision.limit}")
         return False, remaining, fingerprint_usage, is_vpn_suspicious
 
     # Check for suspicious patterns
-    if is_vpn_suspicious and not is_suspicious_user(usage_data, fingerprint):
-        logger.warning(f"🚨 Suspicious activity detected: IP {client_ip} has {len(ip_fingerprints)} fingerprints")
-        flag_suspicious_user(usage_data, fingerprint, f"Multiple fingerprints from IP: {len(ip_fingerprints)}")
+    if is_vpn_suspicious:
+        if await usage_store.flag_suspicious(fingerprint, f"Multiple fingerprints from IP: {ip_fingerprint_count}"):
+            logger.warning(f"🚨 Suspicious activity detected: IP {client_ip} has {ip_fingerprint_count} fingerprints")
 
     return True, remaining, fingerprint_usage, is_vpn_suspicious
 
-def increment_usage_advanced(fingerprint: str):
-    """Increment usage counter for a fingerprint"""
-    usage_data = load_usage_data()
-    today = date.today().isoformat()
-
-    if today not in usage_data["daily_usage"]:
-        usage_data["daily_usage"][today] = {}
-
-    usage_data["daily_usage"][today][fingerprint] = usage_data["daily_usage"][today].get(fingerprint, 0) + 1
-    save_usage_data(usage_data)
+async def increment_usage_advanced(client_ip: str, fingerprint: str):
+    """Increment usage counters for a fingerprint and its IP (persisted in batches)"""
+    await rate_limiter.hit(fingerprint, client_ip)
 
 async def setup_webhook(telegram_app):
     """Configurar webhook en Telegram"""
@@ -231,8 +144,7 @@ app_state = {
     "processed_updates": 0
 }
 
-# Gestión de tareas de video (migrado de web_app.py)
-tasks: Dict[str, Dict[str, Any]] = {}
+# Las tareas de video se guardan en la cola persistente (job_queue), no en memoria
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -240,11 +152,10 @@ async def lifespan(app: FastAPI):
     logger.info("🚀 Iniciando aplicación FastAPI para TELEWAN Bot")
 
     # Verificar credenciales críticas antes de inicializar
+    # Sin token solo se omite Telegram: la cola, el poller y el rate limiter siguen sirviendo /generate
     if not Config.TELEGRAM_BOT_TOKEN:
-        logger.error("❌ TELEGRAM_BOT_TOKEN no configurado - aplicación no puede inicializarse")
+        logger.error("❌ TELEGRAM_BOT_TOKEN no configurado - continuando sin Telegram")
         app_state["error"] = "TELEGRAM_BOT_TOKEN missing"
-        yield
-        return
 
     if not Config.WAVESPEED_API_KEY:
         logger.warning("⚠️  WAVESPEED_API_KEY no configurado - funcionalidades limitadas")
@@ -253,78 +164,96 @@ async def lifespan(app: FastAPI):
     try:
         logger.info("ℹ️  Sistema de eventos deshabilitado - usando modo directo")
 
-        # 3. Inicializar aplicación de Telegram (requiere token)
-        try:
-            # Usar imports del inicio del archivo (no re-importar)
-            telegram_app = Application.builder().token(Config.TELEGRAM_BOT_TOKEN).build()
-
-            # Agregar manejadores de comandos
-            telegram_app.add_handler(CommandHandler("start", start))
-            telegram_app.add_handler(CommandHandler("help", help_command))
-            telegram_app.add_handler(CommandHandler("models", list_models_command))
-            telegram_app.add_handler(CommandHandler("textvideo", handle_text_video))
-            telegram_app.add_handler(CommandHandler("quality", handle_quality_video))
-            telegram_app.add_handler(CommandHandler("preview", handle_preview_video))
-            telegram_app.add_handler(CommandHandler("optimize", handle_optimize))
-            telegram_app.add_handler(CommandHandler("lastvideo", handle_lastvideo))
-            telegram_app.add_handler(CommandHandler("balance", handle_balance))
-            telegram_app.add_handler(CommandHandler("debugfiles", handle_debug_files))
-            telegram_app.add_handler(CommandHandler("download", handle_download))
-
-            # Handler automático para URLs de redes sociales (PRIORIDAD ALTA)
-            telegram_app.add_handler(MessageHandler(filters.TEXT & (~filters.COMMAND), handle_social_url))
-
-            # Agregar manejadores de mensajes (photos, documents, stickers)
-            telegram_app.add_handler(MessageHandler(filters.PHOTO, handle_photo))
-            telegram_app.add_handler(MessageHandler(image_document_filter, handle_document_image))
-            telegram_app.add_handler(MessageHandler(static_sticker_filter, handle_sticker_image))
-
-            # ¡CRÍTICO! Inicializar la aplicación de Telegram para webhook
-            await telegram_app.initialize()
-            logger.info("✅ Telegram Application inicializado (initialize() llamado)")
-
-            app_state["telegram_app"] = telegram_app
-            logger.info("✅ Aplicación de Telegram registrada en app_state")
-
-            # Configurar webhook si está habilitado
-            if Config.USE_WEBHOOK:
-                # Verificar que WEBHOOK_URL esté configurada
-                if not Config.WEBHOOK_URL:
-                    if os.getenv('RAILWAY_ENVIRONMENT'):
-                        logger.error("❌ WEBHOOK_URL no configurada - REQUERIDA para Railway")
-                        logger.error("💡 Configurar en Railway Dashboard > Variables > WEBHOOK_URL")
-                        logger.error("💡 Formato esperado: https://tu-proyecto.up.railway.app")
-                        logger.error("💡 El nombre del proyecto se encuentra en la URL de Railway")
-                        raise ValueError("WEBHOOK_URL requerida para Railway pero no configurada")
+        if Config.TELEGRAM_BOT_TOKEN:
+            # 3. Inicializar aplicación de Telegram (requiere token)
+            try:
+                # Usar imports del inicio del archivo (no re-importar)
+                telegram_app = Application.builder().token(Config.TELEGRAM_BOT_TOKEN).build()
+
+                # Agregar manejadores de comandos
+                telegram_app.add_handler(CommandHandler("start", start))
+                telegram_app.add_handler(CommandHandler("help", help_command))
+                telegram_app.add_handler(CommandHandler("models", list_models_command))
+                telegram_app.add_handler(CommandHandler("textvideo", handle_text_video))
+                telegram_app.add_handler(CommandHandler("quality", handle_quality_video))
+                telegram_app.add_handler(CommandHandler("preview", handle_preview_video))
+                telegram_app.add_handler(CommandHandler("optimize", handle_optimize))
+                telegram_app.add_handler(CommandHandler("lastvideo", handle_lastvideo))
+                telegram_app.add_handler(CommandHandler("balance", handle_balance))
+                telegram_app.add_handler(CommandHandler("debugfiles", handle_debug_files))
+                telegram_app.add_handler(CommandHandler("download", handle_download))
+
+                # Handler automático para URLs de redes sociales (PRIORIDAD ALTA)
+                telegram_app.add_handler(MessageHandler(filters.TEXT & (~filters.COMMAND), handle_social_url))
+
+                # Agregar manejadores de mensajes (photos, documents, stickers)
+                telegram_app.add_handler(MessageHandler(filters.PHOTO, handle_photo))
+                telegram_app.add_handler(MessageHandler(image_document_filter, handle_document_image))
+                telegram_app.add_handler(MessageHandler(static_sticker_filter, handle_sticker_image))
+
+                # ¡CRÍTICO! Inicializar la aplicación de Telegram para webhook
+                await telegram_app.initialize()
+                logger.info("✅ Telegram Application inicializado (initialize() llamado)")
+
+                app_state["telegram_app"] = telegram_app
+                logger.info("✅ Aplicación de Telegram registrada en app_state")
+
+                # Configurar webhook si está habilitado
+                if Config.USE_WEBHOOK:
+                    # Verificar que WEBHOOK_URL esté configurada
+                    if not Config.WEBHOOK_URL:
+                        if os.getenv('RAILWAY_ENVIRONMENT'):
+                            logger.error("❌ WEBHOOK_URL no configurada - REQUERIDA para Railway")
+                            logger.error("💡 Configurar en Railway Dashboard > Variables > WEBHOOK_URL")
+                            logger.error("💡 Formato esperado: https://tu-proyecto.up.railway.app")
+                            logger.error("💡 El nombre del proyecto se encuentra en la URL de Railway")
+                            raise ValueError("WEBHOOK_URL requerida para Railway pero no configurada")
+                        else:
+                            logger.warning("⚠️  WEBHOOK_URL no configurada - usando modo local sin webhook")
+
+                    if Config.WEBHOOK_URL:
+                        try:
+                            await setup_webhook(telegram_app)
+                            logger.info("✅ Webhook configurado correctamente")
+                        except Exception as webhook_error:
+                            logger.error(f"❌ Error configurando webhook: {webhook_error}")
+                            logger.warning("⚠️  El bot no funcionará sin webhook en Railway")
+                            raise webhook_error  # En Railway, webhook es obligatorio
                     else:
-                        logger.warning("⚠️  WEBHOOK_URL no configurada - usando modo local sin webhook")
-
-                if Config.WEBHOOK_URL:
-                    try:
-                        await setup_webhook(telegram_app)
-                        logger.info("✅ Webhook configurado correctamente")
-                    except Exception as webhook_error:
-                        logger.error(f"❌ Error configurando webhook: {webhook_error}")
-                        logger.warning("⚠️  El bot no funcionará sin webhook en Railway")
-                        raise webhook_error  # En Railway, webhook es obligatorio
+                        logger.error("❌ WEBHOOK_URL no configurada - requerida para Railway")
+                        logger.error("💡 Configura WEBHOOK_URL en las variables de entorno de Railway")
+                        raise ValueError("WEBHOOK_URL requerida para funcionamiento en Railway")
                 else:
-                    logger.error("❌ WEBHOOK_URL no configurada - requerida para Railway")
-                    logger.error("💡 Configura WEBHOOK_URL en las variables de entorno de Railway")
-                    raise ValueError("WEBHOOK_URL requerida para funcionamiento en Railway")
-            else:
-                logger.warning("⚠️  USE_WEBHOOK=false - el bot no funcionará en Railway sin webhooks")
+                    logger.warning("⚠️  USE_WEBHOOK=false - el bot no funcionará en Railway sin webhooks")
 
-            logger.info("🎯 Sistema Event-Driven operativo")
+                logger.info("🎯 Sistema Event-Driven operativo")
 
-        except Exception as telegram_error:
-            logger.error(f"❌ Error inicializando Telegram: {telegram_error}")
-            app_state["telegram_error"] = str(telegram_error)
-            logger.warning("⚠️  Continuando sin Telegram - solo endpoints básicos disponibles")
+            except Exception as telegram_error:
+                logger.error(f"❌ Error inicializando Telegram: {telegram_error}")
+                app_state["telegram_error"] = str(telegram_error)
+                logger.warning("⚠️  Continuando sin Telegram - solo endpoints básicos disponibles")
 
     except Exception as e:
         logger.error(f"❌ Error inicializando componentes: {e}")
         raise
 
+    # Poller central de predicciones de WaveSpeed
+    if Config.USE_PREDICTION_TRACKER:
+        await prediction_tracker.start()
+
+    # Cola de trabajos persistente: retoma los trabajos interrumpidos por un reinicio
+    job_queue.resources["telegram_app"] = app_state.get("telegram_app")
+    await job_queue.start()
+
+    # Rate limiter en memoria con volcado periódico al almacén de uso
+    await rate_limiter.start()
+
+    # Pool de yt-dlp precargado: el primer enlace de /download no paga el arranque de los workers
+    try:
+        await ytdlp_engine.warm_up()
+    except Exception as e:
+        logger.error(f"❌ Error precargando yt-dlp: {e}")
+
     # Ejecutar diagnóstico automático al iniciar
     logger.info("🔍 Ejecutando diagnóstico automático de inicio...")
     try:
@@ -337,13 +266,37 @@ async def lifespan(app: FastAPI):
     # Shutdown: Limpiar recursos en orden inverso
     logger.info("🛑 Apagando aplicación FastAPI")
 
-    try:
-        # Cerrar aplicación de Telegram
-        if app_state["telegram_app"]:
-            await app_state["telegram_app"].shutdown()
+    # Primero la cola de trabajos y el rate limiter: un trabajo en curso todavía envía por Telegram
+    await close_quietly("cola de trabajos", job_queue.stop)
+    await close_quietly("rate limiter", rate_limiter.stop)
+
+    # Cerrar aplicación de Telegram
+    if app_state["telegram_app"]:
+        if await close_quietly("aplicación de Telegram", app_state["telegram_app"].shutdown):
             logger.info("✅ Aplicación de Telegram cerrada correctamente")
+
+    # Cada cierre por separado: un fallo no deja los demás recursos abiertos
+    await close_quietly("pool de yt-dlp", ytdlp_engine.shutdown)
+    await close_quietly("sesiones curl_cffi", curl_session_pool.close)
+    await close_quietly("almacén de uso", usage_store.close)
+    await close_quietly("caché de prompts", prompt_cache.close)
+    await close_quietly("servicio de traducción", translation_service.close)
+    await close_quietly("caché de file_id", file_id_cache.close)
+    await close_quietly("caché de videos sociales", social_cache.close)
+    await close_quietly("normalizador de imágenes", image_normalizer.shutdown)
+    await close_quietly("poller de predicciones", prediction_tracker.stop)
+    await close_quietly("sesión HTTP compartida", close_shared_session)
+
+async def close_quietly(name: str, close) -> bool:
+    """Ejecuta un cierre (síncrono o async) registrando su error sin interrumpir el apagado"""
+    try:
+        result = close()
+        if asyncio.iscoroutine(result):
+            await result
+        return True
     except Exception as e:
-        logger.error(f"❌ Error durante shutdown: {e}")
+        logger.error(f"❌ Error cerrando {name}: {e}")
+        return False
 
 # Crear aplicación FastAPI
 app = FastAPI(
@@ -399,24 +352,25 @@ async def health_check():
 
     return response
 
-@app.post("/wavespeed-webhook", tags=["Wavespeed"])
-async def wavespeed_webhook(request: Request, background_tasks: BackgroundTasks):
+@app.post(Config.WAVESPEED_WEBHOOK_PATH, tags=["Wavespeed"])
+async def wavespeed_webhook(request: Request):
     """
-    Endpoint para recibir webhooks de Wavespeed AI cuando los videos estén listos
-    (Funcionalidad futura - Wavespeed aún no soporta webhooks)
+    Endpoint para recibir webhooks de Wavespeed AI cuando termina una predicción
+    Resuelve al instante la espera pendiente de ese request_id; el worker continúa con descarga y entrega
     """
+    if not verify_wavespeed_webhook_token(request.query_params.get("token")):
+        logger.warning("❌ Webhook de Wavespeed con token inválido")
+        raise HTTPException(status_code=401, detail="Invalid webhook token")
+
     try:
         webhook_data = await request.json()
-        logger.info(f"🎣 Webhook recibido de Wavespeed: {webhook_data}")
-
-        # Aquí iría la lógica para procesar notificaciones de Wavespeed
-        # Por ahora solo loggeamos y retornamos OK
-
-        return {"status": "received", "message": "Webhook processed successfully"}
-
     except Exception as e:
         logger.error(f"❌ Error procesando webhook de Wavespeed: {e}")
-        raise HTTPException(status_code=500, detail=f"Error processing webhook: {str(e)}")
+        raise HTTPException(status_code=400, detail=f"Invalid webhook payload: {str(e)}")
+
+    matched = prediction_tracker.resolve(webhook_data)
+    logger.info(f"🎣 Webhook de Wavespeed recibido (pendiente encontrado: {matched})")
+    return {"status": "received", "matched": matched}
 
 @app.post("/webhook", tags=["Telegram"])
 async def telegram_webhook(request: Request, background_tasks: BackgroundTasks):
@@ -565,6 +519,12 @@ async def get_stats():
         "processed_updates": app_state.get("processed_updates", 0),
         "uptime": (datetime.now() - app_state["start_time"]).total_seconds(),
         "telegram_bot_ready": app_state.get("telegram_app") is not None,
+        "job_queue": await job_queue.get_stats(),
+        "rate_limiter": rate_limiter.get_stats(),
+        "prompt_cache": prompt_cache.get_stats(),
+        "translation": translation_service.get_stats(),
+        "file_id_cache": file_id_cache.get_stats(),
+        "image_normalizer": image_normalizer.get_stats(),
         "timestamp": datetime.now().isoformat()
     }
 
@@ -919,65 +879,147 @@ async def diagnose_text():
     except Exception as e:
         return {"diagnosis": f"❌ Error en diagnóstico: {str(e)}"}
 
-# Función de procesamiento de video (migrada de web_app.py)
-async def process_video_generation(task_id: str):
-    """Process video generation in background"""
-    try:
-        task = tasks[task_id]
-        logger.info(f"🎬 Starting video generation for task {task_id}")
-
-        # Import async functions
-        from async_wavespeed import generate_video, add_audio_to_video, upscale_video_to_1080p
-
-        # Step 1: Generate base video
+def build_generation_pipeline(task: Dict[str, Any], task_id: str, api: AsyncWavespeedAPI) -> Pipeline:
+    """
+    Etapas de un trabajo 'fastapi_video': la lectura de la imagen (clave de caché del optimizer)
+    corre en paralelo con la detección de idioma y la traducción
+    """
+    async def translate(prompt: str, language: str) -> str:
+        translated_prompt, was_translated = await translate_to_english(prompt, source=language)
+        if was_translated:
+            task["translated_prompt"] = translated_prompt
+            logger.info(f"🌐 Translated prompt: {translated_prompt[:100]}...")
+        return translated_prompt
+
+    def load_image(image_filename: str) -> Optional[bytes]:
+        image_path = Path(Config.VOLUME_PATH) / image_filename
+        return image_path.read_bytes() if image_path.exists() else None
+
+    async def optimize(english_prompt: str, image_url: Optional[str], image_bytes: Optional[bytes]) -> str:
+        logger.info("🤖 Optimizing prompt...")
+        if image_url:
+            # Image-to-video with optimization (cached by image hash + text)
+            optimized = await api.optimize_prompt(image_url, english_prompt, image_bytes=image_bytes)
+        else:
+            # Text-to-video with optimization
+            result = await api.optimize_prompt_text_only(english_prompt)
+            optimized = result.get("optimized_prompt") or None
+        if optimized:
+            task["optimized_prompt"] = optimized
+            logger.info(f"✅ Prompt optimized: {optimized[:100]}...")
+            return optimized
+        logger.warning("⚠️ Prompt optimization failed")
+        return english_prompt
+
+    async def generate(final_prompt: str, image_url: Optional[str], model: str) -> Dict[str, Any]:
+        task["final_prompt"] = final_prompt
+        # El request_id queda guardado para no regenerar en un reintento
+        request_id = task.get("request_id")
+        if request_id:
+            return {"request_id": request_id, "push": False}
         logger.info("🎬 Generating base video...")
-        result = await generate_video(
-            prompt=task["final_prompt"],
-            model=task["model"],
-            image_url=task.get("image_url")
-        )
-
-        if not result or "video_url" not in result:
+        result = await api.generate_video(prompt=final_prompt, model=model, image_url=image_url)
+        request_id = result.get("id") if result else None
+        if not request_id:
             raise Exception(f"Video generation failed: {result}")
+        task["request_id"] = request_id
+        # Solo una predicción recién creada puede confiar en el webhook; una retomada se consulta ya
+        return {"request_id": request_id, "push": wavespeed_webhook_url() is not None}
 
-        video_url = result["video_url"]
+    async def poll(request_id: str, push: bool, model: str) -> str:
+        # Motor de polling async (no bloquea el event loop)
+        try:
+            status_result = await wait_for_prediction(api, request_id, label=f"video:{model}", push=push)
+        except PredictionFailedError as e:
+            raise Exception(f"Video generation failed: {e.error}")
+        except PredictionTimeoutError:
+            raise Exception(f"Video generation timeout after {Config.MAX_POLLING_ATTEMPTS} attempts")
+        video_url = status_result["outputs"][0]
         logger.info(f"✅ Base video generated: {video_url}")
+        return video_url
+
+    # Las URLs de audio y upscale quedan guardadas para no repetir (ni pagar) la etapa en un reintento
+    async def audio(video_url: str, final_prompt: str) -> str:
+        audio_result = task.get("audio_remote_url")
+        if audio_result:
+            return audio_result
+        logger.info("🎵 Adding audio to video...")
+        audio_result = await api.add_audio_to_video(video_url, final_prompt)
+        if not audio_result:
+            raise Exception("Audio addition returned no video")
+        task["audio_remote_url"] = audio_result
+        logger.info(f"✅ Audio added: {audio_result}")
+        return audio_result
+
+    async def upscale(audio_video_url: str) -> str:
+        upscale_result = task.get("upscale_remote_url")
+        if upscale_result:
+            return upscale_result
+        logger.info("📈 Upscaling video to 1080p...")
+        upscale_result = await api.upscale_video_to_1080p(audio_video_url)
+        if not upscale_result:
+            raise Exception("Upscaling returned no video")
+        task["upscale_remote_url"] = upscale_result
+        logger.info(f"✅ Video upscaled: {upscale_result}")
+        return upscale_result
+
+    return Pipeline([
+        Stage("language", detect_language, inputs=("prompt",), outputs=("language",),
+              timeout=Config.STAGE_TRANSLATION_TIMEOUT, fallback=lambda prompt: "en"),
+        Stage("translate", translate, inputs=("prompt", "language"), outputs=("english_prompt",),
+              timeout=Config.STAGE_TRANSLATION_TIMEOUT, retries=Config.STAGE_RETRIES,
+              when=lambda values: values["language"] != "en", fallback=lambda prompt, language: prompt),
+        Stage("image", load_image, inputs=("image_filename",), outputs=("image_bytes",),
+              when=lambda values: bool(values["image_filename"]), fallback=lambda image_filename: None),
+        Stage("optimize", optimize, inputs=("english_prompt", "image_url", "image_bytes"),
+              outputs=("final_prompt",), timeout=Config.STAGE_OPTIMIZER_TIMEOUT,
+              when=lambda values: values["auto_optimize"], fallback=lambda english_prompt, *_: english_prompt),
+        Stage("generate", generate, inputs=("final_prompt", "image_url", "model"), outputs=("request_id", "push"),
+              timeout=Config.STAGE_SUBMIT_TIMEOUT),
+        Stage("poll", poll, inputs=("request_id", "push", "model"), outputs=("video_url",)),
+        # Audio y upscale son opcionales: si fallan (o no se piden) se conserva la URL anterior
+        Stage("audio", audio, inputs=("video_url", "final_prompt"), outputs=("audio_video_url",),
+              timeout=Config.STAGE_POSTPROCESS_TIMEOUT,
+              when=lambda values: values["add_audio"], fallback=lambda video_url, *_: video_url),
+        Stage("upscale", upscale, inputs=("audio_video_url",), outputs=("final_video_url",),
+              timeout=Config.STAGE_POSTPROCESS_TIMEOUT,
+              when=lambda values: values["upscale_1080p"], fallback=lambda audio_video_url: audio_video_url),
+    ], name=f"fastapi_video:{task_id[:8]}")
 
-        # Step 2: Add audio if requested
-        if task.get("add_audio"):
-            logger.info("🎵 Adding audio to video...")
-            audio_result = await add_audio_to_video(video_url, task["final_prompt"])
-
-            if audio_result and "video_url" in audio_result:
-                video_url = audio_result["video_url"]
-                logger.info(f"✅ Audio added: {video_url}")
-            else:
-                logger.warning(f"⚠️ Audio addition failed: {audio_result}")
-
-        # Step 3: Upscale to 1080p if requested
-        if task.get("upscale_1080p"):
-            logger.info("📈 Upscaling video to 1080p...")
-            upscale_result = await upscale_video_to_1080p(video_url)
+# Función de procesamiento de video (migrada de web_app.py)
+async def process_video_generation(job, queue):
+    """Handler de la cola para trabajos 'fastapi_video' (generación completa desde /generate)"""
+    task_id = job.id
+    task = job.state
+    logger.info(f"🎬 Starting video generation for task {task_id} (attempt {job.attempts})")
 
-            if upscale_result and "video_url" in upscale_result:
-                video_url = upscale_result["video_url"]
-                logger.info(f"✅ Video upscaled: {video_url}")
-            else:
-                logger.warning(f"⚠️ Upscaling failed: {upscale_result}")
+    pipeline = build_generation_pipeline(task, task_id, AsyncWavespeedAPI())
+    try:
+        result = await pipeline.run({
+            "prompt": task["original_prompt"],
+            "image_url": task.get("image_url"),
+            "image_filename": task.get("image_filename"),
+            "model": task["model"],
+            "auto_optimize": task.get("auto_optimize", False),
+            "add_audio": task.get("add_audio", False),
+            "upscale_1080p": task.get("upscale_1080p", False),
+        }, on_stage_end=lambda stage, record: task.update(stage_timings=pipeline.timings()))
 
         # Update task as completed
         task["status"] = "completed"
-        task["video_url"] = video_url
+        task["video_url"] = result["final_video_url"]
         task["completed_at"] = datetime.now().isoformat()
 
         logger.info(f"🎉 Task {task_id} completed successfully")
 
     except Exception as e:
-        logger.error(f"❌ Task {task_id} failed: {e}")
-        task = tasks.get(task_id)
-        if task:
-            task["status"] = "failed"
-            task["error"] = str(e)
+        # La cola reintenta el trabajo y lo marca como fallido al agotar los intentos
+        logger.error(f"❌ Task {task_id} failed (attempt {job.attempts}/{job.max_attempts}): {e}")
+        task["stage_timings"] = pipeline.timings()
+        task["error"] = str(e.error if isinstance(e, StageError) else e)
+        raise
+
+job_queue.register("fastapi_video", process_video_generation)
 
 # Endpoints del frontend (migrados de web_app.py)
 
@@ -1001,7 +1043,6 @@ async def diagnose_page():
 
 @app.post("/generate", tags=["Video Generation"])
 async def generate_video(
-    background_tasks: BackgroundTasks,
     image: Optional[UploadFile] = File(None),
     prompt: str = Form(...),
     model: str = Form("ultra_fast"),
@@ -1026,10 +1067,10 @@ async def generate_video(
         logger.info(f"🎯 Request from IP: {client_ip}, Fingerprint: {fingerprint[:16]}...")
 
         # Check rate limit
-        allowed, remaining, used, is_vpn_suspicious = check_rate_limit_advanced(client_ip, fingerprint, user_agent)
+        allowed, remaining, used, is_vpn_suspicious = await check_rate_limit_advanced(client_ip, fingerprint, user_agent)
         if not allowed:
             return {
-                "error": f"Rate limit exceeded. Used {used}/5 videos today. Try again tomorrow.",
+                "error": f"Rate limit exceeded. Used {used} videos in the last 24h. Try again tomorrow.",
                 "remaining": remaining,
                 "is_vpn_suspicious": is_vpn_suspicious
             }
@@ -1043,6 +1084,7 @@ async def generate_video(
 
         # Handle image upload
         image_url = None
+        image_filename = None
         if image:
             # Save uploaded image
             image_filename = f"input_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}.jpg"
@@ -1056,59 +1098,23 @@ async def generate_video(
                 content = await image.read()
                 await f.write(content)
 
-            # Create URL for the image
-            image_url = f"/images/{image_filename}"
+            # URL pública para WaveSpeed (relativa si no hay PUBLIC_BASE_URL ni WEBHOOK_URL)
+            image_url = public_image_url(str(image_path)) or f"/images/{image_filename}"
             logger.info(f"🖼️ Image saved: {image_path}")
 
-        # Process prompt
-        original_prompt = prompt
-        translated_prompt = None
-        optimized_prompt = None
-
-        # Detect language and translate if needed
-        detected_lang = detect_language(prompt)
-        if detected_lang != "en":
-            translated_prompt, was_translated = translate_to_english(prompt)
-            if was_translated:
-                prompt = translated_prompt
-                logger.info(f"🌐 Translated prompt: {prompt[:100]}...")
-
-        # Optimize prompt if requested
-        if auto_optimize:
-            try:
-                logger.info("🤖 Optimizing prompt...")
-                from async_wavespeed import optimize_prompt_v3
-
-                if image_url:
-                    # Image-to-video with optimization
-                    result = await optimize_prompt_v3(prompt, image_url)
-                else:
-                    # Text-to-video with optimization
-                    result = await optimize_prompt_v3(prompt)
-
-                if result and "optimized_prompt" in result:
-                    optimized_prompt = result["optimized_prompt"]
-                    logger.info(f"✅ Prompt optimized: {optimized_prompt[:100]}...")
-                else:
-                    logger.warning("⚠️ Prompt optimization failed")
-
-            except Exception as e:
-                logger.error(f"❌ Prompt optimization error: {e}")
-
-        # Use optimized prompt if available, otherwise translated or original
-        final_prompt = optimized_prompt or translated_prompt or original_prompt
-
-        # Create task
+        # Traducción y optimización corren en el trabajo (pipeline por etapas), no en la petición
         task_id = str(uuid.uuid4())
         task = {
             "id": task_id,
             "status": "processing",
-            "original_prompt": original_prompt,
-            "translated_prompt": translated_prompt,
-            "optimized_prompt": optimized_prompt,
-            "final_prompt": final_prompt,
+            "original_prompt": prompt,
+            "translated_prompt": None,
+            "optimized_prompt": None,
+            "final_prompt": None,
             "model": model,
             "image_url": image_url,
+            "image_filename": image_filename,
+            "auto_optimize": auto_optimize,
             "add_audio": add_audio,
             "upscale_1080p": upscale_1080p,
             "created_at": datetime.now().isoformat(),
@@ -1117,20 +1123,18 @@ async def generate_video(
             "user_agent": user_agent
         }
 
-        tasks[task_id] = task
+        # Encolar en la cola persistente (sobrevive a reinicios, procesada por el pool de workers)
+        await job_queue.submit("fastapi_video", {}, state=task, job_id=task_id)
         logger.info(f"📋 Task created: {task_id}")
 
-        # Start background processing
-        background_tasks.add_task(process_video_generation, task_id)
-
         # Increment usage counter
-        increment_usage_advanced(fingerprint)
+        await increment_usage_advanced(client_ip, fingerprint)
 
         return {
             "task_id": task_id,
             "status": "processing",
             "message": "Video generation started",
-            "remaining_today": remaining - 1  # Already used one
+            "remaining_today": remaining - 1 if remaining is not None else None  # Already used one
         }
 
     except Exception as e:
@@ -1144,30 +1148,33 @@ async def get_task_status(task_id: str):
     """
     Get the status of a video generation task
     """
-    if task_id not in tasks:
+    job = await job_queue.get(task_id)
+    if job is None:
         raise HTTPException(status_code=404, detail="Task not found")
 
-    task = tasks[task_id]
+    task = job.state
 
     # If completed, return final result
-    if task["status"] == "completed":
+    if job.status == "completed":
         return {
             "status": "completed",
             "video_url": task["video_url"],
             "prompt_used": task["optimized_prompt"] or task["translated_prompt"] or task["original_prompt"],
             "model": task["model"],
-            "was_optimized": bool(task.get("optimized_prompt"))
+            "was_optimized": bool(task.get("optimized_prompt")),
+            "stages": task.get("stage_timings")
         }
-    elif task["status"] == "failed":
+    elif job.status == "failed":
         return {
             "status": "failed",
-            "error": task["error"]
+            "error": job.error or task.get("error"),
+            "stages": task.get("stage_timings")
         }
     else:
-        # Still processing
+        # Still processing (queued, running or waiting for a retry)
         return {
             "status": "processing",
-            "message": "Video is being generated...",
+            "message": "Video is being generated..." if job.status == "running" else "Video queued...",
             "progress": "Processing with AI model"
         }
 
@@ -1193,24 +1200,23 @@ async def get_image(filename: str):
 
     return FileResponse(
         path=image_path,
-        media_type="image/jpeg",
+        media_type=mimetypes.guess_type(filename)[0] or "image/jpeg",
         filename=filename
     )
 
 @app.get("/usage", tags=["Monitoring"])
 async def get_usage_stats():
     """Get usage statistics"""
-    usage_data = load_usage_data()
-    today = date.today().isoformat()
-
-    today_usage = usage_data.get("daily_usage", {}).get(today, {})
+    await rate_limiter.flush()
+    today_usage = await usage_store.day_usage()
     total_today = sum(today_usage.values())
+    free_limit = rate_limiter.limits_for(Config.RATE_LIMIT_DEFAULT_TIER).get("daily") or 0
 
     return {
         "total_videos_today": total_today,
-        "remaining_limit": max(0, 5 - total_today),  # 5 videos per day limit
+        "remaining_limit": max(0, free_limit - total_today),
         "daily_usage": today_usage,
-        "suspicious_users": len(usage_data.get("suspicious_users", {})),
+        "suspicious_users": await usage_store.suspicious_count(),
         "timestamp": datetime.now().isoformat()
     }
 
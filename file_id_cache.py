@@ -0,0 +1,309 @@
+"""
+File ID Cache
+Índice persistente artefacto -> file_id de Telegram para no subir dos veces el mismo video
+
+- El primer send_video sube el MP4; el file_id que devuelve Telegram se guarda bajo todas las
+  claves del artefacto (URL de origen, hash de contenido)
+- Las entregas siguientes (/lastvideo, reintentos, otro chat, la misma URL social) envían solo el
+  file_id: una llamada pequeña a la API sin subida
+- Los file_id son del bot, no del chat: valen para cualquier chat al que el bot pueda escribir
+- Si Telegram rechaza un file_id guardado se olvida y se vuelve a subir el archivo
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, Optional
+
+from telegram.error import BadRequest
+
+from config import Config
+from media_processing import media_processor
+from mp4_boxes import probe_video
+
+logger = logging.getLogger(__name__)
+
+# Bloque de lectura para el hash de contenido
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+@dataclass
+class CachedFile:
+    file_id: str
+    file_unique_id: Optional[str] = None
+    meta: Dict[str, Any] = field(default_factory=dict)
+
+
+def url_key(url: str) -> str:
+    """Clave de un artefacto por su URL de origen (salida de WaveSpeed o enlace de red social)"""
+    return f"url:{url}"
+
+
+def _path_signature(filepath: str) -> str:
+    stat = os.stat(filepath)
+    return f"{os.path.abspath(filepath)}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+_content_keys: "OrderedDict[str, str]" = OrderedDict()
+
+
+def _hash_file(filepath: str) -> str:
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return f"sha256:{digest.hexdigest()}"
+
+
+async def content_key(filepath: str) -> str:
+    """Clave por hash SHA-256 del contenido (memoizada por ruta, tamaño y mtime)"""
+    signature = await asyncio.to_thread(_path_signature, filepath)
+    key = _content_keys.get(signature)
+    if key is None:
+        key = await asyncio.to_thread(_hash_file, filepath)
+        _content_keys[signature] = key
+        while len(_content_keys) > 256:
+            _content_keys.popitem(last=False)
+    return key
+
+
+def media_of(message) -> Optional[Any]:
+    """Adjunto enviado en un Message (Telegram puede convertir un video corto en animación)"""
+    return getattr(message, 'video', None) or getattr(message, 'animation', None) or getattr(message, 'document', None)
+
+
+class FileIdCache:
+    """
+    Índice artefacto -> file_id en SQLite con los accesos recientes en memoria
+
+    Uso:
+        cached = await file_id_cache.lookup([url_key(url)])
+        ...
+        await file_id_cache.remember(keys, file_id, file_unique_id, meta={"title": title})
+    """
+
+    def __init__(self, path: Optional[str] = None, memory_size: int = None):
+        self.path = path or Config.FILE_ID_CACHE_DB_PATH
+        self.memory_size = memory_size or Config.FILE_ID_CACHE_MEMORY_SIZE
+        self._memory: "OrderedDict[str, CachedFile]" = OrderedDict()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+        self.stats = {"hits": 0, "misses": 0, "uploads": 0, "reuses": 0, "invalidated": 0}
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS file_ids (
+                    key TEXT PRIMARY KEY,
+                    file_id TEXT NOT NULL,
+                    file_unique_id TEXT,
+                    meta TEXT,
+                    created_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_file_ids_file_id ON file_ids (file_id)")
+            self._conn = conn
+        return self._conn
+
+    async def _run(self, fn, *args):
+        def locked():
+            with self._lock:
+                return fn(self._connect(), *args)
+        return await asyncio.to_thread(locked)
+
+    def _remember_in_memory(self, key: str, entry: CachedFile):
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    async def lookup(self, keys: Iterable[str]) -> Optional[CachedFile]:
+        """Primer file_id conocido para cualquiera de las claves"""
+        keys = [k for k in keys if k]
+        if not keys:
+            return None
+        for key in keys:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                self.stats["hits"] += 1
+                return entry
+
+        def op(conn):
+            placeholders = ",".join("?" * len(keys))
+            return conn.execute(
+                f"SELECT key, file_id, file_unique_id, meta FROM file_ids WHERE key IN ({placeholders})",
+                keys
+            ).fetchall()
+        try:
+            rows = await self._run(op)
+        except Exception as e:
+            logger.warning(f"⚠️ Índice de file_id no disponible: {e}")
+            rows = []
+
+        if rows:
+            by_key = {row[0]: row for row in rows}
+            key, file_id, file_unique_id, meta = next(by_key[k] for k in keys if k in by_key)
+            entry = CachedFile(file_id, file_unique_id, json.loads(meta) if meta else {})
+            self._remember_in_memory(key, entry)
+            self.stats["hits"] += 1
+            return entry
+
+        self.stats["misses"] += 1
+        return None
+
+    async def remember(self, keys: Iterable[str], file_id: str, file_unique_id: Optional[str] = None,
+                       meta: Optional[Dict[str, Any]] = None):
+        """Asocia el file_id a todas las claves del artefacto"""
+        keys = [k for k in keys if k]
+        if not keys or not file_id:
+            return
+        entry = CachedFile(file_id, file_unique_id, meta or {})
+        for key in keys:
+            self._remember_in_memory(key, entry)
+
+        meta_json = json.dumps(entry.meta) if entry.meta else None
+        now = time.time()
+
+        def op(conn):
+            conn.executemany(
+                "INSERT OR REPLACE INTO file_ids (key, file_id, file_unique_id, meta, created_at) VALUES (?, ?, ?, ?, ?)",
+                [(key, file_id, file_unique_id, meta_json, now) for key in keys]
+            )
+        try:
+            await self._run(op)
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudo guardar el file_id en el índice: {e}")
+
+    async def forget(self, file_id: str):
+        """Elimina un file_id que Telegram ya no acepta"""
+        for key in [k for k, entry in self._memory.items() if entry.file_id == file_id]:
+            del self._memory[key]
+        self.stats["invalidated"] += 1
+        try:
+            await self._run(lambda conn: conn.execute("DELETE FROM file_ids WHERE file_id = ?", (file_id,)))
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudo eliminar el file_id del índice: {e}")
+
+    def get_stats(self) -> Dict[str, int]:
+        return {**self.stats, "entries_in_memory": len(self._memory)}
+
+    async def close(self):
+        def op():
+            with self._lock:
+                if self._conn is not None:
+                    self._conn.close()
+                    self._conn = None
+        await asyncio.to_thread(op)
+
+
+async def send_video_cached(bot, chat_id: int, filepath: Optional[str] = None, keys: Iterable[str] = (),
+                            meta: Optional[Dict[str, Any]] = None, cache: Optional[FileIdCache] = None, **kwargs):
+    """
+    Envía un video reutilizando el file_id si el artefacto ya se subió alguna vez
+
+    Args:
+        filepath: Archivo local (se sube solo si ninguna clave tiene file_id); puede no existir ya
+        keys: Claves adicionales del artefacto (url_key(...)); el hash de contenido se añade solo
+        meta: Datos que se guardan junto al file_id (título, plataforma...)
+        **kwargs: Argumentos de bot.send_video (caption, supports_streaming, parse_mode...)
+
+    Returns:
+        Message enviado
+
+    Raises:
+        FileNotFoundError: Si no hay file_id conocido y el archivo local ya no existe
+    """
+    cache = cache or file_id_cache
+    keys = [k for k in keys if k]
+    has_file = bool(filepath) and os.path.exists(filepath)
+
+    if Config.USE_FILE_ID_CACHE:
+        cached = await cache.lookup(keys)
+        if cached is None and has_file:
+            keys.append(await content_key(filepath))
+            cached = await cache.lookup(keys[-1:])
+
+        if cached is not None:
+            try:
+                message = await bot.send_video(chat_id=chat_id, video=cached.file_id, **kwargs)
+                cache.stats["reuses"] += 1
+                logger.info(f"♻️ Video reenviado por file_id sin subirlo ({cached.file_id[:16]}...)")
+                # Enlazar las claves nuevas (p.ej. el hash de contenido) al mismo file_id
+                await cache.remember(keys, cached.file_id, cached.file_unique_id, meta or cached.meta)
+                return message
+            except BadRequest as e:
+                logger.warning(f"⚠️ Telegram rechazó el file_id guardado ({e}), subiendo de nuevo")
+                await cache.forget(cached.file_id)
+
+    if not has_file:
+        raise FileNotFoundError(f"Video no disponible: {filepath}")
+
+    # Duración y resolución de las cajas MP4: Telegram muestra el reproductor sin procesar el archivo
+    # (el faststart ya se hizo al descargar: aquí el archivo puede estar compartido y no se modifica)
+    info = await probe_video(filepath)
+    if 'duration' not in kwargs or 'width' not in kwargs:
+        kwargs = {**info.send_kwargs(), **kwargs}
+
+    # Miniatura en un temporal propio de esta subida
+    thumbnail = None if 'thumbnail' in kwargs else await media_processor.extract_thumbnail(filepath, info)
+    try:
+        with open(filepath, 'rb') as video_file:
+            if thumbnail:
+                with open(thumbnail, 'rb') as thumb_file:
+                    message = await bot.send_video(chat_id=chat_id, video=video_file, thumbnail=thumb_file, **kwargs)
+            else:
+                message = await bot.send_video(chat_id=chat_id, video=video_file, **kwargs)
+    finally:
+        if thumbnail and os.path.exists(thumbnail):
+            os.remove(thumbnail)
+    cache.stats["uploads"] += 1
+
+    media = media_of(message)
+    if Config.USE_FILE_ID_CACHE and media is not None:
+        if not any(k.startswith("sha256:") for k in keys):
+            keys.append(await content_key(filepath))
+        await cache.remember(keys, media.file_id, getattr(media, 'file_unique_id', None), meta)
+    return message
+
+
+async def send_video_by_url(bot, chat_id: int, video_url: str, keys: Iterable[str] = (),
+                            meta: Optional[Dict[str, Any]] = None, cache: Optional[FileIdCache] = None, **kwargs):
+    """
+    Envía un video pasando su URL a Telegram: sus servidores lo descargan, sin pasar por los nuestros
+    Retorna el Message enviado o None si Telegram no pudo obtener la URL (el llamador sube el archivo)
+
+    Raises:
+        TelegramError: Timeouts y errores de red se propagan: Telegram pudo haber entregado el video
+            igualmente y subirlo de nuevo lo duplicaría
+    """
+    cache = cache or file_id_cache
+    try:
+        message = await bot.send_video(chat_id=chat_id, video=video_url, **kwargs)
+    except BadRequest as e:
+        # Así rechaza Telegram una URL que no puede descargar
+        logger.warning(f"⚠️ Telegram no pudo obtener el video por URL ({e}), se usará la subida directa")
+        return None
+
+    media = media_of(message)
+    if Config.USE_FILE_ID_CACHE and media is not None:
+        await cache.remember([url_key(video_url), *keys], media.file_id, getattr(media, 'file_unique_id', None), meta)
+    logger.info(f"🔗 Video entregado por URL sin descargarlo: {video_url[:50]}...")
+    return message
+
+
+# Instancia global del índice
+file_id_cache = FileIdCache()
@@ -0,0 +1,275 @@
+"""
+Image Normalizer
+Normaliza imágenes de entrada (documentos, stickers, HEIC...) en un pool de procesos
+
+- Decodifica (HEIC/HEIF con pillow-heif si está instalado), aplica la orientación EXIF,
+  recorta al aspect ratio de salida (Config.ASPECT_RATIO), reduce a la resolución del modelo
+  y re-codifica a JPEG/WebP
+- El trabajo de CPU va a un ProcessPoolExecutor: el event loop nunca se bloquea
+- Resultado cacheado por hash del contenido + parámetros (archivo en el volumen + índice en memoria)
+"""
+import asyncio
+import hashlib
+import importlib.util
+import io
+import logging
+import multiprocessing
+import os
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+_HEIF_REGISTERED = False
+
+# Formatos que WaveSpeed no acepta directamente pero que se pueden normalizar a JPEG/WebP
+NORMALIZABLE_MIME_TYPES = {'image/bmp', 'image/tiff', 'image/tif', 'image/x-icon'}
+HEIF_MIME_TYPES = {'image/heic', 'image/heif'}
+
+
+def _register_optional_decoders():
+    """Registra pillow-heif (HEIC/HEIF) si está disponible; Pillow no los abre por sí solo"""
+    global _HEIF_REGISTERED
+    if _HEIF_REGISTERED:
+        return
+    _HEIF_REGISTERED = True
+    try:
+        from pillow_heif import register_heif_opener
+        register_heif_opener()
+    except ImportError:
+        logger.debug("pillow-heif no disponible: las imágenes HEIC/HEIF se envían sin normalizar")
+
+
+def heif_available() -> bool:
+    """pillow-heif instalado (se comprueba sin importarlo en el proceso principal)"""
+    return importlib.util.find_spec("pillow_heif") is not None
+
+
+def can_normalize(mime_type: Optional[str]) -> bool:
+    """True si el documento tiene un formato que solo se acepta tras normalizarlo"""
+    if not Config.NORMALIZE_INPUT_IMAGES or not mime_type:
+        return False
+    mime_type = mime_type.lower()
+    return mime_type in NORMALIZABLE_MIME_TYPES or (mime_type in HEIF_MIME_TYPES and heif_available())
+
+
+@dataclass
+class NormalizedImage:
+    data: bytes
+    width: int
+    height: int
+    format: str
+    source_format: Optional[str]
+    source_size: Tuple[int, int]
+
+    @property
+    def extension(self) -> str:
+        return "webp" if self.format == "WEBP" else "jpg"
+
+
+def parse_aspect_ratio(aspect_ratio: str) -> float:
+    """'16:9' -> 1.777...; valores inválidos se tratan como 16:9"""
+    try:
+        width, height = (float(part) for part in aspect_ratio.split(":"))
+        return width / height
+    except (AttributeError, ValueError, ZeroDivisionError):
+        return 16 / 9
+
+
+def target_box(min_side: int, aspect_ratio: str, portrait: bool) -> Tuple[int, int]:
+    """Caja de salida (ancho, alto) para la resolución del modelo, orientada como la imagen"""
+    ratio = parse_aspect_ratio(aspect_ratio)
+    long_side = int(round(min_side * max(ratio, 1 / ratio)))
+    return (min_side, long_side) if portrait else (long_side, min_side)
+
+
+def normalize_image_bytes(data: bytes, min_side: int, aspect_ratio: str = "16:9", crop_to_aspect: bool = True,
+                          output_format: str = "JPEG", quality: int = 90) -> NormalizedImage:
+    """
+    Normaliza una imagen (se ejecuta en un proceso del pool; también se puede llamar directamente)
+
+    Args:
+        min_side: Lado corto de la resolución del modelo (480, 720...)
+        aspect_ratio: Aspect ratio de salida; se orienta en vertical si la imagen es vertical
+        crop_to_aspect: Recortar al centro al aspect ratio antes de reducir
+        output_format: 'JPEG' o 'WEBP'
+    """
+    from PIL import Image, ImageOps
+
+    _register_optional_decoders()
+
+    with Image.open(io.BytesIO(data)) as source:
+        source_format = source.format
+        source_size = source.size
+        # JPEG: decodificar ya reducido (escalado DCT) cuando la imagen es mucho mayor que el destino
+        source.draft("RGB", (min_side * 2, min_side * 2))
+        # Multi-frame (GIF, TIFF, ICO): primer frame
+        source.seek(0)
+        image = ImageOps.exif_transpose(source)
+        image.load()
+
+    if image.mode in ("RGBA", "LA", "P"):
+        image = image.convert("RGBA")
+        background = Image.new("RGB", image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel("A"))
+        image = background
+    elif image.mode != "RGB":
+        image = image.convert("RGB")
+
+    portrait = image.height > image.width
+    box_width, box_height = target_box(min_side, aspect_ratio, portrait)
+
+    if crop_to_aspect:
+        # Recorte centrado al aspect ratio (resize con box: recorte y reducción en una pasada)
+        crop_width = min(image.width, image.height * box_width / box_height)
+        crop_height = min(image.height, image.width * box_height / box_width)
+        left, top = (image.width - crop_width) / 2, (image.height - crop_height) / 2
+        # Sin ampliar imágenes más pequeñas que la caja
+        if crop_width < box_width:
+            box_width, box_height = int(crop_width), int(crop_height)
+        image = image.resize((box_width, box_height), Image.LANCZOS,
+                             box=(left, top, left + crop_width, top + crop_height), reducing_gap=3.0)
+    elif image.width > box_width or image.height > box_height:
+        image.thumbnail((box_width, box_height), Image.LANCZOS, reducing_gap=3.0)
+
+    output_format = "WEBP" if output_format.upper() == "WEBP" else "JPEG"
+    buffer = io.BytesIO()
+    if output_format == "WEBP":
+        image.save(buffer, format="WEBP", quality=quality, method=4)
+    else:
+        image.save(buffer, format="JPEG", quality=quality, optimize=True, progressive=True)
+    return NormalizedImage(buffer.getvalue(), image.width, image.height, output_format, source_format, source_size)
+
+
+def public_image_url(filepath: str) -> Optional[str]:
+    """
+    URL pública de una imagen del volumen servida por /images/{filename}
+    None si no hay URL pública (modo polling sin PUBLIC_BASE_URL): se usa la URL original
+    """
+    base_url = Config.PUBLIC_BASE_URL or Config.WEBHOOK_URL
+    if not base_url:
+        return None
+    if not base_url.startswith('http'):
+        base_url = f"https://{base_url}"
+    return f"{base_url.rstrip('/')}/images/{os.path.basename(filepath)}"
+
+
+class ImageNormalizer:
+    """
+    Normalización de imágenes en un pool de procesos con caché por hash de contenido
+
+    Uso:
+        path, image = await image_normalizer.normalize(data, min_side=480)
+    """
+
+    def __init__(self, workers: int = None, directory: str = None, memory_size: int = 256):
+        self.workers = workers or Config.IMAGE_NORMALIZER_WORKERS
+        self.directory = directory
+        self.memory_size = memory_size
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._index: "OrderedDict[str, str]" = OrderedDict()
+        self._inflight = {}
+
+        self.stats = {"normalized": 0, "cache_hits": 0, "errors": 0}
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # spawn: el proceso principal tiene hilos (asyncio.to_thread, SQLite); fork no es seguro
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+            logger.info(f"🖼️ Pool de normalización de imágenes iniciado ({self.workers} procesos)")
+        return self._pool
+
+    def cache_key(self, data: bytes, min_side: int) -> str:
+        params = f"{min_side}:{Config.ASPECT_RATIO}:{Config.INPUT_IMAGE_CROP_TO_ASPECT}:{Config.INPUT_IMAGE_FORMAT}:{Config.INPUT_IMAGE_QUALITY}"
+        digest = hashlib.sha256(data)
+        digest.update(params.encode())
+        return digest.hexdigest()[:32]
+
+    async def normalize(self, data: bytes, min_side: int) -> Tuple[str, Optional[NormalizedImage]]:
+        """
+        Normaliza la imagen y la guarda en el volumen
+        Retorna (ruta, NormalizedImage); en un acierto de caché NormalizedImage es None
+        """
+        key = await asyncio.to_thread(self.cache_key, data, min_side)
+        cached = self._index.get(key) or await asyncio.to_thread(self._find_on_disk, key)
+        if cached:
+            self._remember(key, cached)
+            self.stats["cache_hits"] += 1
+            return cached, None
+
+        # Peticiones simultáneas de la misma imagen comparten el trabajo
+        if key in self._inflight:
+            return await asyncio.shield(self._inflight[key])
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result = await self._normalize_uncached(key, data, min_side)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # Evitar el aviso de excepción no recuperada si nadie más espera
+            raise
+        finally:
+            del self._inflight[key]
+
+    async def _normalize_uncached(self, key: str, data: bytes, min_side: int) -> Tuple[str, NormalizedImage]:
+        loop = asyncio.get_running_loop()
+        try:
+            image = await loop.run_in_executor(
+                self._get_pool(), normalize_image_bytes, data, min_side, Config.ASPECT_RATIO,
+                Config.INPUT_IMAGE_CROP_TO_ASPECT, Config.INPUT_IMAGE_FORMAT, Config.INPUT_IMAGE_QUALITY
+            )
+        except Exception:
+            self.stats["errors"] += 1
+            raise
+
+        path = os.path.join(self._directory(), f"norm_{key}.{image.extension}")
+        await asyncio.to_thread(self._write_atomic, path, image.data)
+        self._remember(key, path)
+        self.stats["normalized"] += 1
+        logger.info(f"🖼️ Imagen normalizada: {image.source_format} {image.source_size[0]}x{image.source_size[1]} "
+                    f"({len(data):,} bytes) -> {image.format} {image.width}x{image.height} ({len(image.data):,} bytes)")
+        return path, image
+
+    def _directory(self) -> str:
+        directory = self.directory or Config.VOLUME_PATH
+        os.makedirs(directory, exist_ok=True)
+        return directory
+
+    def _find_on_disk(self, key: str) -> Optional[str]:
+        for extension in ("jpg", "webp"):
+            path = os.path.join(self._directory(), f"norm_{key}.{extension}")
+            if os.path.exists(path):
+                return path
+        return None
+
+    @staticmethod
+    def _write_atomic(path: str, data: bytes):
+        part_path = f"{path}.part"
+        with open(part_path, "wb") as f:
+            f.write(data)
+        os.replace(part_path, path)
+
+    def _remember(self, key: str, path: str):
+        self._index[key] = path
+        self._index.move_to_end(key)
+        while len(self._index) > self.memory_size:
+            self._index.popitem(last=False)
+
+    def get_stats(self):
+        return {**self.stats, "workers": self.workers, "pool_started": self._pool is not None}
+
+    def shutdown(self):
+        """Cierra el pool de procesos (shutdown de la aplicación)"""
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+# Instancia global del normalizador
+image_normalizer = ImageNormalizer()
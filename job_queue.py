@@ -0,0 +1,616 @@
+"""
+Job Queue
+Cola de trabajos persistente con pool de workers async para la generación de videos
+
+- Backend SQLite por defecto (un archivo en Config.VOLUME_PATH), Redis opcional vía events/bus.py
+- Visibility timeout: un worker "alquila" el trabajo y renueva el lease con heartbeats;
+  si el proceso muere, el lease expira y otro worker (o el proceso reiniciado) lo retoma
+- Reintentos con backoff y límite de intentos por trabajo
+- Los trabajos terminados se purgan tras Config.JOB_RETENTION_HOURS
+"""
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+
+
+@dataclass
+class Job:
+    """Trabajo encolado; payload son los parámetros de entrada y state el progreso visible para los clientes"""
+    id: str
+    kind: str
+    payload: Dict[str, Any] = field(default_factory=dict)
+    state: Dict[str, Any] = field(default_factory=dict)
+    status: str = QUEUED
+    attempts: int = 0
+    max_attempts: int = 3
+    error: Optional[str] = None
+    created_at: float = 0.0
+    updated_at: float = 0.0
+    visible_at: float = 0.0
+    worker_id: Optional[str] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "attempts": self.attempts,
+            "max_attempts": self.max_attempts,
+            "error": self.error,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+            "payload": self.payload,
+            "state": self.state,
+        }
+
+
+JobHandler = Callable[[Job, "JobQueue"], Awaitable[Any]]
+
+
+# ----------------------------------------------------------------------
+# Backends
+# ----------------------------------------------------------------------
+
+class SQLiteJobBackend:
+    """Backend SQLite (WAL); las operaciones bloqueantes se ejecutan en un thread aparte"""
+
+    name = "sqlite"
+
+    def __init__(self, path: str = None):
+        self.path = path or Config.JOB_QUEUE_DB_PATH
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    state TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    max_attempts INTEGER NOT NULL,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    visible_at REAL NOT NULL,
+                    worker_id TEXT
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_ready ON jobs (status, visible_at)")
+            self._conn = conn
+        return self._conn
+
+    async def _run(self, fn, *args):
+        def locked():
+            with self._lock:
+                return fn(self._connect(), *args)
+        return await asyncio.to_thread(locked)
+
+    @staticmethod
+    def _row_to_job(row: sqlite3.Row) -> Job:
+        return Job(
+            id=row["id"], kind=row["kind"], status=row["status"],
+            payload=json.loads(row["payload"]), state=json.loads(row["state"]),
+            attempts=row["attempts"], max_attempts=row["max_attempts"], error=row["error"],
+            created_at=row["created_at"], updated_at=row["updated_at"],
+            visible_at=row["visible_at"], worker_id=row["worker_id"],
+        )
+
+    async def enqueue(self, job: Job):
+        def op(conn):
+            conn.execute(
+                "INSERT INTO jobs (id, kind, status, payload, state, attempts, max_attempts, error, "
+                "created_at, updated_at, visible_at, worker_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job.id, job.kind, job.status, json.dumps(job.payload), json.dumps(job.state),
+                 job.attempts, job.max_attempts, job.error, job.created_at, job.updated_at,
+                 job.visible_at, job.worker_id)
+            )
+        await self._run(op)
+
+    async def claim(self, worker_id: str, kinds: List[str], visibility_timeout: float) -> Optional[Job]:
+        def op(conn):
+            now = time.time()
+            placeholders = ",".join("?" for _ in kinds)
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Trabajos listos o con lease expirado (worker caído)
+                row = conn.execute(
+                    f"SELECT * FROM jobs WHERE kind IN ({placeholders}) AND status IN (?, ?) "
+                    f"AND visible_at <= ? ORDER BY visible_at LIMIT 1",
+                    (*kinds, QUEUED, RUNNING, now)
+                ).fetchone()
+                if row is None:
+                    conn.execute("COMMIT")
+                    return None
+                conn.execute(
+                    "UPDATE jobs SET status = ?, attempts = attempts + 1, worker_id = ?, "
+                    "visible_at = ?, updated_at = ? WHERE id = ?",
+                    (RUNNING, worker_id, now + visibility_timeout, now, row["id"])
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            job = self._row_to_job(row)
+            recovered = job.status == RUNNING
+            job.status, job.worker_id, job.attempts = RUNNING, worker_id, job.attempts + 1
+            job.visible_at = now + visibility_timeout
+            return job, recovered
+        result = await self._run(op)
+        if result is None:
+            return None
+        job, recovered = result
+        if recovered:
+            logger.warning(f"♻️ Recuperando trabajo {job.id} ({job.kind}) con lease expirado")
+        return job
+
+    async def heartbeat(self, job: Job, visibility_timeout: float) -> bool:
+        def op(conn):
+            now = time.time()
+            cursor = conn.execute(
+                "UPDATE jobs SET visible_at = ?, state = ?, updated_at = ? "
+                "WHERE id = ? AND worker_id = ? AND status = ?",
+                (now + visibility_timeout, json.dumps(job.state), now, job.id, job.worker_id, RUNNING)
+            )
+            return cursor.rowcount == 1
+        return await self._run(op)
+
+    async def finish(self, job: Job, status: str, error: Optional[str] = None, retry_at: Optional[float] = None) -> bool:
+        def op(conn):
+            now = time.time()
+            cursor = conn.execute(
+                "UPDATE jobs SET status = ?, state = ?, error = ?, visible_at = ?, worker_id = NULL, "
+                "updated_at = ? WHERE id = ? AND worker_id = ?",
+                (status, json.dumps(job.state), error, retry_at or now, now, job.id, job.worker_id)
+            )
+            return cursor.rowcount == 1
+        return await self._run(op)
+
+    async def get(self, job_id: str) -> Optional[Job]:
+        def op(conn):
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            return self._row_to_job(row) if row else None
+        return await self._run(op)
+
+    async def counts(self) -> Dict[str, int]:
+        def op(conn):
+            rows = conn.execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status").fetchall()
+            return {row["status"]: row["n"] for row in rows}
+        return await self._run(op)
+
+    async def purge(self, older_than: float) -> int:
+        def op(conn):
+            cursor = conn.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?",
+                (COMPLETED, FAILED, older_than)
+            )
+            return cursor.rowcount
+        return await self._run(op)
+
+    async def close(self):
+        def op():
+            with self._lock:
+                if self._conn is not None:
+                    self._conn.close()
+                    self._conn = None
+        await asyncio.to_thread(op)
+
+
+class RedisJobBackend:
+    """
+    Backend Redis reutilizando el pool de conexiones de events/bus.py
+    - job:{id}           hash con los campos del trabajo
+    - jobs:ready:{kind}  sorted set de trabajos encolados (score = visible_at)
+    - jobs:running       sorted set de trabajos en curso (score = expiración del lease)
+    """
+
+    name = "redis"
+
+    # Reencola leases expirados y reclama atómicamente el primer trabajo listo
+    CLAIM_SCRIPT = """
+    local now = tonumber(ARGV[1])
+    local lease_until = tonumber(ARGV[2])
+    local expired = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', now, 'LIMIT', 0, 20)
+    for _, id in ipairs(expired) do
+        redis.call('ZREM', KEYS[1], id)
+        local kind = redis.call('HGET', 'job:' .. id, 'kind')
+        if kind then
+            redis.call('HSET', 'job:' .. id, 'recovered', '1')
+            redis.call('ZADD', 'jobs:ready:' .. kind, now, id)
+        end
+    end
+    for i = 4, #ARGV do
+        local ids = redis.call('ZRANGEBYSCORE', 'jobs:ready:' .. ARGV[i], '-inf', now, 'LIMIT', 0, 1)
+        if ids[1] then
+            local id = ids[1]
+            redis.call('ZREM', 'jobs:ready:' .. ARGV[i], id)
+            redis.call('ZADD', KEYS[1], lease_until, id)
+            redis.call('HINCRBY', 'job:' .. id, 'attempts', 1)
+            redis.call('HSET', 'job:' .. id, 'status', 'running', 'worker_id', ARGV[3],
+                       'visible_at', lease_until, 'updated_at', now)
+            return id
+        end
+    end
+    return false
+    """
+
+    # Actualiza solo si el worker sigue siendo el dueño del lease
+    FENCED_UPDATE_SCRIPT = """
+    if redis.call('HGET', KEYS[1], 'worker_id') ~= ARGV[1] then
+        return 0
+    end
+    for i = 2, #ARGV, 2 do
+        redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 1])
+    end
+    return 1
+    """
+
+    def __init__(self, bus=None):
+        if bus is None:
+            from events.bus import event_bus as bus
+        self.bus = bus
+
+    @staticmethod
+    def _job_key(job_id: str) -> str:
+        return f"job:{job_id}"
+
+    @staticmethod
+    def _to_hash(job: Job) -> Dict[str, str]:
+        return {
+            "id": job.id, "kind": job.kind, "status": job.status,
+            "payload": json.dumps(job.payload), "state": json.dumps(job.state),
+            "attempts": str(job.attempts), "max_attempts": str(job.max_attempts),
+            "error": job.error or "", "created_at": str(job.created_at),
+            "updated_at": str(job.updated_at), "visible_at": str(job.visible_at),
+            "worker_id": job.worker_id or "",
+        }
+
+    @staticmethod
+    def _from_hash(data: Dict[str, str]) -> Job:
+        return Job(
+            id=data["id"], kind=data["kind"], status=data["status"],
+            payload=json.loads(data["payload"]), state=json.loads(data["state"]),
+            attempts=int(data["attempts"]), max_attempts=int(data["max_attempts"]),
+            error=data.get("error") or None, created_at=float(data["created_at"]),
+            updated_at=float(data["updated_at"]), visible_at=float(data["visible_at"]),
+            worker_id=data.get("worker_id") or None,
+        )
+
+    async def ping(self):
+        async with self.bus.connection() as client:
+            await client.ping()
+
+    async def enqueue(self, job: Job):
+        async with self.bus.connection() as client:
+            pipe = client.pipeline(transaction=True)
+            pipe.hset(self._job_key(job.id), mapping=self._to_hash(job))
+            pipe.zadd(f"jobs:ready:{job.kind}", {job.id: job.visible_at})
+            await pipe.execute()
+
+    async def claim(self, worker_id: str, kinds: List[str], visibility_timeout: float) -> Optional[Job]:
+        now = time.time()
+        async with self.bus.connection() as client:
+            job_id = await client.eval(
+                self.CLAIM_SCRIPT, 1, "jobs:running",
+                now, now + visibility_timeout, worker_id, *kinds
+            )
+            if not job_id:
+                return None
+            data = await client.hgetall(self._job_key(job_id))
+            if data.get("recovered"):
+                await client.hdel(self._job_key(job_id), "recovered")
+                logger.warning(f"♻️ Recuperando trabajo {job_id} ({data.get('kind')}) con lease expirado")
+        return self._from_hash(data)
+
+    async def _fenced_update(self, client, job: Job, fields: Dict[str, str]) -> bool:
+        args = [job.worker_id or ""]
+        for key, value in fields.items():
+            args.extend([key, value])
+        return bool(await client.eval(self.FENCED_UPDATE_SCRIPT, 1, self._job_key(job.id), *args))
+
+    async def heartbeat(self, job: Job, visibility_timeout: float) -> bool:
+        now = time.time()
+        async with self.bus.connection() as client:
+            owned = await self._fenced_update(client, job, {
+                "visible_at": str(now + visibility_timeout),
+                "state": json.dumps(job.state),
+                "updated_at": str(now),
+            })
+            if owned:
+                await client.zadd("jobs:running", {job.id: now + visibility_timeout})
+            return owned
+
+    async def finish(self, job: Job, status: str, error: Optional[str] = None, retry_at: Optional[float] = None) -> bool:
+        now = time.time()
+        async with self.bus.connection() as client:
+            owned = await self._fenced_update(client, job, {
+                "status": status,
+                "state": json.dumps(job.state),
+                "error": error or "",
+                "visible_at": str(retry_at or now),
+                "updated_at": str(now),
+                "worker_id": "",
+            })
+            if not owned:
+                return False
+            pipe = client.pipeline(transaction=True)
+            pipe.zrem("jobs:running", job.id)
+            if status == QUEUED:
+                pipe.zadd(f"jobs:ready:{job.kind}", {job.id: retry_at or now})
+            else:
+                # Los trabajos terminados expiran solos (equivalente a purge)
+                pipe.expire(self._job_key(job.id), int(Config.JOB_RETENTION_HOURS * 3600))
+            await pipe.execute()
+            return True
+
+    async def get(self, job_id: str) -> Optional[Job]:
+        async with self.bus.connection() as client:
+            data = await client.hgetall(self._job_key(job_id))
+        return self._from_hash(data) if data else None
+
+    async def counts(self) -> Dict[str, int]:
+        async with self.bus.connection() as client:
+            running = await client.zcard("jobs:running")
+        return {RUNNING: running}
+
+    async def purge(self, older_than: float) -> int:
+        # Redis expira los trabajos terminados con EXPIRE
+        return 0
+
+    async def close(self):
+        pass
+
+
+async def create_job_backend(backend: str = None):
+    """
+    Crea el backend configurado (Config.JOB_QUEUE_BACKEND)
+    Si se pide Redis y no está disponible, se usa SQLite
+    """
+    backend = (backend or Config.JOB_QUEUE_BACKEND).lower()
+    if backend == "redis":
+        try:
+            from events.bus import event_bus
+            event_bus.redis_url = Config.REDIS_URL
+            redis_backend = RedisJobBackend(event_bus)
+            await redis_backend.ping()
+            logger.info("✅ Cola de trabajos usando Redis")
+            return redis_backend
+        except Exception as e:
+            logger.warning(f"⚠️ Redis no disponible para la cola de trabajos ({e}), usando SQLite")
+    return SQLiteJobBackend()
+
+
+# ----------------------------------------------------------------------
+# Cola y workers
+# ----------------------------------------------------------------------
+
+class JobQueue:
+    """
+    Cola de trabajos con pool de workers async
+
+    Uso:
+        job_queue.register("web_video", run_web_video_job)
+        await job_queue.start()
+        job_id = await job_queue.submit("web_video", {...}, state={...})
+    """
+
+    def __init__(self, backend=None, workers: int = None, visibility_timeout: float = None,
+                 poll_interval: float = 0.5, heartbeat_interval: float = None):
+        self.backend = backend
+        self.workers = workers or Config.MAX_ASYNC_WORKERS
+        self.visibility_timeout = visibility_timeout or Config.JOB_VISIBILITY_TIMEOUT
+        self.poll_interval = poll_interval
+        # El heartbeat también persiste job.state (progreso visible en /status)
+        self.heartbeat_interval = heartbeat_interval or min(self.visibility_timeout / 3, Config.JOB_PROGRESS_SYNC_INTERVAL)
+        self.worker_prefix = f"{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+        # Recursos compartidos para los handlers (p.ej. la Application de Telegram)
+        self.resources: Dict[str, Any] = {}
+        self._handlers: Dict[str, JobHandler] = {}
+        self._requires: Dict[str, tuple] = {}
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._running = False
+        self._last_purge = 0.0
+
+        self.stats = {"submitted": 0, "completed": 0, "failed": 0, "retried": 0}
+
+    @property
+    def is_running(self) -> bool:
+        return self._running
+
+    def register(self, kind: str, handler: JobHandler, requires: tuple = ()):
+        """
+        Registra el handler de un tipo de trabajo (solo se reclaman los tipos registrados)
+
+        requires: recursos de self.resources que el handler necesita; mientras falte alguno
+        los trabajos de ese tipo no se reclaman y siguen encolados sin consumir intentos
+        """
+        self._handlers[kind] = handler
+        self._requires[kind] = tuple(requires)
+
+    def _claimable_kinds(self) -> List[str]:
+        """Tipos registrados cuyos recursos requeridos están disponibles en este proceso"""
+        return [kind for kind in self._handlers
+                if all(self.resources.get(name) is not None for name in self._requires.get(kind, ()))]
+
+    async def _ensure_backend(self):
+        if self.backend is None:
+            self.backend = await create_job_backend()
+        return self.backend
+
+    async def start(self):
+        """Inicia el pool de workers; los trabajos pendientes de un arranque anterior se retoman solos"""
+        if self._running:
+            return
+        await self._ensure_backend()
+        self._running = True
+        self._wakeup = asyncio.Event()
+        self._tasks = [
+            asyncio.create_task(self._worker(f"{self.worker_prefix}-{n}"))
+            for n in range(self.workers)
+        ]
+        logger.info(f"🚀 JobQueue iniciada: {self.workers} workers, backend {self.backend.name}, "
+                    f"tipos {sorted(self._claimable_kinds())}")
+        unavailable = sorted(set(self._handlers) - set(self._claimable_kinds()))
+        if unavailable:
+            logger.warning(f"⚠️ Tipos sin sus recursos, no se reclamarán: {unavailable}")
+
+    async def stop(self):
+        """Detiene los workers; los trabajos interrumpidos se retoman al expirar su lease"""
+        self._running = False
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self.backend is not None:
+            await self.backend.close()
+        logger.info("✅ JobQueue detenida")
+
+    async def submit(self, kind: str, payload: Dict[str, Any], state: Dict[str, Any] = None,
+                     job_id: str = None, max_attempts: int = None) -> str:
+        """Encola un trabajo y retorna su id"""
+        await self._ensure_backend()
+        now = time.time()
+        job = Job(
+            id=job_id or str(uuid.uuid4()),
+            kind=kind,
+            payload=payload,
+            state=state or {},
+            max_attempts=max_attempts or Config.JOB_MAX_ATTEMPTS,
+            created_at=now,
+            updated_at=now,
+            visible_at=now,
+        )
+        await self.backend.enqueue(job)
+        self.stats["submitted"] += 1
+        if self._wakeup is not None:
+            self._wakeup.set()
+        logger.info(f"📋 Trabajo encolado: {job.id} ({kind})")
+        return job.id
+
+    async def get(self, job_id: str) -> Optional[Job]:
+        await self._ensure_backend()
+        return await self.backend.get(job_id)
+
+    async def get_stats(self) -> Dict[str, Any]:
+        counts = await self.backend.counts() if self.backend else {}
+        return {
+            **self.stats,
+            "workers": self.workers,
+            "backend": self.backend.name if self.backend else None,
+            "running": self._running,
+            "jobs": counts,
+        }
+
+    async def _worker(self, worker_id: str):
+        while self._running:
+            try:
+                await self._maybe_purge()
+                job = None
+                kinds = self._claimable_kinds()
+                if kinds:
+                    job = await self.backend.claim(worker_id, kinds, self.visibility_timeout)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Error reclamando trabajos ({worker_id}): {e}")
+                await asyncio.sleep(self.poll_interval * 4)
+                continue
+
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            await self._execute(job)
+
+    async def _execute(self, job: Job):
+        if job.attempts > job.max_attempts:
+            logger.error(f"💥 Trabajo {job.id} agotó sus {job.max_attempts} intentos")
+            await self.backend.finish(job, FAILED, error=job.error or "Max attempts exceeded")
+            self.stats["failed"] += 1
+            return
+
+        handler = self._handlers[job.kind]
+        heartbeat = asyncio.create_task(self._heartbeat(job))
+        logger.info(f"⚙️ Ejecutando trabajo {job.id} ({job.kind}), intento {job.attempts}/{job.max_attempts}")
+        try:
+            await handler(job, self)
+        except asyncio.CancelledError:
+            # Apagado: el lease expirará y el trabajo se retomará
+            raise
+        except Exception as e:
+            error = str(e) or type(e).__name__
+            if job.attempts < job.max_attempts:
+                delay = Config.JOB_RETRY_BACKOFF * (2 ** (job.attempts - 1))
+                logger.warning(f"🔄 Trabajo {job.id} falló ({error}), reintento en {delay:.1f}s")
+                await self.backend.finish(job, QUEUED, error=error, retry_at=time.time() + delay)
+                self.stats["retried"] += 1
+            else:
+                logger.error(f"❌ Trabajo {job.id} falló definitivamente: {error}")
+                await self.backend.finish(job, FAILED, error=error)
+                self.stats["failed"] += 1
+            return
+        finally:
+            heartbeat.cancel()
+
+        # El handler puede marcar el trabajo como fallido en su state sin lanzar excepción
+        if job.state.get("status") == FAILED:
+            await self.backend.finish(job, FAILED, error=job.state.get("error"))
+            self.stats["failed"] += 1
+        else:
+            await self.backend.finish(job, COMPLETED)
+            self.stats["completed"] += 1
+
+    async def _heartbeat(self, job: Job):
+        """Renueva el lease del trabajo y persiste su progreso"""
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            try:
+                if not await self.backend.heartbeat(job, self.visibility_timeout):
+                    logger.warning(f"⚠️ Lease perdido para el trabajo {job.id}")
+            except Exception as e:
+                logger.warning(f"⚠️ Error renovando lease de {job.id}: {e}")
+
+    async def _maybe_purge(self):
+        now = time.time()
+        if now - self._last_purge < 3600:
+            return
+        self._last_purge = now
+        removed = await self.backend.purge(now - Config.JOB_RETENTION_HOURS * 3600)
+        if removed:
+            logger.info(f"🧹 {removed} trabajos terminados purgados de la cola")
+
+
+# Instancia global de la cola
+job_queue = JobQueue()
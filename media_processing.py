@@ -0,0 +1,314 @@
+"""
+Media Processing
+Trabajos de ffmpeg sobre videos descargados, como subprocesos async con concurrencia acotada
+
+- Ajuste a un tamaño máximo (límite de subida de Telegram): primero un remux sin re-codificar
+  (solo la primera pista de video y de audio); si no basta, re-codificación H.264/AAC con el
+  bitrate calculado para la duración y una altura acorde a ese bitrate
+- Faststart: remux sin re-codificar con 'moov' delante, una sola vez al terminar la descarga
+  (antes de que el archivo se comparta entre chats o entre en la caché)
+- Miniatura JPEG del primer keyframe en cada subida, en un archivo temporal propio de esa subida
+- ffmpeg corre en su propio proceso: el event loop nunca se bloquea y un trabajo colgado se mata
+"""
+import asyncio
+import logging
+import os
+import shutil
+import tempfile
+import time
+import weakref
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import Config
+from mp4_boxes import probe_video
+
+try:
+    import resource  # CPU de los subprocesos (solo Unix)
+except ImportError:
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+# Margen para la cabecera del contenedor y la variación del bitrate del codificador
+CONTAINER_MARGIN = 0.92
+
+# Por debajo de este bitrate de video (kbps) el resultado no es visible: no se intenta
+MIN_VIDEO_KBPS = 120
+
+# (bitrate de video mínimo en kbps, altura máxima): más bitrate permite más resolución
+HEIGHT_FOR_BITRATE = ((1800, 720), (900, 540), (450, 480), (0, 360))
+
+# Miniatura de Telegram: JPEG de como máximo 320 px por lado y 200 KB
+THUMBNAIL_MAX_SIDE = 320
+
+# Faststart y miniatura retrasan el envío: no se espera más que esto (segundos)
+STREAMING_PREP_TIMEOUT = 60
+
+
+def ffmpeg_available() -> bool:
+    return shutil.which('ffmpeg') is not None
+
+
+@dataclass
+class FitPlan:
+    """Re-codificación necesaria para que un video de duration segundos ocupe menos de size_limit"""
+    video_kbps: int
+    audio_kbps: int
+    max_height: int
+
+
+def plan_fit(size_limit: int, duration: float) -> Optional[FitPlan]:
+    """Bitrates y altura para el límite; None si la duración no deja bitrate suficiente"""
+    if not duration or duration <= 0:
+        return None
+    total_kbps = size_limit * 8 / 1000 / duration * CONTAINER_MARGIN
+    audio_kbps = 96 if total_kbps >= 600 else 64
+    video_kbps = int(total_kbps - audio_kbps)
+    if video_kbps < MIN_VIDEO_KBPS:
+        return None
+    max_height = next(height for min_kbps, height in HEIGHT_FOR_BITRATE if video_kbps >= min_kbps)
+    return FitPlan(video_kbps, audio_kbps, max_height)
+
+
+def remux_args(source: str, target: str) -> List[str]:
+    return ['ffmpeg', '-y', '-v', 'error', '-i', source, '-map', '0:v:0', '-map', '0:a:0?',
+            '-c', 'copy', '-movflags', '+faststart', target]
+
+
+def reencode_args(source: str, target: str, plan: FitPlan) -> List[str]:
+    return [
+        'ffmpeg', '-y', '-v', 'error', '-i', source,
+        '-map', '0:v:0', '-map', '0:a:0?',
+        '-vf', f"scale=-2:'min({plan.max_height},ih)'",
+        '-c:v', 'libx264', '-preset', 'veryfast',
+        '-b:v', f'{plan.video_kbps}k', '-maxrate', f'{plan.video_kbps}k', '-bufsize', f'{plan.video_kbps * 2}k',
+        '-c:a', 'aac', '-b:a', f'{plan.audio_kbps}k',
+        '-movflags', '+faststart', target,
+    ]
+
+
+def faststart_args(source: str, target: str) -> List[str]:
+    """Copia de todas las pistas con 'moov' delante (sin re-codificar)"""
+    return ['ffmpeg', '-y', '-v', 'error', '-i', source, '-map', '0', '-c', 'copy',
+            '-movflags', '+faststart', '-f', 'mp4', target]
+
+
+def thumbnail_args(source: str, target: str) -> List[str]:
+    """JPEG del primer keyframe (skip_frame: el decodificador ni siquiera mira los demás frames)"""
+    side = THUMBNAIL_MAX_SIDE
+    return ['ffmpeg', '-y', '-v', 'error', '-skip_frame', 'nokey', '-i', source,
+            '-map', '0:v:0', '-frames:v', '1', '-update', '1',
+            '-vf', f"scale={side}:{side}:force_original_aspect_ratio=decrease", '-q:v', '5', '-f', 'image2', target]
+
+
+def _temp_path(filepath: str, suffix: str) -> str:
+    """Ruta temporal única junto al video (dos trabajos sobre el mismo archivo nunca comparten salida)"""
+    fd, path = tempfile.mkstemp(prefix=f".{os.path.basename(filepath)}.", suffix=suffix,
+                                dir=os.path.dirname(filepath) or None)
+    os.close(fd)
+    return path
+
+
+def _children_cpu_seconds() -> float:
+    """Tiempo de CPU (usuario + sistema) acumulado por los subprocesos terminados"""
+    if resource is None:
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+class MediaProcessor:
+    """
+    Ejecutor de ffmpeg con un máximo de trabajos simultáneos
+
+    Uso:
+        result = await media_processor.fit_to_size(filepath, Config.TELEGRAM_UPLOAD_LIMIT, duration)
+    """
+
+    def __init__(self, max_concurrent: int = None, timeout: float = None):
+        self.max_concurrent = max_concurrent or Config.FFMPEG_CONCURRENCY
+        self.timeout = timeout or Config.FFMPEG_TIMEOUT
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._file_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+        self.stats = {"remuxed": 0, "reencoded": 0, "failed": 0,
+                      "faststart": 0, "thumbnails": 0, "prep_failed": 0, "prep_cpu_seconds": 0.0}
+
+    async def run_ffmpeg(self, args: List[str], timeout: float = None) -> Tuple[int, str]:
+        """
+        Ejecuta ffmpeg/ffprobe respetando el límite de concurrencia
+
+        Returns:
+            (returncode, stdout + stderr)
+
+        Raises:
+            asyncio.TimeoutError: Si supera el timeout (el proceso se mata)
+            FileNotFoundError: Si ffmpeg no está instalado
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrent)
+        async with self._semaphore:
+            process = await asyncio.create_subprocess_exec(
+                *args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT
+            )
+            try:
+                output, _ = await asyncio.wait_for(process.communicate(), timeout=timeout or self.timeout)
+            except (asyncio.TimeoutError, asyncio.CancelledError):
+                if process.returncode is None:
+                    process.kill()
+                    await process.wait()
+                raise
+            return process.returncode, output.decode(errors='replace').strip()
+
+    async def probe_duration(self, filepath: str) -> float:
+        """Duración en segundos con ffprobe (0 si no se puede leer)"""
+        try:
+            returncode, output = await self.run_ffmpeg(
+                ['ffprobe', '-v', 'error', '-show_entries', 'format=duration', '-of', 'csv=p=0', filepath], timeout=30
+            )
+            return float(output) if returncode == 0 else 0.0
+        except (ValueError, FileNotFoundError, asyncio.TimeoutError):
+            return 0.0
+
+    async def fit_to_size(self, filepath: str, size_limit: int, duration: float = 0) -> Dict[str, Any]:
+        """
+        Deja el video por debajo de size_limit (el original se sustituye por el resultado)
+
+        Returns:
+            dict: {'success': bool, 'filepath': str, 'file_size': int, 'method': 'none'|'remux'|'reencode', 'error': str}
+        """
+        file_size = os.path.getsize(filepath)
+        if file_size <= size_limit:
+            return {'success': True, 'filepath': filepath, 'file_size': file_size, 'method': 'none'}
+
+        base, _ = os.path.splitext(filepath)
+        target = f"{base}_fit.mp4"
+        logger.info(f"📐 Video de {file_size / 1024 / 1024:.1f} MB supera {size_limit / 1024 / 1024:.0f} MB, ajustando...")
+        replaced = False
+        try:
+            # Remux: basta cuando el exceso son pistas extra o un contenedor ineficiente
+            if file_size <= size_limit * 1.1:
+                returncode, _ = await self.run_ffmpeg(remux_args(filepath, target))
+                if returncode == 0 and os.path.getsize(target) <= size_limit:
+                    self.stats["remuxed"] += 1
+                    replaced = True
+                    return self._replace(filepath, target, 'remux')
+
+            duration = duration or await self.probe_duration(filepath)
+            plan = plan_fit(size_limit, duration)
+            if plan is None:
+                self.stats["failed"] += 1
+                return {'success': False, 'error': f'Video demasiado largo ({duration:.0f}s) para el límite de '
+                                                   f'{size_limit / 1024 / 1024:.0f} MB'}
+
+            logger.info(f"🎞️ Re-codificando a {plan.video_kbps} kbps, {plan.max_height}p")
+            returncode, output = await self.run_ffmpeg(reencode_args(filepath, target, plan))
+            if returncode != 0 or not os.path.exists(target) or os.path.getsize(target) > size_limit:
+                self.stats["failed"] += 1
+                return {'success': False, 'error': f'No se pudo reducir el video: {output[-200:]}'}
+            self.stats["reencoded"] += 1
+            replaced = True
+            return self._replace(filepath, target, 'reencode')
+
+        except FileNotFoundError:
+            self.stats["failed"] += 1
+            return {'success': False, 'error': 'ffmpeg no está instalado en el servidor'}
+        except asyncio.TimeoutError:
+            self.stats["failed"] += 1
+            return {'success': False, 'error': f'Timeout reduciendo el video (máx {self.timeout:.0f}s)'}
+        finally:
+            if not replaced and os.path.exists(target):
+                os.remove(target)
+
+    async def make_faststart(self, filepath: str) -> Dict[str, Any]:
+        """
+        Con 'moov' al final, sustituye el archivo por su remux faststart (reproducción progresiva real
+        con supports_streaming). Se llama al terminar la descarga, antes de compartir el archivo;
+        un fallo deja el original intacto
+
+        Returns:
+            dict: {'info': Mp4Info, 'remuxed': bool, 'file_size': int,
+                   'first_frame_bytes': (antes, después), 'cpu_seconds': float}
+        """
+        lock = self._file_locks.get(filepath)
+        if lock is None:
+            lock = self._file_locks[filepath] = asyncio.Lock()
+        async with lock:
+            info = await probe_video(filepath)
+            result = {'info': info, 'remuxed': False, 'file_size': info.file_size, 'cpu_seconds': 0.0,
+                      'first_frame_bytes': (info.first_frame_bytes(), info.first_frame_bytes())}
+            if (not Config.VIDEO_FASTSTART or not info.complete or info.faststart or info.fragmented
+                    or not ffmpeg_available()):
+                return result
+
+            target = _temp_path(filepath, '.mp4')
+            cpu_before = _children_cpu_seconds()
+            start = time.monotonic()
+            try:
+                returncode, output = await self.run_ffmpeg(faststart_args(filepath, target),
+                                                           timeout=min(self.timeout, STREAMING_PREP_TIMEOUT))
+                remuxed = await probe_video(target) if returncode == 0 else None
+                if remuxed is None or not (remuxed.complete and remuxed.faststart):
+                    raise RuntimeError(output[-200:] or (remuxed and remuxed.error))
+                os.replace(target, filepath)
+                self.stats["faststart"] += 1
+                result.update(info=remuxed, remuxed=True, file_size=remuxed.file_size,
+                              first_frame_bytes=(info.first_frame_bytes(), remuxed.first_frame_bytes()))
+            except (RuntimeError, FileNotFoundError, asyncio.TimeoutError) as e:
+                self.stats["prep_failed"] += 1
+                logger.warning(f"⚠️ No se pudo pasar el video a faststart, se conserva tal cual: {e}")
+                return result
+            finally:
+                result['cpu_seconds'] = _children_cpu_seconds() - cpu_before
+                self.stats["prep_cpu_seconds"] += result['cpu_seconds']
+                if os.path.exists(target):
+                    os.remove(target)
+
+        before, after = result['first_frame_bytes']
+        logger.info(f"⚡ Faststart en {time.monotonic() - start:.2f}s (CPU {result['cpu_seconds']:.2f}s): "
+                    f"primer frame tras {after / 1024:,.0f} KB en vez de {before / 1024:,.0f} KB")
+        return result
+
+    async def extract_thumbnail(self, filepath: str, info=None) -> Optional[str]:
+        """
+        Miniatura JPEG (<= 320 px) del primer keyframe en un archivo temporal propio de quien la pide
+        (debe borrarla tras enviarla); None si no hay pista de video, ffmpeg o falla
+        """
+        info = info or await probe_video(filepath)
+        if not Config.VIDEO_THUMBNAILS or not info.video_codec or not ffmpeg_available():
+            return None
+
+        target = _temp_path(filepath, '.jpg')
+        cpu_before = _children_cpu_seconds()
+        created = False
+        try:
+            returncode, output = await self.run_ffmpeg(thumbnail_args(filepath, target),
+                                                       timeout=min(self.timeout, STREAMING_PREP_TIMEOUT))
+            if returncode != 0 or os.path.getsize(target) == 0:
+                raise RuntimeError(output[-200:])
+            self.stats["thumbnails"] += 1
+            created = True
+            return target
+        except (RuntimeError, FileNotFoundError, asyncio.TimeoutError) as e:
+            self.stats["prep_failed"] += 1
+            logger.warning(f"⚠️ No se pudo generar la miniatura, se envía sin ella: {e}")
+            return None
+        finally:
+            self.stats["prep_cpu_seconds"] += _children_cpu_seconds() - cpu_before
+            if not created and os.path.exists(target):
+                os.remove(target)
+
+    @staticmethod
+    def _replace(filepath: str, target: str, method: str) -> Dict[str, Any]:
+        os.remove(filepath)
+        file_size = os.path.getsize(target)
+        logger.info(f"✅ Video ajustado por {method}: {file_size / 1024 / 1024:.1f} MB")
+        return {'success': True, 'filepath': target, 'file_size': file_size, 'method': method}
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {**self.stats, "max_concurrent": self.max_concurrent}
+
+
+# Instancia global del procesador
+media_processor = MediaProcessor()
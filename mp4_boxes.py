@@ -0,0 +1,293 @@
+"""
+MP4 Boxes
+Lectura de la estructura ISO-BMFF (MP4/MOV) de un video sin cargarlo en memoria
+
+- Recorre solo las cabeceras de las cajas de primer nivel (8/16 bytes cada una) y el contenido de 'moov'
+- El archivo se abre con mmap: solo se leen las páginas de las cabeceras y de 'moov', no el 'mdat'
+- Completo = 'ftyp' + 'moov' + 'mdat' con tamaño real, ninguna caja más allá del final del archivo
+  y los offsets de chunk de cada pista dentro del archivo (una descarga cortada no pasa)
+- Extrae duración, resolución y códecs para enviarlos a send_video (duration/width/height)
+"""
+import asyncio
+import logging
+import mmap
+import os
+import struct
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Cajas de 'moov' que solo contienen otras cajas
+CONTAINER_BOXES = {b'moov', b'trak', b'mdia', b'minf', b'stbl', b'mvex', b'edts', b'dinf'}
+
+
+@dataclass
+class Mp4Info:
+    """Estructura y metadatos de un MP4"""
+    file_size: int = 0
+    is_mp4: bool = False  # La primera caja es 'ftyp'
+    complete: bool = False
+    error: Optional[str] = None
+    brand: Optional[str] = None
+    duration: float = 0.0  # Segundos
+    width: int = 0
+    height: int = 0
+    video_codec: Optional[str] = None  # 'avc1', 'hvc1', 'av01'...
+    audio_codec: Optional[str] = None  # 'mp4a', 'Opus'...
+    mdat_size: int = 0  # Bytes de datos de media declarados
+    faststart: bool = False  # 'moov' antes de 'mdat' (reproducción sin esperar al final)
+    moov_end: int = 0  # Offset del final de 'moov'
+    fragmented: bool = False
+    boxes: List[Tuple[str, int, int]] = field(default_factory=list)  # (tipo, offset, tamaño) de primer nivel
+
+    def send_kwargs(self) -> Dict[str, Any]:
+        """Argumentos de bot.send_video que Telegram usa para el reproductor (solo los conocidos)"""
+        kwargs = {}
+        if self.duration > 0:
+            kwargs['duration'] = max(1, round(self.duration))
+        if self.width and self.height:
+            kwargs['width'] = self.width
+            kwargs['height'] = self.height
+        return kwargs
+
+    def first_frame_bytes(self) -> int:
+        """Bytes que un cliente descarga en orden antes de poder mostrar el primer frame (con 'moov' al final, todo)"""
+        return self.moov_end if self.faststart else self.file_size
+
+
+def _read_header(buf, offset: int, end: int) -> Optional[Tuple[bytes, int, int]]:
+    """(tipo, tamaño total, tamaño de cabecera) de la caja en offset; None si la cabecera no cabe"""
+    if end - offset < 8:
+        return None
+    size, box_type = struct.unpack_from('>I4s', buf, offset)
+    header = 8
+    if size == 1:
+        if end - offset < 16:
+            return None
+        size, = struct.unpack_from('>Q', buf, offset + 8)
+        header = 16
+    elif size == 0:
+        size = end - offset  # Hasta el final del contenedor
+    if box_type == b'uuid':
+        header += 16
+    return box_type, size, header
+
+
+def _fourcc(value: bytes) -> str:
+    return value.decode('latin-1').strip()
+
+
+class _MoovParser:
+    """Recorre 'moov' y acumula los datos de las pistas"""
+
+    def __init__(self, buf, info: Mp4Info):
+        self.buf = buf
+        self.info = info
+        self.movie_timescale = 0
+        self.movie_duration = 0
+        self.fragment_duration = 0
+        self.max_chunk_offset = 0
+        self.track_duration = 0.0  # Pista de video (si mvhd no indica duración)
+        self._track: Dict[str, Any] = {}
+
+    def parse(self, start: int, end: int):
+        offset = start
+        while offset < end:
+            header = _read_header(self.buf, offset, end)
+            if header is None:
+                raise ValueError(f"cabecera de caja cortada en {offset}")
+            box_type, size, header_size = header
+            if size < header_size or offset + size > end:
+                raise ValueError(f"caja '{_fourcc(box_type)}' sale de su contenedor")
+            body = offset + header_size
+            if box_type == b'trak':
+                self._track = {}
+                self.parse(body, offset + size)
+                self._finish_track()
+            elif box_type in CONTAINER_BOXES:
+                self.parse(body, offset + size)
+            else:
+                handler = getattr(self, f"_box_{_fourcc(box_type)}", None)
+                if handler is not None:
+                    handler(body, offset + size)
+            offset += size
+
+    def _full_box(self, body: int) -> Tuple[int, int]:
+        """(versión, offset tras version/flags)"""
+        return self.buf[body], body + 4
+
+    def _box_mvhd(self, body: int, end: int):
+        version, pos = self._full_box(body)
+        if version == 1:
+            self.movie_timescale, self.movie_duration = struct.unpack_from('>IQ', self.buf, pos + 16)
+        else:
+            self.movie_timescale, self.movie_duration = struct.unpack_from('>II', self.buf, pos + 8)
+
+    def _box_mehd(self, body: int, end: int):
+        version, pos = self._full_box(body)
+        self.fragment_duration, = struct.unpack_from('>Q' if version == 1 else '>I', self.buf, pos)
+
+    def _box_tkhd(self, body: int, end: int):
+        version, pos = self._full_box(body)
+        pos += 32 if version == 1 else 20  # Fechas, track_ID, reservado y duración
+        pos += 8 + 8 + 36  # Reservado, layer/grupo/volumen, matriz
+        width, height = struct.unpack_from('>II', self.buf, pos)
+        self._track['display'] = (width >> 16, height >> 16)  # Punto fijo 16.16
+
+    def _box_mdhd(self, body: int, end: int):
+        version, pos = self._full_box(body)
+        if version == 1:
+            timescale, duration = struct.unpack_from('>IQ', self.buf, pos + 16)
+        else:
+            timescale, duration = struct.unpack_from('>II', self.buf, pos + 8)
+        self._track['duration'] = duration / timescale if timescale else 0.0
+
+    def _box_hdlr(self, body: int, end: int):
+        _, pos = self._full_box(body)
+        self._track['handler'] = bytes(self.buf[pos + 4:pos + 8])
+
+    def _box_stsd(self, body: int, end: int):
+        _, pos = self._full_box(body)
+        count, = struct.unpack_from('>I', self.buf, pos)
+        if count and end - (pos + 4) >= 8:
+            _, entry_type = struct.unpack_from('>I4s', self.buf, pos + 4)
+            self._track['codec'] = _fourcc(entry_type)
+            entry_body = pos + 4 + 8
+            if end - entry_body >= 28:
+                # VisualSampleEntry: 6 reservado + 2 data_reference_index + 16 predefinido/reservado
+                self._track['coded'] = struct.unpack_from('>HH', self.buf, entry_body + 24)
+
+    def _box_stco(self, body: int, end: int):
+        self._chunk_offsets(body, end, 4, '>I')
+
+    def _box_co64(self, body: int, end: int):
+        self._chunk_offsets(body, end, 8, '>Q')
+
+    def _chunk_offsets(self, body: int, end: int, width: int, fmt: str):
+        _, pos = self._full_box(body)
+        count, = struct.unpack_from('>I', self.buf, pos)
+        if count:
+            last = pos + 4 + (count - 1) * width
+            if last + width > end:
+                raise ValueError("tabla de chunks cortada")
+            # Los chunks van en orden de archivo: basta con el último
+            self.max_chunk_offset = max(self.max_chunk_offset, struct.unpack_from(fmt, self.buf, last)[0])
+
+    def _finish_track(self):
+        track = self._track
+        if track.get('handler') == b'vide' and not self.info.video_codec:
+            self.info.video_codec = track.get('codec')
+            width, height = track.get('display') or (0, 0)
+            if not (width and height):
+                width, height = track.get('coded') or (0, 0)
+            self.info.width, self.info.height = width, height
+            self.track_duration = track.get('duration', 0.0)
+        elif track.get('handler') == b'soun' and not self.info.audio_codec:
+            self.info.audio_codec = track.get('codec')
+
+    def duration(self) -> float:
+        if self.movie_timescale:
+            if self.movie_duration:
+                return self.movie_duration / self.movie_timescale
+            if self.fragment_duration:
+                return self.fragment_duration / self.movie_timescale
+        return self.track_duration
+
+
+def inspect_buffer(buf, length: Optional[int] = None) -> Mp4Info:
+    """Analiza un MP4 ya accesible como buffer (bytes, memoryview o mmap)"""
+    length = len(buf) if length is None else length
+    info = Mp4Info(file_size=length)
+    moov = None
+    media_seen = False
+
+    offset = 0
+    while offset < length:
+        header = _read_header(buf, offset, length)
+        if header is None:
+            info.error = f"cabecera de caja cortada en el byte {offset}"
+            break
+        box_type, size, header_size = header
+        info.boxes.append((_fourcc(box_type), offset, size))
+        if offset == 0:
+            info.is_mp4 = box_type == b'ftyp'
+            if not info.is_mp4:
+                info.error = "no es ISO-BMFF (falta 'ftyp')"
+                return info
+            info.brand = _fourcc(bytes(buf[offset + header_size:offset + header_size + 4]))
+        if size < header_size:
+            info.error = f"tamaño inválido en '{_fourcc(box_type)}' ({size})"
+            break
+        if offset + size > length:
+            info.error = (f"archivo cortado: '{_fourcc(box_type)}' declara {size:,} bytes "
+                          f"y quedan {length - offset:,}")
+            break
+
+        if box_type == b'moov':
+            moov = (offset + header_size, offset + size)
+            info.faststart = not media_seen
+            info.moov_end = offset + size
+        elif box_type == b'mdat':
+            info.mdat_size += size - header_size
+            media_seen = True
+        elif box_type == b'moof':
+            info.fragmented = True
+        offset += size
+
+    if moov is None:
+        info.error = info.error or "falta 'moov'"
+        return info
+
+    parser = _MoovParser(buf, info)
+    try:
+        parser.parse(*moov)
+    except (ValueError, struct.error, IndexError) as e:
+        info.error = info.error or f"'moov' inválido: {e}"
+        return info
+    info.duration = parser.duration()
+
+    if info.error:
+        return info
+    if not info.mdat_size:
+        info.error = "'mdat' vacío o ausente"
+    elif parser.max_chunk_offset >= length:
+        info.error = f"datos de media fuera del archivo (offset {parser.max_chunk_offset:,})"
+    else:
+        info.complete = True
+    return info
+
+
+def inspect_file(path: str) -> Mp4Info:
+    """Analiza un MP4 en disco con mmap (solo se tocan las páginas de cabeceras y 'moov')"""
+    length = os.path.getsize(path)
+    if length == 0:
+        return Mp4Info(error="archivo vacío")
+    with open(path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            return inspect_buffer(buf, length)
+
+
+async def probe_video(path: str) -> Mp4Info:
+    """inspect_file sin bloquear el event loop; un error de lectura se refleja en Mp4Info.error"""
+    try:
+        return await asyncio.to_thread(inspect_file, path)
+    except (OSError, ValueError) as e:
+        return Mp4Info(error=str(e))
+
+
+def ensure_complete(info: Mp4Info) -> None:
+    """
+    Rechaza un MP4 incompleto o corrupto
+    Otros formatos (WebM...) no se evalúan aquí: solo se registra un aviso
+
+    Raises:
+        ValueError: Si es ISO-BMFF y no está completo
+    """
+    if not info.is_mp4:
+        logger.warning(f"⚠️ Video sin estructura MP4 verificable: {info.error}")
+        return
+    if not info.complete:
+        raise ValueError(f"Video incompleto o corrupto: {info.error}")
+    logger.info(f"✅ MP4 completo: {info.duration:.1f}s {info.width}x{info.height} "
+                f"{info.video_codec or '?'}/{info.audio_codec or '-'}{' (faststart)' if info.faststart else ''}")
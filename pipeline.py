@@ -0,0 +1,242 @@
+"""
+Pipeline
+Ejecutor de etapas en forma de DAG para el flujo de generación de videos
+
+- Cada etapa declara sus entradas y salidas (claves del contexto); una etapa arranca en cuanto
+  todas sus entradas existen, así el trabajo independiente corre en paralelo
+  (p.ej. cargar la imagen mientras se detecta el idioma y se traduce el prompt)
+- Timeout, reintentos con backoff y registro de tiempos por etapa
+- Etapas condicionales (when) y opcionales (fallback): si se omiten o fallan, el fallback
+  produce sus salidas y el resto del pipeline continúa
+- Las funciones síncronas (detección de idioma, traducción) se ejecutan en un thread aparte
+"""
+import asyncio
+import inspect
+import logging
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Type
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+COMPLETED = "completed"
+SKIPPED = "skipped"
+FAILED = "failed"
+FALLBACK = "fallback"
+CANCELLED = "cancelled"
+
+
+@dataclass
+class Stage:
+    """
+    Etapa del pipeline
+
+    fn recibe las entradas como argumentos posicionales (en el orden de inputs) y retorna el valor
+    de la salida (una sola salida) o un dict {salida: valor} (varias salidas)
+    """
+    name: str
+    fn: Callable[..., Any]
+    inputs: Sequence[str] = ()
+    outputs: Sequence[str] = ()
+    timeout: Optional[float] = None  # Por intento (segundos)
+    retries: int = 0
+    retry_backoff: float = 1.0  # Espera base entre intentos (se duplica en cada reintento)
+    retry_on: Tuple[Type[BaseException], ...] = (Exception,)
+    when: Optional[Callable[[Dict[str, Any]], bool]] = None  # Recibe el contexto; False = omitir la etapa
+    fallback: Optional[Callable[..., Any]] = None  # Mismas reglas que fn; None = la etapa es obligatoria
+
+
+@dataclass
+class StageRecord:
+    """Registro de ejecución de una etapa"""
+    name: str
+    status: str = PENDING
+    attempts: int = 0
+    started_at: Optional[float] = None
+    duration: Optional[float] = None
+    error: Optional[str] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "status": self.status,
+            "attempts": self.attempts,
+            "duration": round(self.duration, 3) if self.duration is not None else None,
+            "error": self.error,
+        }
+
+
+class StageError(Exception):
+    """Una etapa obligatoria falló tras agotar sus reintentos"""
+
+    def __init__(self, stage: str, error: BaseException):
+        self.stage = stage
+        self.error = error
+        super().__init__(f"Stage '{stage}' failed: {error}")
+
+
+StageHook = Callable[[Stage, StageRecord], Any]
+
+
+class Pipeline:
+    """
+    DAG de etapas; las dependencias se deducen de las entradas y salidas declaradas
+    Guarda los registros de la última ejecución: crear una instancia por ejecución
+
+    Uso:
+        pipeline = Pipeline([
+            Stage("language", detect_language, inputs=("prompt",), outputs=("language",)),
+            Stage("image", load_image, inputs=("image_path",), outputs=("image_bytes",)),
+            Stage("optimize", optimize, inputs=("prompt", "image_bytes"), outputs=("final_prompt",)),
+        ])
+        values = await pipeline.run({"prompt": ..., "image_path": ...})
+    """
+
+    def __init__(self, stages: List[Stage], name: str = "pipeline"):
+        self.stages = list(stages)
+        self.name = name
+        self._validate()
+
+    def _validate(self):
+        names = [stage.name for stage in self.stages]
+        if len(names) != len(set(names)):
+            raise ValueError(f"Duplicate stage names in {self.name}: {names}")
+        producers: Dict[str, str] = {}
+        for stage in self.stages:
+            for output in stage.outputs:
+                if output in producers:
+                    raise ValueError(f"Output '{output}' produced by both '{producers[output]}' and '{stage.name}'")
+                producers[output] = stage.name
+
+        # Orden topológico: detecta ciclos al construir el pipeline, no al ejecutarlo
+        resolved = set()
+        remaining = list(self.stages)
+        while remaining:
+            ready = [s for s in remaining
+                     if all(producers.get(i) in resolved or i not in producers for i in s.inputs)]
+            if not ready:
+                raise ValueError(f"Dependency cycle in {self.name}: {[s.name for s in remaining]}")
+            resolved.update(s.name for s in ready)
+            remaining = [s for s in remaining if s not in ready]
+
+    async def run(self, context: Dict[str, Any], on_stage_start: Optional[StageHook] = None,
+                  on_stage_end: Optional[StageHook] = None) -> Dict[str, Any]:
+        """
+        Ejecuta el DAG sobre un contexto inicial (entradas externas)
+
+        Returns:
+            Contexto con todas las salidas; los registros quedan en self.records
+
+        Raises:
+            StageError: Si una etapa sin fallback falla (las etapas en curso se cancelan)
+            KeyError: Si falta una entrada que ninguna etapa produce
+        """
+        values = dict(context)
+        self.records: Dict[str, StageRecord] = {s.name: StageRecord(s.name) for s in self.stages}
+        produced = {output for stage in self.stages for output in stage.outputs}
+        for stage in self.stages:
+            missing = [i for i in stage.inputs if i not in produced and i not in values]
+            if missing:
+                raise KeyError(f"Stage '{stage.name}' needs inputs not provided: {missing}")
+
+        pending = list(self.stages)
+        running: Dict[asyncio.Task, Stage] = {}
+        started = time.perf_counter()
+        try:
+            while pending or running:
+                for stage in [s for s in pending if all(i in values for i in s.inputs)]:
+                    pending.remove(stage)
+                    running[asyncio.create_task(self._run_stage(stage, values, on_stage_start))] = stage
+
+                if not running:
+                    raise KeyError(f"Stages blocked on missing inputs: {[s.name for s in pending]}")
+
+                done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    stage = running.pop(task)
+                    values.update(task.result())
+                    if on_stage_end:
+                        await _maybe_await(on_stage_end(stage, self.records[stage.name]))
+        finally:
+            for task, stage in running.items():
+                if not task.done():
+                    task.cancel()
+                    self.records[stage.name].status = CANCELLED
+            if running:
+                await asyncio.gather(*running, return_exceptions=True)
+
+        logger.info(f"🧩 {self.name} completado en {time.perf_counter() - started:.2f}s: " + ", ".join(
+            f"{r.name}={r.duration:.2f}s" if r.duration is not None else f"{r.name}={r.status}"
+            for r in self.records.values()
+        ))
+        return values
+
+    async def _run_stage(self, stage: Stage, values: Dict[str, Any], on_stage_start: Optional[StageHook]) -> Dict[str, Any]:
+        record = self.records[stage.name]
+        args = [values[name] for name in stage.inputs]
+        record.started_at = time.time()
+        start = time.perf_counter()
+
+        try:
+            if stage.when is not None and not stage.when(values):
+                record.status = SKIPPED
+                return self._outputs(stage, await _call(stage.fallback, args) if stage.fallback else None)
+
+            if on_stage_start:
+                await _maybe_await(on_stage_start(stage, record))
+
+            for attempt in range(stage.retries + 1):
+                record.attempts = attempt + 1
+                try:
+                    result = await asyncio.wait_for(_call(stage.fn, args), timeout=stage.timeout)
+                    record.status = COMPLETED
+                    return self._outputs(stage, result)
+                except stage.retry_on as e:
+                    if isinstance(e, asyncio.TimeoutError):
+                        e = asyncio.TimeoutError(f"timeout after {stage.timeout}s")
+                    record.error = f"{type(e).__name__}: {e}"
+                    if attempt >= stage.retries:
+                        raise
+                    delay = stage.retry_backoff * (2 ** attempt)
+                    logger.warning(f"🔁 Etapa '{stage.name}' falló ({record.error}), reintento {attempt + 1}/{stage.retries} en {delay:.1f}s")
+                    await asyncio.sleep(delay)
+
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            record.error = record.error or f"{type(e).__name__}: {e}"
+            if stage.fallback is None:
+                record.status = FAILED
+                logger.error(f"❌ Etapa '{stage.name}' falló: {record.error}")
+                raise StageError(stage.name, e) from e
+            record.status = FALLBACK
+            logger.warning(f"⚠️ Etapa '{stage.name}' falló ({record.error}), usando fallback")
+            return self._outputs(stage, await _call(stage.fallback, args))
+        finally:
+            record.duration = time.perf_counter() - start
+
+    @staticmethod
+    def _outputs(stage: Stage, result: Any) -> Dict[str, Any]:
+        if not stage.outputs:
+            return {}
+        if len(stage.outputs) == 1:
+            return {stage.outputs[0]: result}
+        result = result or {}
+        return {output: result.get(output) for output in stage.outputs}
+
+    def timings(self) -> Dict[str, Dict[str, Any]]:
+        """Registros de la última ejecución, serializables (para job.state y /status)"""
+        return {name: record.to_dict() for name, record in getattr(self, "records", {}).items()}
+
+
+async def _call(fn: Callable[..., Any], args: List[Any]) -> Any:
+    if inspect.iscoroutinefunction(fn):
+        return await fn(*args)
+    # Funciones bloqueantes (red, CPU) fuera del event loop
+    return await _maybe_await(await asyncio.to_thread(fn, *args))
+
+
+async def _maybe_await(value: Any) -> Any:
+    if inspect.isawaitable(value):
+        return await value
+    return value
@@ -0,0 +1,438 @@
+"""
+Prediction Tracker
+Poller central que consulta todos los request_id pendientes de WaveSpeed desde un único loop
+"""
+import asyncio
+import logging
+import random
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from config import Config
+from async_polling import (
+    calculate_smart_polling_interval,
+    normalize_prediction,
+    PredictionFailedError,
+    PredictionTimeoutError,
+)
+
+logger = logging.getLogger(__name__)
+
+ProgressCallback = Callable[[int, Optional[str]], Awaitable[None]]
+
+
+@dataclass
+class TrackedPrediction:
+    """Estado de polling de una predicción pendiente"""
+    request_id: str
+    api: Any
+    label: str
+    max_attempts: int
+    base_interval: float
+    interval_fn: Callable[[int, int, float], float]
+    future: asyncio.Future
+    created_at: float
+    next_poll_at: float
+    deadline: Optional[float] = None
+    attempts: int = 0
+    consecutive_errors: int = 0
+    last_status: Optional[str] = None
+    in_flight: bool = False
+    push: bool = False  # Se espera un webhook; el polling es solo respaldo
+    progress_callbacks: List[ProgressCallback] = field(default_factory=list)
+
+
+class PredictionTracker:
+    """
+    Servicio central de seguimiento de predicciones
+
+    - Un solo loop en background para todos los request_id en vuelo
+    - Varios waiters del mismo request_id comparten las consultas
+    - Calendario adaptativo: aprende cuánto tarda cada tipo de trabajo y no consulta antes de tiempo
+    - Jitter y límite global de consultas/segundo para repartir la carga en el tiempo
+    - resolve(): los webhooks de WaveSpeed resuelven el future al instante; para las predicciones
+      con webhook el polling queda como barrido lento de respaldo
+    """
+
+    # Resultados de webhook que llegan antes de que alguien haga track() del request_id
+    EARLY_RESULTS_MAX = 1000
+    EARLY_RESULTS_TTL = 600
+
+    def __init__(self, max_requests_per_second: float = None, jitter: float = None,
+                 tick_interval: float = 0.1):
+        # tick_interval define la ráfaga máxima permitida (max_requests_per_second * tick_interval)
+        self.max_requests_per_second = max_requests_per_second or Config.PREDICTION_TRACKER_MAX_RPS
+        self.jitter = Config.PREDICTION_TRACKER_JITTER if jitter is None else jitter
+        self.tick_interval = tick_interval
+
+        self._pending: Dict[str, TrackedPrediction] = {}
+        self._expected_durations: Dict[str, float] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._running = False
+        self._checks: set = set()
+        self._early_results: "OrderedDict[str, tuple]" = OrderedDict()
+
+        self.stats = {
+            "tracked": 0,
+            "deduplicated": 0,
+            "status_requests": 0,
+            "completed": 0,
+            "failed": 0,
+            "timed_out": 0,
+            "webhook_resolved": 0,
+        }
+
+    @property
+    def is_running(self) -> bool:
+        return self._running and self._task is not None and not self._task.done()
+
+    async def start(self):
+        """Inicia el loop de polling en background"""
+        self._ensure_running()
+
+    async def stop(self):
+        """Detiene el loop y cancela los waiters pendientes"""
+        self._running = False
+        if self._task and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+
+        for check in list(self._checks):
+            check.cancel()
+        self._checks.clear()
+
+        for prediction in self._pending.values():
+            if not prediction.future.done():
+                prediction.future.cancel()
+        self._pending.clear()
+        logger.info("✅ PredictionTracker detenido")
+
+    def _ensure_running(self):
+        """Arranca el loop bajo demanda (el bot en modo polling no tiene lifespan)"""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Nuevo event loop (p.ej. reinicio o tests): descartar estado del loop anterior
+            self._loop = loop
+            self._task = None
+            self._pending.clear()
+            self._checks = set()
+            self._wakeup = asyncio.Event()
+
+        if not self.is_running:
+            self._running = True
+            self._task = loop.create_task(self._run())
+            logger.info(f"🚀 PredictionTracker iniciado (max {self.max_requests_per_second:.0f} req/s)")
+
+    def track(
+        self,
+        api,
+        request_id: str,
+        max_attempts: Optional[int] = None,
+        base_interval: Optional[float] = None,
+        timeout: Optional[float] = None,
+        interval_fn: Callable[[int, int, float], float] = calculate_smart_polling_interval,
+        on_progress: Optional[ProgressCallback] = None,
+        label: str = "video",
+        push: bool = False,
+    ) -> asyncio.Future:
+        """
+        Registra un request_id y retorna el future que se resolverá con los datos de la predicción
+        Si el request_id ya está en seguimiento, se reutiliza el mismo future
+        """
+        self._ensure_running()
+
+        existing = self._pending.get(request_id)
+        if existing and not existing.future.done():
+            self.stats["deduplicated"] += 1
+            if on_progress:
+                existing.progress_callbacks.append(on_progress)
+            return existing.future
+
+        if max_attempts is None:
+            max_attempts = Config.MAX_POLLING_ATTEMPTS
+        if base_interval is None:
+            base_interval = Config.POLLING_INTERVAL
+
+        now = time.monotonic()
+        if push and timeout is None:
+            timeout = Config.WAVESPEED_WEBHOOK_TIMEOUT
+        prediction = TrackedPrediction(
+            request_id=request_id,
+            api=api,
+            label=label,
+            max_attempts=max_attempts,
+            base_interval=base_interval,
+            interval_fn=interval_fn,
+            future=self._loop.create_future(),
+            created_at=now,
+            next_poll_at=now,
+            deadline=now + timeout if timeout else None,
+            push=push,
+        )
+        if on_progress:
+            prediction.progress_callbacks.append(on_progress)
+
+        prediction.next_poll_at = now + self._first_delay(prediction)
+        self._pending[request_id] = prediction
+        self.stats["tracked"] += 1
+
+        # El webhook pudo llegar antes que el track() (predicciones muy rápidas)
+        early = self._pop_early_result(request_id)
+        if early is not None:
+            self._apply_result(prediction, early, source="webhook")
+
+        self._wakeup.set()
+        return prediction.future
+
+    def resolve(self, payload: Dict[str, Any]) -> bool:
+        """
+        Aplica una notificación push (webhook de WaveSpeed) a la predicción pendiente
+
+        Returns:
+            bool: True si había un waiter para ese request_id y quedó resuelto
+        """
+        task_data = normalize_prediction(payload)
+        request_id = task_data.get('id')
+        if not request_id:
+            logger.warning(f"⚠️ Webhook sin id de predicción: {payload}")
+            return False
+
+        prediction = self._pending.get(request_id)
+        if prediction is None or prediction.future.done():
+            # Sin waiter en este proceso: guardar por si el track() llega después
+            if task_data.get('status') in ('completed', 'failed'):
+                self._store_early_result(request_id, task_data)
+            return False
+
+        return self._apply_result(prediction, task_data, source="webhook")
+
+    def _store_early_result(self, request_id: str, task_data: Dict[str, Any]):
+        self._early_results[request_id] = (time.monotonic(), task_data)
+        self._early_results.move_to_end(request_id)
+        while len(self._early_results) > self.EARLY_RESULTS_MAX:
+            self._early_results.popitem(last=False)
+
+    def _pop_early_result(self, request_id: str) -> Optional[Dict[str, Any]]:
+        entry = self._early_results.pop(request_id, None)
+        if entry is None:
+            return None
+        stored_at, task_data = entry
+        if time.monotonic() - stored_at > self.EARLY_RESULTS_TTL:
+            return None
+        return task_data
+
+    async def wait(self, api, request_id: str, **kwargs) -> Dict[str, Any]:
+        """Registra el request_id y espera su resultado"""
+        future = self.track(api, request_id, **kwargs)
+        # shield: cancelar un waiter no debe cancelar el future compartido
+        return await asyncio.shield(future)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Estadísticas del tracker"""
+        return {
+            **self.stats,
+            "pending": len(self._pending),
+            "expected_durations": dict(self._expected_durations),
+        }
+
+    # ------------------------------------------------------------------
+    # Calendario adaptativo
+    # ------------------------------------------------------------------
+
+    def _jittered(self, interval: float) -> float:
+        if self.jitter <= 0:
+            return interval
+        return interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def _first_delay(self, prediction: TrackedPrediction) -> float:
+        if prediction.push:
+            # Con webhook solo se consulta como respaldo, muy espaciado
+            return self._clamp_to_deadline(prediction, self._jittered(Config.WAVESPEED_WEBHOOK_FALLBACK_INTERVAL))
+        expected = self._expected_durations.get(prediction.label)
+        if expected:
+            # No consultar hasta acercarse a la duración típica de este tipo de trabajo
+            delay = self._jittered(expected * 0.8)
+        else:
+            # Sin historial: primera consulta pronto, repartida para no sincronizar ráfagas
+            delay = random.uniform(0, prediction.base_interval) if self.jitter > 0 else 0.0
+        return self._clamp_to_deadline(prediction, delay)
+
+    def _next_delay(self, prediction: TrackedPrediction) -> float:
+        expected = self._expected_durations.get(prediction.label)
+        if prediction.push:
+            delay = Config.WAVESPEED_WEBHOOK_FALLBACK_INTERVAL
+        elif expected:
+            elapsed = time.monotonic() - prediction.created_at
+            if elapsed < expected * 0.8:
+                delay = expected * 0.8 - elapsed
+            else:
+                delay = max(prediction.base_interval, expected * 0.1)
+        else:
+            delay = prediction.interval_fn(prediction.attempts - 1, prediction.max_attempts, prediction.base_interval)
+
+        if prediction.consecutive_errors >= 3:
+            # Errores de red repetidos: espaciar las consultas
+            delay = max(delay, prediction.base_interval * 4)
+
+        return self._clamp_to_deadline(prediction, self._jittered(delay))
+
+    def _clamp_to_deadline(self, prediction: TrackedPrediction, delay: float) -> float:
+        if prediction.deadline is None:
+            return delay
+        return max(0.0, min(delay, prediction.deadline - time.monotonic()))
+
+    def _record_duration(self, label: str, duration: float):
+        """Media móvil exponencial del tiempo de completado por tipo de trabajo"""
+        previous = self._expected_durations.get(label)
+        self._expected_durations[label] = duration if previous is None else previous * 0.7 + duration * 0.3
+
+    # ------------------------------------------------------------------
+    # Loop principal
+    # ------------------------------------------------------------------
+
+    async def _run(self):
+        logger.info("🔄 PredictionTracker loop iniciado")
+        # Token bucket: ráfaga máxima de un tick, recarga a max_requests_per_second
+        capacity = max(1.0, self.max_requests_per_second * self.tick_interval)
+        tokens = capacity
+        last_refill = time.monotonic()
+
+        try:
+            while self._running:
+                self._wakeup.clear()
+                now = time.monotonic()
+                tokens = min(capacity, tokens + (now - last_refill) * self.max_requests_per_second)
+                last_refill = now
+
+                due = sorted(
+                    (p for p in self._pending.values() if not p.in_flight and p.next_poll_at <= now),
+                    key=lambda p: p.next_poll_at
+                )
+
+                dispatched = 0
+                for prediction in due:
+                    if tokens < 1:
+                        break
+                    tokens -= 1
+                    dispatched += 1
+                    # Despachar sin esperar: la latencia de una consulta no frena a las demás
+                    prediction.in_flight = True
+                    check = asyncio.create_task(self._check(prediction))
+                    self._checks.add(check)
+                    check.add_done_callback(self._checks.discard)
+
+                if len(due) > dispatched:
+                    # Quedan consultas vencidas: esperar al siguiente token
+                    await asyncio.sleep((1 - tokens) / self.max_requests_per_second)
+                    continue
+
+                waiting = [p for p in self._pending.values() if not p.in_flight]
+                if not waiting:
+                    await self._wakeup.wait()
+                    continue
+
+                next_due = min(p.next_poll_at for p in waiting)
+                sleep_for = next_due - time.monotonic()
+                if sleep_for > 0:
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), timeout=sleep_for)
+                    except asyncio.TimeoutError:
+                        pass
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"💥 Error en loop de PredictionTracker: {e}")
+            self._running = False
+            for prediction in self._pending.values():
+                if not prediction.future.done():
+                    prediction.future.set_exception(e)
+            self._pending.clear()
+
+    async def _check(self, prediction: TrackedPrediction):
+        """Consulta una predicción y resuelve o reprograma su future"""
+        try:
+            await self._poll_once(prediction)
+        finally:
+            prediction.in_flight = False
+            self._wakeup.set()
+
+    async def _poll_once(self, prediction: TrackedPrediction):
+        request_id = prediction.request_id
+        prediction.attempts += 1
+        self.stats["status_requests"] += 1
+
+        try:
+            task_data = normalize_prediction(await prediction.api.get_video_status(request_id))
+            prediction.consecutive_errors = 0
+            if prediction.future.done():
+                # Resuelto por webhook mientras la consulta estaba en vuelo
+                return
+            if self._apply_result(prediction, task_data, source="polling"):
+                return
+
+        except Exception as polling_error:
+            prediction.consecutive_errors += 1
+            logger.error(f"❌ Error consultando {prediction.label} {request_id} (intento {prediction.attempts}): {polling_error}")
+
+        for callback in list(prediction.progress_callbacks):
+            try:
+                await callback(prediction.attempts - 1, prediction.last_status)
+            except Exception as progress_error:
+                logger.warning(f"⚠️ Error en callback de progreso: {progress_error}")
+
+        deadline_passed = prediction.deadline is not None and time.monotonic() >= prediction.deadline
+        if prediction.attempts >= prediction.max_attempts or deadline_passed:
+            logger.error(f"⏰ Timeout esperando {prediction.label} {request_id} (último status: {prediction.last_status})")
+            self._finish(prediction, error=PredictionTimeoutError(request_id, prediction.attempts, prediction.last_status))
+            self.stats["timed_out"] += 1
+            return
+
+        prediction.next_poll_at = time.monotonic() + self._next_delay(prediction)
+
+    def _apply_result(self, prediction: TrackedPrediction, task_data: Dict[str, Any], source: str) -> bool:
+        """Resuelve el future si la predicción terminó; retorna True si quedó resuelta"""
+        request_id = prediction.request_id
+        prediction.last_status = task_data.get('status')
+
+        if prediction.last_status == 'completed' and task_data.get('outputs'):
+            duration = time.monotonic() - prediction.created_at
+            self._record_duration(prediction.label, duration)
+            logger.info(f"🎬 {prediction.label} {request_id} completado en {duration:.1f}s "
+                        f"({prediction.attempts} consultas, vía {source})")
+            self._finish(prediction, result=task_data)
+            self.stats["completed"] += 1
+            if source == "webhook":
+                self.stats["webhook_resolved"] += 1
+            return True
+
+        if prediction.last_status == 'failed':
+            error_msg = task_data.get('error') or 'Unknown error'
+            logger.error(f"❌ {prediction.label} {request_id} falló: {error_msg} (vía {source})")
+            self._finish(prediction, error=PredictionFailedError(request_id, error_msg))
+            self.stats["failed"] += 1
+            if source == "webhook":
+                self.stats["webhook_resolved"] += 1
+            return True
+
+        return False
+
+    def _finish(self, prediction: TrackedPrediction, result: Dict[str, Any] = None, error: Exception = None):
+        self._pending.pop(prediction.request_id, None)
+        if prediction.future.done():
+            return
+        if error is not None:
+            prediction.future.set_exception(error)
+        else:
+            prediction.future.set_result(result)
+
+
+# Instancia global del tracker
+prediction_tracker = PredictionTracker()
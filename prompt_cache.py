@@ -0,0 +1,186 @@
+"""
+Prompt Cache
+Caché de resultados del prompt optimizer de WaveSpeed (ahorra créditos y segundos de espera)
+
+- Clave: identidad exacta de la imagen (file_unique_id de Telegram o SHA-256 del contenido) +
+  texto normalizado + mode + style; dos imágenes distintas nunca comparten resultado
+- Nivel 1: LRU en memoria (acierto en microsegundos)
+- Nivel 2: SQLite en disco opcional, compartido entre procesos y reinicios
+- TTL por entrada (Config.PROMPT_CACHE_TTL) y métricas de aciertos/fallos
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+def normalize_prompt_text(text: str) -> str:
+    """Normaliza el texto del usuario para la clave (espacios y mayúsculas no cambian el resultado)"""
+    return " ".join((text or "").split()).lower()
+
+
+def image_digest(image_bytes: bytes) -> str:
+    """
+    Hash exacto (SHA-256) del contenido de la imagen
+    Un hash perceptual agrupa imágenes distintas (colores planos, poco contraste) y devolvería
+    el prompt de otra imagen, quizá de otro usuario
+    """
+    return f"sha256:{hashlib.sha256(image_bytes).hexdigest()}"
+
+
+def telegram_image_key(file_unique_id: Optional[str]) -> Optional[str]:
+    """Clave de imagen a partir del file_unique_id de Telegram (estable entre reenvíos del mismo archivo)"""
+    return f"tg:{file_unique_id}" if file_unique_id else None
+
+
+def make_cache_key(image_hash: Optional[str], text: str, mode: str = "video", style: str = "default") -> str:
+    raw = json.dumps([image_hash or "", normalize_prompt_text(text), mode, style])
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+class PromptCache:
+    """
+    Caché de dos niveles para prompts optimizados
+
+    Uso:
+        key = make_cache_key(image_digest(data), text, "video", "default")
+        cached = await prompt_cache.get(key)
+        if cached is None:
+            ...
+            await prompt_cache.set(key, optimized)
+    """
+
+    def __init__(self, max_entries: int = None, ttl: float = None, path: Optional[str] = None, use_disk: bool = None):
+        self.max_entries = max_entries or Config.PROMPT_CACHE_SIZE
+        self.ttl = ttl or Config.PROMPT_CACHE_TTL
+        self.use_disk = Config.PROMPT_CACHE_USE_DISK if use_disk is None else use_disk
+        self.path = path or Config.PROMPT_CACHE_DB_PATH
+        self._memory: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "expired": 0}
+
+    # ------------------------------------------------------------------
+    # Nivel 2: SQLite
+    # ------------------------------------------------------------------
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS prompt_cache (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_prompt_cache_expiry ON prompt_cache (expires_at)")
+            self._conn = conn
+        return self._conn
+
+    async def _run(self, fn, *args):
+        def locked():
+            with self._lock:
+                return fn(self._connect(), *args)
+        return await asyncio.to_thread(locked)
+
+    # ------------------------------------------------------------------
+    # API
+    # ------------------------------------------------------------------
+
+    def _remember(self, key: str, expires_at: float, value: str):
+        self._memory[key] = (expires_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def get_cached(self, key: str) -> Optional[str]:
+        """Consulta solo el nivel en memoria (síncrono)"""
+        entry = self._memory.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= time.time():
+            del self._memory[key]
+            self.stats["expired"] += 1
+            return None
+        self._memory.move_to_end(key)
+        return value
+
+    async def get(self, key: str) -> Optional[str]:
+        value = self.get_cached(key)
+        if value is not None:
+            self.stats["memory_hits"] += 1
+            return value
+
+        if self.use_disk:
+            try:
+                row = await self._run(lambda conn: conn.execute(
+                    "SELECT value, expires_at FROM prompt_cache WHERE key = ? AND expires_at > ?",
+                    (key, time.time())
+                ).fetchone())
+            except Exception as e:
+                logger.warning(f"⚠️ Caché de prompts en disco no disponible: {e}")
+                row = None
+            if row:
+                value, expires_at = row
+                self._remember(key, expires_at, value)
+                self.stats["disk_hits"] += 1
+                return value
+
+        self.stats["misses"] += 1
+        return None
+
+    async def set(self, key: str, value: str):
+        expires_at = time.time() + self.ttl
+        self._remember(key, expires_at, value)
+        self.stats["stores"] += 1
+
+        if self.use_disk:
+            def op(conn):
+                conn.execute(
+                    "INSERT OR REPLACE INTO prompt_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, value, expires_at)
+                )
+                # Limpieza oportunista de entradas caducadas
+                conn.execute("DELETE FROM prompt_cache WHERE expires_at <= ?", (time.time(),))
+            try:
+                await self._run(op)
+            except Exception as e:
+                logger.warning(f"⚠️ No se pudo guardar el prompt en la caché de disco: {e}")
+
+    def get_stats(self) -> Dict[str, float]:
+        lookups = self.stats["memory_hits"] + self.stats["disk_hits"] + self.stats["misses"]
+        hits = self.stats["memory_hits"] + self.stats["disk_hits"]
+        return {
+            **self.stats,
+            "entries_in_memory": len(self._memory),
+            "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+        }
+
+    async def close(self):
+        def op():
+            with self._lock:
+                if self._conn is not None:
+                    self._conn.close()
+                    self._conn = None
+        await asyncio.to_thread(op)
+
+
+# Instancia global de la caché
+prompt_cache = PromptCache()
@@ -0,0 +1,252 @@
+"""
+Rate Limiter
+Límite de videos por ventana deslizante de 24h, en memoria, con persistencia write-behind
+
+- Los contadores por fingerprint e IP viven en memoria: check() responde sin tocar disco
+- Ventana deslizante aproximada: uso = hoy + ayer * (fracción del día que aún no ha pasado)
+- Los incrementos se acumulan y se vuelcan en lote a usage_store cada Config.RATE_LIMIT_FLUSH_INTERVAL
+  segundos y en el shutdown; el volcado devuelve los totales durables de todas las claves usadas
+  desde el volcado anterior, así que cada proceso incorpora también lo que contaron los demás
+- Límites por plan (free/pro/creator/enterprise) desde Config.RATE_LIMIT_TIERS
+"""
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from config import Config
+from usage_store import FINGERPRINT, IP, usage_store
+
+logger = logging.getLogger(__name__)
+
+# Los contadores sin cambios pendientes y sin uso en este tiempo se descartan de memoria
+IDLE_EVICTION_SECONDS = 3600
+
+
+@dataclass
+class RateLimitDecision:
+    """Resultado de check(); used/remaining/limit se refieren a la clave que limita (fingerprint o IP)"""
+    allowed: bool
+    used: int
+    remaining: Optional[int]
+    limit: Optional[int]
+    tier: str
+    scope: str = FINGERPRINT
+
+
+@dataclass
+class _Window:
+    day: str
+    current: int = 0
+    previous: int = 0
+    pending: int = 0
+    last_access: float = 0.0
+
+
+def _day_fraction_elapsed(now: datetime) -> float:
+    midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    return (now - midnight).total_seconds() / 86400
+
+
+class SlidingWindowRateLimiter:
+    """
+    Rate limiter en memoria por fingerprint e IP
+
+    Uso:
+        decision = await rate_limiter.check(fingerprint, client_ip)
+        if decision.allowed:
+            ...
+            await rate_limiter.hit(fingerprint, client_ip)
+    """
+
+    def __init__(self, store=None, flush_interval: float = None):
+        self.store = store or usage_store
+        self.flush_interval = flush_interval or Config.RATE_LIMIT_FLUSH_INTERVAL
+        self._windows: Dict[Tuple[str, str], _Window] = {}
+        self._carry: List[Tuple[str, str, str, int]] = []  # Pendientes de días ya cerrados
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._task: Optional[asyncio.Task] = None
+        self._last_flush = 0.0
+        self._user_tiers_raw: Optional[str] = None
+        self._user_tiers: Dict[str, str] = {}
+
+        self.stats = {"checks": 0, "hits": 0, "rejected": 0, "flushes": 0, "flushed_keys": 0}
+
+    # ------------------------------------------------------------------
+    # Planes
+    # ------------------------------------------------------------------
+
+    def tier_for(self, fingerprint: str) -> str:
+        """Plan del fingerprint según Config.RATE_LIMIT_USER_TIERS (por defecto RATE_LIMIT_DEFAULT_TIER)"""
+        raw = Config.RATE_LIMIT_USER_TIERS or ""
+        if raw != self._user_tiers_raw:
+            tiers = {}
+            for entry in raw.split(","):
+                key, _, tier = entry.strip().partition(":")
+                if key and tier in Config.RATE_LIMIT_TIERS:
+                    tiers[key] = tier
+            self._user_tiers, self._user_tiers_raw = tiers, raw
+        return self._user_tiers.get(fingerprint, Config.RATE_LIMIT_DEFAULT_TIER)
+
+    @staticmethod
+    def limits_for(tier: str) -> Dict[str, Optional[int]]:
+        return Config.RATE_LIMIT_TIERS.get(tier) or Config.RATE_LIMIT_TIERS[Config.RATE_LIMIT_DEFAULT_TIER]
+
+    # ------------------------------------------------------------------
+    # Ventanas en memoria
+    # ------------------------------------------------------------------
+
+    def _roll(self, scope: str, key: str, window: _Window, today: str):
+        if window.day == today:
+            return
+        if window.pending:
+            self._carry.append((scope, key, window.day, window.pending))
+        yesterday = (date.fromisoformat(today) - timedelta(days=1)).isoformat()
+        window.previous = window.current if window.day == yesterday else 0
+        window.current, window.pending, window.day = 0, 0, today
+
+    async def _window(self, scope: str, key: str) -> _Window:
+        today = date.today().isoformat()
+        window = self._windows.get((scope, key))
+        if window is None:
+            # Primera vez en este proceso: cargar hoy y ayer del almacén durable
+            yesterday = (date.today() - timedelta(days=1)).isoformat()
+            current = await self.store.get_usage(key, scope=scope, day=today)
+            previous = await self.store.get_usage(key, scope=scope, day=yesterday)
+            window = self._windows.setdefault((scope, key), _Window(day=today, current=current, previous=previous))
+        self._roll(scope, key, window, today)
+        window.last_access = time.monotonic()
+        return window
+
+    @staticmethod
+    def _used(window: _Window) -> int:
+        weight = 1.0 - _day_fraction_elapsed(datetime.now())
+        return window.current + int(window.previous * weight)
+
+    # ------------------------------------------------------------------
+    # API
+    # ------------------------------------------------------------------
+
+    async def usage(self, key: str, scope: str = FINGERPRINT) -> int:
+        """Uso en la ventana deslizante de 24h"""
+        return self._used(await self._window(scope, key))
+
+    async def check(self, fingerprint: str, client_ip: str = None, tier: str = None) -> RateLimitDecision:
+        """Comprueba el límite del plan para el fingerprint y su IP (no consume cupo)"""
+        self.stats["checks"] += 1
+        tier = tier or self.tier_for(fingerprint)
+        limits = self.limits_for(tier)
+
+        scopes = [(FINGERPRINT, fingerprint, limits.get("daily"))]
+        if client_ip:
+            scopes.append((IP, client_ip, limits.get("ip_daily")))
+
+        decision = None
+        for scope, key, limit in scopes:
+            used = self._used(await self._window(scope, key))
+            if limit is None:
+                candidate = RateLimitDecision(True, used, None, None, tier, scope)
+            else:
+                candidate = RateLimitDecision(used < limit, used, max(0, limit - used), limit, tier, scope)
+            if decision is None or not candidate.allowed:
+                decision = candidate
+            if not candidate.allowed:
+                break
+
+        if not decision.allowed:
+            self.stats["rejected"] += 1
+        return decision
+
+    async def hit(self, fingerprint: str, client_ip: str = None) -> int:
+        """Cuenta un uso para el fingerprint (y su IP); retorna el uso del fingerprint"""
+        self.stats["hits"] += 1
+        keys = [(FINGERPRINT, fingerprint)]
+        if client_ip:
+            keys.append((IP, client_ip))
+        used = 0
+        for scope, key in keys:
+            window = await self._window(scope, key)
+            window.current += 1
+            window.pending += 1
+            if scope == FINGERPRINT:
+                used = self._used(window)
+        return used
+
+    async def flush(self) -> int:
+        """Vuelca en un lote los contadores cambiados; retorna cuántas claves se escribieron"""
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            today = date.today().isoformat()
+            items, flushed = list(self._carry), []
+            self._carry.clear()
+            for (scope, key), window in self._windows.items():
+                self._roll(scope, key, window, today)
+                # Claves activas sin cambios van con delta 0 para leer su total durable en el mismo lote
+                if window.pending or window.last_access >= self._last_flush:
+                    items.append((scope, key, window.day, window.pending))
+                    flushed.append(window)
+                    window.pending = 0
+            self._last_flush = time.monotonic()
+
+            if items:
+                try:
+                    totals = await self.store.increment_many(items)
+                except Exception as e:
+                    # Reponer lo pendiente para el próximo volcado
+                    logger.error(f"❌ Error volcando contadores de uso: {e}")
+                    self._carry.extend(items)
+                    return 0
+
+                # Sincronizar con lo que otros procesos hayan contado mientras tanto
+                day_totals = totals[len(totals) - len(flushed):]
+                for window, total in zip(flushed, day_totals):
+                    if window.day == today:
+                        window.current = total + window.pending
+
+                self.stats["flushes"] += 1
+                self.stats["flushed_keys"] += len(items)
+
+            self._evict_idle()
+            return len(items)
+
+    def _evict_idle(self):
+        cutoff = time.monotonic() - IDLE_EVICTION_SECONDS
+        idle = [k for k, w in self._windows.items() if not w.pending and w.last_access < cutoff]
+        for k in idle:
+            del self._windows[k]
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"❌ Error en el volcado periódico del rate limiter: {e}")
+
+    async def start(self):
+        """Inicia el volcado periódico en segundo plano"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._flush_loop())
+            logger.info(f"🚦 Rate limiter iniciado (volcado cada {self.flush_interval:.0f}s)")
+
+    async def stop(self):
+        """Detiene el volcado periódico y escribe los contadores pendientes"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        flushed = await self.flush()
+        logger.info(f"✅ Rate limiter detenido ({flushed} contadores volcados)")
+
+    def get_stats(self) -> Dict[str, int]:
+        return {**self.stats, "keys_in_memory": len(self._windows)}
+
+
+# Instancia global del rate limiter
+rate_limiter = SlidingWindowRateLimiter()
@@ -0,0 +1,442 @@
+"""
+Social Cache
+Caché de videos de redes sociales por ID canónico: artefacto en el volumen + file_id de Telegram
+
+- Canonicalización por plataforma: el mismo video compartido como vm.tiktok.com/..., tiktok.com/@u/video/ID,
+  x.com o twitter.com, con o sin parámetros de seguimiento, produce la misma clave (tiktok:ID, x:ID...)
+- Los enlaces cortos (vm.tiktok.com, fb.watch, /s/ de Reddit, /share/ de Instagram) se resuelven una vez
+  siguiendo la redirección y el resultado se memoriza
+- El archivo descargado se conserva en SOCIAL_CACHE_DIR en vez de borrarse tras enviarlo; junto a él se
+  guarda el file_id del primer envío: un enlace repetido se responde sin tráfico a la plataforma
+- Vigencia (TTL) por entrada y límite de bytes en disco con expulsión de los menos usados (LRU)
+"""
+import asyncio
+import json
+import logging
+import os
+import re
+import shutil
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional
+from urllib.parse import parse_qs, urljoin, urlparse
+
+from config import Config
+from download_service import canonical_url
+
+logger = logging.getLogger(__name__)
+
+# Enlaces cortos o de compartir que hay que resolver antes de poder canonicalizarlos
+SHORT_LINK_HOSTS = {"vm.tiktok.com", "vt.tiktok.com", "fb.watch"}
+SHORT_LINK_PATHS = {
+    "tiktok.com": re.compile(r"^/t/[A-Za-z0-9]+"),
+    "reddit.com": re.compile(r"^/r/[^/]+/s/[A-Za-z0-9]+"),
+    "instagram.com": re.compile(r"^/share/"),
+    "facebook.com": re.compile(r"^/share/"),
+}
+
+X_HOSTS = {"x.com", "twitter.com", "fxtwitter.com", "vxtwitter.com", "fixupx.com", "fixvx.com"}
+_TIKTOK_ID_RE = re.compile(r"/(?:@[^/]+/)?(?:video|photo|v)/(\d+)")
+_X_STATUS_RE = re.compile(r"/status(?:es)?/(\d+)")
+_INSTAGRAM_CODE_RE = re.compile(r"/(?:p|reels?|tv)/([A-Za-z0-9_-]+)")
+_REDDIT_POST_RE = re.compile(r"/comments/([a-z0-9]+)")
+_FACEBOOK_VIDEO_RE = re.compile(r"/(?:videos|reel|watch)/(?:[^/]+/)*?(\d{6,})")
+
+
+def _host(url: str) -> str:
+    host = urlparse(url.strip()).hostname or ""
+    for prefix in ("www.", "m.", "mobile.", "old.", "new."):
+        if host.startswith(prefix):
+            return host[len(prefix):]
+    return host
+
+
+def _host_is(host: str, domain: str) -> bool:
+    return host == domain or host.endswith("." + domain)
+
+
+def is_short_link(url: str) -> bool:
+    """True si el enlace solo redirige al video y hay que resolverlo para canonicalizarlo"""
+    host = _host(url)
+    if host in SHORT_LINK_HOSTS:
+        return True
+    path = urlparse(url.strip()).path
+    return any(_host_is(host, domain) and pattern.match(path) for domain, pattern in SHORT_LINK_PATHS.items())
+
+
+def canonical_id(url: str) -> str:
+    """
+    ID canónico del video de un enlace ya resuelto
+    'tiktok:7301234567890', 'x:1790000000000000000', 'instagram:C1a2B3', 'reddit:1abc2d', 'facebook:1234567890';
+    si el enlace no encaja en ningún patrón, su URL canónica
+    """
+    parsed = urlparse(url.strip())
+    host = _host(url)
+    path = parsed.path
+
+    if _host_is(host, "tiktok.com"):
+        match = _TIKTOK_ID_RE.search(path)
+        if match:
+            return f"tiktok:{match.group(1)}"
+    elif host in X_HOSTS:
+        match = _X_STATUS_RE.search(path)
+        if match:
+            return f"x:{match.group(1)}"
+    elif _host_is(host, "instagram.com") or host == "instagr.am":
+        match = _INSTAGRAM_CODE_RE.search(path)
+        if match:
+            return f"instagram:{match.group(1)}"
+    elif host == "redd.it" and path.strip("/"):
+        return f"reddit:{path.strip('/').split('/')[0]}"
+    elif _host_is(host, "reddit.com"):
+        match = _REDDIT_POST_RE.search(path)
+        if match:
+            return f"reddit:{match.group(1)}"
+    elif _host_is(host, "facebook.com") or host == "fb.com":
+        video_id = parse_qs(parsed.query).get("v", [None])[0]
+        if video_id and video_id.isdigit():
+            return f"facebook:{video_id}"
+        match = _FACEBOOK_VIDEO_RE.search(path + "/")
+        if match:
+            return f"facebook:{match.group(1)}"
+
+    return canonical_url(url)
+
+
+async def resolve_short_url(url: str, max_hops: int = 5, timeout: float = None) -> str:
+    """Sigue las redirecciones de un enlace corto (sin descargar la página) hasta llegar a la URL del video"""
+    from async_wavespeed import get_shared_session
+    import aiohttp
+
+    session = await get_shared_session()
+    client_timeout = aiohttp.ClientTimeout(total=timeout or Config.SOCIAL_SHORT_LINK_TIMEOUT)
+    headers = {'User-Agent': 'Mozilla/5.0 (iPhone; CPU iPhone OS 17_5_1 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.5 Mobile/15E148 Safari/604.1'}
+    current = url
+    for _ in range(max_hops):
+        async with session.get(current, allow_redirects=False, timeout=client_timeout, headers=headers) as response:
+            location = response.headers.get('Location')
+        if not location:
+            break
+        current = urljoin(current, location)
+        # Parar en cuanto el destino ya identifica el video (no hace falta cargar la página)
+        if not is_short_link(current) and canonical_id(current) != canonical_url(current):
+            break
+    return current
+
+
+@dataclass
+class SocialArtifact:
+    canonical_id: str
+    filepath: Optional[str]
+    size: int
+    meta: Dict[str, Any] = field(default_factory=dict)
+    file_id: Optional[str] = None
+    file_unique_id: Optional[str] = None
+    created_at: float = 0.0
+    last_access: float = 0.0
+
+
+class SocialCache:
+    """
+    ID canónico -> artefacto descargado y file_id de Telegram, en SQLite con los recientes en memoria
+
+    Uso:
+        canonical = await social_cache.canonicalize(url)
+        artifact = await social_cache.lookup(canonical)
+        ...
+        result = await social_cache.store(canonical, download_result)
+        await social_cache.remember_file_id(canonical, file_id, file_unique_id)
+    """
+
+    def __init__(self, path: Optional[str] = None, directory: Optional[str] = None, ttl: float = None,
+                 max_bytes: int = None, memory_size: int = 1000):
+        self.path = path or Config.SOCIAL_CACHE_DB_PATH
+        self.directory = directory or Config.SOCIAL_CACHE_DIR
+        self.ttl = ttl or Config.SOCIAL_CACHE_TTL
+        self.max_bytes = max_bytes or Config.SOCIAL_CACHE_MAX_MB * 1024 * 1024
+        self.memory_size = memory_size
+        self._memory: "OrderedDict[str, SocialArtifact]" = OrderedDict()
+        self._resolved: "OrderedDict[str, str]" = OrderedDict()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+        self.stats = {"hits": 0, "misses": 0, "expired": 0, "stored": 0, "evicted": 0, "short_links_resolved": 0}
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS social_artifacts (
+                    canonical_id TEXT PRIMARY KEY,
+                    filepath TEXT,
+                    size INTEGER NOT NULL DEFAULT 0,
+                    meta TEXT,
+                    file_id TEXT,
+                    file_unique_id TEXT,
+                    created_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_social_artifacts_access ON social_artifacts (last_access)")
+            self._conn = conn
+        return self._conn
+
+    async def _run(self, fn, *args):
+        def locked():
+            with self._lock:
+                return fn(self._connect(), *args)
+        return await asyncio.to_thread(locked)
+
+    def _remember_in_memory(self, artifact: SocialArtifact):
+        self._memory[artifact.canonical_id] = artifact
+        self._memory.move_to_end(artifact.canonical_id)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    async def canonicalize(self, url: str) -> str:
+        """ID canónico de un enlace; los enlaces cortos se resuelven una vez y se memorizan"""
+        if not is_short_link(url):
+            return canonical_id(url)
+
+        key = canonical_url(url)
+        resolved = self._resolved.get(key)
+        if resolved is None:
+            try:
+                resolved = canonical_id(await resolve_short_url(url))
+                self.stats["short_links_resolved"] += 1
+            except Exception as e:
+                logger.warning(f"⚠️ No se pudo resolver el enlace corto {url}: {e}")
+                return key  # Sin memorizar: se reintenta en el próximo envío
+            self._resolved[key] = resolved
+            while len(self._resolved) > self.memory_size:
+                self._resolved.popitem(last=False)
+        else:
+            self._resolved.move_to_end(key)
+        return resolved
+
+    def _is_fresh(self, artifact: SocialArtifact, now: float) -> bool:
+        return now - artifact.created_at < self.ttl
+
+    async def lookup(self, canonical: str) -> Optional[SocialArtifact]:
+        """Entrada vigente del video (con archivo en disco, file_id o ambos) o None"""
+        if not Config.USE_SOCIAL_CACHE:
+            return None
+        now = time.time()
+        artifact = self._memory.get(canonical)
+        if artifact is None:
+            def op(conn):
+                return conn.execute(
+                    "SELECT canonical_id, filepath, size, meta, file_id, file_unique_id, created_at, last_access "
+                    "FROM social_artifacts WHERE canonical_id = ?", (canonical,)
+                ).fetchone()
+            try:
+                row = await self._run(op)
+            except Exception as e:
+                logger.warning(f"⚠️ Caché de videos sociales no disponible: {e}")
+                row = None
+            if row is not None:
+                artifact = SocialArtifact(row[0], row[1], row[2], json.loads(row[3]) if row[3] else {},
+                                          row[4], row[5], row[6], row[7])
+
+        if artifact is None:
+            self.stats["misses"] += 1
+            return None
+        if not self._is_fresh(artifact, now):
+            self.stats["expired"] += 1
+            await self._delete(artifact)
+            return None
+        if artifact.filepath and not os.path.exists(artifact.filepath):
+            artifact.filepath, artifact.size = None, 0
+        if not artifact.filepath and not artifact.file_id:
+            self.stats["misses"] += 1
+            await self._delete(artifact)
+            return None
+
+        artifact.last_access = now
+        self._remember_in_memory(artifact)
+        self.stats["hits"] += 1
+        try:
+            await self._run(lambda conn: conn.execute(
+                "UPDATE social_artifacts SET last_access = ?, filepath = ?, size = ? WHERE canonical_id = ?",
+                (now, artifact.filepath, artifact.size, canonical)
+            ))
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudo actualizar la caché de videos sociales: {e}")
+        return artifact
+
+    def _artifact_path(self, canonical: str, filepath: str) -> str:
+        extension = os.path.splitext(filepath)[1] or ".mp4"
+        safe_name = re.sub(r"[^A-Za-z0-9_-]+", "_", canonical)[:150]
+        return os.path.join(self.directory, f"{safe_name}{extension}")
+
+    async def store(self, canonical: str, result: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Mueve el archivo descargado a la caché y registra la entrada
+
+        Returns:
+            El resultado con la nueva ruta y 'cached': True (el archivo pasa a ser de la caché: no se borra tras enviarlo)
+        """
+        if not Config.USE_SOCIAL_CACHE or not result.get('success') or not result.get('filepath'):
+            return result
+
+        target = self._artifact_path(canonical, result['filepath'])
+
+        def move():
+            os.makedirs(self.directory, exist_ok=True)
+            if os.path.abspath(result['filepath']) != os.path.abspath(target):
+                shutil.move(result['filepath'], target)
+            return os.path.getsize(target)
+
+        size = await asyncio.to_thread(move)
+        meta = {k: result.get(k) for k in ('title', 'duration', 'platform', 'method') if result.get(k) is not None}
+        meta['file_size'] = size
+        now = time.time()
+        previous = self._memory.get(canonical)
+        artifact = SocialArtifact(canonical, target, size, meta,
+                                  previous.file_id if previous else None,
+                                  previous.file_unique_id if previous else None, now, now)
+        self._remember_in_memory(artifact)
+        self.stats["stored"] += 1
+
+        def op(conn):
+            conn.execute(
+                "INSERT INTO social_artifacts (canonical_id, filepath, size, meta, file_id, file_unique_id, created_at, last_access) "
+                "VALUES (?, ?, ?, ?, NULL, NULL, ?, ?) "
+                "ON CONFLICT(canonical_id) DO UPDATE SET filepath = excluded.filepath, size = excluded.size, "
+                "meta = excluded.meta, created_at = excluded.created_at, last_access = excluded.last_access",
+                (canonical, target, size, json.dumps(meta), now, now)
+            )
+        try:
+            await self._run(op)
+            await self.evict()
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudo guardar el video en la caché social: {e}")
+
+        logger.info(f"💾 Video social en caché: {canonical} ({size:,} bytes)")
+        return {**result, 'filepath': target, 'file_size': size, 'cached': True, 'canonical_id': canonical}
+
+    async def remember_file_id(self, canonical: Optional[str], file_id: Optional[str],
+                               file_unique_id: Optional[str] = None, meta: Optional[Dict[str, Any]] = None):
+        """Asocia el file_id del primer envío al video (crea la entrada si no había archivo en caché)"""
+        if not Config.USE_SOCIAL_CACHE or not canonical or not file_id:
+            return
+        now = time.time()
+        artifact = self._memory.get(canonical)
+        if artifact is not None:
+            artifact.file_id, artifact.file_unique_id = file_id, file_unique_id
+            artifact.meta = artifact.meta or meta or {}
+        else:
+            self._remember_in_memory(SocialArtifact(canonical, None, 0, meta or {}, file_id, file_unique_id, now, now))
+
+        def op(conn):
+            conn.execute(
+                "INSERT INTO social_artifacts (canonical_id, filepath, size, meta, file_id, file_unique_id, created_at, last_access) "
+                "VALUES (?, NULL, 0, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(canonical_id) DO UPDATE SET file_id = excluded.file_id, "
+                "file_unique_id = excluded.file_unique_id, last_access = excluded.last_access",
+                (canonical, json.dumps(meta or {}), file_id, file_unique_id, now, now)
+            )
+        try:
+            await self._run(op)
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudo guardar el file_id en la caché social: {e}")
+
+    async def forget_file_id(self, canonical: str):
+        """Telegram ya no acepta el file_id guardado: se conserva el archivo (si lo hay) para volver a subirlo"""
+        artifact = self._memory.get(canonical)
+        if artifact is not None:
+            artifact.file_id = artifact.file_unique_id = None
+        try:
+            await self._run(lambda conn: conn.execute(
+                "UPDATE social_artifacts SET file_id = NULL, file_unique_id = NULL WHERE canonical_id = ?", (canonical,)
+            ))
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudo actualizar la caché social: {e}")
+
+    async def _delete(self, artifact: SocialArtifact):
+        self._memory.pop(artifact.canonical_id, None)
+        if artifact.filepath:
+            await asyncio.to_thread(_remove_quietly, artifact.filepath)
+        try:
+            await self._run(lambda conn: conn.execute(
+                "DELETE FROM social_artifacts WHERE canonical_id = ?", (artifact.canonical_id,)
+            ))
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudo eliminar la entrada de la caché social: {e}")
+
+    async def evict(self):
+        """Elimina las entradas caducadas y, si el disco supera max_bytes, los archivos menos usados"""
+        now = time.time()
+
+        def op(conn):
+            expired = conn.execute(
+                "SELECT canonical_id, filepath FROM social_artifacts WHERE created_at < ?", (now - self.ttl,)
+            ).fetchall()
+            conn.execute("DELETE FROM social_artifacts WHERE created_at < ?", (now - self.ttl,))
+
+            over_budget = []
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM social_artifacts WHERE filepath IS NOT NULL").fetchone()[0]
+            if total > self.max_bytes:
+                for canonical, filepath, size in conn.execute(
+                    "SELECT canonical_id, filepath, size FROM social_artifacts WHERE filepath IS NOT NULL ORDER BY last_access"
+                ).fetchall():
+                    if total <= self.max_bytes:
+                        break
+                    over_budget.append((canonical, filepath))
+                    total -= size
+                # El file_id sigue siendo válido: se conserva la entrada sin archivo
+                conn.executemany(
+                    "UPDATE social_artifacts SET filepath = NULL, size = 0 WHERE canonical_id = ?",
+                    [(canonical,) for canonical, _ in over_budget]
+                )
+            return expired, over_budget
+
+        expired, over_budget = await self._run(op)
+        for canonical, filepath in expired:
+            self._memory.pop(canonical, None)
+        for canonical, filepath in over_budget:
+            artifact = self._memory.get(canonical)
+            if artifact is not None:
+                artifact.filepath, artifact.size = None, 0
+        paths = [filepath for _, filepath in expired + over_budget if filepath]
+        if paths:
+            await asyncio.to_thread(lambda: [_remove_quietly(path) for path in paths])
+            self.stats["evicted"] += len(paths)
+            logger.info(f"🧹 Caché social: {len(expired)} caducados, {len(over_budget)} archivos expulsados por tamaño")
+
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = self.stats["hits"] + self.stats["misses"] + self.stats["expired"]
+        return {
+            **self.stats,
+            "entries_in_memory": len(self._memory),
+            "hit_rate": round(self.stats["hits"] / lookups, 3) if lookups else 0.0,
+        }
+
+    async def close(self):
+        def op():
+            with self._lock:
+                if self._conn is not None:
+                    self._conn.close()
+                    self._conn = None
+        await asyncio.to_thread(op)
+
+
+def _remove_quietly(filepath: str):
+    try:
+        os.remove(filepath)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning(f"⚠️ No se pudo eliminar {filepath}: {e}")
+
+
+# Instancia global de la caché
+social_cache = SocialCache()
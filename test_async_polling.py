@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+Test de carga para el motor de polling async (async_polling.py)
+Verifica que N generaciones concurrentes no se serializan en el event loop
+"""
+import asyncio
+import logging
+import sys
+import time
+
+sys.path.append('.')
+
+# Configurar logging
+logging.basicConfig(level=logging.WARNING, format='%(levelname)s: %(message)s')
+
+POLLS_UNTIL_DONE = 5
+POLL_INTERVAL = 0.05
+CONCURRENT_JOBS = 20
+
+
+class FakeWavespeedAPI:
+    """API simulada: cada predicción pasa a 'completed' tras N consultas"""
+
+    def __init__(self, polls_until_done: int = POLLS_UNTIL_DONE, fail_ids=None, latency: float = 0.01):
+        self.polls_until_done = polls_until_done
+        self.fail_ids = set(fail_ids or [])
+        self.latency = latency
+        self.calls = {}
+
+    async def get_video_status(self, request_id: str):
+        await asyncio.sleep(self.latency)  # Latencia de red simulada
+        self.calls[request_id] = self.calls.get(request_id, 0) + 1
+
+        if request_id in self.fail_ids:
+            return {"id": request_id, "status": "failed", "error": "NSFW content"}
+        if self.calls[request_id] < self.polls_until_done:
+            return {"id": request_id, "status": "processing", "outputs": []}
+        return {"id": request_id, "status": "completed", "outputs": [f"https://cdn.example.com/{request_id}.mp4"]}
+
+
+async def test_concurrent_jobs_do_not_serialize():
+    """N trabajos concurrentes deben tardar ~lo mismo que uno solo"""
+    print(f"🧪 Probando {CONCURRENT_JOBS} generaciones concurrentes...")
+
+    try:
+        from async_polling import wait_for_prediction, fixed_polling_interval
+
+        api = FakeWavespeedAPI()
+        interval_fn = fixed_polling_interval(POLL_INTERVAL)
+
+        start = time.monotonic()
+        await wait_for_prediction(api, "single", interval_fn=interval_fn, max_attempts=20, use_tracker=False)
+        single_elapsed = time.monotonic() - start
+
+        start = time.monotonic()
+        results = await asyncio.gather(*[
+            wait_for_prediction(api, f"job_{i}", interval_fn=interval_fn, max_attempts=20, use_tracker=False)
+            for i in range(CONCURRENT_JOBS)
+        ])
+        concurrent_elapsed = time.monotonic() - start
+
+        serialized_estimate = single_elapsed * CONCURRENT_JOBS
+        print(f"   Un trabajo: {single_elapsed:.2f}s")
+        print(f"   {CONCURRENT_JOBS} trabajos concurrentes: {concurrent_elapsed:.2f}s")
+        print(f"   Estimado si se serializaran: {serialized_estimate:.2f}s")
+
+        assert all(r["status"] == "completed" for r in results)
+        assert concurrent_elapsed < single_elapsed * 3, "Los trabajos se están serializando"
+        print("✅ Las generaciones concurrentes no se bloquean entre sí")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en test de concurrencia: {e}")
+        return False
+
+
+async def test_event_loop_stays_responsive():
+    """El event loop debe seguir atendiendo otras tareas durante el polling"""
+    print("🧪 Probando que el event loop sigue respondiendo durante el polling...")
+
+    try:
+        from async_polling import wait_for_prediction, fixed_polling_interval
+
+        api = FakeWavespeedAPI(polls_until_done=10)
+        ticks = []
+
+        async def heartbeat():
+            # Simula otro update de Telegram que llega mientras se hace polling
+            for _ in range(10):
+                ticks.append(time.monotonic())
+                await asyncio.sleep(0.02)
+
+        await asyncio.gather(
+            wait_for_prediction(api, "busy", interval_fn=fixed_polling_interval(POLL_INTERVAL), max_attempts=20, use_tracker=False),
+            heartbeat()
+        )
+
+        max_gap = max(b - a for a, b in zip(ticks, ticks[1:]))
+        print(f"   Máximo hueco entre heartbeats: {max_gap * 1000:.0f}ms")
+        assert max_gap < 0.2, "El event loop estuvo bloqueado"
+        print("✅ El event loop no se bloquea")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en test de responsividad: {e}")
+        return False
+
+
+async def test_failure_and_timeout():
+    """Las predicciones fallidas y los timeouts deben lanzar excepciones específicas"""
+    print("🧪 Probando manejo de fallos y timeouts...")
+
+    try:
+        from async_polling import (
+            wait_for_prediction, fixed_polling_interval,
+            PredictionFailedError, PredictionTimeoutError
+        )
+
+        api = FakeWavespeedAPI(polls_until_done=100, fail_ids=["bad"])
+        interval_fn = fixed_polling_interval(0.01)
+
+        try:
+            await wait_for_prediction(api, "bad", interval_fn=interval_fn, max_attempts=5, use_tracker=False)
+            print("❌ No se lanzó PredictionFailedError")
+            return False
+        except PredictionFailedError as e:
+            assert e.error == "NSFW content"
+            print("✅ PredictionFailedError lanzado correctamente")
+
+        try:
+            await wait_for_prediction(api, "slow", interval_fn=interval_fn, max_attempts=5, use_tracker=False)
+            print("❌ No se lanzó PredictionTimeoutError")
+            return False
+        except PredictionTimeoutError as e:
+            assert e.last_status == "processing"
+            assert api.calls["slow"] == 5
+            print("✅ PredictionTimeoutError lanzado correctamente")
+
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en test de fallos: {e}")
+        return False
+
+
+async def test_wrapped_response_is_normalized():
+    """Respuestas con 'data' anidado (cliente sync) también deben funcionar"""
+    print("🧪 Probando normalización de respuestas...")
+
+    try:
+        from async_polling import normalize_prediction, calculate_smart_polling_interval
+
+        wrapped = {"code": 200, "data": {"status": "completed", "outputs": ["x"]}}
+        assert normalize_prediction(wrapped)["status"] == "completed"
+        assert normalize_prediction({"status": "processing"})["status"] == "processing"
+        assert normalize_prediction(None) == {}
+
+        assert calculate_smart_polling_interval(0, 240, 0.5) == 0.5
+        assert calculate_smart_polling_interval(200, 240, 0.5) == 10.0
+        print("✅ Normalización e intervalos correctos")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en test de normalización: {e}")
+        return False
+
+
+async def main():
+    """Función principal de testing"""
+    print("🚀 TEST DE CARGA - MOTOR DE POLLING ASYNC")
+    print("=" * 60)
+
+    tests = [
+        test_concurrent_jobs_do_not_serialize,
+        test_event_loop_stays_responsive,
+        test_failure_and_timeout,
+        test_wrapped_response_is_normalized
+    ]
+
+    passed = 0
+    for test in tests:
+        if await test():
+            passed += 1
+
+    print("\n" + "=" * 60)
+    print(f"📊 RESULTADOS: {passed}/{len(tests)} tests pasaron")
+    return passed == len(tests)
+
+
+if __name__ == "__main__":
+    success = asyncio.run(main())
+    if not success:
+        sys.exit(1)
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+Benchmark del pool de conexiones de AsyncWavespeedAPI
+Compara handshakes y latencia p50/p99 entre una sesión por petición (antes) y la sesión compartida (después)
+"""
+import asyncio
+import logging
+import statistics
+import sys
+import time
+
+sys.path.append('.')
+
+from aiohttp import web
+import aiohttp
+
+# Configurar logging
+logging.basicConfig(level=logging.WARNING, format='%(levelname)s: %(message)s')
+
+TOTAL_REQUESTS = 300
+CONCURRENCY = 20
+
+
+class FakeWavespeedServer:
+    """Servidor local que imita /api/v3/predictions/{id}/result y cuenta conexiones nuevas"""
+
+    def __init__(self):
+        self.connections = set()
+        self.runner = None
+        self.url = None
+
+    async def handle_status(self, request):
+        # Cada conexión TCP nueva llega desde un puerto efímero distinto
+        self.connections.add(request.transport.get_extra_info('peername'))
+        request_id = request.match_info['request_id']
+        return web.json_response({
+            "code": 200,
+            "data": {"id": request_id, "status": "processing", "outputs": []}
+        })
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get('/api/v3/predictions/{request_id}/result', self.handle_status)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}"
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def run_load(request_fn):
+    """Ejecuta TOTAL_REQUESTS peticiones con CONCURRENCY en paralelo y retorna latencias en ms"""
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+    latencies = []
+
+    async def one(i):
+        async with semaphore:
+            start = time.perf_counter()
+            await request_fn(f"req_{i}")
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    await asyncio.gather(*[one(i) for i in range(TOTAL_REQUESTS)])
+    return latencies
+
+
+async def test_shared_session_reuses_connections():
+    """La sesión compartida debe reutilizar conexiones en lugar de abrir una por petición"""
+    print(f"🧪 Benchmark: {TOTAL_REQUESTS} consultas de estado, concurrencia {CONCURRENCY}")
+
+    try:
+        from async_wavespeed import AsyncWavespeedAPI, close_shared_session
+
+        server = FakeWavespeedServer()
+        await server.start()
+
+        api = AsyncWavespeedAPI()
+        api.base_url = server.url
+
+        # Antes: una ClientSession nueva por petición (comportamiento anterior)
+        async def per_request_session(request_id):
+            async with aiohttp.ClientSession(headers=api.headers) as session:
+                async with session.get(f"{server.url}/api/v3/predictions/{request_id}/result") as response:
+                    response.raise_for_status()
+                    await response.json()
+
+        before = await run_load(per_request_session)
+        before_connections = len(server.connections)
+
+        # Después: AsyncWavespeedAPI con la sesión compartida
+        server.connections.clear()
+        after = await run_load(api.get_video_status)
+        after_connections = len(server.connections)
+
+        await close_shared_session()
+        await server.stop()
+
+        print(f"   {'':<22}{'handshakes':>12}{'p50 (ms)':>12}{'p99 (ms)':>12}")
+        print(f"   {'Sesión por petición':<22}{before_connections:>12}{percentile(before, 50):>12.2f}{percentile(before, 99):>12.2f}")
+        print(f"   {'Sesión compartida':<22}{after_connections:>12}{percentile(after, 50):>12.2f}{percentile(after, 99):>12.2f}")
+        print(f"   Media: {statistics.mean(before):.2f}ms -> {statistics.mean(after):.2f}ms")
+
+        assert before_connections == TOTAL_REQUESTS, "La línea base debería abrir una conexión por petición"
+        assert after_connections <= CONCURRENCY, f"Demasiadas conexiones con el pool: {after_connections}"
+        print("✅ La sesión compartida reutiliza conexiones keep-alive")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en benchmark de conexiones: {e}")
+        return False
+
+
+async def test_session_lifecycle():
+    """La sesión se crea bajo demanda, se reutiliza y se recrea tras cerrarla"""
+    print("🧪 Probando ciclo de vida de la sesión compartida...")
+
+    try:
+        from async_wavespeed import get_shared_session, close_shared_session
+        from config import Config
+
+        first = await get_shared_session()
+        second = await get_shared_session()
+        assert first is second, "La sesión no se está reutilizando"
+        assert first.connector.limit == Config.WAVESPEED_POOL_LIMIT
+        assert first.connector.limit_per_host == Config.WAVESPEED_POOL_LIMIT_PER_HOST
+
+        await close_shared_session()
+        assert first.closed, "La sesión no se cerró"
+
+        third = await get_shared_session()
+        assert third is not first and not third.closed
+        await close_shared_session()
+
+        print("✅ Ciclo de vida correcto (creación, reutilización, cierre)")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en test de ciclo de vida: {e}")
+        return False
+
+
+async def main():
+    """Función principal de testing"""
+    print("🚀 BENCHMARK - POOL DE CONEXIONES WAVESPEED")
+    print("=" * 60)
+
+    tests = [
+        test_shared_session_reuses_connections,
+        test_session_lifecycle
+    ]
+
+    passed = 0
+    for test in tests:
+        if await test():
+            passed += 1
+
+    print("\n" + "=" * 60)
+    print(f"📊 RESULTADOS: {passed}/{len(tests)} tests pasaron")
+    return passed == len(tests)
+
+
+if __name__ == "__main__":
+    success = asyncio.run(main())
+    if not success:
+        sys.exit(1)
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Test del pool de sesiones curl_cffi (curl_session_pool.py)
+Verifica la reutilización de la sesión (y su cookie jar) por plataforma e impersonación,
+el límite de peticiones simultáneas, la expulsión de sesiones inactivas y el cierre
+"""
+import asyncio
+import sys
+import time
+import logging
+
+sys.path.append('.')
+
+# Configurar logging
+logging.basicConfig(level=logging.WARNING, format='%(levelname)s: %(message)s')
+
+
+class FakeSession:
+    """Sustituto de curl_cffi.requests.AsyncSession: cuenta handshakes y guarda cookies"""
+
+    def __init__(self, impersonate, headers, max_clients):
+        self.impersonate = impersonate
+        self.headers = headers
+        self.cookies = {}
+        self.handshakes = 0
+        self.active = 0
+        self.peak = 0
+        self.closed = False
+
+    async def get(self, url, **kwargs):
+        if self.closed:
+            raise RuntimeError("Sesión cerrada")
+        if not self.handshakes:
+            self.handshakes += 1  # Solo la primera petición abre la conexión TLS
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        await asyncio.sleep(0.02)
+        self.active -= 1
+        self.cookies.setdefault("tt_webid", "abc")
+        return url
+
+    async def close(self):
+        self.closed = True
+
+
+def make_pool(**kwargs):
+    from curl_session_pool import CurlSessionPool
+    return CurlSessionPool(session_factory=FakeSession, **kwargs)
+
+
+async def test_session_reuse():
+    """Página y video de varios enlaces comparten una sesión por plataforma e impersonación"""
+    print("🧪 Probando reutilización de sesiones...")
+
+    try:
+        pool = make_pool(idle_ttl=60, max_concurrent=4)
+        sessions = []
+        for i in range(3):
+            async with pool.session("TikTok", "safari18_ios", {'Accept-Language': 'en-US'}) as session:
+                await session.get(f"https://www.tiktok.com/@u/video/{i}")
+                await session.get(f"https://v16.tiktokcdn.com/{i}.mp4")
+                sessions.append(session)
+        async with pool.session("Instagram", "chrome124") as other:
+            await other.get("https://www.instagram.com/reel/ABC")
+
+        tiktok = sessions[0]
+        assert all(session is tiktok for session in sessions) and other is not tiktok
+        assert tiktok.handshakes == 1 and tiktok.cookies == {"tt_webid": "abc"}
+        assert tiktok.impersonate == "safari18_ios" and tiktok.headers == {'Accept-Language': 'en-US'}
+        stats = pool.get_stats()
+        assert stats["created"] == 2 and stats["reused"] == 2, stats
+        await pool.close()
+        assert tiktok.closed and other.closed
+
+        print(f"✅ 6 peticiones TikTok con 1 handshake; stats: {stats}")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en test de reutilización: {e}")
+        return False
+
+
+async def test_concurrency_cap():
+    """Nunca más de max_concurrent usos simultáneos de una sesión"""
+    print("🧪 Probando límite de uso simultáneo...")
+
+    try:
+        pool = make_pool(idle_ttl=60, max_concurrent=2)
+        sessions = []
+
+        async def fetch(i):
+            async with pool.session("X/Twitter", "chrome124") as session:
+                sessions.append(session)
+                await session.get(f"https://x.com/u/status/{i}")
+
+        await asyncio.gather(*(fetch(i) for i in range(6)))
+        session = sessions[0]
+        stats = pool.get_stats()
+        await pool.close()
+
+        assert session.peak == 2, f"Pico de uso {session.peak}"
+        assert stats["waits"] >= 1 and stats["created"] == 1, stats
+        print(f"✅ 6 enlaces simultáneos, pico de uso {session.peak}; esperas: {stats['waits']}")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en test de concurrencia: {e}")
+        return False
+
+
+async def test_idle_eviction():
+    """Las sesiones inactivas se cierran; las que están en uso se conservan"""
+    print("🧪 Probando expulsión de sesiones inactivas...")
+
+    try:
+        pool = make_pool(idle_ttl=0.05, max_concurrent=2)
+        async with pool.session("Reddit", "chrome124") as idle:
+            await idle.get("https://www.reddit.com/r/x/comments/1")
+
+        async with pool.session("Facebook", "chrome124") as busy:
+            await asyncio.sleep(0.1)
+            evicted = await pool.evict_idle()  # Reddit lleva 0.1s inactiva; Facebook está en uso
+            assert evicted == 1 and idle.closed and not busy.closed
+
+        async with pool.session("Reddit", "chrome124") as fresh:
+            await fresh.get("https://www.reddit.com/r/x/comments/2")
+        stats = pool.get_stats()
+        await pool.close()
+
+        assert fresh is not idle and stats["evicted"] == 1 and stats["created"] == 3, stats
+        print(f"✅ Sesión inactiva cerrada y recreada bajo demanda; stats: {stats}")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en test de expulsión: {e}")
+        return False
+
+
+async def main():
+    """Función principal de testing"""
+    print("🚀 TEST DEL POOL DE SESIONES CURL_CFFI")
+    print("=" * 60)
+
+    tests = [
+        test_session_reuse,
+        test_concurrency_cap,
+        test_idle_eviction
+    ]
+
+    passed = 0
+    for test in tests:
+        if await test():
+            passed += 1
+
+    print("\n" + "=" * 60)
+    print(f"📊 RESULTADOS: {passed}/{len(tests)} tests pasaron")
+    return passed == len(tests)
+
+
+if __name__ == "__main__":
+    success = asyncio.run(main())
+    if not success:
+        sys.exit(1)
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+Test de la cola de descargas de redes sociales (download_service.py) y de yt-dlp como subproceso async
+Verifica los límites de concurrencia global y por plataforma, la posición en cola, la deduplicación
+por URL canónica (single-flight), el borrado compartido del archivo y que el event loop no se bloquea
+"""
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+import logging
+
+sys.path.append('.')
+
+# Configurar logging
+logging.basicConfig(level=logging.WARNING, format='%(levelname)s: %(message)s')
+
+
+def platform_of(url):
+    return "TikTok" if "tiktok" in url else "Instagram"
+
+
+async def test_concurrency_limits():
+    """Nunca más de max_concurrent descargas en total ni de per_platform por plataforma"""
+    print("🧪 Probando límites de concurrencia y cola...")
+
+    try:
+        from download_service import DownloadService, QUEUED
+
+        active = {"total": 0, "TikTok": 0, "Instagram": 0}
+        peaks = {"total": 0, "TikTok": 0, "Instagram": 0}
+
+        async def fake_download(url, platform, report):
+            active["total"] += 1
+            active[platform] += 1
+            for key in ("total", platform):
+                peaks[key] = max(peaks[key], active[key])
+            await report(50.0, "fake")
+            await asyncio.sleep(0.05)
+            active["total"] -= 1
+            active[platform] -= 1
+            return {'success': True, 'filepath': f"/tmp/{url[-1]}.mp4", 'platform': platform}
+
+        service = DownloadService(fake_download, platform_of, max_concurrent=3, per_platform=2, max_queue=0)
+        positions = []
+
+        async def on_progress(progress):
+            if progress.stage == QUEUED:
+                positions.append(progress.position)
+
+        urls = [f"https://www.tiktok.com/@u/video/{i}" for i in range(5)] + \
+               [f"https://www.instagram.com/reel/{i}" for i in range(3)]
+        start = time.perf_counter()
+        results = await asyncio.gather(*(service.download(url, on_progress) for url in urls))
+        elapsed = time.perf_counter() - start
+
+        assert all(result['success'] for result in results)
+        assert peaks["total"] <= 3 and peaks["TikTok"] <= 2 and peaks["Instagram"] <= 2, peaks
+        assert peaks["total"] == 3, f"No se aprovechó la concurrencia: {peaks}"
+        assert max(positions) >= len(urls) - 3 and service.get_stats()["waiting"] == 0, positions
+        print(f"✅ 8 descargas en {elapsed * 1000:.0f} ms con picos {peaks}; posición máxima en cola {max(positions)}")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en test de concurrencia: {e}")
+        return False
+
+
+async def test_single_flight_and_release():
+    """Variantes de la misma URL comparten una descarga; el archivo se borra al liberarlo el último"""
+    print("🧪 Probando deduplicación (single-flight) y borrado compartido...")
+
+    try:
+        from download_service import DownloadService, canonical_url
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            filepath = os.path.join(tmp_dir, "social_video.mp4")
+            calls = []
+            cleaned = []
+
+            async def fake_download(url, platform, report):
+                calls.append(url)
+                await asyncio.sleep(0.1)
+                with open(filepath, "wb") as f:
+                    f.write(b"video")
+                return {'success': True, 'filepath': filepath, 'platform': platform}
+
+            def cleanup(path):
+                cleaned.append(path)
+                os.remove(path)
+
+            service = DownloadService(fake_download, platform_of, cleanup_fn=cleanup, max_concurrent=4, per_platform=2)
+            shared_progress = []
+
+            async def on_progress(progress):
+                shared_progress.append(progress.shared)
+
+            variants = [
+                "https://www.instagram.com/reel/ABC/",
+                "https://instagram.com/reel/ABC",
+                "http://m.instagram.com/reel/ABC#comments",
+                "https://WWW.INSTAGRAM.COM/reel/ABC/",
+                "https://www.instagram.com/reel/ABC",
+            ]
+            assert len({canonical_url(url) for url in variants}) == 1
+            results = await asyncio.gather(*(service.download(url, on_progress) for url in variants))
+
+            assert len(calls) == 1, calls
+            assert sum(1 for result in results if result.get('shared')) == 4
+            assert any(shared_progress), "Los coalescidos no recibieron progreso"
+
+            for result in results[:-1]:
+                service.release(result)
+            assert os.path.exists(filepath) and not cleaned, "Archivo borrado antes de que todos lo enviaran"
+            service.release(results[-1])
+            assert cleaned == [filepath] and not os.path.exists(filepath)
+
+        print(f"✅ 5 peticiones -> 1 descarga; stats: {service.get_stats()}")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en test de single-flight: {e}")
+        return False
+
+
+async def test_ytdlp_subprocess_is_async():
+    """yt-dlp corre como subproceso async: progreso en streaming, info JSON y el loop sigue libre"""
+    print("🧪 Probando subproceso async de yt-dlp...")
+
+    try:
+        from bot import VideoDownloader
+        from ytdlp_engine import YtDlpEngine, CLI_PROGRESS_MARKER, CLI_INFO_MARKER
+
+        downloader = VideoDownloader()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            filepath = os.path.join(tmp_dir, "social_video_x.mp4")
+            info = json.dumps({"title": "Gato", "duration": 12.4, "ext": "mp4", "filepath": filepath})
+            # Sustituto de yt-dlp: progreso por stderr (como con --print), espera y la línea de info
+            script = (
+                "import sys, time\n"
+                "for p in (10, 55, 100):\n"
+                f"    print('[download] {CLI_PROGRESS_MARKER} ' + str(p) + '.0%', file=sys.stderr, flush=True)\n"
+                "    time.sleep(0.1)\n"
+                f"open({filepath!r}, 'wb').write(b'0' * 20000)\n"
+                f"print({CLI_INFO_MARKER + info!r}, flush=True)\n"
+            )
+            percents = []
+
+            async def progress(percent, detail):
+                percents.append(percent)
+
+            max_lag = 0.0
+            done = False
+
+            async def ticker():
+                nonlocal max_lag
+                while not done:
+                    start = time.perf_counter()
+                    await asyncio.sleep(0.005)
+                    max_lag = max(max_lag, time.perf_counter() - start - 0.005)
+
+            ticker_task = asyncio.create_task(ticker())
+            returncode, parsed, stderr = await YtDlpEngine.run_cli([sys.executable, "-c", script], 10, progress)
+            done = True
+            await ticker_task
+            result = downloader._ytdlp_result(parsed, "TikTok", "yt-dlp")
+
+            # Un yt-dlp colgado se mata al vencer el timeout
+            start = time.perf_counter()
+            try:
+                await YtDlpEngine.run_cli([sys.executable, "-c", "import time; time.sleep(10)"], 0.2)
+                raise AssertionError("No se aplicó el timeout")
+            except asyncio.TimeoutError:
+                killed_after = time.perf_counter() - start
+
+        assert returncode == 0 and percents == [10.0, 55.0, 100.0], (returncode, percents, stderr)
+        assert result['success'] and result['filepath'] == filepath and result['duration'] == 12
+        assert result['file_size'] == 20000 and result['title'] == "Gato"
+        assert max_lag < 0.05, f"Event loop bloqueado {max_lag * 1000:.0f} ms"
+        assert killed_after < 1
+        print(f"✅ Progreso {percents}, retraso máx. del loop {max_lag * 1000:.1f} ms, timeout en {killed_after:.2f}s")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en test de subproceso async: {e}")
+        return False
+
+
+async def main():
+    """Función principal de testing"""
+    print("🚀 TEST DE LA COLA DE DESCARGAS DE REDES SOCIALES")
+    print("=" * 60)
+
+    tests = [
+        test_concurrency_limits,
+        test_single_flight_and_release,
+        test_ytdlp_subprocess_is_async
+    ]
+
+    passed = 0
+    for test in tests:
+        if await test():
+            passed += 1
+
+    print("\n" + "=" * 60)
+    print(f"📊 RESULTADOS: {passed}/{len(tests)} tests pasaron")
+    return passed == len(tests)
+
+
+if __name__ == "__main__":
+    success = asyncio.run(main())
+    if not success:
+        sys.exit(1)
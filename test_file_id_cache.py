@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+Test del índice de file_id de Telegram (file_id_cache.py)
+Verifica que un video se sube una sola vez y las entregas siguientes usan el file_id
+"""
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+from types import SimpleNamespace
+
+sys.path.append('.')
+
+# Configurar logging
+logging.basicConfig(level=logging.WARNING, format='%(levelname)s: %(message)s')
+
+
+class FakeBot:
+    """Bot de Telegram simulado: registra subidas y envíos por file_id"""
+
+    def __init__(self):
+        self.uploads = []
+        self.file_id_sends = []
+        self.rejected = set()
+
+    async def send_video(self, chat_id, video, **kwargs):
+        from telegram.error import BadRequest
+
+        if isinstance(video, str):
+            if video in self.rejected:
+                raise BadRequest("Wrong file identifier/http url specified")
+            self.file_id_sends.append((chat_id, video))
+            file_id = video
+        else:
+            data = video.read()
+            self.uploads.append((chat_id, len(data)))
+            file_id = f"BAAC_{len(self.uploads)}"
+        return SimpleNamespace(video=SimpleNamespace(file_id=file_id, file_unique_id=f"u_{file_id}"))
+
+
+def write_video(directory, name, content=b"\x00\x00\x00\x18ftypmp42" + b"x" * 4096):
+    path = os.path.join(directory, name)
+    with open(path, "wb") as f:
+        f.write(content)
+    return path
+
+
+async def test_upload_once_then_file_id(tmp_dir):
+    """El primer envío sube el archivo; /lastvideo, reintentos y otro chat usan el file_id"""
+    print("🧪 Probando subida única y reenvíos por file_id...")
+
+    try:
+        from file_id_cache import FileIdCache, send_video_cached, url_key
+
+        cache = FileIdCache(path=os.path.join(tmp_dir, "once.db"))
+        bot = FakeBot()
+        video = write_video(tmp_dir, "output_once.mp4")
+        keys = [url_key("https://cdn.wavespeed.ai/out/abc.mp4")]
+
+        await send_video_cached(bot, 1, filepath=video, keys=keys, cache=cache, caption="a")
+        await send_video_cached(bot, 1, filepath=video, keys=keys, cache=cache, caption="retry")
+        await send_video_cached(bot, 2, filepath=video, cache=cache)  # Solo el hash de contenido
+
+        # El archivo local ya se limpió: la URL basta para reenviar
+        os.remove(video)
+        await send_video_cached(bot, 3, keys=keys, cache=cache)
+        await cache.close()
+
+        print(f"   Subidas: {len(bot.uploads)}, envíos por file_id: {len(bot.file_id_sends)}")
+        assert len(bot.uploads) == 1
+        assert [chat for chat, _ in bot.file_id_sends] == [1, 2, 3]
+        assert all(file_id == "BAAC_1" for _, file_id in bot.file_id_sends)
+        print("✅ Un video, una subida")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en test de subida única: {e}")
+        return False
+
+
+async def test_persists_across_restart(tmp_dir):
+    """El índice vive en disco: tras un reinicio tampoco se vuelve a subir"""
+    print("🧪 Probando persistencia del índice...")
+
+    try:
+        from file_id_cache import FileIdCache, send_video_cached, url_key
+
+        path = os.path.join(tmp_dir, "restart.db")
+        cache = FileIdCache(path=path)
+        bot = FakeBot()
+        video = write_video(tmp_dir, "social.mp4")
+        meta = {"title": "Gato", "platform": "TikTok"}
+        await send_video_cached(bot, 1, filepath=video, keys=[url_key("https://tiktok.com/@a/video/1")],
+                                meta=meta, cache=cache)
+        await cache.close()
+
+        restarted = FileIdCache(path=path)
+        cached = await restarted.lookup([url_key("https://tiktok.com/@a/video/1")])
+        await send_video_cached(bot, 5, keys=[url_key("https://tiktok.com/@a/video/1")], cache=restarted)
+        await restarted.close()
+
+        assert cached is not None and cached.file_id == "BAAC_1" and cached.meta == meta
+        assert len(bot.uploads) == 1 and bot.file_id_sends == [(5, "BAAC_1")]
+        print("✅ file_id y metadatos recuperados tras el reinicio")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en test de persistencia: {e}")
+        return False
+
+
+async def test_rejected_file_id_reuploads(tmp_dir):
+    """Un file_id que Telegram rechaza se olvida y el archivo se vuelve a subir"""
+    print("🧪 Probando file_id inválido...")
+
+    try:
+        from file_id_cache import FileIdCache, send_video_cached, url_key
+
+        cache = FileIdCache(path=os.path.join(tmp_dir, "stale.db"))
+        bot = FakeBot()
+        video = write_video(tmp_dir, "stale.mp4")
+        keys = [url_key("https://cdn.wavespeed.ai/out/stale.mp4")]
+
+        await send_video_cached(bot, 1, filepath=video, keys=keys, cache=cache)
+        bot.rejected.add("BAAC_1")
+        await send_video_cached(bot, 1, filepath=video, keys=keys, cache=cache)
+        cached = await cache.lookup(keys)
+
+        os.remove(video)
+        bot.rejected.add("BAAC_2")
+        try:
+            await send_video_cached(bot, 1, keys=keys, cache=cache)
+            missing_raised = False
+        except FileNotFoundError:
+            missing_raised = True
+        await cache.close()
+
+        assert len(bot.uploads) == 2 and cached.file_id == "BAAC_2"
+        assert missing_raised, "Sin archivo ni file_id válido debe fallar"
+        assert cache.get_stats()["invalidated"] == 2
+        print("✅ file_id inválido reemplazado por una subida nueva")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en test de file_id inválido: {e}")
+        return False
+
+
+async def test_disabled_always_uploads(tmp_dir):
+    """Con USE_FILE_ID_CACHE=false se mantiene el comportamiento anterior"""
+    print("🧪 Probando índice desactivado...")
+
+    try:
+        from config import Config
+        from file_id_cache import FileIdCache, send_video_cached
+
+        cache = FileIdCache(path=os.path.join(tmp_dir, "disabled.db"))
+        bot = FakeBot()
+        video = write_video(tmp_dir, "disabled.mp4")
+
+        enabled = Config.USE_FILE_ID_CACHE
+        Config.USE_FILE_ID_CACHE = False
+        try:
+            for _ in range(2):
+                await send_video_cached(bot, 1, filepath=video, cache=cache)
+        finally:
+            Config.USE_FILE_ID_CACHE = enabled
+        await cache.close()
+
+        assert len(bot.uploads) == 2 and not bot.file_id_sends
+        print("✅ Sin índice cada envío sube el archivo")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en test de índice desactivado: {e}")
+        return False
+
+
+async def main():
+    """Función principal de testing"""
+    print("🚀 TEST DEL ÍNDICE DE FILE_ID")
+    print("=" * 60)
+
+    tests = [
+        test_upload_once_then_file_id,
+        test_persists_across_restart,
+        test_rejected_file_id_reuploads,
+        test_disabled_always_uploads
+    ]
+
+    passed = 0
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for test in tests:
+            if await test(tmp_dir):
+                passed += 1
+
+    print("\n" + "=" * 60)
+    print(f"📊 RESULTADOS: {passed}/{len(tests)} tests pasaron")
+    return passed == len(tests)
+
+
+if __name__ == "__main__":
+    success = asyncio.run(main())
+    if not success:
+        sys.exit(1)
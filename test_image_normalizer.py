@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+"""
+Test del normalizador de imágenes de entrada (image_normalizer.py)
+Verifica orientación EXIF, resolución y aspect ratio de salida, caché por contenido,
+el uso desde handle_image_message y mide TIFF/HEIC grandes con el event loop libre
+"""
+import asyncio
+import io
+import logging
+import os
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+sys.path.append('.')
+
+# Configurar logging
+logging.basicConfig(level=logging.WARNING, format='%(levelname)s: %(message)s')
+
+
+def make_image(width, height, mode="RGB"):
+    """Imagen con contenido (gradiente + formas) para que la codificación no sea trivial"""
+    from PIL import Image, ImageDraw
+
+    image = Image.linear_gradient("L").resize((width, height)).convert(mode)
+    draw = ImageDraw.Draw(image)
+    draw.ellipse((width // 4, height // 4, width // 2, height // 2), fill="red" if mode != "L" else 200)
+    draw.rectangle((width // 2, height // 2, width * 3 // 4, height * 3 // 4), fill="blue" if mode != "L" else 50)
+    return image
+
+
+def encode(image, fmt, **kwargs):
+    buffer = io.BytesIO()
+    image.save(buffer, format=fmt, **kwargs)
+    return buffer.getvalue()
+
+
+async def measure_loop_lag(coro):
+    """Ejecuta coro midiendo el mayor retraso del event loop (ticks de 5 ms)"""
+    max_lag = 0.0
+    done = False
+
+    async def ticker():
+        nonlocal max_lag
+        while not done:
+            start = time.perf_counter()
+            await asyncio.sleep(0.005)
+            max_lag = max(max_lag, time.perf_counter() - start - 0.005)
+
+    ticker_task = asyncio.create_task(ticker())
+    try:
+        result = await coro
+    finally:
+        done = True
+        await ticker_task
+    return result, max_lag
+
+
+async def test_exif_orientation_and_alpha():
+    """La orientación EXIF se aplica y la transparencia se aplana sobre blanco"""
+    print("🧪 Probando orientación EXIF y canal alfa...")
+
+    try:
+        from PIL import Image
+        from image_normalizer import normalize_image_bytes
+
+        # Foto horizontal 1600x1200 con EXIF Orientation=6 (girar 90°): se ve vertical
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        rotated = normalize_image_bytes(encode(make_image(1600, 1200), "JPEG", exif=exif), 480)
+        assert rotated.height > rotated.width, f"EXIF ignorado: {rotated.width}x{rotated.height}"
+        assert (rotated.width, rotated.height) == (480, 853), (rotated.width, rotated.height)
+
+        sticker = Image.new("RGBA", (512, 512), (0, 0, 0, 0))
+        sticker.paste((255, 0, 0, 255), (128, 128, 384, 384))
+        flattened = normalize_image_bytes(encode(sticker, "WEBP"), 480, crop_to_aspect=False)
+        with Image.open(io.BytesIO(flattened.data)) as result:
+            assert result.mode == "RGB" and result.format == "JPEG"
+            assert result.getpixel((5, 5))[0] > 240 and result.getpixel((5, 5))[2] > 240, "Fondo no blanco"
+        print(f"✅ EXIF -> {rotated.width}x{rotated.height}; sticker WEBP+alfa -> JPEG RGB")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en test de EXIF/alfa: {e}")
+        return False
+
+
+async def test_resolution_and_aspect():
+    """Salida al lado corto del modelo y al aspect ratio configurado; nunca se amplía"""
+    print("🧪 Probando resolución y aspect ratio...")
+
+    try:
+        from image_normalizer import normalize_image_bytes, target_box
+
+        assert target_box(720, "16:9", portrait=False) == (1280, 720)
+        assert target_box(480, "16:9", portrait=True) == (480, 853)
+
+        large = normalize_image_bytes(encode(make_image(3000, 3000), "PNG"), 720, "16:9")
+        assert (large.width, large.height) == (1280, 720), (large.width, large.height)
+
+        uncropped = normalize_image_bytes(encode(make_image(3000, 2000), "PNG"), 720, "16:9", crop_to_aspect=False)
+        assert uncropped.height == 720 and abs(uncropped.width / uncropped.height - 1.5) < 0.01
+
+        small = normalize_image_bytes(encode(make_image(400, 400), "PNG"), 720, "16:9")
+        assert small.width <= 400 and small.height <= 400, "Se amplió una imagen pequeña"
+        assert abs(small.width / small.height - 16 / 9) < 0.02
+
+        webp = normalize_image_bytes(encode(make_image(2000, 1125), "BMP"), 480, "16:9", output_format="WEBP")
+        assert webp.format == "WEBP" and webp.extension == "webp" and webp.source_format == "BMP"
+        print(f"✅ 3000x3000 -> {large.width}x{large.height}, 400x400 -> {small.width}x{small.height}")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en test de resolución: {e}")
+        return False
+
+
+async def test_content_cache(tmp_dir):
+    """La misma imagen no se vuelve a procesar (memoria y, tras reiniciar, disco)"""
+    print("🧪 Probando caché por contenido...")
+
+    try:
+        from image_normalizer import ImageNormalizer
+
+        data = encode(make_image(2400, 1600), "TIFF")
+        normalizer = ImageNormalizer(workers=1, directory=tmp_dir)
+        try:
+            path, first = await normalizer.normalize(data, 480)
+            concurrent = await asyncio.gather(*(normalizer.normalize(data, 720) for _ in range(3)))
+            again_path, again = await normalizer.normalize(data, 480)
+        finally:
+            normalizer.shutdown()
+
+        restarted = ImageNormalizer(workers=1, directory=tmp_dir)
+        disk_path, disk = await restarted.normalize(data, 480)
+
+        assert first is not None and again is None and again_path == path and os.path.exists(path)
+        assert len({p for p, _ in concurrent}) == 1 and normalizer.stats["normalized"] == 2
+        assert disk is None and disk_path == path and not restarted.get_stats()["pool_started"]
+        print(f"✅ {normalizer.get_stats()}")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en test de caché: {e}")
+        return False
+
+
+async def test_document_handler_uses_normalized_url(tmp_dir):
+    """Un documento TIFF llega a WaveSpeed como la URL pública de la versión normalizada"""
+    print("🧪 Probando handle_image_message con documento TIFF...")
+
+    try:
+        import bot as bot_module
+        import image_normalizer as image_normalizer_module
+        from config import Config
+        from image_normalizer import ImageNormalizer
+
+        events = []
+        tiff = encode(make_image(3000, 2000), "TIFF")
+
+        class FakeFile:
+            file_path = "documents/file_1.tiff"
+
+            async def download_as_bytearray(self):
+                events.append(("download_bytes", None))
+                return bytearray(tiff)
+
+        class FakeWavespeed:
+            async def generate_video(self, prompt, image_url, model=None):
+                events.append(("generate", image_url))
+                return {"id": "req_doc"}
+
+        async def fake_submit(update, processing_msg, request_id, prompt, **kwargs):
+            events.append(("submit", request_id))
+
+        async def get_file(file_id):
+            return FakeFile()
+
+        async def reply_text(text, **kwargs):
+            return SimpleNamespace(edit_text=reply_text)
+
+        document = SimpleNamespace(file_id="doc_1", mime_type="image/tiff", file_name="scan.tiff", file_size=len(tiff))
+        message = SimpleNamespace(
+            photo=None, document=document, sticker=None, forward_origin=None,
+            caption="a cat jumping", chat=SimpleNamespace(id=1), message_id=11,
+            from_user=SimpleNamespace(id=99), reply_text=reply_text
+        )
+        update = SimpleNamespace(message=message)
+        context = SimpleNamespace(bot=SimpleNamespace(get_file=get_file), user_data={"selected_model": "ultra_fast"})
+
+        normalizer = ImageNormalizer(workers=1, directory=tmp_dir)
+        originals = (bot_module.AsyncWavespeedAPI, bot_module.submit_telegram_video_job, bot_module.image_normalizer,
+                     Config.ALLOWED_USER_ID, Config.ARCHIVE_INPUT_IMAGES, Config.PUBLIC_BASE_URL)
+        bot_module.AsyncWavespeedAPI = FakeWavespeed
+        bot_module.submit_telegram_video_job = fake_submit
+        bot_module.image_normalizer = image_normalizer_module.image_normalizer = normalizer
+        Config.ALLOWED_USER_ID = None
+        Config.ARCHIVE_INPUT_IMAGES = True
+        Config.PUBLIC_BASE_URL = "telewan.up.railway.app"
+        try:
+            await bot_module.handle_image_message(update, context, "document")
+        finally:
+            normalizer.shutdown()
+            (bot_module.AsyncWavespeedAPI, bot_module.submit_telegram_video_job, bot_module.image_normalizer,
+             Config.ALLOWED_USER_ID, Config.ARCHIVE_INPUT_IMAGES, Config.PUBLIC_BASE_URL) = originals
+            image_normalizer_module.image_normalizer = originals[2]
+
+        generate_url = next(value for name, value in events if name == "generate")
+        assert generate_url.startswith("https://telewan.up.railway.app/images/norm_"), generate_url
+        assert os.path.exists(os.path.join(tmp_dir, os.path.basename(generate_url)))
+        assert ("submit", "req_doc") in events
+        print(f"✅ WaveSpeed recibe {generate_url[:60]}...")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en test del handler: {e}")
+        return False
+
+
+async def test_large_inputs_benchmark(tmp_dir):
+    """TIFF (y HEIC si pillow-heif está instalado) grande: el pool no bloquea el event loop"""
+    print("🧪 Midiendo TIFF/HEIC grandes...")
+
+    try:
+        from PIL import Image
+        from image_normalizer import ImageNormalizer, normalize_image_bytes, heif_available
+
+        source = make_image(6000, 4000)
+        inputs = {"TIFF 6000x4000": encode(source, "TIFF")}
+        if heif_available():
+            from pillow_heif import register_heif_opener
+            register_heif_opener()
+            inputs["HEIC 6000x4000"] = encode(source, "HEIF", quality=90)
+        else:
+            print("   ⏭️ HEIC omitido: pillow-heif no instalado")
+
+        normalizer = ImageNormalizer(workers=1, directory=tmp_dir)
+        try:
+            # Arranque del proceso del pool fuera de la medición
+            await normalizer.normalize(encode(make_image(64, 64), "PNG"), 480)
+
+            for label, data in inputs.items():
+                start = time.perf_counter()
+                normalize_image_bytes(data, 720)
+                inline_time = time.perf_counter() - start
+
+                start = time.perf_counter()
+                (_, image), max_lag = await measure_loop_lag(normalizer.normalize(data, 720))
+                pool_time = time.perf_counter() - start
+
+                print(f"   {label} ({len(data) / 1024 / 1024:.1f} MB): en línea {inline_time * 1000:.0f} ms "
+                      f"(bloquea el loop), pool {pool_time * 1000:.0f} ms, retraso máx. del loop {max_lag * 1000:.1f} ms "
+                      f"-> {image.width}x{image.height} {len(image.data) / 1024:.0f} KB")
+                assert (image.width, image.height) == (1280, 720)
+                assert max_lag < inline_time / 2, "El event loop quedó bloqueado durante la normalización"
+        finally:
+            normalizer.shutdown()
+
+        print("✅ Normalización fuera del event loop")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en benchmark: {e}")
+        return False
+
+
+async def main():
+    """Función principal de testing"""
+    print("🚀 TEST DEL NORMALIZADOR DE IMÁGENES")
+    print("=" * 60)
+
+    tests = [
+        test_exif_orientation_and_alpha,
+        test_resolution_and_aspect,
+        test_content_cache,
+        test_document_handler_uses_normalized_url,
+        test_large_inputs_benchmark
+    ]
+
+    passed = 0
+    for test in tests:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            if test.__code__.co_argcount:
+                result = await test(tmp_dir)
+            else:
+                result = await test()
+            if result:
+                passed += 1
+
+    print("\n" + "=" * 60)
+    print(f"📊 RESULTADOS: {passed}/{len(tests)} tests pasaron")
+    return passed == len(tests)
+
+
+if __name__ == "__main__":
+    success = asyncio.run(main())
+    if not success:
+        sys.exit(1)
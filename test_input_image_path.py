@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+Test del camino de la imagen de entrada (handle_image_message en bot.py)
+Verifica la elección del PhotoSize según el modelo, que WaveSpeed recibe la URL sin que el bot
+descargue la imagen y que el archivado local es opcional y en segundo plano
+"""
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+from types import SimpleNamespace
+
+sys.path.append('.')
+
+# Configurar logging
+logging.basicConfig(level=logging.WARNING, format='%(levelname)s: %(message)s')
+
+# Tamaños que Telegram genera para una foto de 1280x960
+PHOTO_SIZES = [(90, 68), (320, 240), (800, 600), (1280, 960)]
+
+
+def make_photo_sizes():
+    return [
+        SimpleNamespace(width=w, height=h, file_id=f"photo_{w}", file_unique_id=f"u_{w}", file_size=w * h // 8)
+        for w, h in PHOTO_SIZES
+    ]
+
+
+class FakeFile:
+    """File de Telegram simulado: registra descargas a memoria y a disco"""
+
+    def __init__(self, file_id, events):
+        self.file_id = file_id
+        self.file_path = f"photos/{file_id}.jpg"
+        self.file_size = 1000
+        self.events = events
+
+    async def download_as_bytearray(self):
+        self.events.append(("download_bytes", self.file_id))
+        return bytearray(b"\xff\xd8" + b"x" * 1000)
+
+    async def download_to_drive(self, custom_path=None):
+        await asyncio.sleep(0.01)
+        with open(custom_path, "wb") as f:
+            f.write(b"\xff\xd8" + b"x" * 1000)
+        self.events.append(("archive", self.file_id))
+        return custom_path
+
+
+async def run_handler(model, archive):
+    """Ejecuta handle_image_message con un mensaje de foto simulado; retorna los eventos"""
+    import bot as bot_module
+    from config import Config
+
+    events = []
+
+    class FakeWavespeed:
+        async def generate_video(self, prompt, image_url, model=None):
+            events.append(("generate", image_url))
+            return {"id": "req_1"}
+
+    async def fake_submit(update, processing_msg, request_id, prompt, **kwargs):
+        events.append(("submit", request_id))
+
+    async def get_file(file_id):
+        events.append(("get_file", file_id))
+        return FakeFile(file_id, events)
+
+    async def reply_text(text, **kwargs):
+        return SimpleNamespace(edit_text=reply_text)
+
+    message = SimpleNamespace(
+        photo=make_photo_sizes(), document=None, sticker=None, forward_origin=None,
+        caption="a cat jumping", chat=SimpleNamespace(id=1), message_id=10,
+        from_user=SimpleNamespace(id=99), reply_text=reply_text
+    )
+    update = SimpleNamespace(message=message)
+    context = SimpleNamespace(bot=SimpleNamespace(get_file=get_file), user_data={"selected_model": model})
+
+    originals = (bot_module.AsyncWavespeedAPI, bot_module.submit_telegram_video_job,
+                 Config.ARCHIVE_INPUT_IMAGES, Config.ALLOWED_USER_ID)
+    bot_module.AsyncWavespeedAPI = FakeWavespeed
+    bot_module.submit_telegram_video_job = fake_submit
+    Config.ARCHIVE_INPUT_IMAGES = archive
+    Config.ALLOWED_USER_ID = None
+    try:
+        await bot_module.handle_image_message(update, context, "photo")
+        events.append(("handler_done", None))
+        await asyncio.gather(*bot_module._background_tasks)
+    finally:
+        (bot_module.AsyncWavespeedAPI, bot_module.submit_telegram_video_job,
+         Config.ARCHIVE_INPUT_IMAGES, Config.ALLOWED_USER_ID) = originals
+    return events
+
+
+async def test_photo_size_selection():
+    """480p usa el tamaño de 800x600; 720p el de 1280x960; nunca más de lo necesario"""
+    print("🧪 Probando elección del PhotoSize...")
+
+    try:
+        from bot import model_input_min_side, select_photo_size
+
+        assert model_input_min_side("ultra_fast") == 480
+        assert model_input_min_side("quality") == 720
+        assert model_input_min_side("cinematic_1080p") == 1080
+
+        sizes = make_photo_sizes()
+        assert select_photo_size(sizes, 480).width == 800
+        assert select_photo_size(sizes, 720).width == 1280
+        assert select_photo_size(sizes, 1080).width == 1280, "Sin tamaño suficiente debe usar el mayor"
+        assert select_photo_size(list(reversed(sizes)), 200).width == 320
+        print("✅ 480p -> 800x600, 720p -> 1280x960")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en test de PhotoSize: {e}")
+        return False
+
+
+async def test_url_handoff_without_download():
+    """WaveSpeed recibe la URL del tamaño elegido y el bot no descarga la imagen antes"""
+    print("🧪 Probando entrega de la URL a WaveSpeed...")
+
+    try:
+        events = await run_handler("ultra_fast", archive=True)
+        names = [name for name, _ in events]
+
+        generate_url = next(value for name, value in events if name == "generate")
+        assert "photo_800" in generate_url, generate_url
+        assert "download_bytes" not in names, "Se descargó la imagen a memoria"
+        assert names.index("generate") < names.index("archive"), "El archivado retrasó el envío a WaveSpeed"
+        assert names.index("handler_done") < names.index("archive"), "El archivado no fue en segundo plano"
+        print(f"✅ Orden: {' -> '.join(names)}")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en test de entrega de URL: {e}")
+        return False
+
+
+async def test_archive_optional():
+    """Con ARCHIVE_INPUT_IMAGES=false no se guarda nada en el volumen"""
+    print("🧪 Probando archivado desactivado...")
+
+    try:
+        events = await run_handler("quality", archive=False)
+        names = [name for name, _ in events]
+        generate_url = next(value for name, value in events if name == "generate")
+
+        assert "archive" not in names and "download_bytes" not in names
+        assert "photo_1280" in generate_url
+        print("✅ Sin archivado ni descargas locales")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en test de archivado opcional: {e}")
+        return False
+
+
+async def main():
+    """Función principal de testing"""
+    print("🚀 TEST DEL CAMINO DE LA IMAGEN DE ENTRADA")
+    print("=" * 60)
+
+    from config import Config
+    volume_path = Config.VOLUME_PATH
+
+    tests = [
+        test_photo_size_selection,
+        test_url_handoff_without_download,
+        test_archive_optional
+    ]
+
+    passed = 0
+    try:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            Config.VOLUME_PATH = tmp_dir
+            for test in tests:
+                if await test():
+                    passed += 1
+    finally:
+        Config.VOLUME_PATH = volume_path
+
+    print("\n" + "=" * 60)
+    print(f"📊 RESULTADOS: {passed}/{len(tests)} tests pasaron")
+    return passed == len(tests)
+
+
+if __name__ == "__main__":
+    success = asyncio.run(main())
+    if not success:
+        sys.exit(1)
@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+"""
+Test de la cola de trabajos persistente (job_queue.py)
+Verifica pool de workers, reintentos, recuperación tras caída y reparto entre procesos
+"""
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append('.')
+
+# Configurar logging
+logging.basicConfig(level=logging.WARNING, format='%(levelname)s: %(message)s')
+
+
+def make_queue(db_path, **kwargs):
+    from job_queue import JobQueue, SQLiteJobBackend
+    kwargs.setdefault("poll_interval", 0.02)
+    return JobQueue(backend=SQLiteJobBackend(db_path), **kwargs)
+
+
+async def wait_for_status(queue, job_id, statuses, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = await queue.get(job_id)
+        if job and job.status in statuses:
+            return job
+        await asyncio.sleep(0.02)
+    raise TimeoutError(f"Trabajo {job_id} no llegó a {statuses}")
+
+
+async def test_worker_pool_runs_jobs_concurrently(db_path):
+    """N workers deben procesar N trabajos en paralelo"""
+    print("🧪 Probando pool de workers...")
+
+    try:
+        queue = make_queue(db_path, workers=5)
+
+        async def handler(job, q):
+            await asyncio.sleep(0.2)
+            job.state["result"] = job.payload["n"] * 2
+
+        queue.register("double", handler)
+        await queue.start()
+
+        start = time.monotonic()
+        job_ids = [await queue.submit("double", {"n": i}) for i in range(10)]
+        jobs = [await wait_for_status(queue, job_id, {"completed"}) for job_id in job_ids]
+        elapsed = time.monotonic() - start
+        await queue.stop()
+
+        print(f"   10 trabajos de 0.2s con 5 workers: {elapsed:.2f}s")
+        assert [job.state["result"] for job in jobs] == [i * 2 for i in range(10)]
+        assert elapsed < 1.0, "Los trabajos no se ejecutaron en paralelo"
+        print("✅ Trabajos procesados en paralelo con su resultado persistido")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en test de pool de workers: {e}")
+        return False
+
+
+async def test_retries_and_exhaustion(db_path):
+    """Los errores se reintentan con backoff y el trabajo falla al agotar los intentos"""
+    print("🧪 Probando reintentos...")
+
+    try:
+        from config import Config
+
+        backoff = Config.JOB_RETRY_BACKOFF
+        Config.JOB_RETRY_BACKOFF = 0.01
+        queue = make_queue(db_path, workers=2)
+        calls = {}
+
+        async def flaky(job, q):
+            calls[job.id] = calls.get(job.id, 0) + 1
+            if job.payload["fail_times"] >= job.attempts:
+                raise RuntimeError(f"fallo transitorio {job.attempts}")
+            job.state["ok"] = True
+
+        queue.register("flaky", flaky)
+        await queue.start()
+        try:
+            recovered_id = await queue.submit("flaky", {"fail_times": 2}, max_attempts=3)
+            doomed_id = await queue.submit("flaky", {"fail_times": 5}, max_attempts=3)
+            recovered = await wait_for_status(queue, recovered_id, {"completed", "failed"})
+            doomed = await wait_for_status(queue, doomed_id, {"completed", "failed"})
+        finally:
+            await queue.stop()
+            Config.JOB_RETRY_BACKOFF = backoff
+
+        assert recovered.status == "completed" and recovered.attempts == 3
+        assert doomed.status == "failed" and calls[doomed_id] == 3
+        assert "fallo transitorio 3" in doomed.error
+        print(f"✅ Reintento exitoso en el intento {recovered.attempts}; fallo definitivo tras {calls[doomed_id]} intentos")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en test de reintentos: {e}")
+        return False
+
+
+async def test_crash_recovery(db_path):
+    """Un trabajo interrumpido (proceso caído) se retoma cuando expira su lease"""
+    print("🧪 Probando recuperación tras caída del worker...")
+
+    try:
+        crashed = make_queue(db_path, workers=1, visibility_timeout=0.3, heartbeat_interval=0.05)
+        started = asyncio.Event()
+
+        async def hangs(job, q):
+            job.state["request_id"] = "wavespeed-123"  # Checkpoint antes de la caída
+            started.set()
+            await asyncio.sleep(3600)
+
+        crashed.register("video", hangs)
+        await crashed.start()
+        job_id = await crashed.submit("video", {"prompt": "gato"})
+        await started.wait()
+        await asyncio.sleep(0.1)  # Dejar que un heartbeat persista el checkpoint
+        # Simular caída: los workers mueren sin marcar el trabajo como terminado
+        for task in crashed._tasks:
+            task.cancel()
+        await asyncio.gather(*crashed._tasks, return_exceptions=True)
+
+        job = await crashed.get(job_id)
+        assert job.status == "running", "El trabajo debería seguir 'running' tras la caída"
+
+        # "Reinicio": una cola nueva sobre la misma base de datos
+        restarted = make_queue(db_path, workers=1, visibility_timeout=0.3)
+        seen_checkpoint = {}
+
+        async def resumes(job, q):
+            seen_checkpoint["request_id"] = job.state.get("request_id")
+            job.state["video_url"] = "https://cdn.example.com/out.mp4"
+
+        restarted.register("video", resumes)
+        await restarted.start()
+        start = time.monotonic()
+        job = await wait_for_status(restarted, job_id, {"completed"})
+        elapsed = time.monotonic() - start
+        await restarted.stop()
+
+        print(f"   Retomado tras {elapsed:.2f}s (lease de 0.3s), intento {job.attempts}")
+        assert seen_checkpoint["request_id"] == "wavespeed-123", "Se perdió el checkpoint del trabajo"
+        assert job.attempts == 2
+        print("✅ Trabajo recuperado con su checkpoint tras la caída")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en test de recuperación: {e}")
+        return False
+
+
+async def test_multiple_processes_share_queue(db_path):
+    """Varias colas sobre el mismo backend se reparten el trabajo sin duplicarlo"""
+    print("🧪 Probando reparto entre procesos...")
+
+    try:
+        executions = []
+        queues = [make_queue(db_path, workers=3) for _ in range(3)]
+
+        for index, queue in enumerate(queues):
+            async def handler(job, q, index=index):
+                executions.append((job.id, index))
+                await asyncio.sleep(0.02)
+            queue.register("shared", handler)
+            await queue.start()
+
+        # Una cola sin el handler registrado no debe reclamar estos trabajos
+        other = make_queue(db_path, workers=2)
+        other.register("other_kind", lambda job, q: asyncio.sleep(0))
+        await other.start()
+
+        job_ids = [await queues[0].submit("shared", {"n": i}) for i in range(30)]
+        for job_id in job_ids:
+            await wait_for_status(queues[0], job_id, {"completed"})
+
+        for queue in queues + [other]:
+            await queue.stop()
+
+        executed_ids = [job_id for job_id, _ in executions]
+        per_queue = [sum(1 for _, index in executions if index == i) for i in range(3)]
+        print(f"   Trabajos por proceso: {per_queue}")
+        assert sorted(executed_ids) == sorted(job_ids), "Algún trabajo se ejecutó dos veces o nunca"
+        assert sum(1 for count in per_queue if count) >= 2, "El trabajo no se repartió"
+        print("✅ 30 trabajos ejecutados exactamente una vez")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en test de reparto: {e}")
+        return False
+
+
+async def test_missing_resource_defers_jobs(db_path):
+    """Sin el recurso requerido (p.ej. la Application de Telegram) el trabajo sigue encolado sin gastar intentos"""
+    print("🧪 Probando trabajos que esperan un recurso...")
+
+    try:
+        executions = []
+
+        async def handler(job, q):
+            executions.append(q.resources["telegram_app"])
+
+        queue = make_queue(db_path, workers=2)
+        queue.register("telegram_video", handler, requires=("telegram_app",))
+        queue.resources["telegram_app"] = None
+        await queue.start()
+        job_id = await queue.submit("telegram_video", {})
+        await asyncio.sleep(0.3)
+        waiting = await queue.get(job_id)
+        await queue.stop()
+
+        assert waiting.status == "queued" and waiting.attempts == 0 and not executions, waiting.to_dict()
+
+        # Un proceso con Telegram disponible lo ejecuta al primer intento
+        restarted = make_queue(db_path, workers=1)
+        restarted.register("telegram_video", handler, requires=("telegram_app",))
+        restarted.resources["telegram_app"] = "app"
+        await restarted.start()
+        done = await wait_for_status(restarted, job_id, {"completed"})
+        await restarted.stop()
+
+        assert executions == ["app"] and done.attempts == 1, done.to_dict()
+        print("✅ Trabajo en espera sin intentos consumidos y ejecutado al haber Telegram")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en test de recurso ausente: {e}")
+        return False
+
+
+async def test_purge_finished_jobs(db_path):
+    """Los trabajos terminados antiguos se eliminan para que la cola no crezca sin límite"""
+    print("🧪 Probando purga de trabajos terminados...")
+
+    try:
+        from job_queue import SQLiteJobBackend
+
+        queue = make_queue(db_path, workers=1)
+        queue.register("quick", lambda job, q: asyncio.sleep(0))
+        await queue.start()
+        job_id = await queue.submit("quick", {})
+        await wait_for_status(queue, job_id, {"completed"})
+        pending_id = await queue.submit("never_handled", {})
+        await queue.stop()
+
+        backend = SQLiteJobBackend(db_path)
+        removed = await backend.purge(time.time() + 1)
+        assert removed >= 1
+        assert await backend.get(job_id) is None
+        assert (await backend.get(pending_id)).status == "queued", "Se purgó un trabajo pendiente"
+        await backend.close()
+        print(f"✅ {removed} trabajos terminados purgados, pendientes intactos")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en test de purga: {e}")
+        return False
+
+
+async def main():
+    """Función principal de testing"""
+    print("🚀 TEST DE LA COLA DE TRABAJOS")
+    print("=" * 60)
+
+    tests = [
+        test_worker_pool_runs_jobs_concurrently,
+        test_retries_and_exhaustion,
+        test_crash_recovery,
+        test_multiple_processes_share_queue,
+        test_missing_resource_defers_jobs,
+        test_purge_finished_jobs
+    ]
+
+    passed = 0
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for index, test in enumerate(tests):
+            if await test(os.path.join(tmp_dir, f"jobs_{index}.db")):
+                passed += 1
+
+    print("\n" + "=" * 60)
+    print(f"📊 RESULTADOS: {passed}/{len(tests)} tests pasaron")
+    return passed == len(tests)
+
+
+if __name__ == "__main__":
+    success = asyncio.run(main())
+    if not success:
+        sys.exit(1)
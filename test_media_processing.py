@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+"""
+Test del procesado de videos con ffmpeg (media_processing.py)
+Verifica el cálculo de bitrate/altura para un límite de tamaño, que un video dentro del límite
+no se toca, que un fallo conserva el original y, si ffmpeg está instalado, el ajuste real.
+También la preparación para streaming (faststart + miniatura): bytes hasta el primer frame y CPU
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import logging
+
+sys.path.append('.')
+
+# Configurar logging
+logging.basicConfig(level=logging.WARNING, format='%(levelname)s: %(message)s')
+
+MB = 1024 * 1024
+
+# Ancho de banda de referencia de un cliente móvil para estimar el tiempo hasta el primer frame
+CLIENT_BYTES_PER_SECOND = 5_000_000 / 8
+
+
+async def test_fit_plan():
+    """El bitrate objetivo cabe en el límite y la altura baja con el bitrate"""
+    print("🧪 Probando plan de re-codificación por tamaño...")
+
+    try:
+        from media_processing import plan_fit
+
+        short = plan_fit(50 * MB, 60)
+        long = plan_fit(50 * MB, 600)
+        assert short.max_height == 720 and long.max_height == 480, (short, long)
+        for plan, duration in ((short, 60), (long, 600)):
+            size = (plan.video_kbps + plan.audio_kbps) * 1000 / 8 * duration
+            assert size <= 50 * MB, f"{duration}s: {size / MB:.1f} MB"
+        assert plan_fit(50 * MB, 4 * 3600) is None, "4 horas en 50 MB no es visible"
+        assert plan_fit(50 * MB, 0) is None
+
+        print(f"✅ 60s -> {short.video_kbps} kbps {short.max_height}p; 600s -> {long.video_kbps} kbps {long.max_height}p")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en test de plan: {e}")
+        return False
+
+
+async def test_fit_to_size_keeps_original_on_failure():
+    """Dentro del límite no se ejecuta ffmpeg; si el ajuste falla el original sigue en su sitio"""
+    print("🧪 Probando ajuste sin trabajo y con fallo...")
+
+    try:
+        from media_processing import MediaProcessor
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            filepath = os.path.join(tmp_dir, "video.mp4")
+            with open(filepath, "wb") as f:
+                f.write(b"0" * 20000)
+
+            processor = MediaProcessor(max_concurrent=1, timeout=30)
+            untouched = await processor.fit_to_size(filepath, 50000)
+            # Un archivo que no es video: ffmpeg falla (o no está instalado)
+            failed = await processor.fit_to_size(filepath, 19000, duration=10)
+
+            assert untouched == {'success': True, 'filepath': filepath, 'file_size': 20000, 'method': 'none'}
+            assert not failed['success'] and os.path.exists(filepath), failed
+            assert os.listdir(tmp_dir) == ["video.mp4"], os.listdir(tmp_dir)
+
+        print(f"✅ Sin cambios dentro del límite; fallo controlado: {failed['error'][:60]}")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en test de fallo: {e}")
+        return False
+
+
+async def test_reencode_with_ffmpeg():
+    """Un video real por encima del límite queda por debajo (solo si ffmpeg está instalado)"""
+    print("🧪 Probando re-codificación real con ffmpeg...")
+
+    try:
+        from media_processing import MediaProcessor, ffmpeg_available
+
+        if not ffmpeg_available():
+            print("⚠️ ffmpeg no está instalado: se omite la re-codificación real")
+            return True
+
+        processor = MediaProcessor(max_concurrent=1, timeout=120)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            source = os.path.join(tmp_dir, "ruido.mp4")
+            returncode, output = await processor.run_ffmpeg([
+                'ffmpeg', '-y', '-v', 'error', '-f', 'lavfi', '-i', 'noise=alls=100:allf=t+u,format=yuv420p',
+                '-f', 'lavfi', '-i', 'sine=frequency=440', '-t', '8', '-s', '1280x720',
+                '-c:v', 'libx264', '-b:v', '6M', '-c:a', 'aac', '-shortest', source
+            ])
+            assert returncode == 0, output
+            original = os.path.getsize(source)
+            limit = original // 3
+
+            result = await processor.fit_to_size(source, limit)
+            assert result['success'] and result['file_size'] <= limit and not os.path.exists(source), result
+
+        print(f"✅ {original / MB:.1f} MB -> {result['file_size'] / MB:.1f} MB por {result['method']}")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en test de re-codificación: {e}")
+        return False
+
+
+async def test_streaming_args():
+    """Faststart copia todas las pistas sin re-codificar; la miniatura solo decodifica keyframes"""
+    print("🧪 Probando argumentos de faststart y miniatura...")
+
+    try:
+        from media_processing import faststart_args, thumbnail_args
+
+        remux = faststart_args("in.mp4", "out.mp4")
+        thumb = thumbnail_args("in.mp4", "thumb.jpg")
+
+        assert ['-map', '0', '-c', 'copy', '-movflags', '+faststart'] == remux[remux.index('-map'):remux.index('-f')]
+        assert remux[-1] == 'out.mp4' and '-skip_frame' not in remux
+        assert thumb.index('-skip_frame') < thumb.index('-i') and thumb[-1] == 'thumb.jpg' and '-c' not in thumb
+
+        print("✅ " + " ".join(thumb))
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en test de argumentos: {e}")
+        return False
+
+
+async def test_prepare_without_work():
+    """Un MP4 ya faststart no lanza ffmpeg; 'moov' al final obliga a bajar el archivo entero"""
+    print("🧪 Probando faststart sin trabajo y bytes hasta el primer frame...")
+
+    try:
+        from media_processing import MediaProcessor, ffmpeg_available
+        from test_mp4_boxes import build_mp4
+
+        class CountingProcessor(MediaProcessor):
+            calls = 0
+
+            async def run_ffmpeg(self, args, timeout=None):
+                CountingProcessor.calls += 1
+                return await super().run_ffmpeg(args, timeout)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            fast_path = os.path.join(tmp_dir, "fast.mp4")
+            with open(fast_path, "wb") as f:
+                f.write(build_mp4(media_size=4 * MB))
+            processor = CountingProcessor(max_concurrent=1, timeout=30)
+            fast = await processor.make_faststart(fast_path)
+            assert CountingProcessor.calls == 0 and not fast['remuxed'], fast
+            assert os.listdir(tmp_dir) == ["fast.mp4"], os.listdir(tmp_dir)
+
+        from mp4_boxes import inspect_buffer
+        tail = inspect_buffer(build_mp4(media_size=4 * MB, faststart=False))
+        before, after = tail.first_frame_bytes(), fast['info'].first_frame_bytes()
+        assert after < 4096 < 4 * MB <= before, (before, after)
+
+        print(f"✅ Sin ffmpeg para un faststart{'' if ffmpeg_available() else ' (ffmpeg no instalado)'}; "
+              f"primer frame a 5 Mbps: moov al final {before / CLIENT_BYTES_PER_SECOND:.2f}s, "
+              f"faststart {after / CLIENT_BYTES_PER_SECOND * 1000:.1f} ms")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en test de faststart sin trabajo: {e}")
+        return False
+
+
+async def test_concurrent_uploads_same_file():
+    """Dos subidas simultáneas del mismo archivo: cada una su miniatura, el video no se modifica;
+    dos faststart simultáneos del mismo archivo no se pisan"""
+    print("🧪 Probando subidas simultáneas del mismo video...")
+
+    try:
+        from types import SimpleNamespace
+        import media_processing
+        from file_id_cache import FileIdCache, send_video_cached
+        from test_mp4_boxes import build_mp4
+
+        async def fake_ffmpeg(args, timeout=None):
+            # ffmpeg simulado: tarda y escribe la salida (último argumento)
+            await asyncio.sleep(0.05)
+            with open(args[-1], "wb") as f:
+                f.write(b"\xff\xd8" + bytes(100))
+            return 0, ""
+
+        class FakeBot:
+            def __init__(self):
+                self.thumbnails = []
+
+            async def send_video(self, chat_id, video, thumbnail=None, **kwargs):
+                await asyncio.sleep(0.05)  # La otra subida termina mientras tanto
+                self.thumbnails.append((thumbnail.name, thumbnail.read(2)))
+                video.read()
+                return SimpleNamespace(video=SimpleNamespace(file_id=f"BAAC_{chat_id}", file_unique_id=f"u_{chat_id}"))
+
+        original_available = media_processing.ffmpeg_available
+        original_run = media_processing.media_processor.run_ffmpeg
+        media_processing.ffmpeg_available = lambda: True
+        media_processing.media_processor.run_ffmpeg = fake_ffmpeg
+        try:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                path = os.path.join(tmp_dir, "video.mp4")
+                data = build_mp4(media_size=64 * 1024)
+                with open(path, "wb") as f:
+                    f.write(data)
+                bot = FakeBot()
+                cache = FileIdCache(path=os.path.join(tmp_dir, "ids.db"))
+                await asyncio.gather(*(send_video_cached(bot, chat, path, keys=[f"k{chat}"], cache=cache)
+                                       for chat in (1, 2)))
+                await cache.close()
+
+                with open(path, "rb") as f:
+                    assert f.read() == data, "el video compartido cambió durante la subida"
+
+                # Faststart simultáneo del mismo archivo: serializado, el segundo ya lo encuentra hecho
+                with open(path, "wb") as f:
+                    f.write(build_mp4(media_size=64 * 1024, faststart=False))
+                runs = []
+
+                async def fake_remux(args, timeout=None):
+                    runs.append(args[-1])
+                    await asyncio.sleep(0.05)
+                    with open(args[-1], "wb") as f:
+                        f.write(data)
+                    return 0, ""
+
+                media_processing.media_processor.run_ffmpeg = fake_remux
+                first, second = await asyncio.gather(media_processing.media_processor.make_faststart(path),
+                                                     media_processing.media_processor.make_faststart(path))
+                assert len(runs) == 1 and first['remuxed'] != second['remuxed'], (runs, first, second)
+                with open(path, "rb") as f:
+                    assert f.read() == data
+                leftovers = sorted(set(os.listdir(tmp_dir)) - {"video.mp4", "ids.db", "ids.db-wal", "ids.db-shm"})
+        finally:
+            media_processing.ffmpeg_available = original_available
+            media_processing.media_processor.run_ffmpeg = original_run
+
+        names = {name for name, _ in bot.thumbnails}
+        assert len(names) == 2 and all(head == b"\xff\xd8" for _, head in bot.thumbnails), bot.thumbnails
+        assert not leftovers, leftovers
+        print(f"✅ Miniaturas independientes ({', '.join(os.path.basename(n) for n in names)}) y borradas tras enviar")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en test de subidas simultáneas: {e}")
+        return False
+
+
+async def test_prepare_with_ffmpeg():
+    """Remux faststart real y miniatura JPEG; mide bytes hasta el primer frame y CPU (solo con ffmpeg)"""
+    print("🧪 Probando faststart y miniatura reales con ffmpeg...")
+
+    try:
+        from media_processing import MediaProcessor, ffmpeg_available
+        from mp4_boxes import probe_video
+
+        if not ffmpeg_available():
+            print("⚠️ ffmpeg no está instalado: se omite la preparación real")
+            return True
+
+        processor = MediaProcessor(max_concurrent=1, timeout=120)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            source = os.path.join(tmp_dir, "video.mp4")
+            # Sin +faststart: ffmpeg escribe 'moov' al final, como muchos generadores
+            returncode, output = await processor.run_ffmpeg([
+                'ffmpeg', '-y', '-v', 'error', '-f', 'lavfi', '-i', 'testsrc2=size=1280x720:rate=30',
+                '-f', 'lavfi', '-i', 'sine=frequency=440', '-t', '10',
+                '-c:v', 'libx264', '-preset', 'veryfast', '-c:a', 'aac', '-shortest', source
+            ])
+            assert returncode == 0, output
+            original = await probe_video(source)
+            assert original.complete and not original.faststart, original
+
+            result = await processor.make_faststart(source)
+            remuxed = await probe_video(source)
+            assert result['remuxed'] and remuxed.faststart and remuxed.duration == original.duration, result
+
+            start = time.perf_counter()
+            thumbnail = await processor.extract_thumbnail(source)
+            thumb_ms = (time.perf_counter() - start) * 1000
+            assert thumbnail and os.path.getsize(thumbnail) <= 200 * 1024, thumbnail
+            with open(thumbnail, 'rb') as f:
+                assert f.read(2) == b'\xff\xd8', "la miniatura no es JPEG"
+            os.remove(thumbnail)
+
+            again = await processor.make_faststart(source)
+            assert not again['remuxed'], "un faststart no se vuelve a procesar"
+            assert sorted(os.listdir(tmp_dir)) == ["video.mp4"], os.listdir(tmp_dir)
+
+        before, after = result['first_frame_bytes']
+        print(f"✅ Primer frame tras {after / 1024:.0f} KB en vez de {before / 1024:.0f} KB "
+              f"({before / CLIENT_BYTES_PER_SECOND:.2f}s -> {after / CLIENT_BYTES_PER_SECOND:.3f}s a 5 Mbps); "
+              f"CPU del remux {result['cpu_seconds']:.2f}s, miniatura en {thumb_ms:.0f} ms")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en test de preparación real: {e}")
+        return False
+
+
+async def main():
+    """Función principal de testing"""
+    print("🚀 TEST DEL PROCESADO DE VIDEOS CON FFMPEG")
+    print("=" * 60)
+
+    tests = [
+        test_fit_plan,
+        test_fit_to_size_keeps_original_on_failure,
+        test_reencode_with_ffmpeg,
+        test_streaming_args,
+        test_prepare_without_work,
+        test_concurrent_uploads_same_file,
+        test_prepare_with_ffmpeg
+    ]
+
+    passed = 0
+    for test in tests:
+        if await test():
+            passed += 1
+
+    print("\n" + "=" * 60)
+    print(f"📊 RESULTADOS: {passed}/{len(tests)} tests pasaron")
+    return passed == len(tests)
+
+
+if __name__ == "__main__":
+    success = asyncio.run(main())
+    if not success:
+        sys.exit(1)
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+Test del lector de cajas MP4 (mp4_boxes.py)
+Verifica la extracción de duración/resolución/códecs, la detección de archivos cortados,
+que un archivo grande se analiza sin leerlo entero y que send_video recibe los metadatos
+"""
+import asyncio
+import os
+import struct
+import sys
+import tempfile
+import time
+import logging
+from types import SimpleNamespace
+
+sys.path.append('.')
+
+# Configurar logging
+logging.basicConfig(level=logging.WARNING, format='%(levelname)s: %(message)s')
+
+MB = 1024 * 1024
+
+
+def box(box_type: bytes, payload: bytes) -> bytes:
+    return struct.pack('>I4s', 8 + len(payload), box_type) + payload
+
+
+def full_box(box_type: bytes, payload: bytes, version: int = 0) -> bytes:
+    return box(box_type, struct.pack('>B3x', version) + payload)
+
+
+def track(handler: bytes, codec: bytes, width: int, height: int, duration: int, chunk_offset: int) -> bytes:
+    """trak mínimo: tkhd, mdhd (timescale 1000), hdlr, stsd con una entrada y stco con un chunk"""
+    tkhd = full_box(b'tkhd', bytes(20) + bytes(52) + struct.pack('>II', width << 16, height << 16))
+    mdhd = full_box(b'mdhd', struct.pack('>IIII', 0, 0, 1000, duration) + bytes(4))
+    hdlr = full_box(b'hdlr', bytes(4) + handler + bytes(12) + b'\x00')
+    entry = box(codec, bytes(24) + struct.pack('>HH', width, height) + bytes(50))
+    stsd = full_box(b'stsd', struct.pack('>I', 1) + entry)
+    stco = full_box(b'stco', struct.pack('>II', 1, chunk_offset))
+    stbl = box(b'stbl', stsd + stco)
+    return box(b'trak', tkhd + box(b'mdia', mdhd + hdlr + box(b'minf', stbl)))
+
+
+FTYP = box(b'ftyp', b'isom' + struct.pack('>I', 512) + b'isomavc1mp41')
+
+
+def build_moov(media_start: int, media_size: int) -> bytes:
+    """moov de 12.5 s con una pista 1280x720 avc1 y otra mp4a cuyos chunks caen dentro de mdat"""
+    mvhd = full_box(b'mvhd', struct.pack('>IIII', 0, 0, 1000, 12500) + bytes(80))
+    return box(b'moov', mvhd + track(b'vide', b'avc1', 1280, 720, 12500, media_start)
+               + track(b'soun', b'mp4a', 0, 0, 12500, media_start + media_size // 2))
+
+
+def mdat_header(media_size: int, largesize: bool = False) -> bytes:
+    if largesize:
+        return struct.pack('>I4sQ', 1, b'mdat', 16 + media_size)
+    return struct.pack('>I4s', 8 + media_size, b'mdat')
+
+
+def build_mp4(media_size: int = 4096, faststart: bool = True, largesize: bool = False) -> bytes:
+    """MP4 sintético completo con moov delante (faststart) o detrás de mdat"""
+    header = mdat_header(media_size, largesize)
+    if faststart:
+        moov_len = len(build_moov(0, media_size))
+        moov = build_moov(len(FTYP) + moov_len + len(header), media_size)
+        return FTYP + moov + header + bytes(media_size)
+    return FTYP + header + bytes(media_size) + build_moov(len(FTYP) + len(header), media_size)
+
+
+async def test_metadata_extraction():
+    """Duración, resolución, códecs y posición de moov de un MP4 completo"""
+    print("🧪 Probando extracción de metadatos...")
+
+    try:
+        from mp4_boxes import inspect_buffer
+
+        fast = inspect_buffer(build_mp4())
+        tail = inspect_buffer(build_mp4(faststart=False))
+        large = inspect_buffer(build_mp4(largesize=True))
+
+        for info in (fast, tail, large):
+            assert info.complete and info.error is None, info.error
+            assert (info.duration, info.width, info.height) == (12.5, 1280, 720), info
+            assert (info.video_codec, info.audio_codec, info.brand) == ('avc1', 'mp4a', 'isom'), info
+            assert info.mdat_size == 4096, info.mdat_size
+        assert fast.faststart and not tail.faststart and large.faststart
+        assert fast.send_kwargs() == {'duration': 12, 'width': 1280, 'height': 720}, fast.send_kwargs()
+
+        print(f"✅ {fast.duration}s {fast.width}x{fast.height} {fast.video_codec}/{fast.audio_codec}; "
+              f"cajas: {[b[0] for b in fast.boxes]}")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en test de metadatos: {e}")
+        return False
+
+
+async def test_truncated_files():
+    """Un archivo cortado en cualquier punto se rechaza; un no-MP4 solo genera aviso"""
+    print("🧪 Probando detección de archivos cortados...")
+
+    try:
+        from mp4_boxes import inspect_buffer, ensure_complete
+
+        for faststart in (True, False):
+            data = build_mp4(faststart=faststart)
+            for cut in (20, 100, len(data) // 2, len(data) - 1):
+                info = inspect_buffer(data[:cut])
+                assert not info.complete and info.error, (faststart, cut)
+                try:
+                    ensure_complete(info)
+                    raise AssertionError(f"corte en {cut} aceptado")
+                except ValueError:
+                    pass
+
+        # mdat vacío y chunks apuntando fuera del archivo
+        empty_mdat = inspect_buffer(build_mp4(media_size=0))
+        outside = inspect_buffer(FTYP + mdat_header(16) + bytes(16) + build_moov(10 ** 6, 16))
+        assert not empty_mdat.complete and not outside.complete, (empty_mdat.error, outside.error)
+
+        webm = inspect_buffer(b'\x1a\x45\xdf\xa3' + bytes(1000))
+        assert not webm.is_mp4
+        ensure_complete(webm)  # Solo aviso
+
+        print(f"✅ Cortes rechazados ({inspect_buffer(build_mp4()[:-1]).error})")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en test de cortes: {e}")
+        return False
+
+
+async def test_large_file_mmap():
+    """Un archivo de 2 GB (disperso) se analiza en milisegundos: solo se leen cabeceras y moov"""
+    print("🧪 Probando análisis de un archivo grande con mmap...")
+
+    try:
+        from mp4_boxes import probe_video
+
+        media_size = 2048 * MB
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "grande.mp4")
+            header = mdat_header(media_size, largesize=True)
+            with open(path, "wb") as f:
+                f.write(FTYP + header)
+                f.seek(media_size, os.SEEK_CUR)  # mdat disperso: no ocupa disco
+                f.write(build_moov(len(FTYP) + len(header), media_size))
+
+            start = time.perf_counter()
+            info = await probe_video(path)
+            elapsed_ms = (time.perf_counter() - start) * 1000
+
+            assert info.complete and info.mdat_size == media_size, info.error
+            assert info.file_size > media_size and (info.width, info.height) == (1280, 720)
+            assert elapsed_ms < 500, f"{elapsed_ms:.0f} ms"
+
+            missing = await probe_video(os.path.join(tmp_dir, "no_existe.mp4"))
+            assert not missing.complete and missing.error
+
+        print(f"✅ {info.file_size / MB:.0f} MB analizados en {elapsed_ms:.1f} ms")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en test de archivo grande: {e}")
+        return False
+
+
+async def test_send_video_hints():
+    """send_video_cached pasa duration/width/height leídos del MP4 sin pisar los explícitos"""
+    print("🧪 Probando metadatos en send_video...")
+
+    try:
+        from file_id_cache import FileIdCache, send_video_cached
+
+        class FakeBot:
+            def __init__(self):
+                self.calls = []
+
+            async def send_video(self, chat_id, video, **kwargs):
+                self.calls.append(kwargs)
+                return SimpleNamespace(video=SimpleNamespace(file_id="BAAC_1", file_unique_id="u_1"))
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "video.mp4")
+            with open(path, "wb") as f:
+                f.write(build_mp4())
+
+            cache = FileIdCache(path=os.path.join(tmp_dir, "cache.db"))
+            bot = FakeBot()
+            await send_video_cached(bot, 1, path, cache=cache, caption="hola")
+            await send_video_cached(bot, 2, path, keys=["otra"], cache=cache, duration=99, width=640, height=360)
+            await cache.close()
+
+        first, second = bot.calls[0], bot.calls[-1]
+        assert first == {'caption': 'hola', 'duration': 12, 'width': 1280, 'height': 720}, first
+        assert (second['duration'], second['width'], second['height']) == (99, 640, 360), second
+
+        print(f"✅ send_video recibió {first}")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en test de send_video: {e}")
+        return False
+
+
+async def main():
+    """Función principal de testing"""
+    print("🚀 TEST DEL LECTOR DE CAJAS MP4")
+    print("=" * 60)
+
+    tests = [
+        test_metadata_extraction,
+        test_truncated_files,
+        test_large_file_mmap,
+        test_send_video_hints
+    ]
+
+    passed = 0
+    for test in tests:
+        if await test():
+            passed += 1
+
+    print("\n" + "=" * 60)
+    print(f"📊 RESULTADOS: {passed}/{len(tests)} tests pasaron")
+    return passed == len(tests)
+
+
+if __name__ == "__main__":
+    success = asyncio.run(main())
+    if not success:
+        sys.exit(1)
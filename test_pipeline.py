@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+"""
+Test del ejecutor de etapas (pipeline.py) y de los pipelines de generación de fastapi_app y web_app
+Verifica la ejecución en paralelo de etapas independientes, timeouts, reintentos, fallbacks,
+cancelación ante fallos, el registro de tiempos y el encadenado de audio/upscale por URL
+"""
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+sys.path.append('.')
+
+# Configurar logging
+logging.basicConfig(level=logging.WARNING, format='%(levelname)s: %(message)s')
+
+
+async def test_independent_stages_overlap():
+    """Dos etapas sin dependencias entre sí corren a la vez; la dependiente espera a ambas"""
+    print("🧪 Probando ejecución en paralelo...")
+
+    try:
+        from pipeline import Pipeline, Stage
+
+        events = []
+
+        async def slow(name, value, delay=0.1):
+            events.append((f"{name}:start", time.perf_counter()))
+            await asyncio.sleep(delay)
+            events.append((f"{name}:end", time.perf_counter()))
+            return value
+
+        def blocking_upper(text):
+            # Síncrona: debe ir a un thread sin bloquear a las demás
+            time.sleep(0.1)
+            return text.upper()
+
+        pipeline = Pipeline([
+            Stage("a", lambda prompt: slow("a", prompt + "!"), inputs=("prompt",), outputs=("a",)),
+            Stage("b", blocking_upper, inputs=("prompt",), outputs=("b",)),
+            Stage("join", lambda a, b: slow("join", f"{a}|{b}", 0), inputs=("a", "b"), outputs=("joined",)),
+        ])
+
+        start = time.perf_counter()
+        values = await pipeline.run({"prompt": "hola"})
+        elapsed = time.perf_counter() - start
+
+        timings = pipeline.timings()
+        assert values["joined"] == "hola!|HOLA", values
+        assert elapsed < 0.18, f"Las etapas independientes se ejecutaron en serie ({elapsed:.2f}s)"
+        assert all(t["status"] == "completed" and t["duration"] is not None for t in timings.values())
+        print(f"✅ 2 etapas de 100 ms + unión en {elapsed * 1000:.0f} ms")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en test de paralelismo: {e}")
+        return False
+
+
+async def test_timeout_retry_and_fallback():
+    """Cada etapa tiene su timeout y reintentos; las opcionales usan su fallback"""
+    print("🧪 Probando timeout, reintentos y fallback...")
+
+    try:
+        from pipeline import Pipeline, Stage
+
+        calls = {"flaky": 0, "hang": 0}
+
+        async def flaky(x):
+            calls["flaky"] += 1
+            if calls["flaky"] < 3:
+                raise ConnectionError("transient")
+            return x * 2
+
+        async def hang(x):
+            calls["hang"] += 1
+            await asyncio.sleep(10)
+
+        pipeline = Pipeline([
+            Stage("flaky", flaky, inputs=("x",), outputs=("doubled",), retries=2, retry_backoff=0.01),
+            Stage("hang", hang, inputs=("x",), outputs=("hung",), timeout=0.05, retries=1, retry_backoff=0.01,
+                  fallback=lambda x: "fallback"),
+            Stage("skipped", lambda x: 1 / 0, inputs=("x",), outputs=("skipped",),
+                  when=lambda values: False, fallback=lambda x: "not needed"),
+        ])
+        values = await pipeline.run({"x": 21})
+        timings = pipeline.timings()
+
+        assert values["doubled"] == 42 and timings["flaky"]["attempts"] == 3
+        assert values["hung"] == "fallback" and calls["hang"] == 2
+        assert timings["hang"]["status"] == "fallback" and "timeout" in timings["hang"]["error"]
+        assert values["skipped"] == "not needed" and timings["skipped"]["status"] == "skipped"
+        print(f"✅ {timings['hang']}")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en test de timeout/reintentos: {e}")
+        return False
+
+
+async def test_required_failure_cancels():
+    """Si una etapa obligatoria falla, las que siguen en curso se cancelan y se lanza StageError"""
+    print("🧪 Probando fallo de una etapa obligatoria...")
+
+    try:
+        from pipeline import Pipeline, Stage, StageError
+
+        cancelled = asyncio.Event()
+
+        async def long_running(x):
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        async def broken(x):
+            await asyncio.sleep(0.01)
+            raise ValueError("boom")
+
+        pipeline = Pipeline([
+            Stage("long", long_running, inputs=("x",), outputs=("long",)),
+            Stage("broken", broken, inputs=("x",), outputs=("broken",)),
+            Stage("after", lambda broken: broken, inputs=("broken",), outputs=("after",)),
+        ])
+        try:
+            await asyncio.wait_for(pipeline.run({"x": 1}), timeout=2)
+            raise AssertionError("No se lanzó StageError")
+        except StageError as e:
+            assert e.stage == "broken" and isinstance(e.error, ValueError)
+
+        timings = pipeline.timings()
+        assert cancelled.is_set() and timings["long"]["status"] == "cancelled"
+        assert timings["after"]["status"] == "pending"
+
+        for stages in (
+            [Stage("a", str, inputs=("b",), outputs=("a",)), Stage("b", str, inputs=("a",), outputs=("b",))],
+            [Stage("a", str, outputs=("x",)), Stage("b", str, outputs=("x",))],
+        ):
+            try:
+                Pipeline(stages)
+                raise AssertionError("Pipeline inválido aceptado")
+            except ValueError:
+                pass
+        print("✅ StageError, cancelación y validación del DAG")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en test de fallo obligatorio: {e}")
+        return False
+
+
+async def test_fastapi_generation_pipeline():
+    """El trabajo de /generate traduce mientras lee la imagen, optimiza y encadena audio/upscale"""
+    print("🧪 Probando el pipeline de fastapi_app...")
+
+    try:
+        import fastapi_app
+        from config import Config
+
+        events = []
+
+        def detect_language(text):
+            events.append(("language", time.perf_counter()))
+            return "es"
+
+        async def translate_to_english(text, source=None):
+            await asyncio.sleep(0.1)
+            events.append(("translated", source))
+            return "a cat jumping", True
+
+        class FakeAPI:
+            async def optimize_prompt(self, image_url, text, image_bytes=None):
+                events.append(("optimize", image_bytes))
+                return f"{text}, cinematic"
+
+            async def generate_video(self, prompt, model, image_url):
+                events.append(("generate", prompt))
+                return {"id": "pred_1"}
+
+            async def add_audio_to_video(self, video_url, prompt):
+                return None  # Falla el audio: se conserva el video base
+
+            async def upscale_video_to_1080p(self, video_url):
+                events.append(("upscale", video_url))
+                return f"{video_url}?1080p"
+
+        async def fake_wait(api, request_id, **kwargs):
+            return {"outputs": ["https://cdn/video.mp4"]}
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            with open(os.path.join(tmp_dir, "input_1.jpg"), "wb") as f:
+                f.write(b"\xff\xd8image")
+
+            originals = (fastapi_app.detect_language, fastapi_app.translate_to_english, fastapi_app.AsyncWavespeedAPI,
+                         fastapi_app.wait_for_prediction, Config.VOLUME_PATH)
+            fastapi_app.detect_language = detect_language
+            fastapi_app.translate_to_english = translate_to_english
+            fastapi_app.AsyncWavespeedAPI = FakeAPI
+            fastapi_app.wait_for_prediction = fake_wait
+            Config.VOLUME_PATH = tmp_dir
+            try:
+                task = {"original_prompt": "un gato saltando", "model": "ultra_fast", "image_url": "https://x/images/input_1.jpg",
+                        "image_filename": "input_1.jpg", "auto_optimize": True, "add_audio": True, "upscale_1080p": True}
+                job = SimpleNamespace(id="job_pipeline_1", state=task, attempts=1, max_attempts=3)
+                await fastapi_app.process_video_generation(job, None)
+                # Reintento del trabajo: la URL de upscale guardada evita repetir (y pagar) la etapa
+                await fastapi_app.process_video_generation(job, None)
+            finally:
+                (fastapi_app.detect_language, fastapi_app.translate_to_english, fastapi_app.AsyncWavespeedAPI,
+                 fastapi_app.wait_for_prediction, Config.VOLUME_PATH) = originals
+
+        stages = task["stage_timings"]
+        optimize_bytes = next(value for name, value in events if name == "optimize")
+        assert task["status"] == "completed" and task["video_url"] == "https://cdn/video.mp4?1080p"
+        assert task["translated_prompt"] == "a cat jumping" and task["final_prompt"] == "a cat jumping, cinematic"
+        assert optimize_bytes == b"\xff\xd8image", "El optimizer no recibió la imagen"
+        assert stages["image"]["duration"] < stages["translate"]["duration"], stages
+        assert stages["audio"]["status"] == "fallback" and stages["upscale"]["status"] == "completed"
+        assert [name for name, _ in events].count("upscale") == 1, events
+        summary = ", ".join(f"{name}={record['status']}" for name, record in stages.items())
+        print(f"✅ Etapas: {summary}")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en test del pipeline de fastapi_app: {e}")
+        return False
+
+
+async def test_web_pipeline_chains_by_url():
+    """web_app encadena audio y upscale por URL de WaveSpeed y descarga solo el video final"""
+    print("🧪 Probando encadenado de audio y upscale por URL...")
+
+    try:
+        import web_app
+        from pathlib import Path
+
+        DOWNLOAD_TIME = 0.1  # Descarga simulada de un video (s)
+        calls = []
+
+        class FakeAPI:
+            async def generate_video(self, prompt, image_url, model):
+                return {"id": "pred_web"}
+
+            async def add_audio_to_video(self, video_url, prompt):
+                calls.append(("audio", video_url))
+                return "https://cdn/audio.mp4"
+
+            async def upscale_video_to_1080p(self, video_url):
+                calls.append(("upscale", video_url))
+                return "https://cdn/upscaled.mp4"
+
+            async def download_video_to_file(self, video_url, filename, directory=None, **kwargs):
+                calls.append(("download", video_url))
+                await asyncio.sleep(DOWNLOAD_TIME)
+                with open(os.path.join(directory, filename), "wb") as f:
+                    f.write(b"video")
+                return os.path.join(directory, filename)
+
+        async def fake_wait(api, request_id, **kwargs):
+            return {"outputs": ["https://cdn/base.mp4"]}
+
+        originals = (web_app.api_client, web_app.wait_for_prediction, web_app.detect_language, web_app.storage_dir)
+        web_app.api_client = FakeAPI()
+        web_app.wait_for_prediction = fake_wait
+        web_app.detect_language = lambda text: "en"
+        try:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                web_app.storage_dir = Path(tmp_dir)
+                task = {"original_prompt": "a cat"}
+                await web_app.process_video_generation(task, "task_chain", "a cat", None, "text_to_video",
+                                                       False, True, True)
+                first_calls = list(calls)
+
+                # Reintento del trabajo: las URLs intermedias guardadas evitan repetir audio y upscale
+                calls.clear()
+                await web_app.process_video_generation(task, "task_chain", "a cat", None, "text_to_video",
+                                                       False, True, True)
+        finally:
+            web_app.api_client, web_app.wait_for_prediction, web_app.detect_language, web_app.storage_dir = originals
+
+        stages = task["stage_timings"]
+        assert first_calls == [
+            ("audio", "https://cdn/base.mp4"),
+            ("upscale", "https://cdn/audio.mp4"),
+            ("download", "https://cdn/upscaled.mp4"),
+        ], first_calls
+        assert calls == [("download", "https://cdn/upscaled.mp4")], calls
+        assert task["message"] == "¡Video Ultimate completado!" and task["upscaled_video_url"] == task["video_url"]
+        # Antes: audio y upscale incluían cada uno una descarga completa, y había una descarga base más
+        print(f"✅ 1 descarga en vez de 3; ahorro por etapa ≈ {DOWNLOAD_TIME * 1000:.0f} ms de descarga simulada "
+              f"en audio y en upscale (+1 descarga base); download={stages['download']['duration']}s")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en test de encadenado por URL: {e}")
+        return False
+
+
+async def main():
+    """Función principal de testing"""
+    print("🚀 TEST DEL PIPELINE POR ETAPAS")
+    print("=" * 60)
+
+    tests = [
+        test_independent_stages_overlap,
+        test_timeout_retry_and_fallback,
+        test_required_failure_cancels,
+        test_fastapi_generation_pipeline,
+        test_web_pipeline_chains_by_url
+    ]
+
+    passed = 0
+    for test in tests:
+        if await test():
+            passed += 1
+
+    print("\n" + "=" * 60)
+    print(f"📊 RESULTADOS: {passed}/{len(tests)} tests pasaron")
+    return passed == len(tests)
+
+
+if __name__ == "__main__":
+    success = asyncio.run(main())
+    if not success:
+        sys.exit(1)
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+Test del PredictionTracker (poller central de predicciones)
+Compara el número de consultas de estado contra un loop de polling por trabajo
+"""
+import asyncio
+import logging
+import sys
+import time
+
+sys.path.append('.')
+
+# Configurar logging
+logging.basicConfig(level=logging.WARNING, format='%(levelname)s: %(message)s')
+
+# Escala de tiempo reducida: trabajo de ~60s con base 0.5s -> 1.2s con base 0.01s
+JOB_DURATION = 1.2
+BASE_INTERVAL = 0.01
+CONCURRENT_JOBS = 50
+
+
+class TimedWavespeedAPI:
+    """API simulada: cada predicción se completa JOB_DURATION segundos después de la primera consulta"""
+
+    def __init__(self, duration: float = JOB_DURATION, fail_ids=None):
+        self.duration = duration
+        self.fail_ids = set(fail_ids or [])
+        self.started = {}
+        self.status_requests = 0
+
+    def submit(self, request_id: str):
+        self.started[request_id] = time.monotonic()
+
+    async def get_video_status(self, request_id: str):
+        await asyncio.sleep(0.002)  # Latencia de red simulada
+        self.status_requests += 1
+        started = self.started.setdefault(request_id, time.monotonic())
+
+        if request_id in self.fail_ids:
+            return {"id": request_id, "status": "failed", "error": "Invalid image"}
+        if time.monotonic() - started < self.duration:
+            return {"id": request_id, "status": "processing", "outputs": []}
+        return {"id": request_id, "status": "completed", "outputs": [f"https://cdn.example.com/{request_id}.mp4"]}
+
+
+async def run_wave(api, waiter, prefix: str, count: int):
+    for i in range(count):
+        api.submit(f"{prefix}_{i}")
+    return await asyncio.gather(*[waiter(f"{prefix}_{i}") for i in range(count)])
+
+
+async def test_tracker_cuts_status_requests():
+    """El tracker debe reducir las consultas de estado en un orden de magnitud"""
+    print(f"🧪 Comparando consultas de estado para {CONCURRENT_JOBS} trabajos concurrentes...")
+
+    try:
+        from async_polling import wait_for_prediction
+        from prediction_tracker import PredictionTracker
+
+        # Línea base: un loop de polling independiente por trabajo
+        baseline_api = TimedWavespeedAPI()
+        await run_wave(
+            baseline_api,
+            lambda rid: wait_for_prediction(baseline_api, rid, base_interval=BASE_INTERVAL, use_tracker=False),
+            "baseline", CONCURRENT_JOBS
+        )
+        baseline_requests = baseline_api.status_requests
+
+        # Tracker: una primera ronda aprende la duración típica, la segunda la aprovecha
+        tracker = PredictionTracker(max_requests_per_second=2000)
+        tracker_api = TimedWavespeedAPI()
+        waiter = lambda rid: tracker.wait(tracker_api, rid, base_interval=BASE_INTERVAL, label="video:ultra_fast")
+
+        await run_wave(tracker_api, waiter, "warmup", 5)
+        tracker_api.status_requests = 0
+
+        start = time.monotonic()
+        results = await run_wave(tracker_api, waiter, "tracked", CONCURRENT_JOBS)
+        elapsed = time.monotonic() - start
+        tracker_requests = tracker_api.status_requests
+        await tracker.stop()
+
+        print(f"   Loop por trabajo: {baseline_requests} consultas ({baseline_requests / CONCURRENT_JOBS:.1f}/trabajo)")
+        print(f"   PredictionTracker: {tracker_requests} consultas ({tracker_requests / CONCURRENT_JOBS:.1f}/trabajo)")
+        print(f"   Reducción: {baseline_requests / max(tracker_requests, 1):.1f}x")
+        print(f"   Latencia total de la ronda: {elapsed:.2f}s (duración del trabajo: {JOB_DURATION}s)")
+
+        assert all(r["status"] == "completed" for r in results)
+        assert tracker_requests * 8 <= baseline_requests, "La reducción es menor a lo esperado"
+        assert elapsed < JOB_DURATION * 1.6, "El tracker añadió demasiada latencia"
+        print("✅ El tracker reduce las consultas sin añadir latencia significativa")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en test de reducción de consultas: {e}")
+        return False
+
+
+async def test_duplicate_waiters_share_polls():
+    """Varios waiters del mismo request_id deben compartir las consultas"""
+    print("🧪 Probando deduplicación de request_id...")
+
+    try:
+        from prediction_tracker import PredictionTracker
+
+        tracker = PredictionTracker(max_requests_per_second=1000, jitter=0)
+        api = TimedWavespeedAPI(duration=0.1)
+        api.submit("shared")
+
+        results = await asyncio.gather(*[
+            tracker.wait(api, "shared", base_interval=0.02) for _ in range(5)
+        ])
+        stats = tracker.get_stats()
+        await tracker.stop()
+
+        assert all(r["outputs"] for r in results)
+        assert stats["deduplicated"] == 4
+        assert api.status_requests <= 10, f"Demasiadas consultas: {api.status_requests}"
+        print(f"✅ 5 waiters resueltos con {api.status_requests} consultas")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en test de deduplicación: {e}")
+        return False
+
+
+async def test_rate_limit_spreads_requests():
+    """El límite global de consultas/segundo debe repartir las ráfagas"""
+    print("🧪 Probando límite de consultas por segundo...")
+
+    try:
+        from prediction_tracker import PredictionTracker
+
+        tracker = PredictionTracker(max_requests_per_second=50, jitter=0)
+        api = TimedWavespeedAPI(duration=0)
+
+        start = time.monotonic()
+        await run_wave(api, lambda rid: tracker.wait(api, rid), "burst", 20)
+        elapsed = time.monotonic() - start
+        await tracker.stop()
+
+        # 20 consultas a 50 req/s -> ~0.4s como mínimo
+        print(f"   20 consultas en {elapsed:.2f}s")
+        assert elapsed >= 0.3, "Las consultas no se repartieron en el tiempo"
+        print("✅ Las consultas respetan el límite por segundo")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en test de límite de consultas: {e}")
+        return False
+
+
+async def test_failure_and_timeout():
+    """Los fallos y timeouts se propagan como excepciones específicas"""
+    print("🧪 Probando fallos y timeouts en el tracker...")
+
+    try:
+        from async_polling import PredictionFailedError, PredictionTimeoutError, fixed_polling_interval
+        from prediction_tracker import PredictionTracker
+
+        tracker = PredictionTracker(max_requests_per_second=1000, jitter=0)
+        api = TimedWavespeedAPI(duration=60, fail_ids=["bad"])
+
+        try:
+            await tracker.wait(api, "bad")
+            print("❌ No se lanzó PredictionFailedError")
+            return False
+        except PredictionFailedError as e:
+            assert e.error == "Invalid image"
+            print("✅ PredictionFailedError propagado")
+
+        try:
+            await tracker.wait(api, "slow", max_attempts=3, interval_fn=fixed_polling_interval(0.01))
+            print("❌ No se lanzó PredictionTimeoutError")
+            return False
+        except PredictionTimeoutError as e:
+            assert e.attempts == 3
+            print("✅ PredictionTimeoutError propagado")
+
+        assert tracker.get_stats()["pending"] == 0
+        await tracker.stop()
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en test de fallos: {e}")
+        return False
+
+
+async def main():
+    """Función principal de testing"""
+    print("🚀 TEST DEL PREDICTION TRACKER")
+    print("=" * 60)
+
+    tests = [
+        test_tracker_cuts_status_requests,
+        test_duplicate_waiters_share_polls,
+        test_rate_limit_spreads_requests,
+        test_failure_and_timeout
+    ]
+
+    passed = 0
+    for test in tests:
+        if await test():
+            passed += 1
+
+    print("\n" + "=" * 60)
+    print(f"📊 RESULTADOS: {passed}/{len(tests)} tests pasaron")
+    return passed == len(tests)
+
+
+if __name__ == "__main__":
+    success = asyncio.run(main())
+    if not success:
+        sys.exit(1)
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+Test de la caché del prompt optimizer (prompt_cache.py)
+Verifica aciertos en memoria sin gastar créditos, persistencia en disco, TTL y claves exactas por imagen
+"""
+import asyncio
+import io
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append('.')
+
+# Configurar logging
+logging.basicConfig(level=logging.WARNING, format='%(levelname)s: %(message)s')
+
+
+def make_image(quality=90, size=256):
+    """JPEG de prueba con formas suavizadas (bordes como en una foto)"""
+    from PIL import Image, ImageDraw, ImageFilter
+    image = Image.new("RGB", (size, size), (30, 60, 90))
+    draw = ImageDraw.Draw(image)
+    scale = size / 64
+    draw.ellipse((8 * scale, 10 * scale, 40 * scale, 44 * scale), fill=(220, 180, 40))
+    draw.rectangle((36 * scale, 30 * scale, 60 * scale, 60 * scale), fill=(40, 160, 90))
+    draw.polygon([(0, 63 * scale), (20 * scale, 40 * scale), (34 * scale, 63 * scale)], fill=(150, 40, 40))
+    image = image.filter(ImageFilter.GaussianBlur(2))
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+def make_api(cache):
+    """AsyncWavespeedAPI real con las llamadas HTTP sustituidas por un optimizer que cuenta envíos"""
+    import async_wavespeed
+    from async_wavespeed import AsyncWavespeedAPI
+
+    async_wavespeed.prompt_cache = cache
+    api = AsyncWavespeedAPI()
+    api.submits = []
+
+    async def optimize_prompt_v3(image_url, text, mode="video", style="default"):
+        api.submits.append(text)
+        return {"id": f"opt_{len(api.submits)}", "result": None}
+
+    async def get_video_status(request_id):
+        if text_of(request_id) == "fail":
+            return {"status": "failed", "error": "boom"}
+        return {"status": "completed", "outputs": [f"cinematic {text_of(request_id)}"]}
+
+    def text_of(request_id):
+        return api.submits[int(request_id.split("_")[1]) - 1]
+
+    api.optimize_prompt_v3 = optimize_prompt_v3
+    api.get_video_status = get_video_status
+    return api
+
+
+async def test_repeat_served_from_memory(tmp_dir):
+    """La misma foto y el mismo caption no vuelven a llamar al optimizer ni descargan la imagen"""
+    print("🧪 Probando repetición servida desde memoria...")
+
+    try:
+        from prompt_cache import PromptCache
+
+        cache = PromptCache(path=os.path.join(tmp_dir, "memory.db"))
+        api = make_api(cache)
+
+        image = make_image(90)
+        first = await api.optimize_prompt("https://x/cat.jpg", "a cat jumping", image_bytes=image)
+
+        iterations = 200
+        start = time.perf_counter()
+        for _ in range(iterations):
+            repeated = await api.optimize_prompt("https://x/cat2.jpg", "  A cat   JUMPING ", image_bytes=image)
+        per_call_ms = (time.perf_counter() - start) / iterations * 1000
+        await cache.close()
+
+        print(f"   {per_call_ms:.3f} ms por optimización repetida, {len(api.submits)} envío(s) al optimizer")
+        assert first == repeated == "cinematic a cat jumping"
+        assert len(api.submits) == 1, "Se gastaron créditos en una repetición"
+        assert per_call_ms < 1.0
+        assert cache.get_stats()["memory_hits"] == iterations
+        print("✅ Repeticiones en menos de 1 ms sin llamar a WaveSpeed")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en test de memoria: {e}")
+        return False
+
+
+async def test_disk_survives_restart(tmp_dir):
+    """Una caché nueva (otro proceso o reinicio) lee los resultados del nivel en disco"""
+    print("🧪 Probando persistencia en disco...")
+
+    try:
+        from prompt_cache import PromptCache, make_cache_key
+
+        path = os.path.join(tmp_dir, "disk.db")
+        cache = PromptCache(path=path)
+        api = make_api(cache)
+        await api.optimize_prompt("https://x/dog.jpg", "a dog", image_bytes=make_image(85))
+        await cache.close()
+
+        restarted = PromptCache(path=path)
+        api = make_api(restarted)
+        result = await api.optimize_prompt("https://x/dog.jpg", "a dog", image_bytes=make_image(85))
+        stats = restarted.get_stats()
+
+        # Sin disco solo queda la memoria del proceso
+        memory_only = PromptCache(path=path, use_disk=False)
+        missing = await memory_only.get(make_cache_key("sha256:x", "a dog"))
+        await restarted.close()
+
+        assert result == "cinematic a dog" and not api.submits
+        assert stats["disk_hits"] == 1 and stats["misses"] == 0
+        assert missing is None
+        print("✅ Resultado recuperado del disco tras el reinicio")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en test de disco: {e}")
+        return False
+
+
+async def test_ttl_and_failures(tmp_dir):
+    """Las entradas caducan en ambos niveles y las optimizaciones fallidas no se guardan"""
+    print("🧪 Probando TTL y fallos...")
+
+    try:
+        from prompt_cache import PromptCache
+
+        path = os.path.join(tmp_dir, "ttl.db")
+        cache = PromptCache(path=path, ttl=0.05)
+        api = make_api(cache)
+        image = make_image()
+
+        await api.optimize_prompt("https://x/a.jpg", "waves", image_bytes=image)
+        await asyncio.sleep(0.1)
+        await api.optimize_prompt("https://x/a.jpg", "waves", image_bytes=image)
+
+        failed = await api.optimize_prompt("https://x/a.jpg", "fail", image_bytes=image)
+        await api.optimize_prompt("https://x/a.jpg", "fail", image_bytes=image)
+        await cache.close()
+
+        assert api.submits == ["waves", "waves", "fail", "fail"], api.submits
+        assert failed is None
+        assert cache.get_stats()["expired"] == 1
+        print("✅ Entradas caducadas y fallos vuelven a consultar al optimizer")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en test de TTL: {e}")
+        return False
+
+
+async def test_key_components():
+    """Imágenes distintas nunca comparten clave (ni colores planos); mode o style cambian la clave"""
+    print("🧪 Probando componentes de la clave...")
+
+    try:
+        from PIL import Image
+        from prompt_cache import PromptCache, image_digest, make_cache_key, telegram_image_key
+
+        def solid(color):
+            buffer = io.BytesIO()
+            Image.new("RGB", (64, 64), color).save(buffer, format="JPEG")
+            return buffer.getvalue()
+
+        original = image_digest(make_image(95))
+        # Antes (dHash) rojo, azul y una imagen de poco contraste compartían la misma clave
+        digests = {image_digest(data) for data in (solid((200, 10, 10)), solid((10, 10, 200)), solid((120, 120, 121)),
+                                                     make_image(95), make_image(60))}
+        assert len(digests) == 5, digests
+        assert original == image_digest(make_image(95)) and original.startswith("sha256:")
+        assert telegram_image_key("AQAD123") == "tg:AQAD123" and telegram_image_key(None) is None
+
+        # La clave de Telegram se usa sin descargar ni hashear la imagen
+        cache = PromptCache(use_disk=False)
+        api = make_api(cache)
+        await api.optimize_prompt("https://x/a.jpg", "sunset", image_key=telegram_image_key("AQAD1"))
+        await api.optimize_prompt("https://x/other_path.jpg", "sunset", image_key=telegram_image_key("AQAD1"))
+        await api.optimize_prompt("https://x/a.jpg", "sunset", image_key=telegram_image_key("AQAD2"))
+        assert api.submits == ["sunset", "sunset"], api.submits
+
+        key = make_cache_key(original, "Hello  World")
+        assert key == make_cache_key(original, "hello world")
+        assert key != make_cache_key(original, "hello world", mode="image")
+        assert key != make_cache_key(original, "hello world", style="artistic")
+        assert key != make_cache_key(None, "hello world")
+
+        cache = PromptCache(max_entries=2, use_disk=False)
+        for name in ("a", "b", "c"):
+            await cache.set(name, name.upper())
+        assert cache.get_cached("a") is None and cache.get_cached("c") == "C"
+        print("✅ Claves y LRU correctos")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en test de claves: {e}")
+        return False
+
+
+async def main():
+    """Función principal de testing"""
+    print("🚀 TEST DE LA CACHÉ DE PROMPTS")
+    print("=" * 60)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        results = [
+            await test_repeat_served_from_memory(tmp_dir),
+            await test_disk_survives_restart(tmp_dir),
+            await test_ttl_and_failures(tmp_dir),
+            await test_key_components()
+        ]
+
+    passed = sum(results)
+    print("\n" + "=" * 60)
+    print(f"📊 RESULTADOS: {passed}/{len(results)} tests pasaron")
+    return passed == len(results)
+
+
+if __name__ == "__main__":
+    success = asyncio.run(main())
+    if not success:
+        sys.exit(1)
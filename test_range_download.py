@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+"""
+Test de descargas con HTTP Range (reanudación y segmentos paralelos)
+Servidor local con ancho de banda limitado por conexión, como un CDN real
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import struct
+import sys
+import tempfile
+import time
+
+sys.path.append('.')
+
+from aiohttp import web
+
+# Configurar logging
+logging.basicConfig(level=logging.WARNING, format='%(levelname)s: %(message)s')
+
+VIDEO_SIZE = 12 * 1024 * 1024  # 12 MB
+CONNECTION_RATE = 12 * 1024 * 1024  # bytes/s por conexión
+SERVE_CHUNK = 64 * 1024
+
+
+def mp4_header(total_size: int) -> bytes:
+    """Cabecera de un MP4 válido (ftyp + moov con mvhd de 10 s + cabecera de mdat hasta el final)"""
+    ftyp = struct.pack('>I4s4sI4s4s', 24, b'ftyp', b'isom', 0, b'isom', b'mp41')
+    mvhd = struct.pack('>I4sB3xIIII', 108, b'mvhd', 0, 0, 0, 1000, 10000) + bytes(80)
+    head = ftyp + struct.pack('>I4s', 8 + len(mvhd), b'moov') + mvhd
+    return head + struct.pack('>I4s', total_size - len(head), b'mdat')
+
+
+def build_video() -> bytes:
+    header = mp4_header(VIDEO_SIZE)
+    body = hashlib.sha256(b'telewan').digest() * ((VIDEO_SIZE - len(header)) // 32 + 1)
+    return (header + body)[:VIDEO_SIZE]
+
+
+class RangeVideoServer:
+    """Servidor local que soporta Range, limita el ancho de banda por conexión y puede cortar descargas"""
+
+    def __init__(self, video: bytes, accept_ranges: bool = True):
+        self.video = video
+        self.accept_ranges = accept_ranges
+        self.bytes_served = 0
+        self.cut_after = None  # Cortar la próxima respuesta tras N bytes
+        self.runner = None
+        self.url = None
+
+    def _parse_range(self, header):
+        start, _, end = header.replace('bytes=', '').partition('-')
+        start = int(start)
+        end = int(end) if end else len(self.video) - 1
+        return start, min(end, len(self.video) - 1)
+
+    async def handle_video(self, request):
+        headers = {'Content-Type': 'video/mp4'}
+        if self.accept_ranges:
+            headers['Accept-Ranges'] = 'bytes'
+
+        if request.method == 'HEAD':
+            headers['Content-Length'] = str(len(self.video))
+            return web.Response(headers=headers)
+
+        status, start, end = 200, 0, len(self.video) - 1
+        range_header = request.headers.get('Range')
+        if range_header and self.accept_ranges:
+            start, end = self._parse_range(range_header)
+            if start >= len(self.video):
+                return web.Response(status=416)
+            status = 206
+            headers['Content-Range'] = f"bytes {start}-{end}/{len(self.video)}"
+
+        response = web.StreamResponse(status=status, headers=headers)
+        response.content_length = end - start + 1
+        await response.prepare(request)
+
+        cut_after, self.cut_after = self.cut_after, None
+        sent = 0
+        for offset in range(start, end + 1, SERVE_CHUNK):
+            chunk = self.video[offset:min(offset + SERVE_CHUNK, end + 1)]
+            await response.write(chunk)
+            sent += len(chunk)
+            self.bytes_served += len(chunk)
+            if cut_after is not None and sent >= cut_after:
+                request.transport.close()
+                return response
+            await asyncio.sleep(len(chunk) / CONNECTION_RATE)
+
+        await response.write_eof()
+        return response
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get('/video.mp4', self.handle_video)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}/video.mp4"
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+
+def read_file(path: str) -> bytes:
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+async def timed_download(api, url, filename, directory):
+    start = time.monotonic()
+    path = await api.download_video_to_file(url, filename, directory=directory)
+    return path, time.monotonic() - start
+
+
+async def test_parallel_segments_throughput(video, storage_dir):
+    """Con Range, los segmentos paralelos deben multiplicar el throughput frente a una sola conexión"""
+    print(f"🧪 Descargando {VIDEO_SIZE // (1024 * 1024)} MB con límite de {CONNECTION_RATE // (1024 * 1024)} MB/s por conexión...")
+
+    try:
+        from async_wavespeed import AsyncWavespeedAPI
+        from config import Config
+
+        api = AsyncWavespeedAPI()
+        server = RangeVideoServer(video)
+        await server.start()
+
+        segments = Config.DOWNLOAD_SEGMENTS
+        Config.DOWNLOAD_SEGMENTS = 1
+        try:
+            single_path, single_elapsed = await timed_download(api, server.url, "single.mp4", storage_dir)
+        finally:
+            Config.DOWNLOAD_SEGMENTS = segments
+
+        parallel_path, parallel_elapsed = await timed_download(api, server.url, "parallel.mp4", storage_dir)
+        await server.stop()
+
+        mb = VIDEO_SIZE / (1024 * 1024)
+        print(f"   Una conexión:   {single_elapsed:.2f}s ({mb / single_elapsed:.1f} MB/s)")
+        print(f"   {segments} segmentos:    {parallel_elapsed:.2f}s ({mb / parallel_elapsed:.1f} MB/s)")
+        print(f"   Ganancia: {single_elapsed / parallel_elapsed:.1f}x")
+
+        assert read_file(single_path) == video
+        assert read_file(parallel_path) == video, "El archivo segmentado no coincide"
+        assert not [n for n in os.listdir(storage_dir) if '.part' in n], "Quedaron segmentos temporales"
+        assert single_elapsed / parallel_elapsed > 2, "Los segmentos paralelos no mejoraron el throughput"
+        print("✅ Descarga por segmentos íntegra y más rápida")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en test de segmentos paralelos: {e}")
+        return False
+
+
+async def test_resume_after_failure(video, storage_dir):
+    """Tras un corte, el reintento debe pedir solo los bytes que faltan"""
+    print("🧪 Probando reanudación tras un corte de conexión...")
+
+    try:
+        from async_wavespeed import AsyncWavespeedAPI
+        from config import Config
+
+        api = AsyncWavespeedAPI()
+        server = RangeVideoServer(video)
+        await server.start()
+
+        segments, backoff = Config.DOWNLOAD_SEGMENTS, Config.DOWNLOAD_RETRY_BACKOFF
+        Config.DOWNLOAD_SEGMENTS, Config.DOWNLOAD_RETRY_BACKOFF = 1, 0.01
+        try:
+            server.cut_after = VIDEO_SIZE // 2
+            path = await api.download_video_to_file(server.url, "resumed.mp4", directory=storage_dir)
+        finally:
+            Config.DOWNLOAD_SEGMENTS, Config.DOWNLOAD_RETRY_BACKOFF = segments, backoff
+        await server.stop()
+
+        overhead = server.bytes_served / VIDEO_SIZE
+        print(f"   Bytes servidos: {server.bytes_served:,} ({overhead:.2f}x el tamaño del video)")
+        assert read_file(path) == video, "El archivo reanudado no coincide"
+        assert overhead < 1.1, "Se volvió a descargar desde cero"
+        print("✅ La descarga se reanudó desde el último byte escrito")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en test de reanudación: {e}")
+        return False
+
+
+async def test_keep_partial_between_calls(video, storage_dir):
+    """Con keep_partial, una llamada posterior con el mismo filename reanuda el parcial"""
+    print("🧪 Probando reanudación entre llamadas (reintentos del handler)...")
+
+    try:
+        from async_wavespeed import AsyncWavespeedAPI, discard_partial_download
+
+        api = AsyncWavespeedAPI()
+        server = RangeVideoServer(video)
+        await server.start()
+
+        server.cut_after = VIDEO_SIZE // 8  # Corta uno de los segmentos paralelos
+        try:
+            await api.download_video_to_file(server.url, "handler.mp4", directory=storage_dir,
+                                             max_retries=0, keep_partial=True)
+            print("❌ El corte no produjo error")
+            return False
+        except Exception:
+            pass
+
+        partial = [n for n in os.listdir(storage_dir) if n.startswith("handler.mp4.part")]
+        assert partial, "No se conservó el parcial"
+
+        path = await api.download_video_to_file(server.url, "handler.mp4", directory=storage_dir)
+        await server.stop()
+
+        assert read_file(path) == video
+        assert server.bytes_served < VIDEO_SIZE * 1.1, "La segunda llamada descargó todo otra vez"
+        print(f"✅ Segunda llamada reanudó el parcial ({server.bytes_served:,} bytes servidos en total)")
+
+        # Limpieza explícita de parciales
+        open(os.path.join(storage_dir, "orphan.mp4.part"), 'wb').close()
+        open(os.path.join(storage_dir, "orphan.mp4.part2"), 'wb').close()
+        discard_partial_download(os.path.join(storage_dir, "orphan.mp4"))
+        assert not [n for n in os.listdir(storage_dir) if n.startswith("orphan")]
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en test de parciales entre llamadas: {e}")
+        return False
+
+
+async def test_server_without_ranges(video, storage_dir):
+    """Sin soporte de Range se descarga con una sola conexión desde cero"""
+    print("🧪 Probando servidor sin soporte de Range...")
+
+    try:
+        from async_wavespeed import AsyncWavespeedAPI
+
+        api = AsyncWavespeedAPI()
+        server = RangeVideoServer(video, accept_ranges=False)
+        await server.start()
+
+        # Un parcial previo no reanudable debe descartarse
+        with open(os.path.join(storage_dir, "norange.mp4.part"), 'wb') as f:
+            f.write(b'garbage')
+
+        path = await api.download_video_to_file(server.url, "norange.mp4", directory=storage_dir)
+        await server.stop()
+
+        assert read_file(path) == video
+        print("✅ Descarga completa sin Range")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en test sin Range: {e}")
+        return False
+
+
+async def main():
+    """Función principal de testing"""
+    print("🚀 TEST DE DESCARGAS CON HTTP RANGE")
+    print("=" * 60)
+
+    from async_wavespeed import close_shared_session
+
+    video = build_video()
+    tests = [
+        test_parallel_segments_throughput,
+        test_resume_after_failure,
+        test_keep_partial_between_calls,
+        test_server_without_ranges
+    ]
+
+    passed = 0
+    with tempfile.TemporaryDirectory() as storage_dir:
+        for test in tests:
+            if await test(video, storage_dir):
+                passed += 1
+
+    await close_shared_session()
+
+    print("\n" + "=" * 60)
+    print(f"📊 RESULTADOS: {passed}/{len(tests)} tests pasaron")
+    return passed == len(tests)
+
+
+if __name__ == "__main__":
+    success = asyncio.run(main())
+    if not success:
+        sys.exit(1)
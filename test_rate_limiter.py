@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+Test del rate limiter en memoria (rate_limiter.py)
+Verifica límites por plan, latencia de check(), volcado en lote y recuperación tras reinicio
+"""
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append('.')
+
+# Configurar logging
+logging.basicConfig(level=logging.WARNING, format='%(levelname)s: %(message)s')
+
+
+def make_limiter(db_path, flush_interval=60):
+    from rate_limiter import SlidingWindowRateLimiter
+    from usage_store import UsageStore, SQLiteUsageBackend
+    store = UsageStore(backend=SQLiteUsageBackend(db_path), legacy_json_path="")
+    return SlidingWindowRateLimiter(store=store, flush_interval=flush_interval), store
+
+
+async def test_tier_limits(db_path):
+    """El plan free se limita por fingerprint e IP; los planes de pago no"""
+    print("🧪 Probando límites por plan...")
+
+    try:
+        from config import Config
+
+        user_tiers = Config.RATE_LIMIT_USER_TIERS
+        Config.RATE_LIMIT_USER_TIERS = "fp_pro:pro, fp_bad:unknown_tier"
+        try:
+            limiter, store = make_limiter(db_path)
+            free_limit = Config.RATE_LIMIT_TIERS["free"]["daily"]
+
+            for _ in range(free_limit):
+                assert (await limiter.check("fp_free", "10.0.0.1")).allowed
+                await limiter.hit("fp_free", "10.0.0.1")
+            blocked = await limiter.check("fp_free", "10.0.0.1")
+
+            for _ in range(free_limit * 3):
+                await limiter.hit("fp_pro", "10.0.0.2")
+            pro = await limiter.check("fp_pro", "10.0.0.2")
+
+            assert limiter.tier_for("fp_bad") == Config.RATE_LIMIT_DEFAULT_TIER
+        finally:
+            Config.RATE_LIMIT_USER_TIERS = user_tiers
+
+        ip_limit = Config.RATE_LIMIT_TIERS["free"]["ip_daily"]
+        for i in range(ip_limit):
+            await limiter.hit(f"fp_nat_{i}", "10.0.0.3")
+        nat = await limiter.check("fp_nat_new", "10.0.0.3")
+        await store.close()
+
+        assert not blocked.allowed and blocked.used == free_limit and blocked.remaining == 0
+        assert pro.allowed and pro.tier == "pro" and pro.limit is None
+        assert not nat.allowed and nat.scope == "ip", "El límite por IP no se aplicó"
+        print(f"✅ free bloqueado en {free_limit}, pro ilimitado, IP bloqueada en {ip_limit}")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en test de planes: {e}")
+        return False
+
+
+async def test_check_from_memory(db_path):
+    """Tras la primera carga, check() responde desde memoria sin tocar el almacén"""
+    print("🧪 Midiendo latencia de check()...")
+
+    try:
+        limiter, store = make_limiter(db_path)
+        await limiter.check("fp_hot", "10.0.0.9")  # Carga inicial desde el almacén
+
+        lookups = []
+        original_get_usage = store.get_usage
+
+        async def counting_get_usage(*args, **kwargs):
+            lookups.append(args)
+            return await original_get_usage(*args, **kwargs)
+        store.get_usage = counting_get_usage
+
+        iterations = 10000
+        start = time.perf_counter()
+        for _ in range(iterations):
+            await limiter.check("fp_hot", "10.0.0.9")
+        per_check_us = (time.perf_counter() - start) / iterations * 1e6
+        await store.close()
+
+        print(f"   {per_check_us:.1f} µs por check()")
+        assert not lookups, "check() consultó el almacén"
+        assert per_check_us < 200
+        print("✅ check() servido desde memoria")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en test de latencia: {e}")
+        return False
+
+
+async def test_write_behind_and_restart(db_path):
+    """Los hits se vuelcan en lote y sobreviven a un reinicio del proceso"""
+    print("🧪 Probando volcado en lote y reinicio...")
+
+    try:
+        limiter, store = make_limiter(db_path, flush_interval=0.05)
+        await limiter.start()
+
+        writes = []
+        original_increment_many = store.increment_many
+
+        async def counting_increment_many(items):
+            writes.append(len(items))
+            return await original_increment_many(items)
+        store.increment_many = counting_increment_many
+
+        for i in range(20):
+            await limiter.hit(f"fp{i % 4}", "10.0.0.5")
+        assert await store.get_usage("fp0") == 0, "Se escribió en disco por cada hit"
+
+        await asyncio.sleep(0.2)
+        after_interval = await store.get_usage("fp0")
+
+        await limiter.hit("fp0", "10.0.0.5")
+        await limiter.stop()  # El shutdown vuelca lo pendiente
+        await store.close()
+
+        # "Reinicio": limiter nuevo sobre la misma base de datos
+        restarted, restarted_store = make_limiter(db_path)
+        used = await restarted.usage("fp0")
+        await restarted_store.close()
+
+        print(f"   Lotes escritos: {writes} (21 hits)")
+        assert after_interval == 5
+        assert used == 6, f"Se perdieron hits en el reinicio ({used})"
+        assert sum(writes) < 21
+        print("✅ Contadores persistidos en lote y recuperados tras el reinicio")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en test de volcado: {e}")
+        return False
+
+
+async def test_processes_share_counts(db_path):
+    """Dos procesos con su propio limiter convergen al total durable tras volcar"""
+    print("🧪 Probando convergencia entre procesos...")
+
+    try:
+        first, first_store = make_limiter(db_path)
+        second, second_store = make_limiter(db_path)
+
+        for _ in range(2):
+            await first.hit("fp_shared")
+        for _ in range(3):
+            await second.hit("fp_shared")
+        await first.flush()
+        await second.flush()
+        # Una clave consultada desde el último volcado se sincroniza en el siguiente
+        await first.check("fp_shared")
+        await first.flush()
+
+        first_used = await first.usage("fp_shared")
+        second_used = await second.usage("fp_shared")
+        await first_store.close()
+        await second_store.close()
+
+        assert first_used == 5 and second_used == 5, f"{first_used} / {second_used}"
+        print("✅ Ambos procesos ven 5 usos tras el volcado")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en test de convergencia: {e}")
+        return False
+
+
+async def test_sliding_window_weights_yesterday(db_path):
+    """El uso de ayer cuenta en proporción a la parte de la ventana que aún no ha pasado"""
+    print("🧪 Probando ventana deslizante...")
+
+    try:
+        from datetime import date, timedelta
+        from rate_limiter import _Window, SlidingWindowRateLimiter
+
+        today = date.today().isoformat()
+        yesterday = (date.today() - timedelta(days=1)).isoformat()
+
+        window = _Window(day=today, current=1, previous=10)
+        used = SlidingWindowRateLimiter._used(window)
+        assert 1 <= used <= 11
+
+        limiter, store = make_limiter(db_path)
+        stale = _Window(day=yesterday, current=4, pending=2)
+        limiter._windows[("fingerprint", "fp_roll")] = stale
+        await limiter.usage("fp_roll")
+        assert stale.day == today and stale.previous == 4 and stale.current == 0
+        await limiter.flush()
+        assert await store.get_usage("fp_roll", day=yesterday) == 2, "El pendiente de ayer se perdió"
+        await store.close()
+
+        print(f"✅ Uso ponderado actual: {used} (hoy 1, ayer 10)")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en test de ventana deslizante: {e}")
+        return False
+
+
+async def main():
+    """Función principal de testing"""
+    print("🚀 TEST DEL RATE LIMITER EN MEMORIA")
+    print("=" * 60)
+
+    tests = [
+        test_tier_limits,
+        test_check_from_memory,
+        test_write_behind_and_restart,
+        test_processes_share_counts,
+        test_sliding_window_weights_yesterday
+    ]
+
+    passed = 0
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for index, test in enumerate(tests):
+            if await test(os.path.join(tmp_dir, f"usage_{index}.db")):
+                passed += 1
+
+    print("\n" + "=" * 60)
+    print(f"📊 RESULTADOS: {passed}/{len(tests)} tests pasaron")
+    return passed == len(tests)
+
+
+if __name__ == "__main__":
+    success = asyncio.run(main())
+    if not success:
+        sys.exit(1)
@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+"""
+Test de la caché de videos sociales por ID canónico (social_cache.py)
+Verifica la canonicalización por plataforma, la resolución de enlaces cortos, que un enlace repetido
+se sirve desde la caché sin descargar, la vigencia (TTL), la expulsión por tamaño y la persistencia
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import logging
+
+sys.path.append('.')
+
+# Configurar logging
+logging.basicConfig(level=logging.WARNING, format='%(levelname)s: %(message)s')
+
+
+def make_cache(tmp_dir, **kwargs):
+    from social_cache import SocialCache
+    return SocialCache(path=os.path.join(tmp_dir, "social.db"), directory=os.path.join(tmp_dir, "videos"), **kwargs)
+
+
+async def test_canonical_ids():
+    """Variantes del mismo video producen la misma clave"""
+    print("🧪 Probando canonicalización por plataforma...")
+
+    try:
+        from social_cache import canonical_id, is_short_link
+
+        groups = [
+            ("x:1790000000000000001", [
+                "https://x.com/user/status/1790000000000000001",
+                "https://twitter.com/user/status/1790000000000000001?s=20&t=abc",
+                "https://mobile.twitter.com/user/status/1790000000000000001/video/1",
+                "https://fxtwitter.com/user/status/1790000000000000001",
+            ]),
+            ("tiktok:7301234567890123456", [
+                "https://www.tiktok.com/@someone/video/7301234567890123456?is_from_webapp=1&sender_device=pc",
+                "https://m.tiktok.com/v/7301234567890123456.html",
+            ]),
+            ("instagram:C1a2B3c4D5e", [
+                "https://www.instagram.com/reel/C1a2B3c4D5e/?igsh=MWx5",
+                "https://instagram.com/p/C1a2B3c4D5e",
+                "https://www.instagram.com/someone/reel/C1a2B3c4D5e/",
+            ]),
+            ("reddit:1abc2de", [
+                "https://www.reddit.com/r/videos/comments/1abc2de/funny_cat/?utm_source=share",
+                "https://old.reddit.com/r/videos/comments/1abc2de/",
+                "https://redd.it/1abc2de",
+            ]),
+            ("facebook:1234567890123", [
+                "https://www.facebook.com/watch?v=1234567890123&mibextid=abc",
+                "https://m.facebook.com/somepage/videos/1234567890123/",
+                "https://www.facebook.com/reel/1234567890123",
+            ]),
+        ]
+        for expected, urls in groups:
+            ids = {canonical_id(url) for url in urls}
+            assert ids == {expected}, (expected, ids)
+
+        fallback = canonical_id("https://www.example.com/clip/?utm_source=x&b=2&a=1#t")
+        assert fallback == "https://example.com/clip?a=1&b=2", fallback
+
+        assert is_short_link("https://vm.tiktok.com/ZMabc123/")
+        assert is_short_link("https://www.tiktok.com/t/ZTabc123/")
+        assert is_short_link("https://www.reddit.com/r/videos/s/AbCdEf")
+        assert is_short_link("https://fb.watch/abcDEF/")
+        assert not is_short_link("https://www.tiktok.com/@u/video/1")
+
+        print(f"✅ {sum(len(urls) for _, urls in groups)} enlaces -> {len(groups)} IDs canónicos")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en test de canonicalización: {e}")
+        return False
+
+
+async def test_short_link_resolution():
+    """Los enlaces cortos se resuelven siguiendo la redirección sin descargar la página, y se memorizan"""
+    print("🧪 Probando resolución de enlaces cortos...")
+
+    try:
+        from aiohttp import web
+        import social_cache as social_cache_module
+        from async_wavespeed import close_shared_session
+
+        target = "https://www.tiktok.com/@someone/video/7301234567890123456?is_from_webapp=1"
+        requests_seen = []
+
+        async def redirect(request):
+            requests_seen.append(request.path)
+            if request.path == "/hop":
+                raise web.HTTPMovedPermanently("/final")
+            raise web.HTTPFound(target)
+
+        app = web.Application()
+        app.router.add_get("/hop", redirect)
+        app.router.add_get("/final", redirect)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        try:
+            resolved = await social_cache_module.resolve_short_url(f"http://127.0.0.1:{port}/hop")
+        finally:
+            await runner.cleanup()
+            await close_shared_session()
+
+        assert resolved == target and requests_seen == ["/hop", "/final"], (resolved, requests_seen)
+
+        # canonicalize memoriza la resolución: un segundo envío del enlace corto no hace peticiones
+        calls = []
+
+        async def fake_resolve(url, **kwargs):
+            calls.append(url)
+            return target
+
+        original = social_cache_module.resolve_short_url
+        social_cache_module.resolve_short_url = fake_resolve
+        try:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                cache = make_cache(tmp_dir)
+                first = await cache.canonicalize("https://vm.tiktok.com/ZMabc123/")
+                second = await cache.canonicalize("https://vm.tiktok.com/ZMabc123")
+                await cache.close()
+        finally:
+            social_cache_module.resolve_short_url = original
+
+        assert first == second == "tiktok:7301234567890123456" and len(calls) == 1
+        print(f"✅ 2 redirecciones seguidas; enlace corto -> {first} (1 resolución para 2 envíos)")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en test de enlaces cortos: {e}")
+        return False
+
+
+async def test_repeat_link_served_from_cache():
+    """Un enlace repetido (otra variante) se sirve desde disco sin descargar; el archivo no se borra"""
+    print("🧪 Probando aciertos de caché en la cola de descargas...")
+
+    try:
+        from download_service import DownloadService
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            calls = []
+            cleaned = []
+
+            async def fake_download(url, platform, report):
+                calls.append(url)
+                await asyncio.sleep(0.2)  # Descarga real simulada
+                path = os.path.join(tmp_dir, "social_video_1.mp4")
+                with open(path, "wb") as f:
+                    f.write(b"0" * 50000)
+                return {'success': True, 'filepath': path, 'title': "Gato", 'duration': 9, 'platform': platform,
+                        'method': 'yt-dlp', 'file_size': 50000}
+
+            cache = make_cache(tmp_dir)
+            service = DownloadService(fake_download, lambda url: "X (Twitter)", cleanup_fn=cleaned.append, cache=cache)
+
+            first = await service.download("https://x.com/user/status/1790000000000000001?s=20")
+            service.release(first)
+
+            start = time.perf_counter()
+            second = await service.download("https://twitter.com/other/status/1790000000000000001")
+            hit_ms = (time.perf_counter() - start) * 1000
+            service.release(second)
+
+            await cache.remember_file_id(first['canonical_id'], "FILE_ID_1", "UNIQUE_1")
+            artifact = await cache.lookup("x:1790000000000000001")
+            await cache.close()
+
+            assert len(calls) == 1, calls
+            assert first['cached'] and first['filepath'].startswith(os.path.join(tmp_dir, "videos"))
+            assert second['cache_hit'] and second['filepath'] == first['filepath'] and second['title'] == "Gato"
+            assert os.path.exists(first['filepath']) and not cleaned, "El archivo de la caché no debe borrarse"
+            assert artifact.file_id == "FILE_ID_1"
+            assert hit_ms < 50, f"Acierto de caché lento: {hit_ms:.1f} ms"
+
+        print(f"✅ 2.º enlace servido en {hit_ms:.1f} ms sin descargar (descarga simulada: 200 ms)")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en test de aciertos de caché: {e}")
+        return False
+
+
+async def test_ttl_size_eviction_and_persistence():
+    """Entradas caducadas se eliminan; al superar el límite se expulsan los archivos menos usados"""
+    print("🧪 Probando TTL, expulsión por tamaño y persistencia...")
+
+    try:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cache = make_cache(tmp_dir, max_bytes=25000)
+
+            async def store(name, size):
+                path = os.path.join(tmp_dir, f"{name}.mp4")
+                with open(path, "wb") as f:
+                    f.write(b"0" * size)
+                return await cache.store(f"x:{name}", {'success': True, 'filepath': path, 'platform': "X"})
+
+            first = await store("1", 10000)
+            await cache.remember_file_id("x:1", "FILE_1")
+            await asyncio.sleep(0.01)
+            second = await store("2", 10000)
+            await asyncio.sleep(0.01)
+            await cache.lookup("x:1")  # x:1 pasa a ser el más reciente
+            await asyncio.sleep(0.01)
+            await store("3", 10000)  # 30000 > 25000: se expulsa el archivo menos usado (x:2)
+
+            assert os.path.exists(first['filepath']) and not os.path.exists(second['filepath'])
+            assert await cache.lookup("x:2") is None, "Entrada sin archivo ni file_id debería desaparecer"
+            await cache.close()
+
+            # Persistencia: otra instancia (reinicio del bot) encuentra el archivo y el file_id
+            restarted = make_cache(tmp_dir, max_bytes=25000)
+            artifact = await restarted.lookup("x:1")
+            assert artifact is not None and artifact.file_id == "FILE_1" and artifact.filepath == first['filepath']
+            await restarted.close()
+
+            # TTL: todo lo anterior ha caducado
+            expiring = make_cache(tmp_dir, ttl=0.001)
+            await asyncio.sleep(0.01)
+            assert await expiring.lookup("x:1") is None and not os.path.exists(first['filepath'])
+            await expiring.evict()
+            assert not os.listdir(os.path.join(tmp_dir, "videos")), os.listdir(os.path.join(tmp_dir, "videos"))
+            stats = expiring.get_stats()
+            await expiring.close()
+
+        print(f"✅ Expulsión LRU por tamaño, persistencia y TTL; stats: {stats}")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en test de TTL/expulsión: {e}")
+        return False
+
+
+async def main():
+    """Función principal de testing"""
+    print("🚀 TEST DE LA CACHÉ DE VIDEOS SOCIALES")
+    print("=" * 60)
+
+    tests = [
+        test_canonical_ids,
+        test_short_link_resolution,
+        test_repeat_link_served_from_cache,
+        test_ttl_size_eviction_and_persistence
+    ]
+
+    passed = 0
+    for test in tests:
+        if await test():
+            passed += 1
+
+    print("\n" + "=" * 60)
+    print(f"📊 RESULTADOS: {passed}/{len(tests)} tests pasaron")
+    return passed == len(tests)
+
+
+if __name__ == "__main__":
+    success = asyncio.run(main())
+    if not success:
+        sys.exit(1)
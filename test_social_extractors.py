@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+Test de los extractores de redes sociales (social_extractors.py)
+Verifica la detección de plataforma por sufijo de dominio y el parsing del corpus de páginas
+guardadas en fixtures/social_html, con un presupuesto de tiempo por página para detectar
+regresiones y ralentizaciones sin conexión
+"""
+import asyncio
+import json
+import os
+import re
+import statistics
+import sys
+import time
+import logging
+
+sys.path.append('.')
+
+# Configurar logging
+logging.basicConfig(level=logging.WARNING, format='%(levelname)s: %(message)s')
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "social_html")
+
+# Tiempo máximo (mediana) de parsing por página del corpus
+PARSE_BUDGET_MS = 25.0
+
+
+def load_corpus():
+    with open(os.path.join(FIXTURES_DIR, "expected.json"), encoding="utf-8") as f:
+        expected = json.load(f)
+    pages = {}
+    for name in expected:
+        with open(os.path.join(FIXTURES_DIR, name), encoding="utf-8") as f:
+            pages[name] = f.read()
+    return expected, pages
+
+
+def legacy_tiktok_parse(content):
+    """Parsing anterior de bot.py (varias búsquedas sobre todo el HTML), como referencia del benchmark"""
+    video_url = None
+    for pattern in [r'"playAddr":"([^"]+)"', r'"downloadAddr":"([^"]+)"', r'playAddr["\s]*:[\s]*"([^"]+)"',
+                    r'https://v\d+\.ttcdn\.cn[^"\s]+', r'https://v\d+\.bytecdn\.cn[^"\s]+']:
+        match = re.search(pattern, content)
+        if match:
+            video_url = match.group(1).replace('\\u0026', '&').replace('\\', '')
+            if video_url.startswith('http'):
+                break
+    title = None
+    for pattern in [r'"desc":"([^"]+)"', r'"text":"([^"]+)"', r'title["\s]*:[\s]*"([^"]+)"']:
+        match = re.search(pattern, content)
+        if match:
+            title = match.group(1).replace('\\n', ' ').strip()
+            break
+    return video_url, title
+
+
+def median_ms(fn, arg, runs=15):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn(arg)
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+async def test_platform_detection():
+    """Sufijo de dominio: subdominios y dominios cortos sí, subcadenas de otros dominios no"""
+    print("🧪 Probando detección de plataforma por sufijo de dominio...")
+
+    try:
+        from social_extractors import detect_platform, platforms
+
+        cases = [
+            ("https://www.tiktok.com/@u/video/1", "TikTok"),
+            ("https://vm.tiktok.com/ZMabc/", "TikTok"),
+            ("https://instagr.am/p/ABC", "Instagram"),
+            ("https://m.facebook.com/watch?v=1", "Facebook"),
+            ("https://fb.watch/abc/", "Facebook"),
+            ("https://mobile.twitter.com/u/status/1", "X (Twitter)"),
+            ("https://X.COM/u/status/1", "X (Twitter)"),
+            ("https://old.reddit.com/r/a/comments/1", "Reddit"),
+            ("https://redd.it/1abc", "Reddit"),
+            ("https://www.netflix.com/watch/1", None),  # Antes: 'x.com' in 'www.netflix.com'
+            ("https://x.com.evil.example/status/1", None),
+            ("https://notreddit.com/r/a", None),
+            ("https://youtube.com/watch?v=abc", None),
+            ("not-a-url", None),
+        ]
+        for url, expected in cases:
+            assert detect_platform(url) == expected, (url, detect_platform(url), expected)
+
+        urls = [url for url, _ in cases] * 1000
+        start = time.perf_counter()
+        for url in urls:
+            detect_platform(url)
+        per_url_us = (time.perf_counter() - start) * 1e6 / len(urls)
+
+        assert set(platforms()) == {"TikTok", "Instagram", "Facebook", "X (Twitter)", "Reddit"}
+        print(f"✅ {len(cases)} casos correctos; {per_url_us:.1f} µs por URL")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en test de detección: {e}")
+        return False
+
+
+async def test_fixture_corpus():
+    """Cada página guardada produce exactamente el video, título y duración esperados"""
+    print("🧪 Probando el corpus de páginas guardadas...")
+
+    try:
+        from social_extractors import get_extractor
+
+        expected, pages = load_corpus()
+        for name, want in expected.items():
+            video = get_extractor(want["platform"]).parse(pages[name])
+            if want["video_url"] is None:
+                assert video is None, f"{name}: se esperaba None, se obtuvo {video}"
+                continue
+            assert video is not None, f"{name}: no se encontró el video"
+            got = {"platform": want["platform"], "video_url": video.video_url, "title": video.title,
+                   "duration": video.duration}
+            assert got == want, f"{name}: {got} != {want}"
+
+        print(f"✅ {len(expected)} páginas con el resultado esperado")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en test del corpus: {e}")
+        return False
+
+
+async def test_parse_benchmark():
+    """Tiempo de parsing por página dentro del presupuesto; comparación con el parsing anterior"""
+    print("🧪 Midiendo tiempo de parsing del corpus...")
+
+    try:
+        from social_extractors import get_extractor
+
+        expected, pages = load_corpus()
+        lines = []
+        for name, want in expected.items():
+            page = pages[name]
+            parse_ms = median_ms(get_extractor(want["platform"]).parse, page)
+            line = f"   {name:<26} {len(page) / 1024:6.0f} KB  {parse_ms:6.2f} ms"
+            if want["platform"] == "TikTok":
+                legacy_ok = legacy_tiktok_parse(page) == (want["video_url"], want.get("title"))
+                line += f"  (anterior: {median_ms(legacy_tiktok_parse, page):6.2f} ms, {'correcto' if legacy_ok else 'incorrecto'})"
+            lines.append(line)
+            assert parse_ms < PARSE_BUDGET_MS, f"{name}: {parse_ms:.2f} ms supera {PARSE_BUDGET_MS} ms"
+
+        print("✅ Parsing dentro del presupuesto:")
+        print("\n".join(lines))
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en benchmark de parsing: {e}")
+        return False
+
+
+async def main():
+    """Función principal de testing"""
+    print("🚀 TEST DE LOS EXTRACTORES DE REDES SOCIALES")
+    print("=" * 60)
+
+    tests = [
+        test_platform_detection,
+        test_fixture_corpus,
+        test_parse_benchmark
+    ]
+
+    passed = 0
+    for test in tests:
+        if await test():
+            passed += 1
+
+    print("\n" + "=" * 60)
+    print(f"📊 RESULTADOS: {passed}/{len(tests)} tests pasaron")
+    return passed == len(tests)
+
+
+if __name__ == "__main__":
+    success = asyncio.run(main())
+    if not success:
+        sys.exit(1)
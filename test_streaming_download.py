@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+Test de la descarga de videos en streaming a disco (AsyncWavespeedAPI.download_video_to_file)
+Verifica integridad del archivo, renombrado atómico, límite de tamaño y memoria pico acotada
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import struct
+import sys
+import tempfile
+import tracemalloc
+
+sys.path.append('.')
+
+from aiohttp import web
+
+# Configurar logging
+logging.basicConfig(level=logging.WARNING, format='%(levelname)s: %(message)s')
+
+VIDEO_SIZE = 30 * 1024 * 1024  # 30 MB
+SERVE_CHUNK = 64 * 1024
+
+
+def mp4_header(total_size: int) -> bytes:
+    """Cabecera de un MP4 válido (ftyp + moov con mvhd de 10 s + cabecera de mdat hasta el final)"""
+    ftyp = struct.pack('>I4s4sI4s4s', 24, b'ftyp', b'isom', 0, b'isom', b'mp41')
+    mvhd = struct.pack('>I4sB3xIIII', 108, b'mvhd', 0, 0, 0, 1000, 10000) + bytes(80)
+    head = ftyp + struct.pack('>I4s', 8 + len(mvhd), b'moov') + mvhd
+    return head + struct.pack('>I4s', total_size - len(head), b'mdat')
+
+
+def fake_mp4_block(index: int) -> bytes:
+    """Bloque determinista; el primero lleva la cabecera de un MP4 completo"""
+    if index == 0:
+        header = mp4_header(VIDEO_SIZE)
+        return header + bytes(SERVE_CHUNK - len(header))
+    return bytes([index % 256]) * SERVE_CHUNK
+
+
+class FakeVideoServer:
+    """Servidor local que sirve un MP4 grande por bloques"""
+
+    def __init__(self):
+        self.runner = None
+        self.url = None
+
+    async def handle_video(self, request):
+        if request.method == 'HEAD':
+            return web.Response(headers={'Content-Type': 'video/mp4', 'Content-Length': str(VIDEO_SIZE)})
+        response = web.StreamResponse(headers={'Content-Type': 'video/mp4'})
+        response.content_length = VIDEO_SIZE
+        await response.prepare(request)
+        for i in range(VIDEO_SIZE // SERVE_CHUNK):
+            await response.write(fake_mp4_block(i))
+        await response.write_eof()
+        return response
+
+    async def handle_truncated(self, request):
+        # El servidor corta la conexión a mitad del archivo
+        response = web.StreamResponse(headers={'Content-Type': 'video/mp4'})
+        response.content_length = VIDEO_SIZE
+        await response.prepare(request)
+        await response.write(fake_mp4_block(0))
+        request.transport.close()
+        return response
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get('/video.mp4', self.handle_video)
+        app.router.add_get('/truncated.mp4', self.handle_truncated)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}"
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+
+def expected_sha256() -> str:
+    digest = hashlib.sha256()
+    for i in range(VIDEO_SIZE // SERVE_CHUNK):
+        digest.update(fake_mp4_block(i))
+    return digest.hexdigest()
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+async def test_streaming_download_bounded_memory(server, storage_dir):
+    """El archivo descargado debe ser idéntico y la memoria pico muy inferior al tamaño del video"""
+    print(f"🧪 Descargando video de {VIDEO_SIZE // (1024 * 1024)} MB en streaming...")
+
+    try:
+        from async_wavespeed import AsyncWavespeedAPI, get_shared_session
+
+        api = AsyncWavespeedAPI()
+        await get_shared_session()  # Crear la sesión fuera de la medición
+
+        tracemalloc.start()
+        path = await api.download_video_to_file(f"{server.url}/video.mp4", "streamed.mp4",
+                                                model='quality', directory=storage_dir)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        print(f"   Memoria pico (tracemalloc): {peak / 1024:.0f} KB")
+        assert os.path.getsize(path) == VIDEO_SIZE
+        assert file_sha256(path) == expected_sha256(), "El contenido descargado no coincide"
+        assert not os.path.exists(f"{path}.part"), "Quedó el archivo temporal"
+        assert peak < 2 * 1024 * 1024, f"Memoria pico demasiado alta: {peak} bytes"
+        print("✅ Video íntegro con memoria acotada")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en descarga en streaming: {e}")
+        return False
+
+
+async def test_failed_download_leaves_no_partial_file(server, storage_dir):
+    """Una descarga interrumpida o demasiado grande no debe dejar archivos a medias"""
+    print("🧪 Probando limpieza tras descargas fallidas...")
+
+    try:
+        from async_wavespeed import AsyncWavespeedAPI, VideoIntegrityValidator
+
+        api = AsyncWavespeedAPI()
+
+        try:
+            await api.download_video_to_file(f"{server.url}/truncated.mp4", "truncated.mp4", directory=storage_dir)
+            print("❌ La descarga truncada no lanzó error")
+            return False
+        except Exception:
+            pass
+        assert not os.path.exists(os.path.join(storage_dir, "truncated.mp4"))
+        assert not os.path.exists(os.path.join(storage_dir, "truncated.mp4.part"))
+        print("✅ Descarga truncada descartada")
+
+        validator = VideoIntegrityValidator(max_size=1024 * 1024)
+        try:
+            validator.check_content_length(VIDEO_SIZE)
+            print("❌ No se rechazó un Content-Length excesivo")
+            return False
+        except ValueError:
+            pass
+
+        validator.feed(fake_mp4_block(0))
+        assert validator.signature_checked
+        try:
+            for i in range(1, 32):
+                validator.feed(fake_mp4_block(i))
+            print("❌ No se cortó la descarga al superar el límite")
+            return False
+        except ValueError:
+            pass
+        print("✅ Límite de tamaño aplicado durante la descarga")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en test de descargas fallidas: {e}")
+        return False
+
+
+async def main():
+    """Función principal de testing"""
+    print("🚀 TEST DE DESCARGA EN STREAMING")
+    print("=" * 60)
+
+    from async_wavespeed import close_shared_session
+
+    server = FakeVideoServer()
+    await server.start()
+
+    passed = 0
+    tests = [
+        test_streaming_download_bounded_memory,
+        test_failed_download_leaves_no_partial_file
+    ]
+
+    with tempfile.TemporaryDirectory() as storage_dir:
+        for test in tests:
+            if await test(server, storage_dir):
+                passed += 1
+
+    await close_shared_session()
+    await server.stop()
+
+    print("\n" + "=" * 60)
+    print(f"📊 RESULTADOS: {passed}/{len(tests)} tests pasaron")
+    return passed == len(tests)
+
+
+if __name__ == "__main__":
+    success = asyncio.run(main())
+    if not success:
+        sys.exit(1)
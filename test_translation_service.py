@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+Test del servicio de traducción (translation_service.py)
+Usa un backend offline: verifica el camino rápido para inglés, la caché en memoria y en disco,
+la coalescencia de prompts idénticos y que el event loop no se bloquea durante la traducción
+"""
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.append('.')
+
+# Configurar logging
+logging.basicConfig(level=logging.WARNING, format='%(levelname)s: %(message)s')
+
+
+class OfflineBackend:
+    """Sustituto offline de Google: diccionario fijo, latencia bloqueante simulada y contador de llamadas"""
+
+    name = "offline"
+    TRANSLATIONS = {
+        "un gato saltando en la playa": "a cat jumping on the beach",
+        "un perro corriendo": "a dog running",
+    }
+
+    def __init__(self, latency=0.0, fail=False):
+        self.latency = latency
+        self.fail = fail
+        self.detect_calls = 0
+        self.translate_calls = 0
+        self.lock = threading.Lock()
+
+    def detect(self, text):
+        with self.lock:
+            self.detect_calls += 1
+        time.sleep(self.latency)
+        return "es" if text in self.TRANSLATIONS else "en"
+
+    def translate(self, text, source, target="en"):
+        with self.lock:
+            self.translate_calls += 1
+        time.sleep(self.latency)  # Bloqueante, como una petición HTTP síncrona
+        if self.fail:
+            raise ConnectionError("translator unreachable")
+        return self.TRANSLATIONS.get(text, text)
+
+
+def make_service(tmp_dir, backend, db_name="translations.db"):
+    from prompt_cache import PromptCache
+    from translation_service import TranslationService
+
+    cache = PromptCache(max_entries=100, ttl=3600, path=os.path.join(tmp_dir, db_name), use_disk=True)
+    return TranslationService(backend=backend, cache=cache, workers=2)
+
+
+async def test_english_fast_path(tmp_dir):
+    """Prompts en inglés no pasan por langdetect; el español sin acentos sí se detecta"""
+    print("🧪 Probando camino rápido ASCII/inglés...")
+
+    try:
+        from translation_service import looks_english
+
+        assert looks_english("A cat jumping over the fence at sunset")
+        assert not looks_english("un gato saltando en la playa")
+        assert not looks_english("ein Hund läuft")
+        # "a" es preposición en español/portugués/italiano: no basta para saltarse la detección
+        for prompt in ("hombre caminando a casa", "perro corriendo a toda velocidad",
+                       "mujer bailando a medianoche", "ragazza in camera a Roma"):
+            assert not looks_english(prompt), prompt
+
+        backend = OfflineBackend()
+        service = make_service(tmp_dir, backend)
+        english = await service.translate_to_english("A cat jumping over the fence")
+        spanish_lang = await service.detect_language("un gato saltando en la playa")
+        await service.close()
+
+        assert english == ("A cat jumping over the fence", False)
+        assert spanish_lang == "es" and backend.detect_calls == 1 and backend.translate_calls == 0
+        print(f"✅ {service.get_stats()['fast_path']} prompt por camino rápido, 1 detección real")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en test de camino rápido: {e}")
+        return False
+
+
+async def test_memory_and_disk_cache(tmp_dir):
+    """La misma traducción sale de memoria y, tras reiniciar, de SQLite sin llamar al backend"""
+    print("🧪 Probando caché de traducciones...")
+
+    try:
+        backend = OfflineBackend()
+        service = make_service(tmp_dir, backend)
+        first = await service.translate_to_english("un gato saltando en la playa")
+        second = await service.translate_to_english("un  gato saltando en la playa ")
+        await service.close()
+
+        restarted_backend = OfflineBackend()
+        restarted = make_service(tmp_dir, restarted_backend)
+        from_disk = await restarted.translate_to_english("un gato saltando en la playa")
+        stats = restarted.get_stats()
+        await restarted.close()
+
+        assert first == second == from_disk == ("a cat jumping on the beach", True)
+        assert backend.translate_calls == 1 and backend.detect_calls == 1
+        assert restarted_backend.translate_calls == 0 and restarted_backend.detect_calls == 0
+        assert stats["cache"]["disk_hits"] == 2, stats
+        print(f"✅ 1 llamada al backend para 3 traducciones; caché: {stats['cache']}")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en test de caché: {e}")
+        return False
+
+
+async def test_request_coalescing(tmp_dir):
+    """Peticiones simultáneas del mismo prompt comparten una detección y una traducción"""
+    print("🧪 Probando coalescencia de peticiones...")
+
+    try:
+        backend = OfflineBackend(latency=0.05)
+        service = make_service(tmp_dir, backend, "coalesce.db")
+        results = await asyncio.gather(*(service.translate_to_english("un perro corriendo") for _ in range(10)))
+        await service.close()
+
+        assert all(result == ("a dog running", True) for result in results)
+        assert backend.detect_calls == 1 and backend.translate_calls == 1, (backend.detect_calls, backend.translate_calls)
+        print(f"✅ 10 peticiones -> 1 detección + 1 traducción ({service.get_stats()['coalesced']} coalescidas)")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en test de coalescencia: {e}")
+        return False
+
+
+async def test_event_loop_not_blocked(tmp_dir):
+    """Con un traductor lento (bloqueante) el event loop sigue respondiendo"""
+    print("🧪 Probando que la traducción no bloquea el event loop...")
+
+    try:
+        backend = OfflineBackend(latency=0.2)
+        service = make_service(tmp_dir, backend, "blocking.db")
+
+        max_lag = 0.0
+        done = False
+
+        async def ticker():
+            nonlocal max_lag
+            while not done:
+                start = time.perf_counter()
+                await asyncio.sleep(0.005)
+                max_lag = max(max_lag, time.perf_counter() - start - 0.005)
+
+        ticker_task = asyncio.create_task(ticker())
+        start = time.perf_counter()
+        result = await service.translate_to_english("un gato saltando en la playa")
+        elapsed = time.perf_counter() - start
+        done = True
+        await ticker_task
+
+        # Fallos de red: se devuelve el original y no se cachea
+        failing = OfflineBackend(fail=True)
+        failing_service = make_service(tmp_dir, failing, "failing.db")
+        fallback = await failing_service.translate_to_english("un perro corriendo", source="es")
+        retry = await failing_service.translate_to_english("un perro corriendo", source="es")
+        await service.close()
+        await failing_service.close()
+
+        assert result == ("a cat jumping on the beach", True) and elapsed >= 0.4
+        assert max_lag < 0.05, f"Event loop bloqueado {max_lag * 1000:.0f} ms"
+        assert fallback == retry == ("un perro corriendo", False) and failing.translate_calls == 2
+        print(f"✅ Traducción de {elapsed * 1000:.0f} ms con retraso máx. del loop {max_lag * 1000:.1f} ms")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en test de event loop: {e}")
+        return False
+
+
+async def main():
+    """Función principal de testing"""
+    print("🚀 TEST DEL SERVICIO DE TRADUCCIÓN")
+    print("=" * 60)
+
+    tests = [
+        test_english_fast_path,
+        test_memory_and_disk_cache,
+        test_request_coalescing,
+        test_event_loop_not_blocked
+    ]
+
+    passed = 0
+    for test in tests:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            if await test(tmp_dir):
+                passed += 1
+
+    print("\n" + "=" * 60)
+    print(f"📊 RESULTADOS: {passed}/{len(tests)} tests pasaron")
+    return passed == len(tests)
+
+
+if __name__ == "__main__":
+    success = asyncio.run(main())
+    if not success:
+        sys.exit(1)
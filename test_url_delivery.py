@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+Test de la entrega de videos por URL (deliver_generated_video en bot.py)
+Verifica que Telegram recibe la URL de WaveSpeed y que se vuelve a la descarga + subida cuando no cabe o falla
+"""
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+from types import SimpleNamespace
+
+sys.path.append('.')
+
+# Configurar logging
+logging.basicConfig(level=logging.WARNING, format='%(levelname)s: %(message)s')
+
+VIDEO_URL = "https://cdn.wavespeed.ai/outputs/test.mp4"
+VIDEO_BYTES = b"\x00\x00\x00\x18ftypmp42" + b"x" * 4096
+
+
+class FakeBot:
+    """Bot simulado: registra envíos por URL y subidas; puede rechazar URLs como Telegram"""
+
+    def __init__(self, reject_urls=False, url_timeout=False):
+        self.reject_urls = reject_urls
+        self.url_timeout = url_timeout
+        self.url_sends = []
+        self.uploads = []
+
+    async def send_video(self, chat_id, video, **kwargs):
+        from telegram.error import BadRequest, TimedOut
+
+        if isinstance(video, str):
+            if self.reject_urls:
+                raise BadRequest("Failed to get HTTP URL content")
+            if self.url_timeout:
+                raise TimedOut()
+            self.url_sends.append(video)
+            file_id = "BAAC_url"
+        else:
+            self.uploads.append(len(video.read()))
+            file_id = f"BAAC_upload_{len(self.uploads)}"
+        return SimpleNamespace(video=SimpleNamespace(file_id=file_id, file_unique_id=f"u_{file_id}"))
+
+
+class FakeWavespeed:
+    """Cliente WaveSpeed simulado: HEAD con tamaño configurable y descarga a disco contada"""
+
+    def __init__(self, remote_size):
+        self.remote_size = remote_size
+        self.downloads = 0
+
+    async def get_remote_size(self, video_url):
+        return self.remote_size
+
+    async def download_video_to_file(self, video_url, filename, model=None, directory=None, keep_partial=False):
+        await asyncio.sleep(0.01)
+        self.downloads += 1
+        path = os.path.join(directory, filename)
+        with open(path, "wb") as f:
+            f.write(VIDEO_BYTES)
+        return path
+
+
+class FakeMessage:
+    def __init__(self):
+        self.texts = []
+
+    async def edit_text(self, text, **kwargs):
+        self.texts.append(text)
+
+
+async def deliver(tmp_dir, bot, wavespeed, request_id):
+    import bot as bot_module
+    import file_id_cache as file_id_cache_module
+    from config import Config
+    from file_id_cache import FileIdCache
+
+    Config.VOLUME_PATH = tmp_dir
+    cache = FileIdCache(path=os.path.join(tmp_dir, f"{request_id}.db"))
+    bot_module.file_id_cache = file_id_cache_module.file_id_cache = cache
+
+    context = SimpleNamespace(bot=bot, user_data={})
+    processing_msg = FakeMessage()
+    delivered = await bot_module.deliver_generated_video(
+        1, context, processing_msg, wavespeed, request_id, VIDEO_URL, "a cat", model="ultra_fast"
+    )
+    return delivered, context, cache
+
+
+async def test_small_video_by_url(tmp_dir):
+    """Un video dentro del límite se entrega por URL y se archiva después en segundo plano"""
+    print("🧪 Probando entrega por URL...")
+
+    try:
+        import bot as bot_module
+
+        bot, wavespeed = FakeBot(), FakeWavespeed(remote_size=3 * 1024 * 1024)
+        delivered, context, cache = await deliver(tmp_dir, bot, wavespeed, "req_small")
+        downloads_at_delivery = wavespeed.downloads
+
+        await asyncio.gather(*bot_module._background_tasks)
+        last_video = context.user_data["last_video"]
+        archived_lookup = await cache.lookup([f"url:{VIDEO_URL}"])
+        await cache.close()
+
+        assert delivered and bot.url_sends == [VIDEO_URL] and not bot.uploads
+        assert downloads_at_delivery == 0, "La entrega esperó a la descarga"
+        assert wavespeed.downloads == 1 and os.path.exists(last_video["filepath"])
+        assert last_video["file_id"] == "BAAC_url" and archived_lookup.file_id == "BAAC_url"
+        print("✅ Entregado por URL sin descargar; copia archivada en segundo plano")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en test de entrega por URL: {e}")
+        return False
+
+
+async def test_large_video_uploads(tmp_dir):
+    """Por encima del límite de Telegram para URLs se mantiene la descarga + subida"""
+    print("🧪 Probando video mayor que el límite...")
+
+    try:
+        from config import Config
+
+        bot = FakeBot()
+        wavespeed = FakeWavespeed(remote_size=Config.TELEGRAM_URL_FETCH_LIMIT + 1)
+        delivered, context, cache = await deliver(tmp_dir, bot, wavespeed, "req_large")
+        await cache.close()
+
+        assert delivered and not bot.url_sends and bot.uploads == [len(VIDEO_BYTES)]
+        assert wavespeed.downloads == 1
+        print("✅ Video grande descargado y subido")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en test de video grande: {e}")
+        return False
+
+
+async def test_url_fetch_failure_falls_back(tmp_dir):
+    """Si Telegram no puede obtener la URL (o el tamaño es desconocido) se sube el archivo; un timeout se propaga"""
+    print("🧪 Probando fallo de la entrega por URL...")
+
+    try:
+        bot = FakeBot(reject_urls=True)
+        wavespeed = FakeWavespeed(remote_size=1024 * 1024)
+        delivered, context, cache = await deliver(tmp_dir, bot, wavespeed, "req_rejected")
+        await cache.close()
+
+        unknown_bot = FakeBot()
+        unknown = FakeWavespeed(remote_size=None)
+        unknown_delivered, _, unknown_cache = await deliver(tmp_dir, unknown_bot, unknown, "req_unknown")
+        await unknown_cache.close()
+
+        # Un timeout no es un rechazo de la URL: Telegram pudo entregarlo, subirlo lo duplicaría
+        from telegram.error import TimedOut
+        from file_id_cache import send_video_by_url
+        timeout_bot = FakeBot(url_timeout=True)
+        try:
+            await send_video_by_url(timeout_bot, 1, VIDEO_URL, cache=cache)
+            raise AssertionError("el timeout no se propagó")
+        except TimedOut:
+            pass
+
+        assert delivered and bot.uploads and context.user_data["last_video"]["file_id"] == "BAAC_upload_1"
+        assert unknown_delivered and not unknown_bot.url_sends and unknown_bot.uploads
+        assert not timeout_bot.uploads
+        print("✅ Fallback a descarga + subida solo si Telegram rechaza la URL")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en test de fallback: {e}")
+        return False
+
+
+async def main():
+    """Función principal de testing"""
+    print("🚀 TEST DE ENTREGA DE VIDEOS POR URL")
+    print("=" * 60)
+
+    from config import Config
+    volume_path = Config.VOLUME_PATH
+
+    tests = [
+        test_small_video_by_url,
+        test_large_video_uploads,
+        test_url_fetch_failure_falls_back
+    ]
+
+    passed = 0
+    try:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for test in tests:
+                if await test(tmp_dir):
+                    passed += 1
+    finally:
+        Config.VOLUME_PATH = volume_path
+
+    print("\n" + "=" * 60)
+    print(f"📊 RESULTADOS: {passed}/{len(tests)} tests pasaron")
+    return passed == len(tests)
+
+
+if __name__ == "__main__":
+    success = asyncio.run(main())
+    if not success:
+        sys.exit(1)
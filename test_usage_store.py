@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+Test del almacén de uso (usage_store.py)
+Verifica incrementos atómicos entre procesos, migración de usage_data.json y expiración por día
+"""
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append('.')
+
+# Configurar logging
+logging.basicConfig(level=logging.WARNING, format='%(levelname)s: %(message)s')
+
+PROCESSES = 4
+INCREMENTS_PER_PROCESS = 50
+
+
+def make_store(db_path, legacy_json_path=""):
+    from usage_store import UsageStore, SQLiteUsageBackend
+    return UsageStore(backend=SQLiteUsageBackend(db_path), legacy_json_path=legacy_json_path)
+
+
+def increment_in_process(db_path: str, fingerprint: str, count: int):
+    """Proceso independiente (como otro worker de uvicorn) incrementando el mismo contador"""
+    async def run():
+        store = make_store(db_path)
+        await asyncio.gather(*[store.increment(fingerprint) for _ in range(count)])
+        await store.close()
+    asyncio.run(run())
+
+
+async def test_concurrent_increments(db_path):
+    """Incrementos concurrentes desde varios procesos y tareas no deben perder actualizaciones"""
+    print(f"🧪 {PROCESSES} procesos x {INCREMENTS_PER_PROCESS} incrementos sobre el mismo fingerprint...")
+
+    try:
+        warmup = make_store(db_path)
+        await warmup.get_usage("warmup")  # Crear el esquema antes de lanzar los procesos
+        await warmup.close()
+
+        start = time.monotonic()
+        context = multiprocessing.get_context("spawn")
+        processes = [
+            context.Process(target=increment_in_process, args=(db_path, "fp_shared", INCREMENTS_PER_PROCESS))
+            for _ in range(PROCESSES)
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join(timeout=60)
+        elapsed = time.monotonic() - start
+
+        store = make_store(db_path)
+        used = await store.get_usage("fp_shared")
+        await store.close()
+
+        expected = PROCESSES * INCREMENTS_PER_PROCESS
+        print(f"   Contador final: {used}/{expected} ({elapsed:.2f}s)")
+        assert all(process.exitcode == 0 for process in processes), "Algún proceso falló"
+        assert used == expected, "Se perdieron incrementos"
+        print("✅ Ningún incremento perdido")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en test de concurrencia: {e}")
+        return False
+
+
+async def test_rate_limit_flow(db_path):
+    """Asociación IP -> fingerprint, marcado de sospechosos y contadores por día"""
+    print("🧪 Probando flujo de rate limiting...")
+
+    try:
+        from usage_store import IP
+
+        store = make_store(db_path)
+        counts = [await store.associate_fingerprint("10.0.0.1", f"fp{i}") for i in range(5)]
+        repeated = await store.associate_fingerprint("10.0.0.1", "fp0")
+
+        assert counts == [1, 2, 3, 4, 5] and repeated == 5
+        assert await store.flag_suspicious("fp4", "Multiple fingerprints from IP: 5") is True
+        assert await store.flag_suspicious("fp4", "otra vez") is False, "Se duplicó el marcado"
+        assert await store.is_suspicious("fp4") and not await store.is_suspicious("fp0")
+
+        for _ in range(3):
+            await store.increment("fp0")
+        await store.increment("10.0.0.1", scope=IP)
+        await store.increment("fp0", day="2020-01-01")
+
+        assert await store.get_usage("fp0") == 3
+        assert await store.get_usage("10.0.0.1", scope=IP) == 1
+        assert await store.day_usage() == {"fp0": 3}
+        assert await store.suspicious_count() == 1
+        await store.close()
+        print("✅ Contadores, asociaciones y sospechosos correctos")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en test de flujo: {e}")
+        return False
+
+
+async def test_migrate_legacy_json(db_path):
+    """Se importan los dos formatos antiguos de usage_data.json y el archivo se retira"""
+    print("🧪 Probando migración de usage_data.json...")
+
+    try:
+        from usage_store import IP, today_key
+
+        today = today_key()
+        legacy = {
+            # Formato de fastapi_app.py
+            "daily_usage": {today: {"fp_fastapi": 4}, "2020-01-01": {"fp_old": 2}},
+            "ip_fingerprints": {"10.0.0.2": ["fp_fastapi", "fp_web"]},
+            "suspicious_users": {"fp_bad": {"flagged_at": "2024-01-01T00:00:00", "reason": "VPN"}},
+            # Formato de web_app.py
+            "user_fingerprints": {"fp_web": {"daily_usage": 3, "last_used": None}},
+            "last_reset": today,
+        }
+        json_path = db_path + ".json"
+        with open(json_path, "w") as f:
+            json.dump(legacy, f)
+
+        store = make_store(db_path, legacy_json_path=json_path)
+        assert await store.get_usage("fp_fastapi") == 4
+        assert await store.get_usage("fp_web") == 3
+        assert await store.get_usage("fp_old", day="2020-01-01") == 2
+        assert await store.is_suspicious("fp_bad")
+        assert await store.associate_fingerprint("10.0.0.2", "fp_fastapi") == 2
+        await store.close()
+
+        assert not os.path.exists(json_path) and os.path.exists(json_path + ".migrated")
+
+        # Un segundo arranque no vuelve a importar nada
+        web_format = {"daily_usage": {"10.0.0.3": 1}, "last_reset": today}
+        with open(json_path, "w") as f:
+            json.dump(web_format, f)
+        store = make_store(db_path, legacy_json_path=json_path)
+        assert await store.get_usage("fp_fastapi") == 4
+        assert await store.get_usage("10.0.0.3", scope=IP) == 1
+        await store.close()
+        print("✅ Datos migrados y archivo JSON retirado")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en test de migración: {e}")
+        return False
+
+
+async def test_day_bucket_expiry(db_path):
+    """Los días fuera de la retención se purgan y la consulta no depende del historial"""
+    print("🧪 Probando expiración por día...")
+
+    try:
+        from usage_store import FINGERPRINT
+
+        store = make_store(db_path)
+        backend = store.backend
+        await store.get_usage("warmup")
+
+        # Historial grande: 200 días x 250 fingerprints
+        def fill(conn):
+            conn.execute("BEGIN")
+            conn.executemany(
+                "INSERT INTO usage_counters (scope, day, key, count) VALUES (?, ?, ?, 1)",
+                [(FINGERPRINT, f"2019-{(d // 28) + 1:02d}-{(d % 28) + 1:02d}", f"fp{k}")
+                 for d in range(200) for k in range(250)]
+            )
+            conn.execute("COMMIT")
+        await backend._run(fill)
+
+        start = time.monotonic()
+        for _ in range(200):
+            await store.get_usage("fp7")
+        lookup_ms = (time.monotonic() - start) / 200 * 1000
+
+        await store.increment("fp7")
+        store._last_purge = 0
+        await store._maybe_purge()
+        remaining = await backend._run(lambda conn: conn.execute("SELECT COUNT(*) FROM usage_counters").fetchone()[0])
+        await store.close()
+
+        print(f"   Consulta con 50.000 filas de historial: {lookup_ms:.2f} ms")
+        assert remaining == 1, f"Quedaron {remaining} filas tras purgar"
+        assert lookup_ms < 20
+        print("✅ Historial antiguo purgado, solo queda el día actual")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en test de expiración: {e}")
+        return False
+
+
+async def main():
+    """Función principal de testing"""
+    print("🚀 TEST DEL ALMACÉN DE USO")
+    print("=" * 60)
+
+    tests = [
+        test_concurrent_increments,
+        test_rate_limit_flow,
+        test_migrate_legacy_json,
+        test_day_bucket_expiry
+    ]
+
+    passed = 0
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for index, test in enumerate(tests):
+            if await test(os.path.join(tmp_dir, f"usage_{index}.db")):
+                passed += 1
+
+    print("\n" + "=" * 60)
+    print(f"📊 RESULTADOS: {passed}/{len(tests)} tests pasaron")
+    return passed == len(tests)
+
+
+if __name__ == "__main__":
+    success = asyncio.run(main())
+    if not success:
+        sys.exit(1)
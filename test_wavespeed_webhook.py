@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+Test del webhook de WaveSpeed (predicciones resueltas por push)
+Verifica que el webhook resuelve la espera al instante y que el polling queda como respaldo
+"""
+import asyncio
+import logging
+import sys
+import time
+
+sys.path.append('.')
+
+# Configurar logging
+logging.basicConfig(level=logging.WARNING, format='%(levelname)s: %(message)s')
+
+
+class CountingWavespeedAPI:
+    """API simulada que cuenta las consultas de estado; completa tras `duration` segundos"""
+
+    def __init__(self, duration: float = 3600):
+        self.duration = duration
+        self.started = time.monotonic()
+        self.status_requests = 0
+
+    async def get_video_status(self, request_id: str):
+        self.status_requests += 1
+        if time.monotonic() - self.started < self.duration:
+            return {"id": request_id, "status": "processing", "outputs": []}
+        return {"id": request_id, "status": "completed", "outputs": [f"https://cdn.example.com/{request_id}.mp4"]}
+
+
+def completed_payload(request_id: str) -> dict:
+    return {"id": request_id, "status": "completed", "outputs": [f"https://cdn.example.com/{request_id}.mp4"]}
+
+
+async def test_endpoint_resolves_pending_prediction():
+    """Un POST al endpoint del webhook debe resolver la espera en menos de un segundo y sin polling"""
+    print("🧪 Probando resolución por webhook a través del endpoint FastAPI...")
+
+    try:
+        import httpx
+        from fastapi_app import app
+        from async_polling import wait_for_prediction
+        from prediction_tracker import prediction_tracker
+
+        api = CountingWavespeedAPI()
+        waiter = asyncio.create_task(
+            wait_for_prediction(api, "pred_push", label="video:ultra_fast", push=True, use_tracker=True)
+        )
+        await asyncio.sleep(0.05)
+
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            start = time.monotonic()
+            response = await client.post("/wavespeed-webhook", json={"code": 200, "data": completed_payload("pred_push")})
+            result = await asyncio.wait_for(waiter, timeout=1.0)
+            latency = time.monotonic() - start
+
+            # Un webhook repetido (reintento de WaveSpeed) no debe romper nada
+            duplicate = await client.post("/wavespeed-webhook", json=completed_payload("pred_push"))
+
+        await prediction_tracker.stop()
+
+        print(f"   Webhook -> resultado: {latency * 1000:.1f} ms, consultas de estado: {api.status_requests}")
+        assert response.status_code == 200 and response.json()["matched"] is True
+        assert duplicate.status_code == 200 and duplicate.json()["matched"] is False
+        assert result["outputs"][0].endswith("pred_push.mp4")
+        assert latency < 1.0
+        assert api.status_requests == 0, "Con webhook no debería haber polling inmediato"
+        print("✅ Predicción resuelta por push sin consultas de estado")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en test del endpoint: {e}")
+        return False
+
+
+async def test_webhook_before_track():
+    """Si el webhook llega antes que la espera, el resultado se guarda y se entrega al hacer track()"""
+    print("🧪 Probando webhook que llega antes de la espera...")
+
+    try:
+        from prediction_tracker import PredictionTracker
+
+        tracker = PredictionTracker()
+        matched = tracker.resolve({"data": completed_payload("pred_early")})
+
+        api = CountingWavespeedAPI()
+        result = await asyncio.wait_for(tracker.wait(api, "pred_early", push=True), timeout=1.0)
+        await tracker.stop()
+
+        assert matched is False
+        assert result["outputs"][0].endswith("pred_early.mp4")
+        assert api.status_requests == 0
+        print("✅ Resultado temprano entregado sin consultar la API")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en test de webhook temprano: {e}")
+        return False
+
+
+async def test_failed_webhook_raises():
+    """Un webhook con status 'failed' debe propagar PredictionFailedError al waiter"""
+    print("🧪 Probando webhook de predicción fallida...")
+
+    try:
+        from async_polling import PredictionFailedError
+        from prediction_tracker import PredictionTracker
+
+        tracker = PredictionTracker()
+        api = CountingWavespeedAPI()
+        waiter = asyncio.create_task(tracker.wait(api, "pred_failed", push=True))
+        await asyncio.sleep(0.02)
+
+        assert tracker.resolve({"id": "pred_failed", "status": "failed", "error": "NSFW content"})
+        try:
+            await asyncio.wait_for(waiter, timeout=1.0)
+            print("❌ La predicción fallida no lanzó excepción")
+            return False
+        except PredictionFailedError as e:
+            assert e.error == "NSFW content"
+        finally:
+            await tracker.stop()
+
+        assert tracker.get_stats()["webhook_resolved"] == 1
+        print("✅ Fallo propagado al waiter")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en test de webhook fallido: {e}")
+        return False
+
+
+async def test_fallback_sweep_without_webhook():
+    """Si el webhook nunca llega, el barrido lento de polling completa la predicción"""
+    print("🧪 Probando barrido de respaldo sin webhook...")
+
+    try:
+        from config import Config
+        from prediction_tracker import PredictionTracker
+
+        fallback = Config.WAVESPEED_WEBHOOK_FALLBACK_INTERVAL
+        Config.WAVESPEED_WEBHOOK_FALLBACK_INTERVAL = 0.2
+        try:
+            tracker = PredictionTracker()
+            api = CountingWavespeedAPI(duration=0.5)
+            start = time.monotonic()
+            result = await asyncio.wait_for(tracker.wait(api, "pred_lost", push=True), timeout=3.0)
+            elapsed = time.monotonic() - start
+            await tracker.stop()
+        finally:
+            Config.WAVESPEED_WEBHOOK_FALLBACK_INTERVAL = fallback
+
+        print(f"   Completado por polling en {elapsed:.2f}s con {api.status_requests} consultas")
+        assert result["status"] == "completed"
+        assert api.status_requests <= 5, "El respaldo no debería consultar al ritmo normal"
+        print("✅ El barrido de respaldo completó la predicción")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en test de barrido de respaldo: {e}")
+        return False
+
+
+async def test_webhook_url_and_token():
+    """La URL del webhook se deriva de WEBHOOK_URL y el token se valida"""
+    print("🧪 Probando URL y token del webhook...")
+
+    try:
+        from config import Config
+        from async_wavespeed import wavespeed_webhook_url, verify_wavespeed_webhook_token
+
+        saved = (Config.USE_WAVESPEED_WEBHOOK, Config.WAVESPEED_WEBHOOK_URL, Config.WEBHOOK_URL, Config.WAVESPEED_WEBHOOK_SECRET)
+        try:
+            Config.USE_WAVESPEED_WEBHOOK = True
+            Config.WAVESPEED_WEBHOOK_URL = None
+            Config.WEBHOOK_URL = "telewan.up.railway.app/"
+            Config.WAVESPEED_WEBHOOK_SECRET = "s3cret"
+
+            assert wavespeed_webhook_url() == "https://telewan.up.railway.app/wavespeed-webhook?token=s3cret"
+            assert verify_wavespeed_webhook_token("s3cret")
+            assert not verify_wavespeed_webhook_token("wrong")
+            assert not verify_wavespeed_webhook_token(None)
+
+            Config.USE_WAVESPEED_WEBHOOK = False
+            assert wavespeed_webhook_url() is None
+        finally:
+            (Config.USE_WAVESPEED_WEBHOOK, Config.WAVESPEED_WEBHOOK_URL,
+             Config.WEBHOOK_URL, Config.WAVESPEED_WEBHOOK_SECRET) = saved
+
+        print("✅ URL derivada y token verificado")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en test de URL/token: {e}")
+        return False
+
+
+async def main():
+    """Función principal de testing"""
+    print("🚀 TEST DEL WEBHOOK DE WAVESPEED")
+    print("=" * 60)
+
+    tests = [
+        test_endpoint_resolves_pending_prediction,
+        test_webhook_before_track,
+        test_failed_webhook_raises,
+        test_fallback_sweep_without_webhook,
+        test_webhook_url_and_token
+    ]
+
+    passed = 0
+    for test in tests:
+        if await test():
+            passed += 1
+
+    print("\n" + "=" * 60)
+    print(f"📊 RESULTADOS: {passed}/{len(tests)} tests pasaron")
+    return passed == len(tests)
+
+
+if __name__ == "__main__":
+    success = asyncio.run(main())
+    if not success:
+        sys.exit(1)
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""
+Test del motor de yt-dlp en proceso (ytdlp_engine.py)
+Verifica el despacho a un pool de procesos ya arrancado frente a lanzar un proceso por enlace,
+el progreso de los workers al event loop, el timeout por petición y la traducción a parámetros/CLI
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import logging
+
+sys.path.append('.')
+
+# Configurar logging
+logging.basicConfig(level=logging.WARNING, format='%(levelname)s: %(message)s')
+
+
+def fake_download(task_id, request, deadline):
+    """Sustituto de download_in_worker (sin red): progreso, archivo y dict de info"""
+    from ytdlp_engine import report_progress
+    started_at = time.time()
+    for percent in (25.0, 100.0):
+        report_progress(task_id, percent)
+        time.sleep(0.02)  # Descarga en curso
+    filepath = request.output_template.replace('%(ext)s', 'mp4')
+    with open(filepath, 'wb') as f:
+        f.write(b'0' * 10000)
+    return {'success': True, 'started_at': started_at,
+            'info': {'title': "Gato", 'duration': 7.0, 'ext': 'mp4', 'filepath': filepath}}
+
+
+def hanging_download(task_id, request, deadline):
+    """Extracción colgada que nunca llega al hook de progreso"""
+    time.sleep(30)
+    return {'success': True, 'started_at': time.time()}
+
+
+async def test_warm_pool_dispatch():
+    """Con el pool arrancado cada enlace solo paga el despacho, no el arranque de un proceso"""
+    print("🧪 Probando despacho al pool precargado frente a un proceso por enlace...")
+
+    try:
+        from ytdlp_engine import YtDlpEngine, YtDlpRequest
+
+        engine = YtDlpEngine(workers=2, preload=False, worker_fn=fake_download)
+        try:
+            await engine.warm_up()
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                percents = []
+
+                async def progress(percent, detail):
+                    percents.append(percent)
+
+                results = []
+                start = time.perf_counter()
+                for i in range(5):
+                    request = YtDlpRequest(f"https://x.com/u/status/{i}", os.path.join(tmp_dir, f"v{i}.%(ext)s"))
+                    results.append(await engine.download(request, progress))
+                warm_ms = (time.perf_counter() - start) * 1000 / 5 - 40  # Sin la descarga simulada
+                await asyncio.sleep(0.1)  # El hilo lector entrega el último progreso
+
+                assert all(result.success and os.path.exists(result.info['filepath']) for result in results)
+                assert results[0].info['title'] == "Gato" and results[0].engine == "in-process"
+        finally:
+            engine.shutdown()
+
+        # Coste que paga cada enlace con el CLI: arrancar un intérprete (sin contar la importación de yt-dlp)
+        cold = []
+        for _ in range(3):
+            start = time.perf_counter()
+            process = await asyncio.create_subprocess_exec(sys.executable, "-c", "import json, ssl, http.client")
+            await process.wait()
+            cold.append((time.perf_counter() - start) * 1000)
+        cold_ms = min(cold)
+
+        stats = engine.get_stats()
+        assert stats["in_process"] == 5 and stats["avg_dispatch_ms"] is not None
+        assert percents.count(100.0) == 5, percents
+        assert warm_ms < cold_ms, f"Despacho {warm_ms:.1f} ms no mejora el arranque {cold_ms:.1f} ms"
+        print(f"✅ Enlace en pool: {warm_ms:.1f} ms (despacho medio {stats['avg_dispatch_ms']} ms); "
+              f"proceso nuevo: {cold_ms:.1f} ms; ahorro ≈ {cold_ms - warm_ms:.1f} ms por enlace")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en test de despacho: {e}")
+        return False
+
+
+async def test_hung_worker_recycles_pool():
+    """Un worker colgado se mata al vencer el timeout y el siguiente enlace usa un pool nuevo"""
+    print("🧪 Probando timeout de un worker colgado...")
+
+    try:
+        from ytdlp_engine import YtDlpEngine, YtDlpRequest
+
+        engine = YtDlpEngine(workers=1, preload=False, worker_fn=hanging_download)
+        engine.TIMEOUT_GRACE = 0.3
+        try:
+            await engine.warm_up()
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                start = time.perf_counter()
+                hung = await engine.download(YtDlpRequest("https://x.com/u/status/1", os.path.join(tmp_dir, "a.%(ext)s"),
+                                                          timeout=0.2))
+                waited = time.perf_counter() - start
+
+                engine.worker_fn = fake_download
+                after = await engine.download(YtDlpRequest("https://x.com/u/status/2", os.path.join(tmp_dir, "b.%(ext)s")))
+        finally:
+            engine.shutdown()
+
+        assert hung.timed_out and not hung.success and waited < 2, (hung, waited)
+        assert after.success and engine.stats["pool_restarts"] == 1, (after, engine.stats)
+        print(f"✅ Timeout en {waited:.2f}s, pool reiniciado y el siguiente enlace descargó")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en test de timeout: {e}")
+        return False
+
+
+async def test_request_translation():
+    """La misma petición produce parámetros de YoutubeDL y argumentos de CLI equivalentes"""
+    print("🧪 Probando traducción de la petición...")
+
+    try:
+        from ytdlp_engine import YtDlpEngine, YtDlpRequest, ytdlp_available, CLI_INFO_MARKER
+
+        request = YtDlpRequest("https://www.tiktok.com/@u/video/1", "/tmp/v.%(ext)s", max_filesize=100 * 1024 * 1024,
+                               user_agent="UA", headers={'Referer': 'https://www.tiktok.com/'})
+        params = request.to_params()
+        assert params['outtmpl'] == "/tmp/v.%(ext)s" and params['max_filesize'] == 104857600
+        assert params['http_headers'] == {'Referer': 'https://www.tiktok.com/', 'User-Agent': 'UA'}
+        assert request.headers == {'Referer': 'https://www.tiktok.com/'}, "to_params modificó la petición"
+
+        request.impersonate = 'safari-ios:17.5.1'
+        args = request.to_cli_args()
+        assert args[0] == 'yt-dlp' and args[-1] == request.url
+        assert args[args.index('--impersonate') + 1] == 'safari-ios:17.5.1'
+        assert args[args.index('--max-filesize') + 1] == '104857600'
+        assert 'Referer: https://www.tiktok.com/' in args and any(CLI_INFO_MARKER in arg for arg in args)
+
+        # Sin el paquete yt_dlp el motor usa el CLI
+        assert YtDlpEngine().in_process == ytdlp_available()
+        print(f"✅ Parámetros y CLI coherentes; yt_dlp instalado: {ytdlp_available()}")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en test de traducción: {e}")
+        return False
+
+
+async def test_size_budgeted_format_selection():
+    """Se elige antes de descargar el mejor formato que cabe en el límite de entrega"""
+    print("🧪 Probando selección de formato por límite de tamaño...")
+
+    try:
+        from ytdlp_engine import select_format, YtDlpRequest
+
+        mb = 1024 * 1024
+        # Orden de yt-dlp: de peor a mejor
+        formats = [
+            {'format_id': 'audio', 'vcodec': 'none', 'acodec': 'aac', 'filesize': 2 * mb},
+            {'format_id': '360p', 'vcodec': 'h264', 'acodec': 'aac', 'height': 360, 'filesize': 12 * mb},
+            {'format_id': '540p', 'vcodec': 'h264', 'acodec': 'aac', 'height': 540, 'tbr': 2500},  # ~37 MB en 120s
+            {'format_id': '720p', 'vcodec': 'h264', 'acodec': 'aac', 'height': 720, 'filesize_approx': 90 * mb},
+            {'format_id': '1080p', 'vcodec': 'h264', 'acodec': 'aac', 'height': 1080, 'filesize': 20 * mb},
+        ]
+        choice = select_format(formats, 120, 50 * mb)
+        assert (choice.format_id, choice.fits) == ('540p', True), choice
+        assert select_format(formats, 120, 20 * mb).format_id == '360p'
+
+        # Nada cabe: el más pequeño (se reduce después) o ninguno si supera el máximo descargable
+        too_big = [{'format_id': '360p', 'vcodec': 'h264', 'acodec': 'aac', 'height': 360, 'filesize': 120 * mb},
+                   {'format_id': '720p', 'vcodec': 'h264', 'acodec': 'aac', 'height': 720, 'filesize': 300 * mb}]
+        choice = select_format(too_big, 120, 50 * mb, max_filesize=200 * mb)
+        assert (choice.format_id, choice.fits) == ('360p', False), choice
+        assert select_format(too_big[1:], 120, 50 * mb, max_filesize=200 * mb) is None
+
+        # Sin tamaño ni bitrate: el mejor desconocido, se comprueba al terminar
+        unknown = [{'format_id': 'a', 'height': 480}, {'format_id': 'b', 'height': 720}]
+        assert select_format(unknown, None, 50 * mb) == select_format(unknown, 0, 50 * mb)
+        assert select_format(unknown, None, 50 * mb).fits is None
+
+        # CLI: el mismo criterio con filtros del selector de formatos
+        spec = YtDlpRequest("https://x.com/u/status/1", "/tmp/v.%(ext)s", size_limit=50 * mb).format
+        assert spec.startswith(f"best[height<=720][filesize<={50 * mb}]/") and spec.endswith("/worst"), spec
+        assert YtDlpRequest("https://x.com/u/status/1", "/tmp/v.%(ext)s").format == 'best[height<=720]'
+
+        print("✅ 540p (≈37 MB) elegido para 50 MB sin descargar 720p (≈90 MB)")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error en test de selección de formato: {e}")
+        return False
+
+
+async def main():
+    """Función principal de testing"""
+    print("🚀 TEST DEL MOTOR DE YT-DLP EN PROCESO")
+    print("=" * 60)
+
+    tests = [
+        test_warm_pool_dispatch,
+        test_hung_worker_recycles_pool,
+        test_request_translation,
+        test_size_budgeted_format_selection
+    ]
+
+    passed = 0
+    for test in tests:
+        if await test():
+            passed += 1
+
+    print("\n" + "=" * 60)
+    print(f"📊 RESULTADOS: {passed}/{len(tests)} tests pasaron")
+    return passed == len(tests)
+
+
+if __name__ == "__main__":
+    success = asyncio.run(main())
+    if not success:
+        sys.exit(1)
@@ -0,0 +1,228 @@
+"""
+Translation Service
+Detección de idioma y traducción al inglés de los prompts sin bloquear el event loop
+
+- Camino rápido: texto ASCII con palabras funcionales inglesas se da por inglés sin llamar a langdetect
+- Caché de dos niveles (LRU en memoria + SQLite) de texto -> (idioma, traducción), reutilizando PromptCache
+- langdetect y GoogleTranslator (red) corren en un pool de threads propio
+- Prompts idénticos en vuelo comparten una sola detección/traducción
+- Backend intercambiable: Google (deep-translator + langdetect), nulo si no están instalados,
+  o cualquier objeto con detect()/translate() (p.ej. un sustituto offline en los tests)
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from config import Config
+from prompt_cache import PromptCache
+
+logger = logging.getLogger(__name__)
+
+# Palabras funcionales exclusivas del inglés: bastan para reconocer un prompt sin pasar por langdetect
+# (fuera las que también existen en español/portugués/italiano/francés: "a", "an", "in", "on", "camera")
+ENGLISH_MARKERS = {
+    "the", "and", "of", "with", "at", "to", "is", "are", "into", "from", "by",
+    "for", "his", "her", "its", "their", "while", "through", "over", "under", "slowly",
+}
+# Marcadores ingleses mínimos para el camino rápido (uno solo puede ser casualidad)
+MIN_ENGLISH_MARKERS = 2
+# Palabras frecuentes en español/portugués/francés/italiano escritas sin acentos
+NON_ENGLISH_MARKERS = {
+    "el", "la", "los", "las", "un", "una", "de", "del", "que", "y", "con", "por", "para", "en", "su",
+    "le", "les", "des", "du", "et", "une", "il", "o", "os", "e", "com", "um", "uma", "di", "che", "per",
+}
+_WORD_RE = re.compile(r"[a-z']+")
+
+
+def looks_english(text: str) -> bool:
+    """Camino rápido: ASCII, al menos dos marcadores ingleses y mayoría clara sobre los de otros idiomas"""
+    if not text.isascii():
+        return False
+    words = _WORD_RE.findall(text.lower())
+    if not words:
+        return True  # Sin letras (números, emojis ASCII...): nada que traducir
+    english = sum(word in ENGLISH_MARKERS for word in words)
+    other = sum(word in NON_ENGLISH_MARKERS for word in words)
+    return english >= MIN_ENGLISH_MARKERS and english > 2 * other
+
+
+class GoogleTranslationBackend:
+    """langdetect + GoogleTranslator de deep-translator (bloqueantes: se llaman desde el pool de threads)"""
+
+    name = "google"
+
+    def __init__(self):
+        from deep_translator import GoogleTranslator
+        from langdetect import detect
+        self._translator_cls = GoogleTranslator
+        self._detect = detect
+
+    def detect(self, text: str) -> str:
+        return self._detect(text)
+
+    def translate(self, text: str, source: str, target: str = "en") -> str:
+        try:
+            return self._translator_cls(source=source, target=target).translate(text)
+        except Exception:
+            # Si el idioma detectado no es válido para Google, dejar que lo detecte él
+            return self._translator_cls(source="auto", target=target).translate(text)
+
+
+class NullTranslationBackend:
+    """Sin librerías de traducción: todo se trata como inglés"""
+
+    name = "none"
+
+    def detect(self, text: str) -> str:
+        return "en"
+
+    def translate(self, text: str, source: str, target: str = "en") -> str:
+        return text
+
+
+def create_backend(name: str = None):
+    """Backend configurado (Config.TRANSLATION_BACKEND); nulo si faltan las dependencias"""
+    name = (name or Config.TRANSLATION_BACKEND).lower()
+    if name == "google":
+        try:
+            return GoogleTranslationBackend()
+        except ImportError as e:
+            logger.warning(f"⚠️ Librerías de traducción no disponibles ({e}). Instala: pip install deep-translator langdetect")
+    return NullTranslationBackend()
+
+
+class TranslationService:
+    """
+    Detección y traducción async con caché y coalescencia de peticiones
+
+    Uso:
+        language = await translation_service.detect_language(prompt)
+        english, was_translated = await translation_service.translate_to_english(prompt, source=language)
+    """
+
+    def __init__(self, backend=None, cache: Optional[PromptCache] = None, workers: int = None):
+        self._backend = backend
+        self.cache = cache or PromptCache(
+            max_entries=Config.TRANSLATION_CACHE_SIZE,
+            ttl=Config.TRANSLATION_CACHE_TTL,
+            path=Config.TRANSLATION_CACHE_DB_PATH,
+            use_disk=Config.TRANSLATION_CACHE_USE_DISK,
+        )
+        self.workers = workers or Config.TRANSLATION_WORKERS
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+        self.stats = {"fast_path": 0, "cache_hits": 0, "coalesced": 0, "detections": 0, "translations": 0, "errors": 0}
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            self._backend = create_backend()
+        return self._backend
+
+    async def _in_thread(self, fn, *args):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="translation")
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    async def _coalesced(self, key: str, compute: Callable[[], Awaitable]):
+        """Una sola ejecución de compute por clave en vuelo; el resto espera el mismo resultado"""
+        if key in self._inflight:
+            self.stats["coalesced"] += 1
+            return await asyncio.shield(self._inflight[key])
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result = await compute()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # Evitar el aviso de excepción no recuperada si nadie más espera
+            raise
+        finally:
+            del self._inflight[key]
+
+    @staticmethod
+    def _key(kind: str, text: str) -> str:
+        return f"{kind}:" + hashlib.sha256(" ".join(text.split()).encode()).hexdigest()
+
+    async def detect_language(self, text: str) -> str:
+        """Código ISO del idioma del texto; 'en' si no se puede detectar"""
+        if looks_english(text):
+            self.stats["fast_path"] += 1
+            return "en"
+
+        key = self._key("lang", text)
+        cached = await self.cache.get(key)
+        if cached is not None:
+            self.stats["cache_hits"] += 1
+            return cached
+
+        async def compute():
+            try:
+                language = await self._in_thread(self.backend.detect, text)
+            except Exception as e:
+                self.stats["errors"] += 1
+                logger.warning(f"⚠️ Language detection failed: {e}, defaulting to English")
+                return "en"
+            self.stats["detections"] += 1
+            await self.cache.set(key, language)
+            logger.info(f"🌐 Language detected: {language}")
+            return language
+
+        return await self._coalesced(key, compute)
+
+    async def translate_to_english(self, text: str, source: Optional[str] = None) -> Tuple[str, bool]:
+        """
+        Traduce el texto al inglés si no lo está ya
+
+        Args:
+            source: Idioma ya detectado (evita detectarlo otra vez)
+
+        Returns:
+            (texto, traducido); ante un error se devuelve el texto original sin traducir
+        """
+        source = source or await self.detect_language(text)
+        if source == "en":
+            return text, False
+
+        key = self._key("en", text)
+        cached = await self.cache.get(key)
+        if cached is not None:
+            self.stats["cache_hits"] += 1
+            result = json.loads(cached)
+            return result["text"], result["translated"]
+
+        async def compute():
+            try:
+                translated = await self._in_thread(self.backend.translate, text, source, "en")
+            except Exception as e:
+                self.stats["errors"] += 1
+                logger.error(f"❌ Translation failed: {e}")
+                return text, False
+            was_translated = bool(translated) and translated != text
+            translated = translated or text
+            self.stats["translations"] += 1
+            await self.cache.set(key, json.dumps({"text": translated, "translated": was_translated}))
+            logger.info(f"🌐 Translation ({source}): '{text[:50]}...' → '{translated[:50]}...'")
+            return translated, was_translated
+
+        return await self._coalesced(key, compute)
+
+    def get_stats(self):
+        return {**self.stats, "backend": getattr(self._backend, "name", None), "cache": self.cache.get_stats()}
+
+    async def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        await self.cache.close()
+
+
+# Instancia global del servicio
+translation_service = TranslationService()
@@ -0,0 +1,460 @@
+"""
+Usage Store
+Contadores de uso diario para el rate limiting de /generate (reemplaza usage_data.json)
+
+- Backend SQLite (WAL) por defecto en Config.USAGE_DB_PATH, Redis opcional vía events/bus.py
+- Incrementos atómicos por clave y día: varios workers/procesos no pierden actualizaciones
+- Lecturas indexadas por (scope, día, clave): el coste no crece con el historial
+- Los días antiguos y las asociaciones IP -> fingerprint expiran tras Config.USAGE_RETENTION_DAYS
+- Al arrancar se migra el usage_data.json antiguo (se renombra a usage_data.json.migrated)
+"""
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Ámbitos de los contadores
+FINGERPRINT = "fingerprint"
+IP = "ip"
+
+
+def today_key() -> str:
+    return date.today().isoformat()
+
+
+# ----------------------------------------------------------------------
+# Backends
+# ----------------------------------------------------------------------
+
+class SQLiteUsageBackend:
+    """Backend SQLite (WAL); las operaciones bloqueantes se ejecutan en un thread aparte"""
+
+    name = "sqlite"
+
+    def __init__(self, path: str = None):
+        self.path = path or Config.USAGE_DB_PATH
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS usage_counters (
+                    scope TEXT NOT NULL,
+                    day TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    count INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (scope, day, key)
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_usage_day ON usage_counters (day)")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS ip_fingerprints (
+                    ip TEXT NOT NULL,
+                    fingerprint TEXT NOT NULL,
+                    last_seen TEXT NOT NULL,
+                    PRIMARY KEY (ip, fingerprint)
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_ip_last_seen ON ip_fingerprints (last_seen)")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS suspicious_users (
+                    fingerprint TEXT PRIMARY KEY,
+                    reason TEXT,
+                    flagged_at TEXT NOT NULL
+                )
+            """)
+            self._conn = conn
+        return self._conn
+
+    async def _run(self, fn, *args):
+        def locked():
+            with self._lock:
+                return fn(self._connect(), *args)
+        return await asyncio.to_thread(locked)
+
+    @staticmethod
+    def _transaction(conn: sqlite3.Connection, fn):
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = fn()
+            conn.execute("COMMIT")
+            return result
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    async def increment(self, scope: str, key: str, day: str) -> int:
+        def op(conn):
+            def upsert():
+                conn.execute(
+                    "INSERT INTO usage_counters (scope, day, key, count) VALUES (?, ?, ?, 1) "
+                    "ON CONFLICT (scope, day, key) DO UPDATE SET count = count + 1",
+                    (scope, day, key)
+                )
+                return conn.execute(
+                    "SELECT count FROM usage_counters WHERE scope = ? AND day = ? AND key = ?",
+                    (scope, day, key)
+                ).fetchone()[0]
+            return self._transaction(conn, upsert)
+        return await self._run(op)
+
+    async def increment_many(self, items: List[Tuple[str, str, str, int]]) -> List[int]:
+        """Aplica varios (scope, key, day, delta) en una sola transacción y retorna los totales"""
+        def op(conn):
+            def upsert():
+                totals = []
+                for scope, key, day, delta in items:
+                    conn.execute(
+                        "INSERT INTO usage_counters (scope, day, key, count) VALUES (?, ?, ?, ?) "
+                        "ON CONFLICT (scope, day, key) DO UPDATE SET count = count + excluded.count",
+                        (scope, day, key, delta)
+                    )
+                    totals.append(conn.execute(
+                        "SELECT count FROM usage_counters WHERE scope = ? AND day = ? AND key = ?",
+                        (scope, day, key)
+                    ).fetchone()[0])
+                return totals
+            return self._transaction(conn, upsert)
+        return await self._run(op)
+
+    async def get_count(self, scope: str, key: str, day: str) -> int:
+        def op(conn):
+            row = conn.execute(
+                "SELECT count FROM usage_counters WHERE scope = ? AND day = ? AND key = ?",
+                (scope, day, key)
+            ).fetchone()
+            return row[0] if row else 0
+        return await self._run(op)
+
+    async def day_counts(self, scope: str, day: str) -> Dict[str, int]:
+        def op(conn):
+            rows = conn.execute(
+                "SELECT key, count FROM usage_counters WHERE scope = ? AND day = ? AND count > 0", (scope, day)
+            ).fetchall()
+            return dict(rows)
+        return await self._run(op)
+
+    async def add_ip_fingerprint(self, ip: str, fingerprint: str, day: str) -> int:
+        def op(conn):
+            def upsert():
+                conn.execute(
+                    "INSERT INTO ip_fingerprints (ip, fingerprint, last_seen) VALUES (?, ?, ?) "
+                    "ON CONFLICT (ip, fingerprint) DO UPDATE SET last_seen = excluded.last_seen",
+                    (ip, fingerprint, day)
+                )
+                return conn.execute("SELECT COUNT(*) FROM ip_fingerprints WHERE ip = ?", (ip,)).fetchone()[0]
+            return self._transaction(conn, upsert)
+        return await self._run(op)
+
+    async def is_suspicious(self, fingerprint: str) -> bool:
+        def op(conn):
+            row = conn.execute("SELECT 1 FROM suspicious_users WHERE fingerprint = ?", (fingerprint,)).fetchone()
+            return row is not None
+        return await self._run(op)
+
+    async def flag_suspicious(self, fingerprint: str, reason: str, flagged_at: str = None) -> bool:
+        def op(conn):
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO suspicious_users (fingerprint, reason, flagged_at) VALUES (?, ?, ?)",
+                (fingerprint, reason, flagged_at or datetime.now().isoformat())
+            )
+            return cursor.rowcount == 1
+        return await self._run(op)
+
+    async def suspicious_count(self) -> int:
+        def op(conn):
+            return conn.execute("SELECT COUNT(*) FROM suspicious_users").fetchone()[0]
+        return await self._run(op)
+
+    async def set_count_at_least(self, scope: str, key: str, day: str, count: int):
+        """Usado por la migración: idempotente si se importa el mismo JSON dos veces"""
+        def op(conn):
+            conn.execute(
+                "INSERT INTO usage_counters (scope, day, key, count) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (scope, day, key) DO UPDATE SET count = MAX(count, excluded.count)",
+                (scope, day, key, count)
+            )
+        await self._run(op)
+
+    async def purge(self, before_day: str) -> int:
+        def op(conn):
+            removed = conn.execute("DELETE FROM usage_counters WHERE day < ?", (before_day,)).rowcount
+            removed += conn.execute("DELETE FROM ip_fingerprints WHERE last_seen < ?", (before_day,)).rowcount
+            return removed
+        return await self._run(op)
+
+    async def close(self):
+        def op():
+            with self._lock:
+                if self._conn is not None:
+                    self._conn.close()
+                    self._conn = None
+        await asyncio.to_thread(op)
+
+
+class RedisUsageBackend:
+    """
+    Backend Redis reutilizando el pool de conexiones de events/bus.py
+    - usage:{scope}:{day}  hash clave -> contador (HINCRBY, expira con la retención)
+    - usage:ip:{ip}        hash fingerprint -> último día visto
+    - usage:suspicious     hash fingerprint -> {"reason", "flagged_at"}
+    """
+
+    name = "redis"
+
+    def __init__(self, bus=None):
+        if bus is None:
+            from events.bus import event_bus as bus
+        self.bus = bus
+
+    @staticmethod
+    def _ttl() -> int:
+        return (Config.USAGE_RETENTION_DAYS + 1) * 86400
+
+    async def ping(self):
+        async with self.bus.connection() as client:
+            await client.ping()
+
+    async def increment(self, scope: str, key: str, day: str) -> int:
+        async with self.bus.connection() as client:
+            pipe = client.pipeline(transaction=True)
+            pipe.hincrby(f"usage:{scope}:{day}", key, 1)
+            pipe.expire(f"usage:{scope}:{day}", self._ttl())
+            count, _ = await pipe.execute()
+        return int(count)
+
+    async def increment_many(self, items: List[Tuple[str, str, str, int]]) -> List[int]:
+        async with self.bus.connection() as client:
+            pipe = client.pipeline(transaction=True)
+            for scope, key, day, delta in items:
+                pipe.hincrby(f"usage:{scope}:{day}", key, delta)
+                pipe.expire(f"usage:{scope}:{day}", self._ttl())
+            results = await pipe.execute()
+        return [int(total) for total in results[::2]]
+
+    async def get_count(self, scope: str, key: str, day: str) -> int:
+        async with self.bus.connection() as client:
+            value = await client.hget(f"usage:{scope}:{day}", key)
+        return int(value or 0)
+
+    async def day_counts(self, scope: str, day: str) -> Dict[str, int]:
+        async with self.bus.connection() as client:
+            data = await client.hgetall(f"usage:{scope}:{day}")
+        return {key: int(value) for key, value in data.items() if int(value) > 0}
+
+    async def add_ip_fingerprint(self, ip: str, fingerprint: str, day: str) -> int:
+        async with self.bus.connection() as client:
+            pipe = client.pipeline(transaction=True)
+            pipe.hset(f"usage:ip:{ip}", fingerprint, day)
+            pipe.expire(f"usage:ip:{ip}", self._ttl())
+            pipe.hlen(f"usage:ip:{ip}")
+            _, _, count = await pipe.execute()
+        return int(count)
+
+    async def is_suspicious(self, fingerprint: str) -> bool:
+        async with self.bus.connection() as client:
+            return bool(await client.hexists("usage:suspicious", fingerprint))
+
+    async def flag_suspicious(self, fingerprint: str, reason: str, flagged_at: str = None) -> bool:
+        value = json.dumps({"reason": reason, "flagged_at": flagged_at or datetime.now().isoformat()})
+        async with self.bus.connection() as client:
+            return bool(await client.hsetnx("usage:suspicious", fingerprint, value))
+
+    async def suspicious_count(self) -> int:
+        async with self.bus.connection() as client:
+            return int(await client.hlen("usage:suspicious"))
+
+    async def set_count_at_least(self, scope: str, key: str, day: str, count: int):
+        async with self.bus.connection() as client:
+            current = int(await client.hget(f"usage:{scope}:{day}", key) or 0)
+            if count > current:
+                await client.hincrby(f"usage:{scope}:{day}", key, count - current)
+                await client.expire(f"usage:{scope}:{day}", self._ttl())
+
+    async def purge(self, before_day: str) -> int:
+        # Redis expira los días antiguos con EXPIRE
+        return 0
+
+    async def close(self):
+        pass
+
+
+async def create_usage_backend(backend: str = None):
+    """
+    Crea el backend configurado (Config.USAGE_STORE_BACKEND)
+    Si se pide Redis y no está disponible, se usa SQLite
+    """
+    backend = (backend or Config.USAGE_STORE_BACKEND).lower()
+    if backend == "redis":
+        try:
+            from events.bus import event_bus
+            event_bus.redis_url = Config.REDIS_URL
+            redis_backend = RedisUsageBackend(event_bus)
+            await redis_backend.ping()
+            logger.info("✅ Contadores de uso en Redis")
+            return redis_backend
+        except Exception as e:
+            logger.warning(f"⚠️ Redis no disponible para los contadores de uso ({e}), usando SQLite")
+    return SQLiteUsageBackend()
+
+
+# ----------------------------------------------------------------------
+# Store
+# ----------------------------------------------------------------------
+
+class UsageStore:
+    """
+    Contadores de uso por día, asociaciones IP -> fingerprint y usuarios sospechosos
+
+    Uso:
+        used = await usage_store.get_usage(fingerprint)
+        await usage_store.increment(fingerprint)
+    """
+
+    def __init__(self, backend=None, legacy_json_path: str = None):
+        self.backend = backend
+        self.legacy_json_path = legacy_json_path if legacy_json_path is not None else Config.USAGE_LEGACY_JSON_PATH
+        self._init_lock: Optional[asyncio.Lock] = None
+        self._ready = False
+        self._last_purge = 0.0
+
+    async def _ensure_backend(self):
+        if self._ready:
+            return self.backend
+        if self._init_lock is None:
+            self._init_lock = asyncio.Lock()
+        async with self._init_lock:
+            if not self._ready:
+                if self.backend is None:
+                    self.backend = await create_usage_backend()
+                if self.legacy_json_path:
+                    await self.migrate_legacy_json(self.legacy_json_path)
+                self._ready = True
+        return self.backend
+
+    async def increment(self, key: str, scope: str = FINGERPRINT, day: str = None) -> int:
+        """Incrementa atómicamente el contador del día y retorna el nuevo valor"""
+        backend = await self._ensure_backend()
+        await self._maybe_purge()
+        return await backend.increment(scope, key, day or today_key())
+
+    async def increment_many(self, items: List[Tuple[str, str, str, int]]) -> List[int]:
+        """Aplica un lote de incrementos (scope, key, day, delta); usado por el volcado de rate_limiter.py"""
+        backend = await self._ensure_backend()
+        await self._maybe_purge()
+        if not items:
+            return []
+        return await backend.increment_many(items)
+
+    async def get_usage(self, key: str, scope: str = FINGERPRINT, day: str = None) -> int:
+        backend = await self._ensure_backend()
+        return await backend.get_count(scope, key, day or today_key())
+
+    async def day_usage(self, scope: str = FINGERPRINT, day: str = None) -> Dict[str, int]:
+        backend = await self._ensure_backend()
+        return await backend.day_counts(scope, day or today_key())
+
+    async def associate_fingerprint(self, client_ip: str, fingerprint: str) -> int:
+        """Asocia el fingerprint con la IP y retorna cuántos fingerprints distintos tiene esa IP"""
+        backend = await self._ensure_backend()
+        return await backend.add_ip_fingerprint(client_ip, fingerprint, today_key())
+
+    async def is_suspicious(self, fingerprint: str) -> bool:
+        backend = await self._ensure_backend()
+        return await backend.is_suspicious(fingerprint)
+
+    async def flag_suspicious(self, fingerprint: str, reason: str) -> bool:
+        """Marca el fingerprint como sospechoso; retorna False si ya lo estaba"""
+        backend = await self._ensure_backend()
+        return await backend.flag_suspicious(fingerprint, reason)
+
+    async def suspicious_count(self) -> int:
+        backend = await self._ensure_backend()
+        return await backend.suspicious_count()
+
+    async def migrate_legacy_json(self, path: str) -> int:
+        """
+        Importa un usage_data.json antiguo (formatos de fastapi_app.py y web_app.py)
+        El archivo se renombra antes de leerlo: si varios procesos arrancan a la vez solo uno lo importa
+        """
+        migrated_path = f"{path}.migrated"
+        try:
+            os.replace(path, migrated_path)
+        except FileNotFoundError:
+            return 0
+
+        try:
+            with open(migrated_path, 'r') as f:
+                data = json.load(f)
+        except Exception as e:
+            logger.error(f"❌ No se pudo leer {migrated_path} para migrar: {e}")
+            return 0
+
+        imported = 0
+        last_reset = data.get("last_reset") or today_key()
+
+        for day_or_ip, value in (data.get("daily_usage") or {}).items():
+            if isinstance(value, dict):
+                # fastapi_app.py: {"YYYY-MM-DD": {fingerprint: count}}
+                for fingerprint, count in value.items():
+                    await self.backend.set_count_at_least(FINGERPRINT, fingerprint, day_or_ip, int(count))
+                    imported += 1
+            else:
+                # web_app.py: {ip: count} del día last_reset
+                await self.backend.set_count_at_least(IP, day_or_ip, last_reset, int(value))
+                imported += 1
+
+        for fingerprint, info in (data.get("user_fingerprints") or {}).items():
+            count = int((info or {}).get("daily_usage", 0))
+            if count:
+                await self.backend.set_count_at_least(FINGERPRINT, fingerprint, last_reset, count)
+                imported += 1
+
+        today = today_key()
+        for client_ip, fingerprints in (data.get("ip_fingerprints") or {}).items():
+            for fingerprint in fingerprints:
+                await self.backend.add_ip_fingerprint(client_ip, fingerprint, today)
+                imported += 1
+
+        for fingerprint, info in (data.get("suspicious_users") or {}).items():
+            info = info or {}
+            await self.backend.flag_suspicious(fingerprint, info.get("reason", ""), info.get("flagged_at"))
+            imported += 1
+
+        logger.info(f"📦 {imported} registros migrados de {path} al almacén de uso ({self.backend.name})")
+        return imported
+
+    async def _maybe_purge(self):
+        now = time.time()
+        if now - self._last_purge < 3600:
+            return
+        self._last_purge = now
+        cutoff = (date.today() - timedelta(days=Config.USAGE_RETENTION_DAYS)).isoformat()
+        removed = await self.backend.purge(cutoff)
+        if removed:
+            logger.info(f"🧹 {removed} registros de uso anteriores a {cutoff} purgados")
+
+    async def close(self):
+        if self.backend is not None:
+            await self.backend.close()
+        self._ready = False
+
+
+# Instancia global del almacén de uso
+usage_store = UsageStore()
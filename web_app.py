@@ -8,26 +8,12 @@ import uuid
 import asyncio
 import aiofiles
 import base64
-import json
 import logging
+import mimetypes
 from typing import Dict, Any, Optional
-from datetime import datetime, date
+from datetime import datetime
 from pathlib import Path
 
-# Translation imports
-try:
-    from deep_translator import GoogleTranslator
-    from langdetect import detect
-    TRANSLATION_AVAILABLE = True
-    # Define exception for langdetect errors (langdetect doesn't export LangDetectError in some versions)
-    LangDetectError = Exception
-except ImportError as e:
-    print(f"⚠️ Translation libraries import failed: {e}. Install with: pip install deep-translator langdetect")
-    TRANSLATION_AVAILABLE = False
-    GoogleTranslator = None
-    detect = None
-    LangDetectError = Exception
-
 # Telegram imports for bot integration
 try:
     from telegram import Update
@@ -46,7 +32,20 @@ from fastapi.responses import HTMLResponse, FileResponse, JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
 
-from async_wavespeed import AsyncWavespeedAPI
+from async_wavespeed import AsyncWavespeedAPI, close_shared_session, wavespeed_webhook_url, verify_wavespeed_webhook_token
+from async_polling import wait_for_prediction, PredictionFailedError, PredictionTimeoutError
+from pipeline import Pipeline, Stage, StageError
+from prediction_tracker import prediction_tracker
+from job_queue import job_queue
+from usage_store import usage_store
+from rate_limiter import rate_limiter
+from prompt_cache import prompt_cache
+from translation_service import translation_service
+from file_id_cache import file_id_cache
+from social_cache import social_cache
+from ytdlp_engine import ytdlp_engine
+from curl_session_pool import curl_session_pool
+from image_normalizer import image_normalizer
 from config import Config
 
 # Import bot handlers
@@ -70,7 +69,7 @@ logger = logging.getLogger(__name__)
 
 # Global variables
 api_client = AsyncWavespeedAPI()
-tasks: Dict[str, Dict[str, Any]] = {}
+# Video tasks live in the persistent job queue (job_queue), not in memory
 
 # Telegram bot app state (for unified service)
 telegram_app_state = {
@@ -80,44 +79,8 @@ telegram_app_state = {
 }
 
 # Rate limiting configuration
-USAGE_FILE = Path("usage_data.json")
-DAILY_LIMIT = 5
 SUSPICIOUS_THRESHOLD = 3  # Número de IPs diferentes antes de marcar como sospechoso
 
-def load_usage_data() -> Dict[str, Any]:
-    """Load usage data from file"""
-    if USAGE_FILE.exists():
-        try:
-            with open(USAGE_FILE, 'r') as f:
-                return json.load(f)
-        except:
-            pass
-    return {
-        "daily_usage": {},
-        "user_fingerprints": {},  # Maps fingerprint to usage data
-        "ip_fingerprints": {},    # Maps IP to list of fingerprints
-        "suspicious_users": {},   # Users flagged as suspicious
-        "last_reset": str(date.today())
-    }
-
-def save_usage_data(data: Dict[str, Any]):
-    """Save usage data to file"""
-    try:
-        with open(USAGE_FILE, 'w') as f:
-            json.dump(data, f, indent=2)
-    except Exception as e:
-        print(f"Error saving usage data: {e}")
-
-def reset_daily_usage_if_needed(usage_data: Dict[str, Any]) -> Dict[str, Any]:
-    """Reset daily usage counters if it's a new day"""
-    today = str(date.today())
-    if usage_data.get("last_reset") != today:
-        usage_data["daily_usage"] = {}
-        usage_data["last_reset"] = today
-        # Keep fingerprints and suspicious data across days
-        save_usage_data(usage_data)
-    return usage_data
-
 def generate_fingerprint(client_ip: str, user_agent: str = "", fingerprint_data: Dict[str, Any] = None) -> str:
     """Generate a unique fingerprint for the user"""
     import hashlib
@@ -138,125 +101,41 @@ def generate_fingerprint(client_ip: str, user_agent: str = "", fingerprint_data:
     fingerprint_string = "|".join(fingerprint_parts)
     return hashlib.sha256(fingerprint_string.encode()).hexdigest()[:16]
 
-def associate_fingerprint_with_ip(usage_data: Dict[str, Any], client_ip: str, fingerprint: str):
-    """Associate a fingerprint with an IP address for tracking"""
-    ip_fingerprints = usage_data.setdefault("ip_fingerprints", {})
-    if client_ip not in ip_fingerprints:
-        ip_fingerprints[client_ip] = []
-
-    if fingerprint not in ip_fingerprints[client_ip]:
-        ip_fingerprints[client_ip].append(fingerprint)
-
-def is_suspicious_user(usage_data: Dict[str, Any], fingerprint: str) -> bool:
-    """Check if user is flagged as suspicious"""
-    suspicious_users = usage_data.get("suspicious_users", {})
-    return fingerprint in suspicious_users
-
-def flag_suspicious_user(usage_data: Dict[str, Any], fingerprint: str, reason: str):
-    """Flag a user as suspicious"""
-    suspicious_users = usage_data.setdefault("suspicious_users", {})
-    suspicious_users[fingerprint] = {
-        "flagged_at": datetime.now().isoformat(),
-        "reason": reason
-    }
-    save_usage_data(usage_data)
-
 # Translation functions
-def detect_language(text: str) -> str:
-    """Detect the language of the given text"""
-    if not TRANSLATION_AVAILABLE:
-        return "en"  # Default to English if translation not available
-
-    try:
-        return detect(text)
-    except Exception as e:
-        print(f"⚠️ Language detection failed: {e}")
-        return "en"  # Default to English on detection error
-
-def translate_to_english(text: str) -> tuple[str, bool]:
-    """
-    Silently translate any non-English text to English for better AI results
-    Returns: (translated_text, was_translated)
-    """
-    if not TRANSLATION_AVAILABLE:
-        return text, False
-
-    try:
-        detected_lang = detect_language(text)
-
-        if detected_lang == "en":
-            return text, False
+async def detect_language(text: str) -> str:
+    """Detect the language of the given text (cached, off the event loop)"""
+    return await translation_service.detect_language(text)
 
-        # Translate from any detected language to English
-        try:
-            translator = GoogleTranslator(source=detected_lang, target='en')
-            translated = translator.translate(text)
-            print(f"🌐 Auto-translated from {detected_lang}: '{text[:50]}...' → '{translated[:50]}...'")
-            return translated, True
-        except:
-            # If specific language detection fails, try auto-detection
-            translator = GoogleTranslator(source='auto', target='en')
-            translated = translator.translate(text)
-            print(f"🌐 Auto-translated (auto-detect): '{text[:50]}...' → '{translated[:50]}...'")
-            return translated, True
-
-    except Exception as e:
-        print(f"⚠️ Translation error: {e}")
-        return text, False
+async def translate_to_english(text: str, source: Optional[str] = None) -> tuple[str, bool]:
+    """Translate text to English if not already in English (cached, coalesced, off the event loop)"""
+    return await translation_service.translate_to_english(text, source=source)
 
-def check_rate_limit_advanced(client_ip: str, fingerprint: str, user_agent: str = "") -> tuple[bool, int, int, bool]:
+async def check_rate_limit_advanced(client_ip: str, fingerprint: str, user_agent: str = "") -> tuple[bool, int, int, bool]:
     """
     Advanced rate limiting using IP + fingerprint + behavior analysis
     Returns: (allowed: bool, used: int, remaining: int, is_suspicious: bool)
     """
-    usage_data = load_usage_data()
-    usage_data = reset_daily_usage_if_needed(usage_data)
-
     # Associate fingerprint with IP for tracking
-    associate_fingerprint_with_ip(usage_data, client_ip, fingerprint)
+    ip_fingerprint_count = await usage_store.associate_fingerprint(client_ip, fingerprint)
 
     # Check if user is already flagged as suspicious
-    if is_suspicious_user(usage_data, fingerprint):
+    if await usage_store.is_suspicious(fingerprint):
         print(f"🚨 Suspicious user detected: {fingerprint}")
         return False, 0, 0, True
 
     # Check for VPN/abuse patterns
-    ip_fingerprints = usage_data.get("ip_fingerprints", {}).get(client_ip, [])
-    if len(ip_fingerprints) > SUSPICIOUS_THRESHOLD:
-        flag_suspicious_user(usage_data, fingerprint, f"Multiple fingerprints from IP: {len(ip_fingerprints)}")
+    if ip_fingerprint_count > SUSPICIOUS_THRESHOLD:
+        await usage_store.flag_suspicious(fingerprint, f"Multiple fingerprints from IP: {ip_fingerprint_count}")
         return False, 0, 0, True
 
-    # Get usage for this fingerprint (more restrictive than IP alone)
-    user_fingerprints = usage_data.setdefault("user_fingerprints", {})
-    if fingerprint not in user_fingerprints:
-        user_fingerprints[fingerprint] = {"daily_usage": 0, "last_used": None}
+    # Plan limits for this fingerprint and its IP (answered from memory)
+    decision = await rate_limiter.check(fingerprint, client_ip)
+    return decision.allowed, decision.used, decision.remaining, False
 
-    user_data = user_fingerprints[fingerprint]
-    used_today = user_data.get("daily_usage", 0)
-    remaining = max(0, DAILY_LIMIT - used_today)
-
-    return used_today < DAILY_LIMIT, used_today, remaining, False
-
-def increment_usage_advanced(client_ip: str, fingerprint: str) -> bool:
-    """Increment usage counter for fingerprint (more restrictive)"""
+async def increment_usage_advanced(client_ip: str, fingerprint: str) -> bool:
+    """Increment usage counters for fingerprint and IP (persisted in batches by the rate limiter)"""
     try:
-        usage_data = load_usage_data()
-        usage_data = reset_daily_usage_if_needed(usage_data)
-
-        # Update fingerprint usage
-        user_fingerprints = usage_data.setdefault("user_fingerprints", {})
-        if fingerprint not in user_fingerprints:
-            user_fingerprints[fingerprint] = {"daily_usage": 0, "last_used": None}
-
-        user_data = user_fingerprints[fingerprint]
-        user_data["daily_usage"] = user_data.get("daily_usage", 0) + 1
-        user_data["last_used"] = datetime.now().isoformat()
-
-        # Also track IP usage for compatibility
-        daily_usage = usage_data.setdefault("daily_usage", {})
-        daily_usage[client_ip] = daily_usage.get(client_ip, 0) + 1
-
-        save_usage_data(usage_data)
+        await rate_limiter.hit(fingerprint, client_ip)
         return True
     except Exception as e:
         print(f"Error incrementing usage: {e}")
@@ -351,20 +230,62 @@ async def lifespan(app: FastAPI):
         if not BOT_HANDLERS_AVAILABLE:
             logger.warning("   - Bot handlers not importable")
 
+    # Start central WaveSpeed prediction poller
+    if Config.USE_PREDICTION_TRACKER:
+        await prediction_tracker.start()
+
+    # Start the persistent job queue (resumes jobs interrupted by a restart)
+    job_queue.resources["telegram_app"] = telegram_app_state.get("telegram_app")
+    await job_queue.start()
+
+    # In-memory rate limiter with periodic write-behind to the usage store
+    await rate_limiter.start()
+
+    # Warm yt-dlp pool: the first social link doesn't pay for worker start-up
+    try:
+        await ytdlp_engine.warm_up()
+    except Exception as e:
+        logger.error(f"❌ Error warming up yt-dlp: {e}")
+
     logger.info("✅ Unified SynthClip + TELEWAN service ready!")
     
     yield
 
     # Cleanup on shutdown
     logger.info("🛑 Shutting down unified service...")
-    
+
+    # Stop the job queue and rate limiter first: in-flight jobs still send through Telegram
+    await close_quietly("job queue", job_queue.stop)
+    await close_quietly("rate limiter", rate_limiter.stop)
+
     # Shutdown Telegram bot
     if telegram_app_state.get("telegram_app"):
-        try:
-            await telegram_app_state["telegram_app"].shutdown()
+        if await close_quietly("Telegram bot", telegram_app_state["telegram_app"].shutdown):
             logger.info("✅ Telegram bot shutdown complete")
-        except Exception as e:
-            logger.error(f"❌ Error during Telegram shutdown: {e}")
+
+    # Each close on its own: one failure doesn't leave the rest open
+    await close_quietly("yt-dlp pool", ytdlp_engine.shutdown)
+    await close_quietly("curl_cffi sessions", curl_session_pool.close)
+    await close_quietly("usage store", usage_store.close)
+    await close_quietly("prompt cache", prompt_cache.close)
+    await close_quietly("translation service", translation_service.close)
+    await close_quietly("file_id cache", file_id_cache.close)
+    await close_quietly("social cache", social_cache.close)
+    await close_quietly("image normalizer", image_normalizer.shutdown)
+    await close_quietly("prediction tracker", prediction_tracker.stop)
+    await close_quietly("shared HTTP session", close_shared_session)
+
+
+async def close_quietly(name: str, close) -> bool:
+    """Run a (sync or async) close, logging its error without aborting shutdown"""
+    try:
+        result = close()
+        if asyncio.iscoroutine(result):
+            await result
+        return True
+    except Exception as e:
+        logger.error(f"❌ Error closing {name}: {e}")
+        return False
 
 
 
@@ -396,7 +317,6 @@ async def root():
 
 @app.post("/generate")
 async def generate_video(
-    background_tasks: BackgroundTasks,
     image: Optional[UploadFile] = File(None),
     prompt: str = Form(...),
     model: str = Form("ultra_fast"),
@@ -421,7 +341,7 @@ async def generate_video(
         print(f"🎯 Request from IP: {client_ip}, Fingerprint: {fingerprint[:8]}...")
 
         # Check advanced rate limit
-        allowed, used, remaining, is_suspicious = check_rate_limit_advanced(client_ip, fingerprint, user_agent)
+        allowed, used, remaining, is_suspicious = await check_rate_limit_advanced(client_ip, fingerprint, user_agent)
         if not allowed:
             if is_suspicious:
                 return {
@@ -434,9 +354,9 @@ async def generate_video(
             else:
                 return {
                     "error": "Límite diario excedido",
-                    "message": f"Has alcanzado el límite de {DAILY_LIMIT} videos por día. Usaste {used} hoy.",
+                    "message": f"Has alcanzado el límite diario de tu plan. Usaste {used} videos en las últimas 24h.",
                     "remaining": remaining,
-                    "reset_time": "mañana a las 00:00",
+                    "reset_time": "ventana móvil de 24 horas",
                     "upgrade_message": "Actualiza a un plan premium para más videos diarios."
                 }
 
@@ -453,11 +373,11 @@ async def generate_video(
         # Generate task ID
         task_id = str(uuid.uuid4())
 
-        # Initialize task
-        tasks[task_id] = {
+        # Initialize task state (persisted by the job queue)
+        task_state = {
             "status": "processing",
             "progress": 0,
-            "created_at": datetime.now(),
+            "created_at": datetime.now().isoformat(),
             "model": model,
             "auto_optimize": auto_optimize,
             "add_audio": add_audio,
@@ -487,26 +407,24 @@ async def generate_video(
         print(f"🎯 Processing request: model={model}, has_image={image is not None}, image_url={image_url is not None}")
 
         # Increment usage counter (advanced system)
-        increment_usage_advanced(client_ip, fingerprint)
-
-        # Start background processing
-        background_tasks.add_task(
-            process_video_generation,
-            task_id,
-            prompt,
-            image_url,
-            model,
-            auto_optimize,
-            add_audio,
-            upscale_1080p
-        )
+        await increment_usage_advanced(client_ip, fingerprint)
+
+        # Queue the job (survives restarts, processed by the worker pool)
+        await job_queue.submit("web_video", {
+            "prompt": prompt,
+            "image_url": image_url,
+            "model": model,
+            "auto_optimize": auto_optimize,
+            "add_audio": add_audio,
+            "upscale_1080p": upscale_1080p
+        }, state=task_state, job_id=task_id)
 
         return {
             "task_id": task_id,
             "status": "processing",
             "message": "Video generation started",
             "usage_today": used + 1,
-            "remaining_today": remaining - 1
+            "remaining_today": remaining - 1 if remaining is not None else None
         }
 
     except HTTPException:
@@ -519,34 +437,173 @@ async def get_task_status(task_id: str):
     """
     Get the status of a video generation task
     """
-    if task_id not in tasks:
+    job = await job_queue.get(task_id)
+    if job is None:
         raise HTTPException(status_code=404, detail="Task not found")
 
-    task = tasks[task_id]
+    task = job.state
 
     # If completed, return final result
-    if task["status"] == "completed":
+    if job.status == "completed":
         return {
             "status": "completed",
             "video_url": task["video_url"],
-            "prompt_used": task["optimized_prompt"] or task["translated_prompt"] or task["original_prompt"],
+            "prompt_used": task.get("optimized_prompt") or task.get("translated_prompt") or task["original_prompt"],
             "model": task["model"],
-            "was_optimized": bool(task.get("optimized_prompt"))
+            "was_optimized": bool(task.get("optimized_prompt")),
+            "stages": task.get("stage_timings")
         }
-    elif task["status"] == "failed":
+    elif job.status == "failed":
         return {
             "status": "failed",
-            "error": task["error"]
+            "error": job.error or task.get("error"),
+            "stages": task.get("stage_timings")
         }
     else:
-        # Still processing
+        # Still processing (queued, running or waiting for a retry)
         return {
             "status": "processing",
             "progress": task.get("progress", 0),
-            "message": task.get("message", "Processing...")
+            "message": task.get("message", "Processing..." if job.status == "running" else "Queued...")
         }
 
+# Progreso y mensaje visibles en /status al arrancar cada etapa
+WEB_STAGE_PROGRESS = {
+    "language": (10, "Preparando generación de video..."),
+    "translate": (15, "Preparando descripción..."),
+    "image": (15, "Cargando imagen..."),
+    "optimize": (20, "Optimizando descripción con IA..."),
+    "generate": (30, "Generando video..."),
+    "poll": (50, "Video generation in progress..."),
+    "audio": (80, "Generando audio ambiental..."),
+    "upscale": (90, "Escalando a 1080P premium..."),
+    "download": (95, "Descargando video..."),
+}
+
+
+def build_web_pipeline(task: Dict[str, Any], task_id: str) -> Pipeline:
+    """
+    Etapas de /generate: la carga de la imagen corre en paralelo con la detección de idioma
+    y la traducción; el optimizer arranca en cuanto ambas terminan. Audio y upscale reciben
+    la URL de salida de la etapa anterior y solo el video final se descarga
+    """
+    async def translate(prompt: str, language: str) -> str:
+        translated_prompt, was_translated = await translate_to_english(prompt, source=language)
+        if was_translated:
+            task["translated_prompt"] = translated_prompt
+            task["original_language"] = language
+        return translated_prompt
+
+    def load_image(image_url: str) -> Optional[bytes]:
+        # La imagen subida está en el volumen: el optimizer la usa para la clave de caché sin descargarla
+        image_path = storage_dir / os.path.basename(image_url)
+        return image_path.read_bytes() if image_path.exists() else None
+
+    async def optimize(english_prompt: str, image_url: Optional[str], image_bytes: Optional[bytes], model: str) -> str:
+        if model == "text_to_video":
+            result = await api_client.optimize_prompt_text_only(text=english_prompt, mode="video", style="default")
+            optimized = result.get("optimized_prompt")
+        else:
+            # Cached by image hash + text: repeated requests skip the optimizer entirely
+            optimized = await api_client.optimize_prompt(
+                image_url=image_url, text=english_prompt, mode="video", style="default", image_bytes=image_bytes
+            )
+        if optimized and optimized.strip() and optimized != english_prompt:
+            task["optimized_prompt"] = optimized
+            logger.info(f"✅ Prompt optimized: '{english_prompt[:30]}...' → '{optimized[:30]}...'")
+            return optimized
+        return english_prompt
+
+    async def generate(final_prompt: str, image_url: Optional[str], model: str) -> Dict[str, Any]:
+        # A retried job already has a request_id: keep polling it instead of paying for a new generation
+        request_id = task.get("request_id")
+        if request_id:
+            return {"request_id": request_id, "push": False}
+        video_result = await api_client.generate_video(prompt=final_prompt, image_url=image_url, model=model)
+        request_id = (video_result or {}).get("id")
+        if not request_id:
+            raise Exception(f"No request ID received from API: {video_result}")
+        task["request_id"] = request_id
+        # Solo una predicción recién creada puede confiar en el webhook; una retomada se consulta ya
+        return {"request_id": request_id, "push": wavespeed_webhook_url() is not None}
+
+    async def poll(request_id: str, push: bool, model: str) -> str:
+        max_attempts = Config.MAX_POLLING_ATTEMPTS
+
+        async def report_progress(attempt: int, status: Optional[str]):
+            task["progress"] = min(50 + (attempt / max_attempts) * 30, 90)
+            task["message"] = f"Generating video... ({attempt + 1}/{max_attempts})"
+
+        try:
+            status_result = await wait_for_prediction(
+                api_client, request_id, max_attempts=max_attempts,
+                on_progress=report_progress, label=f"video:{model}", push=push
+            )
+        except PredictionFailedError as e:
+            raise Exception(f"Video generation failed: {e.error}")
+        except PredictionTimeoutError:
+            raise Exception(f"Video generation timeout after {max_attempts} attempts")
+        return status_result['outputs'][0]
+
+    # Audio y upscale se encadenan por la URL de salida de WaveSpeed: solo se descarga el resultado final.
+    # Las URLs intermedias quedan en el estado del trabajo para no repetir (ni pagar) una etapa en un reintento
+    async def audio(video_url: str, final_prompt: str) -> str:
+        audio_video_url = task.get("audio_remote_url") or await api_client.add_audio_to_video(video_url, final_prompt)
+        if not audio_video_url:
+            raise Exception("Audio generation returned no video")
+        task["audio_remote_url"] = audio_video_url
+        return audio_video_url
+
+    async def upscale(audio_video_url: str) -> str:
+        upscaled_video_url = task.get("upscale_remote_url") or await api_client.upscale_video_to_1080p(audio_video_url)
+        if not upscaled_video_url:
+            raise Exception("1080P upscale returned no video")
+        task["upscale_remote_url"] = upscaled_video_url
+        return upscaled_video_url
+
+    async def download(final_video_url: str) -> str:
+        # Stream video straight to disk (atomic rename, validated while downloading)
+        video_filename = task.get("video_filename") or \
+            f"output_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}.mp4"
+        await api_client.download_video_to_file(final_video_url, video_filename, directory=str(storage_dir))
+        task["video_filename"] = video_filename
+        task["video_url"] = f"/videos/{video_filename}"
+        if task.get("audio_remote_url"):
+            task["audio_video_url"] = task["video_url"]
+        if task.get("upscale_remote_url"):
+            task["upscaled_video_url"] = task["video_url"]
+        return video_filename
+
+    retries = Config.STAGE_RETRIES
+    return Pipeline([
+        Stage("language", detect_language, inputs=("prompt",), outputs=("language",),
+              timeout=Config.STAGE_TRANSLATION_TIMEOUT, fallback=lambda prompt: "en"),
+        Stage("translate", translate, inputs=("prompt", "language"), outputs=("english_prompt",),
+              timeout=Config.STAGE_TRANSLATION_TIMEOUT, retries=retries,
+              when=lambda values: values["language"] != "en", fallback=lambda prompt, language: prompt),
+        Stage("image", load_image, inputs=("image_url",), outputs=("image_bytes",),
+              when=lambda values: bool(values["image_url"]), fallback=lambda image_url: None),
+        Stage("optimize", optimize, inputs=("english_prompt", "image_url", "image_bytes", "model"),
+              outputs=("final_prompt",), timeout=Config.STAGE_OPTIMIZER_TIMEOUT,
+              when=lambda values: values["auto_optimize"] and (values["model"] == "text_to_video" or bool(values["image_url"])),
+              fallback=lambda english_prompt, *_: english_prompt),
+        Stage("generate", generate, inputs=("final_prompt", "image_url", "model"), outputs=("request_id", "push"),
+              timeout=Config.STAGE_SUBMIT_TIMEOUT),
+        Stage("poll", poll, inputs=("request_id", "push", "model"), outputs=("video_url",)),
+        # Audio y upscale son opcionales: si fallan (o no se piden) pasa la URL anterior
+        Stage("audio", audio, inputs=("video_url", "final_prompt"), outputs=("audio_video_url",),
+              timeout=Config.STAGE_POSTPROCESS_TIMEOUT,
+              when=lambda values: values["add_audio"], fallback=lambda video_url, *_: video_url),
+        Stage("upscale", upscale, inputs=("audio_video_url",), outputs=("final_video_url",),
+              timeout=Config.STAGE_POSTPROCESS_TIMEOUT,
+              when=lambda values: values["upscale_1080p"], fallback=lambda audio_video_url: audio_video_url),
+        Stage("download", download, inputs=("final_video_url",), outputs=("video_filename",),
+              timeout=Config.STAGE_DOWNLOAD_TIMEOUT, retries=retries),
+    ], name=f"web_video:{task_id[:8]}")
+
+
 async def process_video_generation(
+    task: Dict[str, Any],
     task_id: str,
     prompt: str,
     image_url: Optional[str],
@@ -556,358 +613,54 @@ async def process_video_generation(
     upscale_1080p: bool
 ):
     """
-    Background task to process video generation
+    Background task to process video generation (stage DAG, see build_web_pipeline)
     """
-    try:
-        task = tasks[task_id]
-        task["progress"] = 10
-        if model == "text_to_video":
-            task["message"] = "Preparando generación de video desde texto..."
-        else:
-            task["message"] = "Preparando generación de video desde imagen..."
-
-        # Step 1: Silently translate to English if needed, then optimize if requested
-        final_prompt = prompt
-        original_language = detect_language(prompt)
-        was_translated = False
-
-        # Silently auto-translate any non-English prompts to English for better AI results
-        if original_language != "en":
-            translated_prompt, was_translated = translate_to_english(prompt)
-            if was_translated:
-                final_prompt = translated_prompt
-                task["translated_prompt"] = final_prompt
-                task["original_prompt"] = prompt  # Keep original for reference
-                task["original_language"] = original_language
-
-        # Determine progress message based on content type
-        is_text_only = (model == "text_to_video")
-
-        if auto_optimize:
-            if is_text_only:
-                task["progress"] = 20
-                task["message"] = "Optimizando descripción con IA..."
-
-                try:
-                    print(f"🤖 Starting text-only optimization for: '{final_prompt[:50]}...'")
-                    # Use text-only optimization for T2V (use translated prompt)
-                    optimize_result = await api_client.optimize_prompt_text_only(
-                        text=final_prompt,
-                        mode="video",
-                        style="default"
-                    )
-
-                    print(f"📋 Text-only optimization result: {optimize_result}")
-
-                    # The method now returns a standardized response
-                    optimization_successful = False
-                    if "optimized_prompt" in optimize_result:
-                        optimized = optimize_result["optimized_prompt"]
-                        print(f"📝 Found optimized_prompt: '{optimized[:50]}...'")
-                        # Accept any optimized prompt, not just longer ones
-                        if optimized and optimized.strip() and optimized != final_prompt:
-                            old_prompt = final_prompt
-                            final_prompt = optimized
-                            task["optimized_prompt"] = final_prompt
-                            optimization_successful = True
-                            print(f"✅ Text-only prompt optimized: '{old_prompt[:30]}...' → '{final_prompt[:30]}...'")
-                        else:
-                            print(f"📝 Optimized prompt is same as original or empty, keeping current prompt")
-                    else:
-                        print(f"⚠️  No optimized_prompt found in response: {list(optimize_result.keys())}")
-
-                    if not optimization_successful:
-                        print(f"📝 Continuing with current prompt: '{final_prompt[:50]}...'")
-
-                except Exception as e:
-                    print(f"⚠️  Text-only prompt optimization failed: {e}")
-                    print(f"📝 Continuing with current prompt: '{final_prompt[:50]}...'")
-
-            elif image_url:
-                task["progress"] = 20
-                task["message"] = "Analizando imagen y optimizando descripción..."
-
-                try:
-                    optimize_result = await api_client.optimize_prompt_v3(
-                        image_url=image_url,
-                        text=final_prompt,
-                        mode="video",
-                        style="default"
-                    )
-
-                    # Poll for optimization result with timeout
-                    task_id = optimize_result["id"]
-                    max_attempts = 15  # Aumentar a 15 intentos (7.5 segundos total)
-                    attempt = 0
-                    optimization_successful = False
-
-                    while attempt < max_attempts:
-                        try:
-                            opt_status = await api_client.get_prompt_optimizer_result(task_id)
-
-                            if opt_status.get("status") == "completed":
-                                print(f"📋 Image optimization completed, response: {opt_status}")
-                                if "optimized_prompt" in opt_status:
-                                    optimized = opt_status["optimized_prompt"]
-                                    print(f"📝 Found optimized_prompt: '{optimized[:50]}...'")
-                                    # Accept any optimized prompt, not just longer ones
-                                    if optimized and optimized.strip():
-                                        old_prompt = final_prompt
-                                        final_prompt = optimized
-                                        task["optimized_prompt"] = final_prompt
-                                        optimization_successful = True
-                                        print(f"✅ Image-based prompt optimized: '{old_prompt[:30]}...' → '{final_prompt[:30]}...'")
-                                        break
-                                elif "result" in opt_status and opt_status["result"]:
-                                    # Some APIs return result directly
-                                    optimized = opt_status["result"]
-                                    print(f"📝 Found result: '{optimized[:50]}...'")
-                                    if optimized and optimized.strip():
-                                        old_prompt = final_prompt
-                                        final_prompt = optimized
-                                        task["optimized_prompt"] = final_prompt
-                                        optimization_successful = True
-                                        print(f"✅ Image-based prompt optimized (result): '{old_prompt[:30]}...' → '{final_prompt[:30]}...'")
-                                        break
-                                else:
-                                    print(f"⚠️  No optimized_prompt or result found in completed response: {list(opt_status.keys())}")
-                                break
-                            elif opt_status.get("status") == "failed":
-                                print(f"⚠️  Prompt optimization failed on server side")
-                                break
-
-                            # Wait before next attempt
-                            await asyncio.sleep(0.5)
-                            attempt += 1
-
-                        except Exception as poll_error:
-                            print(f"⚠️  Error polling prompt optimization: {poll_error}")
-                            break
-
-                    if not optimization_successful:
-                        if attempt >= max_attempts:
-                            print(f"⚠️  Prompt optimization timed out after {max_attempts} attempts, continuing with current prompt")
-                        print(f"📝 Continuing with prompt: '{final_prompt[:50]}...'")
-
-                except Exception as e:
-                    print(f"⚠️  Image-based prompt optimization failed: {e}")
-                    # Continue with original prompt
-            else:
-                print(f"📝 Using original prompt (auto_optimize={auto_optimize}, model={model})")
-
-        print(f"🎬 Final prompt: {final_prompt[:100]}...")
-        print(f"📊 Prompt summary: original={len(prompt)} chars, final={len(final_prompt)} chars, was_translated={was_translated}")
-
-        task["progress"] = 30
-        if model == "text_to_video":
-            task["message"] = "Generando video desde descripción textual..."
-        else:
-            task["message"] = "Generando video desde imagen..."
-
-        # Step 2: Generate video
-        try:
-            print(f"🎬 Starting video generation with model: {model}")
-            print(f"📝 Prompt: {final_prompt[:100]}...")
-            print(f"🖼️  Image URL: {image_url}")
-
-            video_result = await api_client.generate_video(
-                prompt=final_prompt,
-                image_url=image_url,
-                model=model
-            )
+    pipeline = build_web_pipeline(task, task_id)
 
-            print(f"✅ Video generation API response: {video_result}")
+    def on_stage_start(stage: Stage, record):
+        task["progress"], task["message"] = WEB_STAGE_PROGRESS.get(stage.name, (task.get("progress", 0), task.get("message")))
 
-            if not video_result:
-                raise Exception("Empty response from video generation API")
+    def on_stage_end(stage: Stage, record):
+        task["stage_timings"] = pipeline.timings()
 
-            task["progress"] = 50
-            task["message"] = "Video generation in progress..."
+    try:
+        await pipeline.run({
+            "prompt": prompt,
+            "image_url": image_url,
+            "model": model,
+            "auto_optimize": auto_optimize,
+            "add_audio": add_audio,
+            "upscale_1080p": upscale_1080p,
+        }, on_stage_start=on_stage_start, on_stage_end=on_stage_end)
+    except Exception as e:
+        error_msg = str(e.error if isinstance(e, StageError) else e)
+        logger.error(f"❌ Video generation failed for task {task_id}: {e}")
+        task["stage_timings"] = pipeline.timings()
+        task["error"] = error_msg
+        # The job queue retries the task and marks it failed once attempts are exhausted
+        raise
 
-            # Step 3: Poll for completion
-            request_id = video_result.get("id")
-            if not request_id:
-                print(f"❌ No request ID in response: {video_result}")
-                raise Exception("No request ID received from API")
+    task["progress"] = 100
+    task["status"] = "completed"
 
-            print(f"🔄 Starting polling for request_id: {request_id}")
-            print(f"📊 Full initial response: {video_result}")
+    # Set final message based on what was processed
+    if task.get("audio_video_url") and task.get("upscaled_video_url"):
+        task["message"] = "¡Video Ultimate completado!"
+    elif task.get("audio_video_url"):
+        task["message"] = "¡Video con audio completado!"
+    elif task.get("upscaled_video_url"):
+        task["message"] = "¡Video 1080P completado!"
+    else:
+        task["message"] = "¡Video completado!"
 
-            # Poll for status
-            max_attempts = 240  # ~4 minutes (back to original)
-            for attempt in range(max_attempts):
-                try:
-                    print(f"🔍 Checking status (attempt {attempt + 1}/{max_attempts}) for request_id: {request_id}")
-                    status_result = await api_client.get_video_status(request_id)
-                    print(f"📋 Raw status result: {status_result}")
-
-                    if not status_result:
-                        print(f"⚠️  Empty status result, retrying...")
-                        await asyncio.sleep(1)
-                        continue
-
-                    # Handle nested response structure like the original bot
-                    if status_result.get('data'):
-                        task_data = status_result['data']
-                        status = task_data.get('status')
-                        print(f"📊 Using nested status: {status}")
-                    else:
-                        status = status_result.get("status")
-                        print(f"📊 Using direct status: {status}")
-
-                    if status is None:
-                        print(f"⚠️  Status is None, response: {status_result}")
-                        await asyncio.sleep(1)
-                        continue
-
-                    if status == "completed":
-                        # Extract video URL from outputs array (as per API documentation)
-                        if status_result.get('outputs') and len(status_result['outputs']) > 0:
-                            video_url = status_result['outputs'][0]
-                            print(f"🎬 Video URL found: {video_url[:50]}...")
-                        else:
-                            print(f"❌ No video URL found in response: {status_result}")
-                            raise Exception("No video URL received from completed API response")
-
-                        if video_url:
-                            # Download and save video
-                            task["progress"] = 70
-                            task["message"] = "Descargando video base..."
-
-                            video_content = await api_client.download_video(video_url)
-
-                            # Save video file
-                            video_filename = f"output_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}.mp4"
-                            video_path = storage_dir / video_filename
-
-                            async with aiofiles.open(video_path, "wb") as f:
-                                await f.write(video_content)
-
-                            task["video_url"] = f"/videos/{video_filename}"
-                            print(f"✅ Video base generated successfully: {video_filename}")
-
-                            # If no additional processing is needed, mark as completed immediately
-                            if not add_audio and not upscale_1080p:
-                                task["progress"] = 100
-                                task["status"] = "completed"
-                                task["message"] = "¡Video completado!"
-                                print(f"🎉 Video processing completed for task {task_id}")
-                                return
-
-                            # Process additional stages
-                            final_video_url = task['video_url']
-                            final_video_path = video_path
-
-                            # Stage 1: Audio processing (if requested)
-                            if add_audio:
-                                print("🎵 Starting audio generation...")
-                                task["progress"] = 80
-                                task["message"] = "Generando audio ambiental..."
-
-                                # Create a URL for the generated video so audio API can access it
-                                video_file_url = f"{os.getenv('BASE_URL', 'http://localhost:8000')}{task['video_url']}"
-
-                                try:
-                                    # Pass the final prompt (optimized or original) to audio generation
-                                    final_prompt = task.get("optimized_prompt") or task["original_prompt"]
-                                    audio_video_url = await api_client.add_audio_to_video(video_file_url, final_prompt)
-                                    if audio_video_url:
-                                        # Download the video with audio and replace the original
-                                        audio_video_content = await api_client.download_video(audio_video_url)
-
-                                        # Save the video with audio, replacing the original
-                                        async with aiofiles.open(video_path, "wb") as f:
-                                            await f.write(audio_video_content)
-
-                                        task["audio_video_url"] = task["video_url"]  # Same URL, new content
-                                        print(f"✅ Audio added successfully, video updated")
-                                    else:
-                                        print("⚠️  Audio generation failed, keeping original video")
-                                except Exception as e:
-                                    print(f"⚠️  Audio generation error: {e}, keeping original video")
-
-                            # Stage 2: 1080P upscale (if requested)
-                            if upscale_1080p:
-                                print("⬆️ Starting 1080P upscale...")
-                                task["progress"] = 95
-                                task["message"] = "Escalando a 1080P premium..."
-
-                                # Create a URL for the current video (with or without audio)
-                                video_file_url = f"{os.getenv('BASE_URL', 'http://localhost:8000')}{task['video_url']}"
-
-                                try:
-                                    upscaled_video_url = await api_client.upscale_video_to_1080p(video_file_url)
-                                    if upscaled_video_url:
-                                        # Download the upscaled video and replace the original
-                                        upscaled_video_content = await api_client.download_video(upscaled_video_url)
-
-                                        # Save the upscaled video, replacing the original
-                                        async with aiofiles.open(video_path, "wb") as f:
-                                            await f.write(upscaled_video_content)
-
-                                        task["upscaled_video_url"] = task["video_url"]  # Same URL, new content
-                                        print(f"✅ Video upscaled to 1080P successfully")
-                                    else:
-                                        print("⚠️  1080P upscale failed, keeping original video")
-                                except Exception as e:
-                                    print(f"⚠️  1080P upscale error: {e}, keeping original video")
-
-                            # All stages completed - mark as done
-                            task["progress"] = 100
-                            task["status"] = "completed"
-
-                            # Set final message based on what was processed
-                            if add_audio and upscale_1080p:
-                                task["message"] = "¡Video Ultimate completado!"
-                            elif add_audio:
-                                task["message"] = "¡Video con audio completado!"
-                            elif upscale_1080p:
-                                task["message"] = "¡Video 1080P completado!"
-                            else:
-                                task["message"] = "¡Video completado!"
-
-                            print(f"🎉 All processing stages completed for task {task_id}")
-                            return
-
-                    elif status == "failed":
-                        error_msg = status_result.get("error", "Video generation failed on API side")
-                        print(f"❌ Video generation failed: {error_msg}")
-                        raise Exception(f"Video generation failed: {error_msg}")
-
-                    elif status == "processing":
-                        pass  # Still processing, continue polling
-
-                    else:
-                        print(f"🤔 Unknown status: {status}")
-
-                    # Update progress
-                    progress = 50 + (attempt / max_attempts) * 30
-                    task["progress"] = min(progress, 90)
-                    task["message"] = f"Generating video... ({attempt + 1}/{max_attempts})"
-
-                    await asyncio.sleep(1)  # Check every 1 second
-
-                except Exception as e:
-                    print(f"❌ Status check failed (attempt {attempt + 1}): {type(e).__name__}: {e}")
-                    if attempt < max_attempts - 1:  # Don't sleep on last attempt
-                        await asyncio.sleep(2)  # Wait longer on error
-                    else:
-                        raise Exception(f"Status polling failed after {max_attempts} attempts: {e}")
-
-            # If we get here, polling timed out
-            print(f"⏰ Polling timeout after {max_attempts} attempts")
-            raise Exception(f"Video generation timeout after {max_attempts} attempts")
+    logger.info(f"🎉 All processing stages completed for task {task_id}")
 
-        except Exception as e:
-            print(f"❌ Video generation failed: {type(e).__name__}: {e}")
-            raise Exception(f"Video generation failed: {str(e)}")
+async def run_web_video_job(job, queue):
+    """Job queue handler for 'web_video' jobs submitted by /generate"""
+    job.state["status"] = "processing"
+    await process_video_generation(job.state, job.id, **job.payload)
 
-    except Exception as e:
-        error_msg = str(e)
-        print(f"❌ Video generation failed for task {task_id}: {error_msg}")
-
-        task["status"] = "failed"
-        task["error"] = error_msg
+job_queue.register("web_video", run_web_video_job)
 
 # Serve video files
 @app.get("/videos/{filename}")
@@ -933,7 +686,7 @@ async def get_image(filename: str):
 
     return FileResponse(
         path=image_path,
-        media_type="image/jpeg",
+        media_type=mimetypes.guess_type(filename)[0] or "image/jpeg",
         filename=filename
     )
 
@@ -961,6 +714,30 @@ async def health_check():
     
     return health_info
 
+# ============================================================================
+# WAVESPEED WEBHOOK ENDPOINT
+# ============================================================================
+
+@app.post(Config.WAVESPEED_WEBHOOK_PATH)
+async def wavespeed_webhook(request: Request):
+    """
+    Webhook endpoint called by WaveSpeed when a prediction finishes
+    Resolves the pending wait for that request_id right away; the job worker continues with download and delivery
+    """
+    if not verify_wavespeed_webhook_token(request.query_params.get("token")):
+        logger.warning("❌ Invalid WaveSpeed webhook token")
+        raise HTTPException(status_code=401, detail="Invalid webhook token")
+
+    try:
+        webhook_data = await request.json()
+    except Exception as e:
+        logger.error(f"❌ Invalid WaveSpeed webhook payload: {e}")
+        raise HTTPException(status_code=400, detail="Invalid webhook payload")
+
+    matched = prediction_tracker.resolve(webhook_data)
+    logger.info(f"🎣 WaveSpeed webhook received (pending prediction matched: {matched})")
+    return {"status": "received", "matched": matched}
+
 # ============================================================================
 # TELEGRAM WEBHOOK ENDPOINTS
 # ============================================================================
@@ -1071,17 +848,17 @@ async def check_usage(request: Request = None):
     # For usage checking, we create a temporary fingerprint
     # In production, this would come from browser fingerprinting
     temp_fingerprint = generate_fingerprint(client_ip, user_agent)
-    allowed, used, remaining, is_suspicious = check_rate_limit_advanced(client_ip, temp_fingerprint, user_agent)
+    allowed, used, remaining, is_suspicious = await check_rate_limit_advanced(client_ip, temp_fingerprint, user_agent)
 
     return {
         "ip": client_ip,
         "fingerprint": temp_fingerprint[:8],
         "used_today": used,
         "remaining_today": remaining,
-        "daily_limit": DAILY_LIMIT,
+        "daily_limit": rate_limiter.limits_for(rate_limiter.tier_for(temp_fingerprint)).get("daily"),
         "allowed": allowed and not is_suspicious,
         "suspicious": is_suspicious,
-        "reset_time": "mañana a las 00:00"
+        "reset_time": "ventana móvil de 24 horas"
     }
 
 if __name__ == "__main__":
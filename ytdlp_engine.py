@@ -0,0 +1,497 @@
+"""
+yt-dlp Engine
+Descargas de redes sociales con yt_dlp.YoutubeDL dentro de un pool de procesos de larga duración
+
+- Cada proceso del pool importa yt_dlp y precarga los extractores de las plataformas soportadas
+  una sola vez al arrancar: un enlace ya no paga el arranque del intérprete ni la importación
+- extract_info devuelve el dict de info (título, duración, resolución, ruta exacta del archivo):
+  nada de interpretar líneas de --print ni de buscar el archivo en el volumen
+- Con límite de entrega (size_limit) se consultan los formatos antes de descargar y se elige el
+  mejor que cabe: nunca se descarga un archivo que Telegram va a rechazar
+- Progreso de los workers al event loop por una cola multiprocessing; timeout por petición
+  aplicado dentro del worker (el hook de progreso cancela la descarga)
+- Sin el paquete yt_dlp (o con YTDLP_IN_PROCESS=false) se usa el CLI como subproceso async
+"""
+import asyncio
+import importlib.util
+import json
+import logging
+import multiprocessing
+import re
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+from itertools import count
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Extractores que cada worker importa al arrancar (claves de yt_dlp.extractor)
+PRELOAD_EXTRACTORS = ("TikTok", "Instagram", "Twitter", "Reddit", "Facebook")
+
+# Campos del dict de info que vuelven al proceso principal (el dict completo no compensa serializarlo)
+INFO_FIELDS = ("id", "title", "duration", "ext", "width", "height", "filesize", "format_id", "extractor_key")
+
+# Marcadores de las líneas del CLI que se interpretan (progreso e info final en JSON)
+CLI_PROGRESS_MARKER = 'TELEWAN_PROGRESS '
+CLI_INFO_MARKER = 'TELEWAN_INFO '
+_PERCENT_RE = re.compile(r'(\d+(?:\.\d+)?)%')
+
+ProgressFn = Callable[[Optional[float], Optional[str]], Awaitable[None]]
+
+
+def ytdlp_available() -> bool:
+    """Paquete yt_dlp instalado (se comprueba sin importarlo en el proceso principal)"""
+    return importlib.util.find_spec("yt_dlp") is not None
+
+
+@dataclass
+class FormatChoice:
+    """Formato elegido antes de descargar"""
+    format_id: str
+    estimated_size: Optional[int]  # Bytes (None si la plataforma no da tamaño ni bitrate)
+    fits: Optional[bool]  # Cabe en el límite de entrega (None: desconocido)
+
+
+def estimate_size(fmt: Dict[str, Any], duration: Optional[float]) -> Optional[int]:
+    """Tamaño del formato: el declarado, el aproximado o bitrate (kbps) x duración"""
+    size = fmt.get('filesize') or fmt.get('filesize_approx')
+    if size:
+        return int(size)
+    if fmt.get('tbr') and duration:
+        return int(fmt['tbr'] * 1000 / 8 * duration)
+    return None
+
+
+def select_format(formats: List[Dict[str, Any]], duration: Optional[float], size_limit: int,
+                  max_height: int = 720, max_filesize: Optional[int] = None) -> Optional[FormatChoice]:
+    """
+    Mejor formato con audio y video de altura <= max_height que cabe en size_limit
+
+    yt-dlp ordena los formatos de peor a mejor. Si ninguno cabe se elige el mejor de tamaño
+    desconocido o, si no, el más pequeño (se reduce después con ffmpeg); None si incluso ese
+    supera max_filesize y no merece la pena descargarlo
+    """
+    candidates = []
+    for index, fmt in enumerate(formats):
+        if fmt.get('vcodec') == 'none' or fmt.get('acodec') == 'none':
+            continue  # Solo video o solo audio
+        if (fmt.get('height') or 0) > max_height:
+            continue
+        candidates.append((index, fmt, estimate_size(fmt, duration)))
+    if not candidates:
+        return None
+
+    fitting = [c for c in candidates if c[2] is not None and c[2] <= size_limit]
+    if fitting:
+        _, fmt, size = max(fitting, key=lambda c: c[0])
+        return FormatChoice(str(fmt.get('format_id')), size, True)
+
+    unknown = [c for c in candidates if c[2] is None]
+    if unknown:
+        _, fmt, _ = max(unknown, key=lambda c: c[0])
+        return FormatChoice(str(fmt.get('format_id')), None, None)
+
+    _, fmt, size = min(candidates, key=lambda c: c[2])
+    if max_filesize and size > max_filesize:
+        return None
+    return FormatChoice(str(fmt.get('format_id')), size, False)
+
+
+@dataclass
+class YtDlpRequest:
+    """Descarga a realizar; se traduce a parámetros de YoutubeDL o a argumentos del CLI"""
+    url: str
+    output_template: str
+    max_height: int = 720
+    size_limit: Optional[int] = None  # Límite de entrega (bytes): se elige el formato antes de descargar
+    max_filesize: Optional[int] = None  # Bytes
+    user_agent: Optional[str] = None
+    headers: Dict[str, str] = field(default_factory=dict)
+    impersonate: Optional[str] = None  # 'chrome-120', 'safari-ios:17.5.1'...
+    timeout: float = 120.0
+
+    @property
+    def format(self) -> str:
+        """
+        Selector de formato de yt-dlp
+        Con size_limit (CLI): el mejor que declara caber, luego el de tamaño desconocido y por último el peor
+        """
+        best = f'best[height<={self.max_height}]'
+        if not self.size_limit:
+            return best
+        limit = self.size_limit
+        return (f'{best}[filesize<={limit}]/{best}[filesize_approx<={limit}]/'
+                f'{best}[filesize<=?{limit}][filesize_approx<=?{limit}]/worst')
+
+    def to_params(self) -> Dict[str, Any]:
+        """Parámetros de yt_dlp.YoutubeDL (se llama dentro del worker)"""
+        params = {
+            'outtmpl': self.output_template,
+            'format': self.format,
+            'noplaylist': True,
+            'nocheckcertificate': True,
+            'quiet': True,
+            'no_warnings': True,
+            'noprogress': True,
+            'socket_timeout': 30,
+            'http_headers': dict(self.headers),
+        }
+        if self.user_agent:
+            params['http_headers']['User-Agent'] = self.user_agent
+        if self.max_filesize:
+            params['max_filesize'] = self.max_filesize
+        if self.impersonate:
+            from yt_dlp.networking.impersonate import ImpersonateTarget
+            params['impersonate'] = ImpersonateTarget.from_str(self.impersonate)
+        return params
+
+    def to_cli_args(self) -> List[str]:
+        """Comando equivalente del CLI (progreso línea a línea e info final en JSON con la ruta exacta)"""
+        args = [
+            'yt-dlp',
+            '--no-check-certificates',
+            '--no-playlist',
+            '--format', self.format,
+            '--output', self.output_template,
+            '--newline',
+            '--progress',
+            '--progress-template', f'download:{CLI_PROGRESS_MARKER}%(progress._percent_str)s',
+            '--print', f'after_move:{CLI_INFO_MARKER}%(.{{{",".join(INFO_FIELDS)},filepath}})j',
+        ]
+        if self.max_filesize:
+            args += ['--max-filesize', str(self.max_filesize)]
+        if self.user_agent:
+            args += ['--user-agent', self.user_agent]
+        for name, value in self.headers.items():
+            args += ['--add-header', f'{name}: {value}']
+        if self.impersonate:
+            args += ['--impersonate', self.impersonate]
+        args.append(self.url)
+        return args
+
+
+@dataclass
+class YtDlpResult:
+    success: bool
+    info: Dict[str, Any] = field(default_factory=dict)  # INFO_FIELDS + filepath
+    error: Optional[str] = None
+    timed_out: bool = False
+    engine: str = "in-process"
+    dispatch_ms: Optional[float] = None  # Desde el envío hasta que un worker empezó la descarga
+    elapsed: float = 0.0
+
+
+# --- Código que se ejecuta en los procesos del pool ---
+
+_worker_progress = None
+
+
+def _init_worker(progress_queue, preload: bool):
+    global _worker_progress
+    _worker_progress = progress_queue
+    if preload:
+        started = time.perf_counter()
+        try:
+            import yt_dlp
+            from yt_dlp.extractor import get_info_extractor
+            for key in PRELOAD_EXTRACTORS:
+                get_info_extractor(key)
+            # Primera instancia: carga los handlers de red (y curl_cffi para la impersonación)
+            yt_dlp.YoutubeDL({'quiet': True, 'no_warnings': True}).close()
+        except Exception as e:
+            logging.getLogger(__name__).warning(f"⚠️ Precarga de yt-dlp incompleta: {e}")
+        logging.getLogger(__name__).info(f"🧰 Worker de yt-dlp listo en {time.perf_counter() - started:.2f}s")
+
+
+def _ping() -> float:
+    return time.time()
+
+
+def report_progress(task_id: int, percent: float):
+    """Envía el progreso de una tarea al proceso principal (desde un worker)"""
+    if _worker_progress is not None:
+        try:
+            _worker_progress.put_nowait((task_id, percent))
+        except Exception:
+            pass
+
+
+def download_in_worker(task_id: int, request: YtDlpRequest, deadline: float) -> Dict[str, Any]:
+    """Descarga con YoutubeDL en el worker; retorna un dict serializable (nunca lanza)"""
+    started_at = time.time()
+    import yt_dlp
+    from yt_dlp.utils import DownloadCancelled
+
+    last_reported = [-1.0]
+
+    def hook(status):
+        if time.time() > deadline:
+            raise DownloadCancelled(f"timeout after {request.timeout:.0f}s")
+        if status.get('status') == 'downloading':
+            total = status.get('total_bytes') or status.get('total_bytes_estimate')
+            if total:
+                percent = min(100.0, 100.0 * status.get('downloaded_bytes', 0) / total)
+                if percent - last_reported[0] >= 1:
+                    last_reported[0] = percent
+                    report_progress(task_id, percent)
+        elif status.get('status') == 'finished':
+            report_progress(task_id, 100.0)
+
+    params = request.to_params()
+    params['progress_hooks'] = [hook]
+    choice = None
+    try:
+        with yt_dlp.YoutubeDL(params) as ydl:
+            if not request.size_limit:
+                info = _single_entry(ydl.extract_info(request.url, download=True))
+            else:
+                # Primero los formatos (sin descargar): se elige el mejor que cabe en el límite de entrega
+                probed = _single_entry(ydl.extract_info(request.url, download=False))
+                if probed is None:
+                    info = None
+                else:
+                    choice = select_format(probed.get('formats') or [probed], probed.get('duration'),
+                                           request.size_limit, request.max_height, request.max_filesize)
+                    if choice is None:
+                        return {'success': False, 'started_at': started_at,
+                                'error': 'File is larger than max-filesize (ningún formato cabe)'}
+                    with yt_dlp.YoutubeDL({**params, 'format': choice.format_id}) as downloader:
+                        info = _single_entry(downloader.process_ie_result(probed, download=True))
+    except DownloadCancelled as e:
+        return {'success': False, 'error': str(e), 'timed_out': True, 'started_at': started_at}
+    except Exception as e:
+        return {'success': False, 'error': str(e), 'started_at': started_at}
+
+    if info is None:
+        return {'success': False, 'error': 'No se pudo obtener información del video', 'started_at': started_at}
+    downloaded = (info.get('requested_downloads') or [{}])[0]
+    result = {name: downloaded.get(name, info.get(name)) for name in INFO_FIELDS}
+    result['filepath'] = downloaded.get('filepath') or info.get('filepath') or info.get('_filename')
+    if choice is not None:
+        result['estimated_size'] = choice.estimated_size
+        result['fits'] = choice.fits
+    if not result['filepath']:
+        # --max-filesize: yt-dlp omite la descarga sin error
+        return {'success': False, 'error': 'File is larger than max-filesize', 'started_at': started_at}
+    return {'success': True, 'info': result, 'started_at': started_at}
+
+
+def _single_entry(info: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    if info and info.get('_type') == 'playlist' and info.get('entries'):
+        return next((entry for entry in info['entries'] if entry), None)
+    return info
+
+
+# --- Proceso principal ---
+
+class YtDlpEngine:
+    """
+    Pool de procesos con yt_dlp precargado
+
+    Uso:
+        result = await ytdlp_engine.download(YtDlpRequest(url, output_template, ...), progress=callback)
+    """
+
+    # Margen sobre el timeout de la petición antes de dar el worker por colgado (segundos)
+    TIMEOUT_GRACE = 30.0
+
+    def __init__(self, workers: int = None, preload: bool = True, worker_fn: Callable = download_in_worker):
+        self.workers = workers or Config.YTDLP_WORKERS
+        self.preload = preload
+        self.worker_fn = worker_fn
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._progress_queue = None
+        self._reader: Optional[threading.Thread] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._callbacks: Dict[int, ProgressFn] = {}
+        self._task_ids = count(1)
+
+        self.stats = {"in_process": 0, "cli": 0, "failed": 0, "timeouts": 0, "pool_restarts": 0,
+                      "dispatch_ms_total": 0.0}
+
+    @property
+    def in_process(self) -> bool:
+        return Config.YTDLP_IN_PROCESS and (self.worker_fn is not download_in_worker or ytdlp_available())
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # spawn: el proceso principal tiene hilos (asyncio.to_thread, SQLite); fork no es seguro
+            context = multiprocessing.get_context("spawn")
+            self._progress_queue = context.Queue()
+            self._loop = asyncio.get_running_loop()
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=context,
+                                             initializer=_init_worker, initargs=(self._progress_queue, self.preload))
+            self._reader = threading.Thread(target=self._read_progress, args=(self._progress_queue,),
+                                            name="ytdlp-progress", daemon=True)
+            self._reader.start()
+            logger.info(f"🧰 Pool de yt-dlp iniciado ({self.workers} procesos)")
+        return self._pool
+
+    def _read_progress(self, progress_queue):
+        while True:
+            item = progress_queue.get()
+            if item is None:
+                return
+            loop = self._loop
+            if loop is not None and not loop.is_closed():
+                loop.call_soon_threadsafe(self._dispatch_progress, *item)
+
+    def _dispatch_progress(self, task_id: int, percent: float):
+        callback = self._callbacks.get(task_id)
+        if callback is not None:
+            task = asyncio.ensure_future(callback(percent, 'yt-dlp'))
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+    async def warm_up(self):
+        """Arranca todos los workers (con yt_dlp ya importado) antes del primer enlace"""
+        if not self.in_process:
+            return
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        pool = self._get_pool()
+        await asyncio.gather(*(loop.run_in_executor(pool, _ping) for _ in range(self.workers)))
+        logger.info(f"🧰 yt-dlp precargado en {self.workers} workers ({time.perf_counter() - started:.2f}s)")
+
+    async def download(self, request: YtDlpRequest, progress: Optional[ProgressFn] = None) -> YtDlpResult:
+        if self.in_process:
+            return await self._download_in_process(request, progress)
+        return await self._download_cli(request, progress)
+
+    async def _download_in_process(self, request: YtDlpRequest, progress: Optional[ProgressFn]) -> YtDlpResult:
+        loop = asyncio.get_running_loop()
+        task_id = next(self._task_ids)
+        if progress:
+            self._callbacks[task_id] = progress
+        submitted = time.time()
+        started = time.perf_counter()
+        pool = self._get_pool()
+        try:
+            # Margen sobre el timeout del worker: si el hook no llega a cancelar (p.ej. extracción colgada)
+            raw = await asyncio.wait_for(
+                loop.run_in_executor(pool, self.worker_fn, task_id, request, submitted + request.timeout),
+                timeout=request.timeout + self.TIMEOUT_GRACE
+            )
+        except asyncio.TimeoutError:
+            self.stats["timeouts"] += 1
+            self._restart_pool(pool)
+            return YtDlpResult(False, error=f"timeout after {request.timeout:.0f}s", timed_out=True,
+                               elapsed=time.perf_counter() - started)
+        except BrokenProcessPool as e:
+            self.stats["failed"] += 1
+            self._restart_pool(pool)
+            return YtDlpResult(False, error=f"Worker de yt-dlp caído: {e}", elapsed=time.perf_counter() - started)
+        finally:
+            self._callbacks.pop(task_id, None)
+
+        dispatch_ms = max(0.0, (raw.get('started_at', submitted) - submitted) * 1000)
+        self.stats["in_process"] += 1
+        self.stats["dispatch_ms_total"] += dispatch_ms
+        if raw.get('timed_out'):
+            self.stats["timeouts"] += 1
+        if not raw.get('success'):
+            self.stats["failed"] += 1
+        return YtDlpResult(bool(raw.get('success')), raw.get('info') or {}, raw.get('error'),
+                           bool(raw.get('timed_out')), "in-process", dispatch_ms, time.perf_counter() - started)
+
+    def _restart_pool(self, pool: ProcessPoolExecutor):
+        """Un worker colgado o caído: se descarta el pool (el siguiente enlace crea uno nuevo)"""
+        if self._pool is not pool:
+            return
+        self.stats["pool_restarts"] += 1
+        for process in list(getattr(pool, '_processes', {}).values()):
+            process.kill()
+        pool.shutdown(wait=False, cancel_futures=True)
+        self._pool = None
+        self._stop_reader()
+
+    def _stop_reader(self):
+        if self._progress_queue is not None:
+            self._progress_queue.put(None)
+            self._progress_queue = None
+
+    async def _download_cli(self, request: YtDlpRequest, progress: Optional[ProgressFn]) -> YtDlpResult:
+        started = time.perf_counter()
+        self.stats["cli"] += 1
+        try:
+            returncode, info, stderr = await self.run_cli(request.to_cli_args(), request.timeout, progress)
+        except asyncio.TimeoutError:
+            self.stats["timeouts"] += 1
+            return YtDlpResult(False, error=f"timeout after {request.timeout:.0f}s", timed_out=True,
+                               engine="cli", elapsed=time.perf_counter() - started)
+        if returncode != 0 or not info:
+            self.stats["failed"] += 1
+            return YtDlpResult(False, error=stderr or 'No se pudo obtener información del video',
+                               engine="cli", elapsed=time.perf_counter() - started)
+        return YtDlpResult(True, info, engine="cli", elapsed=time.perf_counter() - started)
+
+    @staticmethod
+    async def run_cli(cmd: List[str], timeout: float, progress: Optional[ProgressFn] = None) -> Tuple[int, Optional[dict], str]:
+        """
+        Ejecuta el CLI de yt-dlp como subproceso async leyendo stdout/stderr en streaming
+
+        Returns:
+            (returncode, info dict o None, stderr sin las líneas de progreso)
+
+        Raises:
+            asyncio.TimeoutError: Si supera el timeout (el proceso se mata)
+        """
+        process = await asyncio.create_subprocess_exec(
+            *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+        )
+        info = None
+        errors = []
+
+        async def pump(stream):
+            nonlocal info
+            async for raw_line in stream:
+                line = raw_line.decode(errors='replace').strip()
+                # En modo --print el progreso sale por stderr: se busca el marcador en ambos
+                if CLI_PROGRESS_MARKER in line:
+                    match = _PERCENT_RE.search(line)
+                    if progress and match:
+                        await progress(float(match.group(1)), 'yt-dlp')
+                elif line.startswith(CLI_INFO_MARKER):
+                    try:
+                        info = json.loads(line[len(CLI_INFO_MARKER):])
+                    except ValueError:
+                        logger.warning(f"⚠️ Info de yt-dlp no válida: {line[:200]}")
+                elif line:
+                    errors.append(line)
+
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(pump(process.stdout), pump(process.stderr), process.wait()),
+                timeout=timeout
+            )
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+            raise
+        return process.returncode, info, '\n'.join(errors)
+
+    def get_stats(self) -> Dict[str, Any]:
+        dispatched = self.stats["in_process"]
+        return {
+            **{k: v for k, v in self.stats.items() if k != "dispatch_ms_total"},
+            "avg_dispatch_ms": round(self.stats["dispatch_ms_total"] / dispatched, 2) if dispatched else None,
+            "workers": self.workers,
+            "pool_started": self._pool is not None,
+            "mode": "in-process" if self.in_process else "cli",
+        }
+
+    def shutdown(self):
+        """Cierra el pool de procesos (shutdown de la aplicación)"""
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+        self._stop_reader()
+
+
+# Instancia global del motor
+ytdlp_engine = YtDlpEngine()